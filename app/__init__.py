@@ -1,16 +1,71 @@
+import time
+
+_import_started = time.perf_counter()
+
+import logging
+
 from flask import Flask
 from app.config import load_configurations, configure_logging
+from app.decorators.admission import init_admission_control
+from app.services.affinity import init_affinity
+from app.services.coalescer import init_send_coalescer
+from app.services.lifecycle import init_lifecycle
+from app.services.llm_fallback import init_llm_responder
+from app.services.media_downloader import init_media_downloader
+from app.services.media_manager import init_media_manager
+from app.services.outbox import init_outbox
+from app.services.scheduler import init_scheduler
+from app.services.sessions import init_sessions
+from app.services.status_store import init_status_store
+from app.services.tenants import init_tenants
+from app.services.warmup import init_warm_up
+from app.utils.profiling import init_profiler
+from app.utils.startup_profile import StartupProfile
+from app.utils.traffic_recorder import init_traffic_recorder
 from .views import webhook_blueprint
 
+# Time spent importing the app package and its dependencies
+IMPORT_SECONDS = time.perf_counter() - _import_started
+
 
 def create_app():
+    profile = StartupProfile()
+    profile.add("import app", IMPORT_SECONDS)
     app = Flask(__name__)
+    app.extensions["startup_profile"] = profile
 
     # Load configurations and logging settings
-    load_configurations(app)
-    configure_logging()
+    with profile.phase("load_configurations"):
+        load_configurations(app)
+    with profile.phase("configure_logging"):
+        configure_logging()
+
+    # Services
+    for init_service in (
+        init_lifecycle,
+        init_status_store,
+        init_tenants,
+        init_sessions,
+        init_outbox,
+        init_send_coalescer,
+        init_scheduler,
+        init_admission_control,
+        init_affinity,
+        init_llm_responder,
+        init_media_manager,
+        init_media_downloader,
+        init_traffic_recorder,
+        init_profiler,
+    ):
+        with profile.phase(init_service.__name__):
+            init_service(app)
 
     # Import and register blueprints, if any
     app.register_blueprint(webhook_blueprint)
 
+    # Clients and caches are created on first use unless WARM_UP is set
+    with profile.phase("init_warm_up"):
+        init_warm_up(app)
+    logging.info(profile.format())
+
     return app
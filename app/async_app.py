@@ -0,0 +1,190 @@
+"""
+Async serving mode: the /webhook contract on an aiohttp event loop.
+
+`create_async_app()` serves the same GET (verification) and POST (signed
+events) endpoints as the Flask app, with the same verification, signature
+check, status fast path and reply flow. Waiting on the Graph API and the
+OpenAI Assistant happens on the event loop, so requests in flight are not
+limited by the number of threads.
+
+Configuration and services (status store, outbox, media, Assistant
+responder) come from a regular `create_app()` instance, whose app context is
+pushed around each request so the shared code reads the same config and
+`app.extensions`.
+"""
+import asyncio
+import json
+import logging
+import time
+
+import aiohttp
+from aiohttp import web
+
+from app import create_app
+from app.decorators.admission import CLAIMED, DUPLICATE, IN_FLIGHT
+from app.decorators.affinity import route_messages
+from app.decorators.security import get_request_secret, validate_signature
+from app.services.affinity import FORWARDED_HEADER, SECRET_HEADER
+from app.utils import metrics
+from app.utils.ingestion import get_status_events, get_webhook_batch
+from app.utils.whatsapp_async import process_whatsapp_message_async
+from app.utils.whatsapp_utils import is_valid_whatsapp_message
+from app.services.lifecycle import drain
+from app.views import readiness, verify_subscription
+
+FLASK_APP = web.AppKey("flask_app", object)
+
+
+async def graph_session_ctx(app):
+    """Open one pooled Graph API session for the app's lifetime."""
+    flask_app = app[FLASK_APP]
+    connector = aiohttp.TCPConnector(limit=flask_app.config.get("GRAPH_POOL_SIZE", 20))
+    session = aiohttp.ClientSession(connector=connector)
+    flask_app.extensions["async_graph_session"] = session
+    yield
+    flask_app.extensions.pop("async_graph_session", None)
+    await session.close()
+
+
+async def webhook_get(request):
+    flask_app = request.app[FLASK_APP]
+    result, status = verify_subscription(
+        request.query.get("hub.mode"),
+        request.query.get("hub.verify_token"),
+        request.query.get("hub.challenge"),
+        flask_app.config["VERIFY_TOKEN"],
+    )
+    if isinstance(result, dict):
+        return web.json_response(result, status=status)
+    return web.Response(text=result or "", status=status)
+
+
+async def drain_on_shutdown(app):
+    """On SIGTERM (aiohttp's graceful exit), drain the requests in flight and the queues."""
+    flask_app = app[FLASK_APP]
+    if "lifecycle" in flask_app.extensions:
+        await asyncio.to_thread(drain, flask_app, flask_app.config["SHUTDOWN_DRAIN_TIMEOUT"])
+
+
+async def health_get(request):
+    lifecycle = request.app[FLASK_APP].extensions.get("lifecycle")
+    return web.json_response(lifecycle.stats() if lifecycle is not None else {"state": "ready"})
+
+
+async def ready_get(request):
+    result, status = readiness(request.app[FLASK_APP].extensions.get("lifecycle"))
+    return web.json_response(result, status=status)
+
+
+async def webhook_post(request):
+    flask_app = request.app[FLASK_APP]
+    lifecycle = flask_app.extensions.get("lifecycle")
+    if lifecycle is not None and not lifecycle.enter():
+        metrics.increment("webhook_shed", kind="webhook", reason="draining")
+        return web.json_response(
+            {"status": "error", "message": "Shutting down, retry later"}, status=503,
+            headers={"Retry-After": str(flask_app.config["WEBHOOK_RETRY_AFTER"])},
+        )
+    profiler = flask_app.extensions.get("profiler")
+    # Requests share the event loop thread: capture spans, not stacks
+    token = profiler.begin(sample=False) if profiler is not None else None
+    try:
+        return await handle_webhook_post(request)
+    finally:
+        if token is not None:
+            profiler.end(token, f"{request.method} {request.path}")
+        if lifecycle is not None:
+            lifecycle.exit()
+
+
+async def handle_webhook_post(request):
+    flask_app = request.app[FLASK_APP]
+
+    max_bytes = flask_app.config.get("MAX_WEBHOOK_BODY_BYTES")
+    if max_bytes and request.content_length is not None and request.content_length > max_bytes:
+        logging.warning(f"Rejected oversized webhook body: {request.content_length} bytes")
+        return web.json_response({"status": "error", "message": "Payload too large"}, status=413)
+    body = await request.read()
+
+    # A test request context lets the shared Flask helpers (flask.g, the
+    # parse-once batch, tenant lookup) read this body
+    with flask_app.test_request_context("/webhook", method="POST", data=body):
+        signature = request.headers.get("X-Hub-Signature-256", "")[7:]  # Removing 'sha256='
+        if not validate_signature(body, signature, get_request_secret()):
+            logging.info("Signature verification failed!")
+            return web.json_response({"status": "error", "message": "Invalid signature"}, status=403)
+
+        recorder = flask_app.extensions.get("traffic_recorder")
+        if recorder is not None:
+            recorder.record(body, request.headers, time.time())
+
+        try:
+            statuses = get_status_events()
+            if statuses is not None:
+                flask_app.extensions["status_store"].add(statuses)
+                return web.json_response({"status": "ok"})
+            batch = get_webhook_batch()
+        except json.JSONDecodeError:
+            logging.error("Failed to decode JSON")
+            return web.json_response({"status": "error", "message": "Invalid JSON provided"}, status=400)
+
+        if not is_valid_whatsapp_message(batch):
+            return web.json_response({"status": "error", "message": "Not a WhatsApp API event"}, status=404)
+
+        # Meta re-delivers messages when we are slow; answer each only once
+        admission = flask_app.extensions.get("admission")
+        message_ids = [m.message_id for m in batch.messages if m.message_id]
+        claim = admission.claim_messages(message_ids) if admission is not None else CLAIMED
+        if claim == IN_FLIGHT:
+            # Acknowledging it would lose the message if the first attempt fails
+            metrics.increment("webhook_shed", kind="duplicate", reason="in_flight")
+            return web.json_response(
+                {"status": "error", "message": "Server busy, retry later"}, status=503,
+                headers={"Retry-After": str(flask_app.config["WEBHOOK_RETRY_AFTER"])},
+            )
+        if claim == DUPLICATE:
+            metrics.increment("webhook_shed", kind="duplicate", reason="duplicate")
+            logging.info(f"Ignoring duplicate delivery of {message_ids}")
+            return web.json_response({"status": "ok"})
+
+        cluster = flask_app.extensions.get("affinity")
+        if cluster is not None:
+            # The forwarding hop is a blocking HTTP call; run it off the loop
+            await asyncio.to_thread(
+                route_messages, cluster, batch, body,
+                request.headers.get("X-Hub-Signature-256", ""), request.headers.get(FORWARDED_HEADER),
+                request.headers.get(SECRET_HEADER),
+            )
+
+        try:
+            await process_whatsapp_message_async(batch)
+        except Exception:
+            if admission is not None:
+                admission.unclaim_messages(message_ids)
+            raise
+        if admission is not None:
+            admission.complete_messages(message_ids)
+        return web.json_response({"status": "ok"})
+
+
+def create_async_app(flask_app=None):
+    """
+    Build the aiohttp application.
+
+    Args:
+        flask_app (Flask): App providing configuration and services
+            (default: a new `create_app()`)
+
+    Returns:
+        aiohttp.web.Application: The async webhook app
+    """
+    flask_app = flask_app or create_app()
+    app = web.Application(client_max_size=flask_app.config["MAX_WEBHOOK_BODY_BYTES"] + 1)
+    app[FLASK_APP] = flask_app
+    app.cleanup_ctx.append(graph_session_ctx)
+    app.on_shutdown.append(drain_on_shutdown)
+    app.router.add_get("/health", health_get)
+    app.router.add_get("/ready", ready_get)
+    app.router.add_get("/webhook", webhook_get)
+    app.router.add_post("/webhook", webhook_post)
+    return app
@@ -14,9 +14,133 @@ def load_configurations(app):
     app.config["VERSION"] = os.getenv("VERSION")
     app.config["PHONE_NUMBER_ID"] = os.getenv("PHONE_NUMBER_ID")
     app.config["VERIFY_TOKEN"] = os.getenv("VERIFY_TOKEN")
+    # Base URL of the Graph API (override to point at a local stub server)
+    app.config["GRAPH_API_URL"] = os.getenv("GRAPH_API_URL", "https://graph.facebook.com")
+    # Keep-alive connections kept open to the Graph API
+    app.config["GRAPH_POOL_SIZE"] = int(os.getenv("GRAPH_POOL_SIZE", "20"))
+    # Header image of the welcome template (public URL or local file path)
+    app.config["WELCOME_HEADER_IMAGE"] = os.getenv(
+        "WELCOME_HEADER_IMAGE", "https://www.rizosafrosymas.com/_next/image?url=%2Fram1.jpg&w=2048&q=75"
+    )
+    # Seconds the welcome waits for the upload of a local header file (URLs fall back to the link)
+    app.config["WELCOME_HEADER_WAIT"] = float(os.getenv("WELCOME_HEADER_WAIT", "5"))
+    # Outbound media is uploaded once and referenced by id (ids expire after 30 days)
+    app.config["MEDIA_CACHE_PATH"] = os.getenv("MEDIA_CACHE_PATH", "media_cache.json")
+    app.config["MEDIA_ID_TTL"] = float(os.getenv("MEDIA_ID_TTL", str(29 * 24 * 3600)))
+    app.config["MEDIA_REFRESH_MARGIN"] = float(os.getenv("MEDIA_REFRESH_MARGIN", str(24 * 3600)))
+    # Inbound media (photos, voice notes, documents) is streamed here in the
+    # background; unset MEDIA_DOWNLOAD_DIR to disable downloads
+    app.config["MEDIA_DOWNLOAD_DIR"] = os.getenv("MEDIA_DOWNLOAD_DIR", "media")
+    app.config["MEDIA_MAX_BYTES"] = int(os.getenv("MEDIA_MAX_BYTES", str(25 * 1024 * 1024)))
+    app.config["MEDIA_DOWNLOAD_WORKERS"] = int(os.getenv("MEDIA_DOWNLOAD_WORKERS", "4"))
+    app.config["MEDIA_DOWNLOAD_QUEUE"] = int(os.getenv("MEDIA_DOWNLOAD_QUEUE", "100"))
+    # Mark inbound messages as read and show "typing..." while a slow reply is generated
+    app.config["TYPING_INDICATOR"] = os.getenv("TYPING_INDICATOR", "true").lower() in ("1", "true", "yes")
+    # Replies ready within this many seconds skip the indicator
+    app.config["TYPING_INDICATOR_DELAY"] = float(os.getenv("TYPING_INDICATOR_DELAY", "0.5"))
+
+    # Load the message texts, open the Graph API and OpenAI connections and
+    # fetch the Assistant at startup, on a thread ('background') or before
+    # create_app() returns ('blocking'); /ready reports ready once it is done.
+    # 'off' creates everything on first use and reports ready right away.
+    app.config["WARM_UP"] = os.getenv("WARM_UP", "background").lower()
+    # Seconds a SIGTERM gives requests in flight and queued messages before exiting
+    app.config["SHUTDOWN_DRAIN_TIMEOUT"] = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "25"))
+
+    # Multi-tenant routing: one directory per business phone number (see
+    # app/services/tenants.py); unset serves only PHONE_NUMBER_ID
+    app.config["TENANTS_DIR"] = os.getenv("TENANTS_DIR")
+    app.config["TENANT_CACHE_SIZE"] = int(os.getenv("TENANT_CACHE_SIZE", "64"))
+
+    # Several instances behind a load balancer: base URLs of all of them and
+    # of this one; each wa_id is answered by one node (app/services/affinity.py)
+    app.config["CLUSTER_NODES"] = os.getenv("CLUSTER_NODES")
+    app.config["CLUSTER_SELF"] = os.getenv("CLUSTER_SELF")
+    app.config["CLUSTER_FORWARD_TIMEOUT"] = float(os.getenv("CLUSTER_FORWARD_TIMEOUT", "15"))
+    app.config["CLUSTER_CONNECT_TIMEOUT"] = float(os.getenv("CLUSTER_CONNECT_TIMEOUT", "2"))
+    # Shared by the nodes to authenticate forwarded webhooks (required with CLUSTER_NODES)
+    app.config["CLUSTER_SECRET"] = os.getenv("CLUSTER_SECRET")
+
+    # Webhook bodies above this size are rejected before hashing (Meta sends at most ~3MB)
+    app.config["MAX_WEBHOOK_BODY_BYTES"] = int(os.getenv("MAX_WEBHOOK_BODY_BYTES", str(3 * 1024 * 1024)))
+    app.config["MAX_CONTENT_LENGTH"] = app.config["MAX_WEBHOOK_BODY_BYTES"]
+
+    # Bearer token for operational endpoints such as /metrics (disabled when unset)
+    app.config["ADMIN_TOKEN"] = os.getenv("ADMIN_TOKEN")
+
+    # Admission control for the webhook endpoint
+    app.config["WEBHOOK_MAX_IN_FLIGHT"] = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", "32"))
+    app.config["WEBHOOK_MAX_QUEUE"] = int(os.getenv("WEBHOOK_MAX_QUEUE", "64"))
+    app.config["WEBHOOK_QUEUE_TIMEOUT"] = float(os.getenv("WEBHOOK_QUEUE_TIMEOUT", "2"))
+    app.config["WEBHOOK_STATUS_SHARE"] = float(os.getenv("WEBHOOK_STATUS_SHARE", "0.5"))
+    app.config["WEBHOOK_RETRY_AFTER"] = int(os.getenv("WEBHOOK_RETRY_AFTER", "5"))
+
+    # Reply engine: 'keywords' (message_handlers) or 'openai' (Assistant with a latency budget)
+    app.config["REPLY_ENGINE"] = os.getenv("REPLY_ENGINE", "keywords")
+    app.config["OPENAI_REPLY_DEADLINE"] = float(os.getenv("OPENAI_REPLY_DEADLINE", "8"))
+    # 'followup' sends Assistant answers that miss the deadline later, 'drop' discards them
+    app.config["OPENAI_LATE_REPLY"] = os.getenv("OPENAI_LATE_REPLY", "followup")
+    app.config["OPENAI_HOLDING_MESSAGE"] = os.getenv("OPENAI_HOLDING_MESSAGE")
+    app.config["OPENAI_BREAKER_WINDOW"] = int(os.getenv("OPENAI_BREAKER_WINDOW", "20"))
+    app.config["OPENAI_BREAKER_FAILURE_RATIO"] = float(os.getenv("OPENAI_BREAKER_FAILURE_RATIO", "0.5"))
+    app.config["OPENAI_BREAKER_COOLDOWN"] = float(os.getenv("OPENAI_BREAKER_COOLDOWN", "30"))
+    # Shelf mapping each wa_id to its Assistant thread (read by /threads)
+    app.config["OPENAI_THREADS_DB"] = os.getenv("OPENAI_THREADS_DB", "threads_db")
+
+    # Durable outbox for replies (SQLite WAL); unset OUTBOX_PATH to send directly
+    app.config["OUTBOX_PATH"] = os.getenv("OUTBOX_PATH", "outbox.db")
+    app.config["OUTBOX_MAX_ATTEMPTS"] = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+    app.config["OUTBOX_BASE_BACKOFF"] = float(os.getenv("OUTBOX_BASE_BACKOFF", "1"))
+    app.config["OUTBOX_WORKERS"] = int(os.getenv("OUTBOX_WORKERS", "8"))
+
+    # Consecutive text messages to a user are merged into one send; they wait
+    # at most this many seconds (0 sends every message on its own)
+    app.config["SEND_COALESCE_WINDOW"] = float(os.getenv("SEND_COALESCE_WINDOW", "0.5"))
+    app.config["SEND_COALESCE_MAX_CHARS"] = int(os.getenv("SEND_COALESCE_MAX_CHARS", "4096"))
+
+    # Conversation sessions (multi-step flows such as booking)
+    app.config["SESSION_TTL"] = float(os.getenv("SESSION_TTL", "1800"))
+    app.config["SESSION_MAX_ACTIVE"] = int(os.getenv("SESSION_MAX_ACTIVE", "10000"))
+    # Shelf receiving sessions evicted from memory (unset drops them)
+    app.config["SESSION_SPILL_PATH"] = os.getenv("SESSION_SPILL_PATH", "sessions_db")
+
+    # Scheduled messages (reminders, follow-ups); unset SCHEDULER_PATH to disable
+    app.config["SCHEDULER_PATH"] = os.getenv("SCHEDULER_PATH", "scheduled.db")
+    app.config["SCHEDULER_BATCH_SIZE"] = int(os.getenv("SCHEDULER_BATCH_SIZE", "500"))
+    # Seconds ahead whose jobs are held in memory
+    app.config["SCHEDULER_HORIZON"] = float(os.getenv("SCHEDULER_HORIZON", "300"))
+
+    # Delivery-status storage (sent/delivered/read webhooks)
+    app.config["STATUS_STORE_PATH"] = os.getenv("STATUS_STORE_PATH", "status_db.bin")
+    app.config["STATUS_FLUSH_SIZE"] = int(os.getenv("STATUS_FLUSH_SIZE", "512"))
+    app.config["STATUS_FLUSH_INTERVAL"] = float(os.getenv("STATUS_FLUSH_INTERVAL", "5"))
+    # The file is rotated past this size or age; STATUS_KEEP_SEGMENTS rotated files are kept
+    app.config["STATUS_SEGMENT_BYTES"] = int(os.getenv("STATUS_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+    app.config["STATUS_SEGMENT_AGE"] = float(os.getenv("STATUS_SEGMENT_AGE", "86400"))
+    app.config["STATUS_KEEP_SEGMENTS"] = int(os.getenv("STATUS_KEEP_SEGMENTS", "7"))
+
+    # Profiling: span_seconds summaries on /metrics, and capture of webhook
+    # requests slower than PROFILE_SLOW_REQUEST_MS (0 disables) for /profile/slow
+    app.config["PROFILE_SPANS"] = os.getenv("PROFILE_SPANS", "false").lower() in ("1", "true", "yes")
+    app.config["PROFILE_SLOW_REQUEST_MS"] = float(os.getenv("PROFILE_SLOW_REQUEST_MS", "0"))
+    app.config["PROFILE_SLOW_REQUEST_KEEP"] = int(os.getenv("PROFILE_SLOW_REQUEST_KEEP", "50"))
+
+    # Opt-in webhook traffic recording (for replay-based performance testing)
+    app.config["WEBHOOK_RECORD_DIR"] = os.getenv("WEBHOOK_RECORD_DIR")
+    app.config["WEBHOOK_RECORD_KEY"] = os.getenv("WEBHOOK_RECORD_KEY")
+    app.config["WEBHOOK_RECORD_SEGMENT_RECORDS"] = int(os.getenv("WEBHOOK_RECORD_SEGMENT_RECORDS", "10000"))
+
+
+_logging_configured = False
 
 
 def configure_logging():
+    global _logging_configured
+    # Every create_app() calls this; the handlers are only built once per process
+    if _logging_configured:
+        return
+    _logging_configured = True
+
     from logging.handlers import RotatingFileHandler
 
     # Create logs directory
@@ -38,7 +162,8 @@ def configure_logging():
     file_handler = RotatingFileHandler(
         all_logs_file,
         maxBytes=10 * 1024 * 1024,  # 10MB
-        backupCount=5
+        backupCount=5,
+        delay=True,  # Opened on the first record, not at startup
     )
     file_handler.setLevel(logging.INFO)
     file_handler.setFormatter(formatter)
@@ -48,7 +173,8 @@ def configure_logging():
     error_handler = RotatingFileHandler(
         error_logs_file,
         maxBytes=10 * 1024 * 1024,  # 10MB
-        backupCount=5
+        backupCount=5,
+        delay=True,
     )
     error_handler.setLevel(logging.ERROR)
     error_handler.setFormatter(formatter)
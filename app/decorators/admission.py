@@ -0,0 +1,196 @@
+from functools import wraps
+from flask import current_app, jsonify
+import collections
+import logging
+import threading
+import time
+
+from app.services.status_store import looks_like_status_payload
+from app.utils import metrics
+from app.utils.ingestion import get_raw_body, get_webhook_batch
+
+# Outcomes of AdmissionController.claim_messages
+CLAIMED = "claimed"
+DUPLICATE = "duplicate"
+IN_FLIGHT = "in_flight"
+
+
+class AdmissionController:
+    """
+    Bound the number of webhook requests processed at once.
+
+    Inbound messages get every slot and may wait in a bounded queue for one
+    to free up. Status webhooks only get a share of the slots, never queue
+    and never take a slot while messages are waiting. Retries of messages
+    already handled (Meta re-delivers when we are slow) are acknowledged
+    without being processed again; retries of messages still being handled
+    are answered 503, so Meta tries again should the first attempt fail.
+
+    Args:
+        max_in_flight (int): Requests processed concurrently
+        max_queue (int): Inbound-message requests allowed to wait for a slot
+        queue_timeout (float): Seconds a queued request waits before being shed
+        status_share (float): Fraction of max_in_flight status webhooks may use
+        dedup_size (int): Recently accepted message ids remembered
+    """
+
+    def __init__(self, max_in_flight=32, max_queue=64, queue_timeout=2.0, status_share=0.5, dedup_size=10000):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.status_limit = max(1, int(max_in_flight * status_share))
+        self.dedup_size = dedup_size
+        self.in_flight = 0
+        self.waiting = 0
+        # message id -> True once handled, False while being handled
+        self._seen = collections.OrderedDict()
+        self._condition = threading.Condition()
+
+    def admit(self, kind):
+        """
+        Try to take a processing slot.
+
+        Args:
+            kind (str): 'message' or 'status'
+
+        Returns:
+            str: None if admitted, otherwise the reason the request is shed
+        """
+        with self._condition:
+            if kind == "status":
+                if self.waiting or self.in_flight >= self.status_limit:
+                    return "status_overload"
+                self.in_flight += 1
+                return None
+
+            if self.in_flight < self.max_in_flight and not self.waiting:
+                self.in_flight += 1
+                return None
+            if self.waiting >= self.max_queue:
+                return "queue_full"
+
+            self.waiting += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.in_flight >= self.max_in_flight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return "queue_timeout"
+                    self._condition.wait(remaining)
+                self.in_flight += 1
+                return None
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def claim_messages(self, message_ids):
+        """
+        Mark message ids as being handled.
+
+        Returns:
+            str: CLAIMED if any id is new, otherwise IN_FLIGHT if one of them
+            is still being handled, or DUPLICATE if all were handled
+        """
+        with self._condition:
+            new = [m for m in message_ids if m not in self._seen]
+            if message_ids and not new:
+                for message_id in message_ids:
+                    self._seen.move_to_end(message_id)
+                return DUPLICATE if all(self._seen[m] for m in message_ids) else IN_FLIGHT
+            for message_id in new:
+                self._seen[message_id] = False
+            while len(self._seen) > self.dedup_size:
+                self._seen.popitem(last=False)
+            return CLAIMED
+
+    def complete_messages(self, message_ids):
+        """Mark claimed ids as handled: later deliveries are duplicates."""
+        with self._condition:
+            for message_id in message_ids:
+                if message_id in self._seen:
+                    self._seen[message_id] = True
+
+    def unclaim_messages(self, message_ids):
+        """Forget ids whose processing failed so Meta's retry is accepted."""
+        with self._condition:
+            for message_id in message_ids:
+                self._seen.pop(message_id, None)
+
+
+def init_admission_control(app):
+    controller = AdmissionController(
+        max_in_flight=app.config["WEBHOOK_MAX_IN_FLIGHT"],
+        max_queue=app.config["WEBHOOK_MAX_QUEUE"],
+        queue_timeout=app.config["WEBHOOK_QUEUE_TIMEOUT"],
+        status_share=app.config["WEBHOOK_STATUS_SHARE"],
+    )
+    app.extensions["admission"] = controller
+    return controller
+
+
+def _shed(kind, reason):
+    metrics.increment("webhook_shed", kind=kind, reason=reason)
+    logging.debug(f"Shedding {kind} webhook: {reason}")
+    response = jsonify({"status": "error", "message": "Server busy, retry later"})
+    response.headers["Retry-After"] = str(current_app.config["WEBHOOK_RETRY_AFTER"])
+    return response, 503
+
+
+def admission_controlled(f):
+    """
+    Decorator applying load shedding to the webhook endpoint.
+
+    When over capacity the request is answered immediately with 503 and a
+    Retry-After header so Meta re-delivers it later. Every shed decision is
+    counted in the 'webhook_shed' metric.
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        controller = current_app.extensions.get("admission")
+        if controller is None:
+            return f(*args, **kwargs)
+
+        message_ids = []
+        if looks_like_status_payload(get_raw_body()):
+            kind = "status"
+        else:
+            kind = "message"
+            try:
+                message_ids = [m.message_id for m in get_webhook_batch().messages if m.message_id]
+            except ValueError:
+                # Invalid JSON: let the handler produce its 400
+                pass
+            claim = controller.claim_messages(message_ids)
+            if claim == IN_FLIGHT:
+                # Acknowledging it would lose the message if the first attempt fails
+                return _shed("duplicate", "in_flight")
+            if claim == DUPLICATE:
+                metrics.increment("webhook_shed", kind="duplicate", reason="duplicate")
+                logging.info(f"Ignoring duplicate delivery of {message_ids}")
+                return jsonify({"status": "ok"}), 200
+
+        reason = controller.admit(kind)
+        if reason is not None:
+            controller.unclaim_messages(message_ids)
+            return _shed(kind, reason)
+
+        metrics.increment("webhook_admitted", kind=kind)
+        succeeded = False
+        try:
+            result = f(*args, **kwargs)
+            status_code = result[1] if isinstance(result, tuple) else 200
+            succeeded = status_code < 400
+            return result
+        finally:
+            controller.release()
+            if succeeded:
+                controller.complete_messages(message_ids)
+            else:
+                controller.unclaim_messages(message_ids)
+
+    return decorated_function
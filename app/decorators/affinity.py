@@ -0,0 +1,72 @@
+from functools import wraps
+from flask import current_app, jsonify, request
+import logging
+
+from app.services.affinity import FORWARDED_HEADER, SECRET_HEADER
+from app.utils import metrics
+from app.utils.ingestion import get_raw_body, get_webhook_batch
+
+
+def route_messages(cluster, batch, body, signature, forwarded=None, secret=None):
+    """
+    Forward the messages other nodes own and keep the rest in `batch`.
+
+    Args:
+        cluster (Cluster): This instance's view of the ring
+        batch (WebhookBatch): The parsed webhook; its messages are narrowed to the local ones
+        body (bytes): The raw webhook body
+        signature (str): Its X-Hub-Signature-256 header
+        forwarded (str): The X-Affinity-Forwarded header of the request, if any
+        secret (str): The X-Affinity-Secret header of the request, if any
+    """
+    if forwarded is not None and not cluster.is_peer(secret):
+        # Any client can set the header; only a peer knows the cluster secret
+        logging.warning("Ignoring an affinity listing sent without the cluster secret")
+        metrics.increment("affinity_unverified")
+        forwarded = None
+    local, remote = cluster.split(batch.messages, forwarded)
+    if forwarded is not None:
+        metrics.increment("affinity_received", len(local))
+    # Better a reply without the owner's state than no reply
+    failed = cluster.forward_all(body, signature, remote) if remote else set()
+    if failed:
+        logging.warning(f"Answering {sorted(failed)} here, their node is unavailable")
+    keep = {id(m) for m in local}
+    batch.messages = [m for m in batch.messages if id(m) in keep or m.wa_id in failed]
+    return batch
+
+
+def affinity_routed(f):
+    """
+    Decorator sending each inbound message to the node owning its sender
+    (see app/services/affinity.py). Apply it below admission_controlled, so
+    the forwarding hop holds an admission slot like local processing does.
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        cluster = current_app.extensions.get("affinity")
+        if cluster is None:
+            return f(*args, **kwargs)
+        try:
+            batch = get_webhook_batch()
+        except ValueError:
+            # Invalid JSON: let the handler produce its 400
+            return f(*args, **kwargs)
+        if not batch.messages:
+            return f(*args, **kwargs)
+
+        route_messages(
+            cluster,
+            batch,
+            get_raw_body(),
+            request.headers.get("X-Hub-Signature-256", ""),
+            request.headers.get(FORWARDED_HEADER),
+            request.headers.get(SECRET_HEADER),
+        )
+        if not batch.messages and not batch.statuses:
+            # Every message was answered by its owner
+            return jsonify({"status": "ok"}), 200
+        return f(*args, **kwargs)
+
+    return decorated_function
@@ -0,0 +1,29 @@
+from functools import wraps
+from flask import current_app, jsonify
+
+from app.utils import metrics
+
+
+def drain_aware(f):
+    """
+    Decorator counting webhook requests in flight, so a drain can wait for
+    them, and refusing new ones with 503 and Retry-After once it started
+    (Meta re-delivers them later, to an instance that is not shutting down).
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        lifecycle = current_app.extensions.get("lifecycle")
+        if lifecycle is None:
+            return f(*args, **kwargs)
+        if not lifecycle.enter():
+            metrics.increment("webhook_shed", kind="webhook", reason="draining")
+            response = jsonify({"status": "error", "message": "Shutting down, retry later"})
+            response.headers["Retry-After"] = str(current_app.config["WEBHOOK_RETRY_AFTER"])
+            return response, 503
+        try:
+            return f(*args, **kwargs)
+        finally:
+            lifecycle.exit()
+
+    return decorated_function
@@ -0,0 +1,23 @@
+from functools import wraps
+from flask import current_app, request
+
+
+def profiled(f):
+    """
+    Decorator capturing each request with the request profiler, if one is
+    configured (see PROFILE_SLOW_REQUEST_MS), so slow requests can be
+    inspected at /profile/slow. Apply it first so the whole request is timed.
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        profiler = current_app.extensions.get("profiler")
+        if profiler is None:
+            return f(*args, **kwargs)
+        token = profiler.begin()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            profiler.end(token, f"{request.method} {request.path}")
+
+    return decorated_function
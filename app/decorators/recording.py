@@ -0,0 +1,20 @@
+from functools import wraps
+from flask import current_app, request
+import time
+
+
+def traffic_recorded(f):
+    """
+    Decorator that hands each webhook request to the traffic recorder, if one
+    is configured (see WEBHOOK_RECORD_DIR). Apply it below signature_required
+    so only verified traffic is recorded.
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        recorder = current_app.extensions.get("traffic_recorder")
+        if recorder is not None:
+            recorder.record(request.get_data(cache=True), request.headers, time.time())
+        return f(*args, **kwargs)
+
+    return decorated_function
@@ -1,38 +1,117 @@
 from functools import wraps
 from flask import current_app, jsonify, request
+import functools
 import logging
 import hashlib
 import hmac
 
+from app.utils.ingestion import get_phone_number_id
 
-def validate_signature(payload, signature):
+
+def get_signing_hmac():
+    """
+    Return an HMAC-SHA256 object keyed with the App Secret.
+
+    The keyed object is built once per app (and rebuilt only if APP_SECRET
+    changes); each request works on a cheap copy of it instead of re-encoding
+    the secret and re-deriving the HMAC pads.
+    """
+    secret = current_app.config["APP_SECRET"]
+    cached = current_app.extensions.get("webhook_signing_hmac")
+    if cached is None or cached[0] != secret:
+        cached = (secret, hmac.new(bytes(secret, "latin-1"), digestmod=hashlib.sha256))
+        current_app.extensions["webhook_signing_hmac"] = cached
+    return cached[1]
+
+
+@functools.lru_cache(maxsize=256)
+def _tenant_signing_hmac(secret):
+    return hmac.new(bytes(secret, "latin-1"), digestmod=hashlib.sha256)
+
+
+def get_request_secret():
+    """
+    App Secret of the tenant a webhook is addressed to, or None for the app's own.
+
+    The body is read before it is verified to find the phone number id; what
+    was read is cached for the handler, so nothing is decoded twice.
+    """
+    registry = current_app.extensions.get("tenants")
+    if registry is None or not registry.directory:
+        return None
+    try:
+        tenant = registry.get(get_phone_number_id())
+    except ValueError:
+        return None
+    return tenant.app_secret if tenant is not None else None
+
+
+def validate_signature(payload, signature, secret=None):
     """
     Validate the incoming payload's signature against our expected signature
+
+    Args:
+        payload (bytes): The raw request body (str is accepted and encoded as UTF-8)
+        signature (str): Hex digest from the X-Hub-Signature-256 header
+        secret (str): A tenant's App Secret (default: APP_SECRET)
     """
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+
     # Use the App Secret to hash the payload
-    expected_signature = hmac.new(
-        bytes(current_app.config["APP_SECRET"], "latin-1"),
-        msg=payload.encode("utf-8"),
-        digestmod=hashlib.sha256,
-    ).hexdigest()
+    mac = (get_signing_hmac() if secret is None else _tenant_signing_hmac(secret)).copy()
+    mac.update(payload)
+    expected_signature = mac.hexdigest()
 
     # Check if the signature matches
-    return hmac.compare_digest(expected_signature, signature)
+    try:
+        return hmac.compare_digest(expected_signature, signature)
+    except TypeError:
+        # Non-ASCII garbage in the header
+        return False
 
 
 def signature_required(f):
     """
     Decorator to ensure that the incoming requests to our webhook are valid and signed with the correct signature.
+
+    The signature is checked over the raw request bytes; bodies larger than
+    MAX_WEBHOOK_BODY_BYTES are rejected before anything is read or hashed.
     """
 
     @wraps(f)
     def decorated_function(*args, **kwargs):
+        max_bytes = current_app.config.get("MAX_WEBHOOK_BODY_BYTES")
+        if max_bytes and request.content_length is not None and request.content_length > max_bytes:
+            logging.warning(f"Rejected oversized webhook body: {request.content_length} bytes")
+            return jsonify({"status": "error", "message": "Payload too large"}), 413
+
         signature = request.headers.get("X-Hub-Signature-256", "")[
             7:
         ]  # Removing 'sha256='
-        if not validate_signature(request.data.decode("utf-8"), signature):
+        if not validate_signature(request.get_data(cache=True), signature, get_request_secret()):
             logging.info("Signature verification failed!")
             return jsonify({"status": "error", "message": "Invalid signature"}), 403
         return f(*args, **kwargs)
 
     return decorated_function
+
+
+def admin_required(f):
+    """
+    Decorator protecting operational endpoints with the ADMIN_TOKEN bearer token.
+    The endpoints are hidden (404) when no ADMIN_TOKEN is configured.
+    """
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        token = current_app.config.get("ADMIN_TOKEN")
+        if not token:
+            return jsonify({"status": "error", "message": "Not found"}), 404
+        provided = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(provided.encode("utf-8"), f"Bearer {token}".encode("utf-8")):
+            logging.info("Admin authentication failed!")
+            return jsonify({"status": "error", "message": "Unauthorized"}), 401
+        return f(*args, **kwargs)
+
+    return decorated_function
@@ -0,0 +1,268 @@
+"""
+Conversation affinity across instances: every wa_id is answered by one node.
+
+Per-user state lives in each instance (greeted users, the Assistant thread
+shelf, the Assistant run in flight for a thread), so consecutive messages
+from a user must reach the same instance. The nodes listed in CLUSTER_NODES
+form a consistent-hash ring of wa_id -> node. A webhook that arrives at the
+wrong node (the load balancer picks any) is forwarded once, with its
+original body and signature, to the node that owns each sender; the owner
+answers and the first node passes its response back to Meta.
+
+Forwarded requests carry the X-Affinity-Forwarded header listing the
+wa_ids the receiver must answer, and the shared CLUSTER_SECRET in
+X-Affinity-Secret; the listing is only honored with the secret, since any
+client can set the header. Receivers never forward again, so nodes whose
+member lists briefly disagree cannot bounce a message between them.
+If an owner cannot be reached its messages are answered locally: the user
+gets a reply, possibly without the state kept on the owner. An owner that
+accepted the connection but is slow to answer (its reply waits on the
+Assistant) has the webhook and will answer it, so a read timeout counts as
+delivered rather than producing a second reply here. Forwards to different
+peers run concurrently.
+
+Adding or removing a node only moves the wa_ids of the ring segments it
+gains or loses (about 1/N of them). Status webhooks are not routed; they
+are stored wherever they arrive.
+"""
+import bisect
+import hashlib
+import hmac
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from app.utils import metrics
+
+FORWARDED_HEADER = "X-Affinity-Forwarded"
+SECRET_HEADER = "X-Affinity-Secret"
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent-hash ring with virtual nodes.
+
+    Args:
+        nodes (iterable): Node names (the base URLs of the instances)
+        replicas (int): Points per node on the ring; more spreads keys more evenly
+    """
+
+    def __init__(self, nodes=(), replicas=128):
+        self.replicas = replicas
+        self._points = []
+        self._owners = []
+        self.nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        kept = [(p, n) for p, n in zip(self._points, self._owners) if n != node]
+        self._points = [p for p, _ in kept]
+        self._owners = [n for _, n in kept]
+
+    def node_for(self, key):
+        """
+        Returns:
+            str: The node owning a key (the first point clockwise from its hash), or None if empty
+        """
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+class Cluster:
+    """
+    This instance's view of the ring and the forwarding hop to its peers.
+
+    Args:
+        self_node (str): This instance's base URL, as listed in `nodes`
+        nodes (iterable): Base URLs of every instance (this one included)
+        timeout (float): Seconds to wait for a peer to answer a forwarded webhook
+        replicas (int): Virtual nodes per instance
+        connect_timeout (float): Seconds to wait for a connection to a peer;
+            only a peer that could not be reached is answered for locally
+        secret (str): Shared by the nodes to prove a webhook was forwarded by a
+            peer; without it forwarded listings are never honored
+    """
+
+    def __init__(self, self_node, nodes, timeout=15.0, replicas=128, connect_timeout=2.0, secret=None):
+        self.self_node = self_node
+        self.secret = secret
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.replicas = replicas
+        self._lock = threading.Lock()
+        self.ring = HashRing(nodes, replicas)
+        self.ring.add(self_node)
+        self._session = None
+        self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="affinity")
+
+    @property
+    def nodes(self):
+        return sorted(self.ring.nodes)
+
+    def set_nodes(self, nodes):
+        """Change the members; only the wa_ids of added or removed nodes move."""
+        with self._lock:
+            ring = HashRing((), self.replicas)
+            for node in set(nodes) | {self.self_node}:
+                ring.add(node)
+            self.ring = ring
+        logging.info(f"Cluster members: {self.nodes}")
+
+    def is_peer(self, secret):
+        """
+        Returns:
+            bool: True if `secret` (the X-Affinity-Secret header) is the cluster's
+        """
+        if not self.secret or secret is None:
+            return False
+        return hmac.compare_digest(secret.encode("utf-8"), self.secret.encode("utf-8"))
+
+    def owner(self, wa_id):
+        return self.ring.node_for(wa_id)
+
+    def split(self, messages, forwarded=None):
+        """
+        Group a webhook's messages by the node that answers them.
+
+        Args:
+            messages (list): MessageEvent instances
+            forwarded (str): The X-Affinity-Forwarded header, if a peer sent the webhook
+
+        Returns:
+            tuple: (messages to answer here, {peer node: wa_ids to forward})
+        """
+        if forwarded is not None:
+            # A peer already routed these; answer what it asked for, never forward again
+            wanted = set(forwarded.split(","))
+            return [m for m in messages if m.wa_id in wanted], {}
+
+        ring = self.ring
+        local, remote = [], {}
+        for message in messages:
+            node = ring.node_for(message.wa_id)
+            if node == self.self_node:
+                local.append(message)
+            else:
+                wa_ids = remote.setdefault(node, [])
+                if message.wa_id not in wa_ids:
+                    wa_ids.append(message.wa_id)
+        return local, remote
+
+    def get_session(self):
+        if self._session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=32)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._session = session
+        return self._session
+
+    def forward(self, node, body, signature, wa_ids):
+        """
+        Send a webhook body to the node owning some of its senders.
+
+        Args:
+            node (str): The peer's base URL
+            body (bytes): The raw webhook body (unchanged, so its signature still verifies)
+            signature (str): The original X-Hub-Signature-256 header
+            wa_ids (list): Senders the peer must answer
+
+        Returns:
+            bool: True if the peer accepted the webhook, or received it and is still answering
+        """
+        headers = {
+            "Content-Type": "application/json",
+            "X-Hub-Signature-256": signature,
+            FORWARDED_HEADER: ",".join(wa_ids),
+        }
+        if self.secret:
+            headers[SECRET_HEADER] = self.secret
+        try:
+            response = self.get_session().post(
+                f"{node}/webhook", data=body, headers=headers, timeout=(self.connect_timeout, self.timeout),
+            )
+        except requests.ReadTimeout:
+            # The peer has the webhook and is answering it; replying here too would send two answers
+            logging.warning(f"{node} took over {self.timeout}s to answer a forwarded webhook, leaving it the reply")
+            metrics.increment("affinity_forwards", result="timeout")
+            return True
+        except requests.RequestException as e:
+            logging.error(f"Forwarding to {node} failed: {e}")
+            metrics.increment("affinity_forwards", result="error")
+            return False
+        if response.status_code >= 400:
+            logging.error(f"Forwarding to {node} was answered with {response.status_code}")
+            metrics.increment("affinity_forwards", result="rejected")
+            return False
+        metrics.increment("affinity_forwards", result="ok")
+        return True
+
+    def forward_all(self, body, signature, remote):
+        """
+        Forward a webhook to every peer owning some of its senders, concurrently.
+
+        Args:
+            body (bytes): The raw webhook body
+            signature (str): The original X-Hub-Signature-256 header
+            remote (dict): {peer node: wa_ids}, as returned by split()
+
+        Returns:
+            set: wa_ids whose owner could not be reached
+        """
+        if len(remote) == 1:
+            # No other forward to overlap with; skip the hand-off to the pool
+            (node, wa_ids), = remote.items()
+            return set() if self.forward(node, body, signature, wa_ids) else set(wa_ids)
+        futures = {node: self._pool.submit(self.forward, node, body, signature, wa_ids)
+                   for node, wa_ids in remote.items()}
+        failed = set()
+        for node, future in futures.items():
+            if not future.result():
+                failed.update(remote[node])
+        return failed
+
+    def stats(self):
+        return {"self": self.self_node, "nodes": self.nodes, "replicas": self.replicas}
+
+
+def init_affinity(app):
+    """Join the cluster listed in CLUSTER_NODES (single instance when unset)."""
+    nodes = [n.strip().rstrip("/") for n in (app.config.get("CLUSTER_NODES") or "").split(",") if n.strip()]
+    if not nodes:
+        app.extensions["affinity"] = None
+        return None
+    self_node = (app.config.get("CLUSTER_SELF") or "").rstrip("/")
+    if self_node not in nodes:
+        raise ValueError(f"CLUSTER_SELF {self_node!r} is not one of CLUSTER_NODES {nodes}")
+    secret = app.config.get("CLUSTER_SECRET")
+    if not secret:
+        raise ValueError("CLUSTER_SECRET must be set when CLUSTER_NODES is")
+    cluster = Cluster(
+        self_node, nodes, timeout=app.config["CLUSTER_FORWARD_TIMEOUT"],
+        connect_timeout=app.config.get("CLUSTER_CONNECT_TIMEOUT", 2.0), secret=secret,
+    )
+    app.extensions["affinity"] = cluster
+    logging.info(f"Cluster node {self_node} of {cluster.nodes}")
+    return cluster
@@ -0,0 +1,212 @@
+"""
+Reply cache for frequently asked Assistant questions.
+
+Guests ask the same handful of questions ("wifi password?", "check-out
+time?") over and over. Questions are normalized (case and accent folding,
+punctuation and stopword removal, optionally reduced to their token set) so
+that different phrasings share one cache entry. Entries expire after a TTL,
+the least recently used entry is evicted when the cache is full, and the
+whole cache is dropped when the Assistant's configuration (instructions,
+model or files) changes.
+"""
+import collections
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+
+from app.utils import metrics
+
+# Words that carry no meaning for matching questions (English and Spanish)
+STOPWORDS = frozenset(
+    """
+    a an the is are was were be been am do does did can could would should will
+    i me you it its this that there what whats which how when where who please
+    hi hello hey thanks thank of to in on at for from with and or my our your
+    el la los las un una unos unas es son de del al a en y o que cual cuales
+    como cuando donde por para con se me te lo le hola gracias favor
+    """.split()
+)
+
+# Questions about the guest themselves must go to the Assistant
+PERSONAL_WORDS = frozenset(
+    """
+    my mine im ive reservation booking booked order paid payment refund
+    mi mis mio mia reserva reservacion pedido pago pague reembolso
+    """.split()
+)
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _fold(text):
+    """Lowercase and strip accents ("Contraseña" -> "contrasena")."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def normalize_question(text, token_set=True):
+    """
+    Reduce a question to its cache key.
+
+    Args:
+        text (str): The user's message
+        token_set (bool): Ignore word order and repeated words
+
+    Returns:
+        str: The normalized key, or "" if nothing meaningful is left
+    """
+    words = [w for w in _WORD.findall(_fold(text)) if w not in STOPWORDS]
+    if token_set:
+        words = sorted(set(words))
+    return " ".join(words)
+
+
+def is_cacheable(text, max_words=12):
+    """
+    Check whether a question is generic enough to share an answer.
+
+    Long messages, messages with numbers (dates, booking codes, phone numbers)
+    and messages about the guest's own booking are never cached.
+
+    Args:
+        text (str): The user's message
+        max_words (int): Longer messages are treated as conversation, not FAQ
+
+    Returns:
+        bool: True if the answer may be served from the cache
+    """
+    words = _WORD.findall(_fold(text))
+    if not words or len(words) > max_words:
+        return False
+    if any(w.isdigit() or w in PERSONAL_WORDS for w in words):
+        return False
+    return True
+
+
+def assistant_fingerprint(assistant):
+    """
+    Hash the parts of an Assistant that affect its answers.
+
+    Args:
+        assistant: Assistant object returned by the OpenAI API
+
+    Returns:
+        str: Fingerprint that changes when the answers may change
+    """
+    parts = [
+        getattr(assistant, "id", ""),
+        getattr(assistant, "model", ""),
+        getattr(assistant, "instructions", "") or "",
+        repr(getattr(assistant, "tools", None)),
+        repr(getattr(assistant, "file_ids", None)),
+        repr(getattr(assistant, "tool_resources", None)),
+    ]
+    return hashlib.sha256("\x00".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+class CacheEntry:
+    __slots__ = ("answer", "expires_at", "hits")
+
+    def __init__(self, answer, expires_at):
+        self.answer = answer
+        self.expires_at = expires_at
+        self.hits = 0
+
+
+class AnswerCache:
+    """
+    LRU + TTL cache of Assistant answers keyed by normalized question.
+
+    Args:
+        max_entries (int): Entries kept before the least recently used is evicted
+        ttl (float): Seconds an answer stays valid
+        token_set (bool): Key on the set of words instead of their order
+    """
+
+    def __init__(self, max_entries=256, ttl=3600.0, token_set=True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.token_set = token_set
+        self.fingerprint = None
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, question):
+        if not is_cacheable(question):
+            return None
+        return normalize_question(question, token_set=self.token_set) or None
+
+    def get(self, question):
+        """
+        Look up a cached answer.
+
+        Args:
+            question (str): The user's message
+
+        Returns:
+            str: The cached answer, or None
+        """
+        key = self.key(question)
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                metrics.increment("answer_cache", result="miss")
+                return None
+            entry.hits += 1
+            self._entries.move_to_end(key)
+        metrics.increment("answer_cache", result="hit")
+        return entry.answer
+
+    def put(self, question, answer):
+        """Cache the answer to a question if the question is cacheable."""
+        key = self.key(question)
+        if key is None or not answer:
+            return
+        with self._lock:
+            self._entries[key] = CacheEntry(answer, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def check_fingerprint(self, fingerprint):
+        """
+        Drop every entry if the Assistant configuration changed.
+
+        Returns:
+            bool: True if the cache was invalidated
+        """
+        with self._lock:
+            changed = self.fingerprint is not None and fingerprint != self.fingerprint
+            self.fingerprint = fingerprint
+            if changed:
+                self._entries.clear()
+        if changed:
+            metrics.increment("answer_cache_invalidated")
+        return changed
+
+    def invalidate(self):
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+            self.fingerprint = None
+        metrics.increment("answer_cache_invalidated")
+
+    def stats(self):
+        """
+        Returns:
+            dict: Entry count and the per-entry hit counters, most hit first
+        """
+        with self._lock:
+            entries = sorted(
+                ((key, entry.hits) for key, entry in self._entries.items()),
+                key=lambda item: item[1],
+                reverse=True,
+            )
+        return {"entries": len(entries), "hits": dict(entries)}
@@ -0,0 +1,287 @@
+"""
+Broadcast sender for template campaigns to large recipient lists.
+
+Recipients are streamed from a CSV or JSONL file, so only the messages in
+flight are held in memory. Sends run on a bounded worker pool behind a
+token-bucket rate limit. Each result is appended to a JSONL results file,
+together with a checkpoint holding the first line not yet finished. A
+crashed campaign restarted with the same results file skips everything that
+was already sent.
+"""
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Columns accepted as the recipient's WhatsApp ID
+RECIPIENT_KEYS = ("wa_id", "phone", "to", "recipient")
+
+
+def iter_recipients(path):
+    """
+    Stream recipients from a CSV (with a header row) or JSONL file.
+
+    Yields:
+        tuple: (index, record) where record is a dict with at least 'wa_id';
+            rows without a recipient, and JSONL lines that are not a JSON
+            object, are yielded with record None
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            rows = (_parse_jsonl_row(line) for line in f)
+        else:
+            rows = csv.DictReader(f)
+        for index, row in enumerate(rows):
+            if row is None:
+                logging.warning(f"Skipping malformed row {index} of {path}")
+                yield index, None
+                continue
+            wa_id = next((str(row[k]).strip() for k in RECIPIENT_KEYS if row.get(k)), None)
+            if wa_id:
+                row["wa_id"] = wa_id.lstrip("+")
+                yield index, row
+            else:
+                yield index, None
+
+
+def _parse_jsonl_row(line):
+    """Parse one JSONL line; None if it is not a JSON object."""
+    if not line.strip():
+        return {}
+    try:
+        row = json.loads(line)
+    except ValueError:
+        return None
+    return row if isinstance(row, dict) else None
+
+
+def count_recipients(path):
+    """Count rows with one streaming pass (for progress and ETA)."""
+    return sum(1 for _ in iter_recipients(path))
+
+
+class TokenBucket:
+    """
+    Rate limiter allowing `rate` acquisitions per second with bursts of `burst`.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CampaignProgress:
+    """Thread-safe counters with throughput and ETA."""
+
+    def __init__(self, total=None):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, status):
+        with self._lock:
+            if status in ("sent", "dry_run"):
+                self.sent += 1
+            elif status == "failed":
+                self.failed += 1
+            else:
+                self.skipped += 1
+
+    @property
+    def done(self):
+        return self.sent + self.failed + self.skipped
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return (self.sent + self.failed) / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        """Seconds left, or None if unknown."""
+        rate = self.rate()
+        if self.total is None or not rate:
+            return None
+        return max(0.0, (self.total - self.done) / rate)
+
+    def format(self):
+        total = f"/{self.total}" if self.total is not None else ""
+        eta = self.eta()
+        eta_text = time.strftime("%H:%M:%S", time.gmtime(eta)) if eta is not None else "--:--:--"
+        return (f"{self.done}{total} done | sent {self.sent} | failed {self.failed} | skipped {self.skipped} | "
+                f"{self.rate():.1f} msg/s | ETA {eta_text}")
+
+
+class Campaign:
+    """
+    Send one template to every recipient of a file.
+
+    Args:
+        recipients_path (str): CSV or JSONL file of recipients
+        results_path (str): JSONL file receiving one result per recipient
+        build_payload (callable): (record) -> JSON body for the messages endpoint
+        send (callable): (payload) -> message id; raises requests exceptions on failure
+        rate (float): Messages per second (0 = unlimited)
+        concurrency (int): Sends in flight
+        max_retries (int): Retries of throttled (429) or failed (5xx, network) sends
+        dry_run (bool): Mark results as 'dry_run' (used with a stub Graph API)
+    """
+
+    def __init__(self, recipients_path, results_path, build_payload, send, rate=20.0, concurrency=8,
+                 max_retries=3, dry_run=False):
+        self.recipients_path = recipients_path
+        self.results_path = results_path
+        self.checkpoint_path = f"{results_path}.checkpoint"
+        self.build_payload = build_payload
+        self.send = send
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.dry_run = dry_run
+        self.progress = CampaignProgress()
+        self._results_lock = threading.Lock()
+        self._in_flight = set()
+        self._position = -1
+
+    def _load_checkpoint(self):
+        """
+        Returns:
+            tuple: (first line not finished, set of finished lines after it)
+        """
+        watermark = 0
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                watermark = json.load(f).get("next_index", 0)
+        done = set()
+        if os.path.exists(self.results_path):
+            with open(self.results_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        index = json.loads(line)["index"]
+                    except (ValueError, KeyError):
+                        continue  # Partial last line after a crash
+                    if index >= watermark:
+                        done.add(index)
+            # A crash can leave a torn last line; start appending on a fresh one
+            with open(self.results_path, "rb+") as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell():
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        f.write(b"\n")
+        return watermark, done
+
+    def _save_checkpoint(self):
+        # Every line read so far is finished, except sends still in flight
+        next_index = min(self._in_flight) if self._in_flight else self._position + 1
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"next_index": next_index, "updated": time.time()}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _send_with_retries(self, payload):
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                return self.send(payload)
+            except requests.RequestException as e:
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                retryable = status is None or status == 429 or status >= 500
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                time.sleep(min(30.0, 2 ** attempt * 0.5))
+
+    def _process(self, index, record, results_file):
+        result = {"index": index, "wa_id": record["wa_id"] if record else None}
+        if record is None:
+            result.update(status="skipped", error="no recipient")
+        else:
+            try:
+                message_id = self._send_with_retries(self.build_payload(record))
+                result.update(status="dry_run" if self.dry_run else "sent", message_id=message_id)
+            except Exception as e:
+                result.update(status="failed", error=str(e))
+        result["t"] = round(time.time(), 3)
+        self.progress.record(result["status"])
+        with self._results_lock:
+            results_file.write(json.dumps(result) + "\n")
+            self._in_flight.discard(index)
+
+    def run(self, report_every=5.0, report=None):
+        """
+        Send the campaign, resuming from the checkpoint if there is one.
+
+        Args:
+            report_every (float): Seconds between progress reports
+            report (callable): Called with the progress line (default: logging.info)
+
+        Returns:
+            CampaignProgress: Final counters
+        """
+        report = report or logging.info
+        watermark, done = self._load_checkpoint()
+        self._position = watermark - 1
+        if watermark or done:
+            report(f"Resuming campaign at line {watermark} ({len(done)} later lines already done)")
+        self.progress.total = count_recipients(self.recipients_path) - watermark - len(done)
+
+        slots = threading.BoundedSemaphore(self.concurrency)
+        last_report = time.monotonic()
+        with open(self.results_path, "a", encoding="utf-8", buffering=1) as results_file, \
+                ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="campaign") as pool:
+
+            def run_one(index, record):
+                try:
+                    self._process(index, record, results_file)
+                finally:
+                    slots.release()
+
+            for index, record in iter_recipients(self.recipients_path):
+                if index < watermark:
+                    continue
+                if index in done:
+                    with self._results_lock:
+                        self._position = index
+                    continue
+                # Blocks while `concurrency` sends are in flight: the file is never read ahead
+                slots.acquire()
+                with self._results_lock:
+                    self._in_flight.add(index)
+                    self._position = index
+                pool.submit(run_one, index, record)
+
+                if time.monotonic() - last_report >= report_every:
+                    last_report = time.monotonic()
+                    with self._results_lock:
+                        self._save_checkpoint()
+                    report(self.progress.format())
+
+        with self._results_lock:
+            self._save_checkpoint()
+        report(self.progress.format())
+        return self.progress
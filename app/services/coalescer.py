@@ -0,0 +1,235 @@
+"""
+Per-recipient coalescing of outbound text messages.
+
+A new user gets the welcome template, the welcome menu and the keyword
+reply in a row, and a batched webhook can queue several replies to the same
+wa_id within milliseconds. Each send is one Graph API request and, later,
+three status webhooks. Consecutive text messages to the same recipient are
+therefore held in a buffer and sent as one message, their bodies joined by a
+blank line.
+
+A buffer is flushed when the webhook that filled it has been answered, when
+its `window` ends (for sends outside a webhook, such as late Assistant
+answers), when the next text would take it past the 4096-character limit of
+a WhatsApp text, or when a message that cannot be merged (a template, media,
+a reply quoting a message) is sent to the same recipient; that message then
+goes out right after the buffered texts, so the order is kept.
+"""
+import atexit
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+
+from app.utils import metrics
+
+MAX_TEXT_CHARS = 4096
+SEPARATOR = "\n\n"
+# Locks ordering the sends to each recipient; a recipient always maps to the same one
+STRIPES = 64
+
+
+class _Buffer:
+    __slots__ = ("sender", "message", "bodies", "length", "deadline")
+
+    def __init__(self, sender, message, body, deadline):
+        self.sender = sender
+        self.message = message
+        self.bodies = [body]
+        self.length = len(body)
+        self.deadline = deadline
+
+
+class SendCoalescer:
+    """
+    Buffers text messages per recipient and merges them into one send.
+
+    Args:
+        deliver (callable): (recipient, data, sender) -> result; sends one
+            message body (str) for real
+        window (float): Longest time in seconds a text waits in the buffer
+        max_chars (int): Longest merged text body
+        start (bool): Start the thread flushing buffers whose window ended
+            (tests call flush() themselves)
+    """
+
+    def __init__(self, deliver, window=0.5, max_chars=MAX_TEXT_CHARS, start=True):
+        self.deliver = deliver
+        self.window = window
+        self.max_chars = max_chars
+        self._buffers = {}
+        # (deadline, sequence, recipient); entries of buffers flushed early are skipped
+        self._deadlines = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._stripes = [threading.Lock() for _ in range(STRIPES)]
+        self._stopping = False
+        self.saved = 0
+
+        self._thread = None
+        if start:
+            self._thread = threading.Thread(target=self._flush_loop, name="send-coalescer", daemon=True)
+            self._thread.start()
+
+    def _stripe(self, recipient):
+        return self._stripes[hash(recipient) % STRIPES]
+
+    def _mergeable(self, data):
+        # The parsed message if it is a plain text that fits in a merged body
+        try:
+            message = json.loads(data)
+        except (TypeError, ValueError):
+            return None
+        if not isinstance(message, dict) or message.get("type") != "text" or "context" in message:
+            return None
+        body = (message.get("text") or {}).get("body")
+        if not isinstance(body, str) or len(body) > self.max_chars:
+            return None
+        return message
+
+    def submit(self, recipient, data, sender=None):
+        """
+        Send a message, holding it back to merge it if it is a text.
+
+        Args:
+            recipient (str): WhatsApp ID of the recipient
+            data (str): JSON body for the messages endpoint
+            sender (str): Tenant phone number id it is sent from (None for the app's own)
+
+        Returns:
+            deliver's result, or None if the message was buffered
+        """
+        if self._stopping:
+            # Closed (the app is draining): nothing would flush the buffer any more
+            return self.deliver(recipient, data, sender)
+        message = self._mergeable(data)
+        with self._stripe(recipient):
+            with self._lock:
+                buffer = self._buffers.get(recipient)
+                if message is not None and buffer is not None and buffer.sender == sender:
+                    body = message["text"]["body"]
+                    if buffer.length + len(SEPARATOR) + len(body) <= self.max_chars:
+                        buffer.bodies.append(body)
+                        buffer.length += len(SEPARATOR) + len(body)
+                        return None
+                full = self._buffers.pop(recipient, None)
+                if message is not None:
+                    deadline = time.monotonic() + self.window
+                    self._buffers[recipient] = _Buffer(sender, message, message["text"]["body"], deadline)
+                    heapq.heappush(self._deadlines, (deadline, next(self._sequence), recipient))
+                    self._wake.notify()
+            if full is not None:
+                self._send(recipient, full)
+            if message is None:
+                return self.deliver(recipient, data, sender)
+        return None
+
+    def _send(self, recipient, buffer):
+        # Called with the recipient's stripe held, so its sends stay in order
+        if len(buffer.bodies) > 1:
+            buffer.message["text"]["body"] = SEPARATOR.join(buffer.bodies)
+            saved = len(buffer.bodies) - 1
+            with self._lock:
+                self.saved += saved
+            metrics.increment("coalesced_messages", len(buffer.bodies))
+            metrics.increment("coalesced_sends_saved", saved)
+        return self.deliver(recipient, json.dumps(buffer.message), buffer.sender)
+
+    def flush(self, recipient=None):
+        """
+        Send the buffered texts of one recipient now, or of every recipient.
+
+        Returns:
+            int: Number of messages sent
+        """
+        recipients = [recipient] if recipient is not None else None
+        if recipients is None:
+            with self._lock:
+                recipients = list(self._buffers)
+        sent = 0
+        for recipient in recipients:
+            with self._stripe(recipient):
+                with self._lock:
+                    buffer = self._buffers.pop(recipient, None)
+                if buffer is not None:
+                    self._send(recipient, buffer)
+                    sent += 1
+        return sent
+
+    def _flush_due(self, now):
+        with self._lock:
+            due = []
+            while self._deadlines and self._deadlines[0][0] <= now:
+                due.append(heapq.heappop(self._deadlines)[2])
+        for recipient in due:
+            with self._stripe(recipient):
+                with self._lock:
+                    buffer = self._buffers.get(recipient)
+                    if buffer is None or buffer.deadline > now:
+                        continue
+                    del self._buffers[recipient]
+                self._send(recipient, buffer)
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                while not self._stopping:
+                    if self._deadlines:
+                        timeout = self._deadlines[0][0] - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    else:
+                        timeout = None
+                    self._wake.wait(timeout)
+                if self._stopping:
+                    return
+            try:
+                self._flush_due(time.monotonic())
+            except Exception as e:
+                logging.error(f"Failed to send coalesced messages: {e}")
+
+    def stats(self):
+        """
+        Returns:
+            dict: Recipients with buffered texts, and Graph API calls saved so far
+        """
+        with self._lock:
+            return {"buffered": len(self._buffers), "saved": self.saved}
+
+    def close(self):
+        """Stop the flush thread and send whatever is buffered."""
+        with self._lock:
+            if self._stopping:
+                return
+            self._stopping = True
+            self._wake.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+
+def init_send_coalescer(app):
+    """Create the send coalescer unless SEND_COALESCE_WINDOW is 0."""
+    window = app.config.get("SEND_COALESCE_WINDOW") or 0
+    if window <= 0:
+        return None
+
+    # Imported lazily: whatsapp_utils uses the coalescer through app.extensions
+    from flask import g
+    from app.services.tenants import use_tenant
+    from app.utils.whatsapp_utils import deliver_now
+
+    def deliver(recipient, data, sender):
+        with app.app_context():
+            g.tenant = None
+            if sender is not None:
+                use_tenant(sender)
+            return deliver_now(recipient, data)
+
+    coalescer = SendCoalescer(deliver, window=window, max_chars=app.config["SEND_COALESCE_MAX_CHARS"])
+    app.extensions["send_coalescer"] = coalescer
+    atexit.register(coalescer.close)
+    return coalescer
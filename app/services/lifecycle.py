@@ -0,0 +1,195 @@
+"""
+Process lifecycle: readiness after warm-up and a graceful drain on shutdown.
+
+An instance starts in 'starting' and reports ready (GET /ready) once the
+warm-up has loaded the message texts, opened the Graph API and OpenAI
+connections and fetched the Assistant, so the load balancer only sends it
+traffic when it is warm. Webhooks are handled while starting, too: Meta does
+not go through the readiness check.
+
+On SIGTERM the instance drains: /ready turns 503 so it is taken out of
+rotation, new webhooks are answered 503 with Retry-After (Meta re-delivers
+them, to another instance), and the requests in flight, including welcome
+flows and Assistant runs, get up to SHUTDOWN_DRAIN_TIMEOUT seconds to
+finish. Late Assistant answers are then delivered, buffered texts are
+flushed into the outbox and the outbox is given the rest of the deadline to
+send. What is still pending then stays on disk (outbox, scheduled
+messages, sessions, delivery statuses) and is picked up on the next start.
+"""
+import logging
+import signal
+import threading
+import time
+
+from app.utils import metrics
+
+STARTING = "starting"
+READY = "ready"
+DRAINING = "draining"
+STOPPED = "stopped"
+
+
+class Lifecycle:
+    """State of the instance and the webhook requests it is handling."""
+
+    def __init__(self):
+        self.state = STARTING
+        self.started = time.time()
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def mark_ready(self):
+        """Report ready, unless a drain already started."""
+        with self._condition:
+            if self.state == STARTING:
+                self.state = READY
+                logging.info(f"Ready after {time.time() - self.started:.2f}s")
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    def enter(self):
+        """
+        Count a request in flight.
+
+        Returns:
+            bool: False if the instance is draining and must refuse the request
+        """
+        with self._condition:
+            if self.state in (DRAINING, STOPPED):
+                return False
+            self.in_flight += 1
+            return True
+
+    def exit(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def begin_drain(self):
+        """Stop accepting requests."""
+        with self._condition:
+            if self.state in (DRAINING, STOPPED):
+                return False
+            self.state = DRAINING
+        logging.info(f"Draining: {self.in_flight} requests in flight")
+        return True
+
+    def wait_idle(self, timeout):
+        """
+        Returns:
+            bool: True if no request was left in flight within the timeout
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self.in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def stats(self):
+        return {"state": self.state, "in_flight": self.in_flight, "uptime": round(time.time() - self.started, 1)}
+
+
+def drain(app, timeout=25.0):
+    """
+    Stop taking work, finish what is in flight and persist the rest.
+
+    Args:
+        app (Flask): The app whose services are shut down
+        timeout (float): Seconds the whole drain may take
+
+    Returns:
+        dict: What was finished and what was left for the next start
+    """
+    deadline = time.monotonic() + timeout
+    lifecycle = app.extensions.get("lifecycle")
+    if lifecycle is not None and not lifecycle.begin_drain():
+        return None
+
+    def remaining():
+        return max(0.0, deadline - time.monotonic())
+
+    report = {"requests_finished": True, "late_replies_finished": True, "outbox_pending": 0}
+    if lifecycle is not None:
+        report["requests_finished"] = lifecycle.wait_idle(remaining())
+
+    responder = app.extensions.get("llm_responder")
+    if responder is not None:
+        # Answers that missed their deadline are still due to the user
+        report["late_replies_finished"] = responder.wait_late(remaining())
+        responder.shutdown(wait=False)
+
+    downloader = app.extensions.get("media_downloader")
+    if downloader is not None:
+        downloader.shutdown(wait=False)
+
+    coalescer = app.extensions.get("send_coalescer")
+    if coalescer is not None:
+        coalescer.close()
+
+    scheduler = app.extensions.get("scheduler")
+    if scheduler is not None:
+        scheduler.close()
+
+    outbox = app.extensions.get("outbox")
+    if outbox is not None:
+        outbox.wait_idle(remaining())
+        # Left on disk, sent after the restart
+        report["outbox_pending"] = outbox.stats()["pending"]
+        outbox.close()
+
+    sessions = app.extensions.get("sessions")
+    if sessions is not None:
+        sessions.close()
+
+    status_store = app.extensions.get("status_store")
+    if status_store is not None:
+        status_store.close()
+
+    recorder = app.extensions.get("traffic_recorder")
+    if recorder is not None:
+        recorder.close()
+
+    if lifecycle is not None:
+        report["requests_left"] = lifecycle.in_flight
+        lifecycle.state = STOPPED
+    report["seconds"] = round(timeout - remaining(), 2)
+    metrics.increment("drains", clean=str(report["requests_finished"] and report["late_replies_finished"]).lower())
+    logging.info(f"Drained: {report}")
+    return report
+
+
+def install_signal_handlers(app, stop):
+    """
+    Drain on SIGTERM, then call `stop` to end the server.
+
+    The drain runs on its own thread so the server keeps answering the
+    requests in flight (and /ready with 503) meanwhile.
+
+    Args:
+        app (Flask): The app to drain
+        stop (callable): Stops the server once drained (e.g. by raising SIGINT in it)
+    """
+
+    def handle(signum, frame):
+        logging.info(f"Received signal {signum}, draining for up to {app.config['SHUTDOWN_DRAIN_TIMEOUT']}s")
+
+        def run():
+            try:
+                drain(app, app.config["SHUTDOWN_DRAIN_TIMEOUT"])
+            finally:
+                stop()
+
+        threading.Thread(target=run, name="drain").start()
+
+    signal.signal(signal.SIGTERM, handle)
+
+
+def init_lifecycle(app):
+    lifecycle = Lifecycle()
+    app.extensions["lifecycle"] = lifecycle
+    return lifecycle
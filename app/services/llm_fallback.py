@@ -0,0 +1,298 @@
+"""
+Latency budget for Assistant replies.
+
+The OpenAI Assistant gets a per-message deadline. If it has not answered in
+time the user immediately gets the keyword-engine reply (or a configured
+holding message), and the late Assistant answer is either delivered as a
+follow-up or dropped. A circuit breaker sends messages straight to the fast
+path while the Assistant keeps failing or missing its deadline.
+"""
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from app.utils import metrics
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open breaker over a rolling window of outcomes.
+
+    Args:
+        window (int): Number of recent calls considered
+        failure_ratio (float): Failure share (errors and deadline misses) that opens the breaker
+        min_calls (int): Calls needed in the window before the breaker may open
+        cooldown (float): Seconds the breaker stays open before letting one trial call through
+    """
+
+    def __init__(self, window=20, failure_ratio=0.5, min_calls=5, cooldown=30.0):
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self._outcomes = collections.deque(maxlen=window)
+        self._opened_at = None
+        self._trial_running = False
+        # Bumped whenever the breaker opens or closes, so results of calls
+        # admitted in an earlier period are told apart from current ones
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """
+        Returns:
+            tuple: A call token to hand back to record() if a call to the slow
+                path may be attempted, None otherwise
+        """
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return (self._generation, False)
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return (self._generation, True)
+            return None
+
+    def record(self, call, success):
+        """
+        Record the outcome of a call admitted by allow().
+
+        Results of calls admitted before the breaker last opened or closed are
+        ignored: a late answer must neither close an open breaker nor restart
+        its cooldown. While open, only the half-open trial call counts.
+
+        Args:
+            call (tuple): The token allow() returned for the call
+            success (bool): Whether the call answered in time
+        """
+        generation, trial = call
+        with self._lock:
+            if generation != self._generation:
+                return
+            if self._opened_at is not None:
+                if not trial:
+                    return
+                self._trial_running = False
+                if success:
+                    self._opened_at = None
+                    self._outcomes.clear()
+                    self._generation += 1
+                else:
+                    self._opened_at = time.monotonic()
+                return
+
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_ratio:
+                logging.warning("OpenAI circuit breaker opened, using the keyword replies")
+                metrics.increment("llm_breaker_opened")
+                self._opened_at = time.monotonic()
+                self._generation += 1
+
+
+class DeadlineResponder:
+    """
+    Answer with the slow path if it is fast enough, otherwise with the fast path.
+
+    Args:
+        slow_fn (callable): (message_body, wa_id, name) -> reply, e.g. the Assistant
+        fast_fn (callable): (message_body) -> reply, e.g. the keyword engine
+        deadline (float): Seconds the slow path gets before the fast reply is used
+        late_reply (str): 'followup' to send late slow answers, 'drop' to discard them
+        holding_message (str): Sent instead of the fast reply on a deadline miss, if set
+        breaker (CircuitBreaker): Breaker guarding the slow path
+        max_workers (int): Slow-path calls running at once
+        async_slow_fn (callable): Coroutine function with the signature of
+            `slow_fn`, used by respond_async instead of a worker thread
+    """
+
+    def __init__(self, slow_fn, fast_fn, deadline=8.0, late_reply="followup", holding_message=None,
+                 breaker=None, max_workers=8, async_slow_fn=None):
+        self.slow_fn = slow_fn
+        self.async_slow_fn = async_slow_fn
+        self.fast_fn = fast_fn
+        self.deadline = deadline
+        self.late_reply = late_reply
+        self.holding_message = holding_message
+        self.breaker = breaker or CircuitBreaker()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        # Slow answers that missed the deadline and may still follow up
+        self.late_pending = 0
+        self._late_condition = threading.Condition()
+
+    def respond(self, message_body, wa_id, name, deliver_late=None, fast_fn=None):
+        """
+        Produce a reply within the deadline.
+
+        Args:
+            message_body (str): The user's message
+            wa_id (str): WhatsApp ID of the user
+            name (str): Profile name of the user
+            deliver_late (callable): Called with the slow answer if it arrives
+                after the deadline and late replies are enabled
+            fast_fn (callable): Fast path for this call (e.g. a tenant's keywords)
+
+        Returns:
+            str: The reply to send now
+        """
+        fast_fn = fast_fn or self.fast_fn
+        call = self.breaker.allow()
+        if call is None:
+            metrics.increment("llm_fallback", reason="circuit_open")
+            return fast_fn(message_body)
+
+        future = self._pool.submit(self.slow_fn, message_body, wa_id, name)
+        try:
+            reply = future.result(timeout=self.deadline)
+        except TimeoutError:
+            logging.warning(f"Assistant missed the {self.deadline}s deadline for {wa_id}, using the fast reply")
+            metrics.increment("llm_fallback", reason="deadline")
+            self.breaker.record(call, False)
+            with self._late_condition:
+                self.late_pending += 1
+            future.add_done_callback(lambda f: self._late(f, wa_id, deliver_late))
+            return self.holding_message or fast_fn(message_body)
+        except Exception as e:
+            logging.error(f"Assistant failed for {wa_id}: {e}")
+            metrics.increment("llm_fallback", reason="error")
+            self.breaker.record(call, False)
+            return fast_fn(message_body)
+
+        self.breaker.record(call, True)
+        return reply
+
+    async def respond_async(self, message_body, wa_id, name, deliver_late=None, fast_fn=None):
+        """
+        Event-loop version of respond: waiting for the slow path holds no thread.
+
+        Args:
+            message_body (str): The user's message
+            wa_id (str): WhatsApp ID of the user
+            name (str): Profile name of the user
+            deliver_late (callable): Called on the event loop with the slow
+                answer if it arrives after the deadline and late replies are enabled
+            fast_fn (callable): Fast path for this call (e.g. a tenant's keywords)
+
+        Returns:
+            str: The reply to send now
+        """
+        # Only the async serving mode needs asyncio; keep it off the WSGI startup path
+        import asyncio
+
+        fast_fn = fast_fn or self.fast_fn
+        call = self.breaker.allow()
+        if call is None:
+            metrics.increment("llm_fallback", reason="circuit_open")
+            return fast_fn(message_body)
+
+        if self.async_slow_fn is not None:
+            future = asyncio.ensure_future(self.async_slow_fn(message_body, wa_id, name))
+        else:
+            future = asyncio.wrap_future(self._pool.submit(self.slow_fn, message_body, wa_id, name))
+        try:
+            # Shielded: a deadline miss must not cancel the run, its answer may follow up
+            reply = await asyncio.wait_for(asyncio.shield(future), self.deadline)
+        except asyncio.TimeoutError:
+            logging.warning(f"Assistant missed the {self.deadline}s deadline for {wa_id}, using the fast reply")
+            metrics.increment("llm_fallback", reason="deadline")
+            self.breaker.record(call, False)
+            with self._late_condition:
+                self.late_pending += 1
+            future.add_done_callback(lambda f: self._late(f, wa_id, deliver_late))
+            return self.holding_message or fast_fn(message_body)
+        except Exception as e:
+            logging.error(f"Assistant failed for {wa_id}: {e}")
+            metrics.increment("llm_fallback", reason="error")
+            self.breaker.record(call, False)
+            return fast_fn(message_body)
+
+        self.breaker.record(call, True)
+        return reply
+
+    def _late(self, future, wa_id, deliver_late):
+        try:
+            if future.cancelled() or future.exception() is not None:
+                return
+            if self.late_reply != "followup" or deliver_late is None:
+                metrics.increment("llm_late_reply", action="dropped")
+                return
+            metrics.increment("llm_late_reply", action="delivered")
+            try:
+                deliver_late(future.result())
+            except Exception as e:
+                logging.error(f"Failed to deliver late Assistant reply to {wa_id}: {e}")
+        finally:
+            with self._late_condition:
+                self.late_pending -= 1
+                self._late_condition.notify_all()
+
+    def wait_late(self, timeout):
+        """
+        Wait for the late answers still being generated to be delivered or dropped.
+
+        Returns:
+            bool: True if none is left
+        """
+        deadline = time.monotonic() + timeout
+        with self._late_condition:
+            while self.late_pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._late_condition.wait(remaining)
+            return True
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+def init_llm_responder(app):
+    """
+    Create the deadline responder when REPLY_ENGINE is 'openai'.
+    """
+    if app.config["REPLY_ENGINE"] != "openai":
+        return None
+
+    from app.utils.message_handlers import generate_response
+    from app.utils.whatsapp_utils import process_text_for_whatsapp
+
+    # openai_service (and the openai package) is imported on the first
+    # Assistant call or by the warm-up, not while the app starts
+    def ask_assistant(message_body, wa_id, name):
+        from app.services import openai_service
+
+        return process_text_for_whatsapp(openai_service.generate_response(message_body, wa_id, name))
+
+    async def ask_assistant_async(message_body, wa_id, name):
+        from app.services import openai_service
+
+        return process_text_for_whatsapp(await openai_service.generate_response_async(message_body, wa_id, name))
+
+    responder = DeadlineResponder(
+        ask_assistant,
+        generate_response,
+        deadline=app.config["OPENAI_REPLY_DEADLINE"],
+        late_reply=app.config["OPENAI_LATE_REPLY"],
+        holding_message=app.config["OPENAI_HOLDING_MESSAGE"],
+        breaker=CircuitBreaker(
+            window=app.config["OPENAI_BREAKER_WINDOW"],
+            failure_ratio=app.config["OPENAI_BREAKER_FAILURE_RATIO"],
+            cooldown=app.config["OPENAI_BREAKER_COOLDOWN"],
+        ),
+        async_slow_fn=ask_assistant_async,
+    )
+    app.extensions["llm_responder"] = responder
+    return responder
@@ -0,0 +1,239 @@
+"""
+Background download of media customers send (photos, voice notes, documents).
+
+A media id from the webhook is resolved to a short-lived download URL with
+the Graph API, and the content is streamed to disk in fixed-size chunks:
+nothing larger than one chunk is held in memory and downloads over the size
+limit are aborted. Files are named by the hex sha256 of their content, so
+media that is sent again (forwarded photos, the same document twice) is
+fetched only once. The webhook announces the hash base64 encoded (it may
+contain '/'), so it is normalized to hex before it is used.
+Downloads run on a small bounded pool; when its queue is full new downloads
+are skipped instead of piling up behind the webhook.
+"""
+import base64
+import binascii
+import hashlib
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from app.utils import metrics
+
+
+class MediaTooLarge(Exception):
+    pass
+
+
+HEX_DIGITS = frozenset("0123456789abcdef")
+
+
+def normalize_sha256(value):
+    """
+    Hex form of a sha256 announced by the webhook or the media endpoint.
+
+    Args:
+        value (str): The hash, hex or base64 (standard or URL-safe, padding optional)
+
+    Returns:
+        str: 64 lowercase hex digits, or None if the value is missing or malformed
+    """
+    if not value or not isinstance(value, str):
+        return None
+    if len(value) == 64 and set(value.lower()) <= HEX_DIGITS:
+        return value.lower()
+    altchars = b"-_" if "-" in value or "_" in value else None
+    try:
+        raw = base64.b64decode(value + "=" * (-len(value) % 4), altchars=altchars, validate=True)
+    except (binascii.Error, ValueError):
+        raw = None
+    if raw is None or len(raw) != 32:
+        logging.warning(f"Ignoring malformed media sha256 {value[:80]!r}")
+        return None
+    return raw.hex()
+
+
+class MediaDownloader:
+    """
+    Resolve and stream inbound media to a directory.
+
+    Args:
+        directory (str): Where downloaded files are stored
+        graph_url (str): Base URL of the Graph API
+        version (str): Graph API version, e.g. 'v18.0'
+        access_token (str): Token for the media endpoints
+        max_bytes (int): Larger media is refused
+        chunk_size (int): Bytes read from the network and written at a time
+        max_workers (int): Downloads running at once
+        max_pending (int): Downloads queued or running before new ones are skipped
+    """
+
+    def __init__(self, directory, graph_url, version, access_token, max_bytes=25 * 1024 * 1024,
+                 chunk_size=64 * 1024, max_workers=4, max_pending=100):
+        self.directory = directory
+        self.graph_url = graph_url
+        self.version = version
+        self.access_token = access_token
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="media")
+        self._pending = 0
+        # sha256 -> future of a download in progress
+        self._in_progress = {}
+        self._lock = threading.Lock()
+
+    def _path(self, sha256, mime_type):
+        extension = mimetypes.guess_extension((mime_type or "").split(";")[0].strip()) or ".bin"
+        return os.path.join(self.directory, f"{sha256}{extension}")
+
+    def find(self, sha256, mime_type=None):
+        """Path of already downloaded media, or None."""
+        sha256 = normalize_sha256(sha256)
+        if not sha256:
+            return None
+        path = self._path(sha256, mime_type)
+        return path if os.path.exists(path) else None
+
+    def submit(self, media_id, sha256=None, mime_type=None, access_token=None):
+        """
+        Queue a download without waiting for it.
+
+        Args:
+            media_id (str): Media id from the webhook
+            sha256 (str): Content hash from the webhook (hex or base64), used to skip known media
+            mime_type (str): MIME type from the webhook
+            access_token (str): Token of the tenant that received it (default: the app's)
+
+        Returns:
+            Future: Resolves to the file path (None if the download failed),
+                or None if the media is already stored or the queue is full
+        """
+        sha256 = normalize_sha256(sha256)
+        if self.find(sha256, mime_type):
+            metrics.increment("media_download", result="duplicate")
+            return None
+        with self._lock:
+            if sha256 and sha256 in self._in_progress:
+                metrics.increment("media_download", result="duplicate")
+                return self._in_progress[sha256]
+            if self._pending >= self.max_pending:
+                metrics.increment("media_download", result="shed")
+                logging.warning(f"Media download queue full, skipping {media_id}")
+                return None
+            self._pending += 1
+            future = self._pool.submit(self._run, media_id, sha256, mime_type, access_token)
+            if sha256:
+                self._in_progress[sha256] = future
+        return future
+
+    def _run(self, media_id, sha256, mime_type, access_token=None):
+        try:
+            path = self.download(media_id, sha256, mime_type, access_token)
+            metrics.increment("media_download", result="ok")
+            return path
+        except MediaTooLarge as e:
+            logging.warning(f"Not downloading media {media_id}: {e}")
+            metrics.increment("media_download", result="too_large")
+        except Exception as e:
+            logging.error(f"Failed to download media {media_id}: {e}")
+            metrics.increment("media_download", result="error")
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._in_progress.pop(sha256, None)
+        return None
+
+    def resolve(self, media_id, access_token=None):
+        """
+        Returns:
+            dict: The media's 'url', 'mime_type', 'sha256' and 'file_size'
+        """
+        response = self.session.get(
+            f"{self.graph_url}/{self.version}/{media_id}",
+            headers={"Authorization": f"Bearer {access_token or self.access_token}"},
+            timeout=10,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def download(self, media_id, sha256=None, mime_type=None, access_token=None):
+        """
+        Resolve and stream one media file to disk (blocking).
+
+        Returns:
+            str: Path of the stored file
+
+        Raises:
+            MediaTooLarge: If the media exceeds max_bytes
+            ValueError: If the content does not match the announced sha256
+            requests.RequestException: If the Graph API calls fail
+        """
+        info = self.resolve(media_id, access_token)
+        sha256 = normalize_sha256(sha256) or normalize_sha256(info.get("sha256"))
+        mime_type = mime_type or info.get("mime_type")
+        if int(info.get("file_size") or 0) > self.max_bytes:
+            raise MediaTooLarge(f"{info['file_size']} bytes exceeds the {self.max_bytes} byte limit")
+        existing = self.find(sha256, mime_type)
+        if existing:
+            return existing
+
+        os.makedirs(self.directory, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f, self.session.get(
+                info["url"],
+                headers={"Authorization": f"Bearer {access_token or self.access_token}"},
+                stream=True,
+                timeout=30,
+            ) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise MediaTooLarge(f"more than {self.max_bytes} bytes")
+                    digest.update(chunk)
+                    f.write(chunk)
+
+            actual = digest.hexdigest()
+            if sha256 and actual != sha256:
+                raise ValueError(f"sha256 mismatch for media {media_id}")
+            path = self._path(actual, mime_type)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        logging.info(f"Downloaded media {media_id} ({size} bytes) to {path}")
+        return path
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+def init_media_downloader(app):
+    """Create the downloader when MEDIA_DOWNLOAD_DIR is configured."""
+    directory = app.config.get("MEDIA_DOWNLOAD_DIR")
+    if not directory:
+        return None
+    downloader = MediaDownloader(
+        directory,
+        app.config["GRAPH_API_URL"],
+        app.config["VERSION"],
+        app.config["ACCESS_TOKEN"],
+        max_bytes=app.config["MEDIA_MAX_BYTES"],
+        max_workers=app.config["MEDIA_DOWNLOAD_WORKERS"],
+        max_pending=app.config["MEDIA_DOWNLOAD_QUEUE"],
+    )
+    app.extensions["media_downloader"] = downloader
+    return downloader
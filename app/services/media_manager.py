@@ -0,0 +1,205 @@
+"""
+Upload-once cache for outbound media (template header images, documents, audio).
+
+Sending a public link makes Meta fetch the file from our web host on every
+message. Instead each asset is uploaded to the Cloud API media endpoint once
+and messages reference the returned media id. Ids are kept in memory and in a
+small JSON file so restarts do not re-upload, and are re-uploaded in the
+background shortly before Meta expires them. Concurrent misses for one asset
+share a single upload, and an asset whose upload failed is not tried again
+for a short backoff, so a slow or failing media endpoint is not hit once per
+message.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from app.utils import metrics
+
+# Meta keeps uploaded media for 30 days
+DEFAULT_MEDIA_TTL = 29 * 24 * 3600
+DEFAULT_REFRESH_MARGIN = 24 * 3600
+# Seconds a failed upload is not retried
+DEFAULT_FAILURE_BACKOFF = 60.0
+
+
+class MediaManager:
+    """
+    Map asset sources (URLs or file paths) to Cloud API media ids.
+
+    Args:
+        upload (callable): (source) -> media id; raises on failure
+        cache_path (str): JSON file persisting the ids, or None for memory only
+        ttl (float): Seconds an uploaded media id is used
+        refresh_margin (float): Ids closer than this to expiry are re-uploaded in the background
+        failure_backoff (float): Seconds an asset whose upload failed is not uploaded again
+    """
+
+    def __init__(self, upload, cache_path=None, ttl=DEFAULT_MEDIA_TTL, refresh_margin=DEFAULT_REFRESH_MARGIN,
+                 failure_backoff=DEFAULT_FAILURE_BACKOFF):
+        self.upload = upload
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.failure_backoff = failure_backoff
+        self._entries = {}
+        self._refreshing = set()
+        # source -> Event set when its upload in flight finishes
+        self._uploading = {}
+        # source -> time before which a failed upload is not retried
+        self._failed_until = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable media cache {self.cache_path}: {e}")
+
+    def _save_locked(self):
+        if not self.cache_path:
+            return
+        tmp_path = f"{self.cache_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logging.error(f"Failed to save media cache {self.cache_path}: {e}")
+
+    def _upload(self, source):
+        try:
+            media_id = self.upload(source)
+        except Exception as e:
+            logging.error(f"Failed to upload media {source}: {e}")
+            metrics.increment("media_upload", result="error")
+            with self._lock:
+                self._failed_until[source] = time.time() + self.failure_backoff
+            return None
+        metrics.increment("media_upload", result="ok")
+        now = time.time()
+        with self._lock:
+            self._entries[source] = {"media_id": media_id, "uploaded_at": now, "expires_at": now + self.ttl}
+            self._failed_until.pop(source, None)
+            self._save_locked()
+        logging.info(f"Uploaded media {source} as {media_id}")
+        return media_id
+
+    def _refresh(self, source):
+        try:
+            self._upload(source)
+        finally:
+            with self._lock:
+                self._refreshing.discard(source)
+
+    def _upload_once(self, source, done):
+        """Run the single upload of a cache miss and wake the callers waiting for it."""
+        try:
+            return self._upload(source)
+        finally:
+            with self._lock:
+                self._uploading.pop(source, None)
+            done.set()
+
+    def get_media_id(self, source, wait=True):
+        """
+        Return the media id for an asset, uploading it if needed.
+
+        Args:
+            source (str): Public URL or local file path of the asset
+            wait (bool): On a miss, wait for the upload; otherwise start it
+                in the background and return None right away
+
+        Returns:
+            str: The media id, or None if the asset could not be uploaded,
+                its last upload failed moments ago, or (without wait) it is
+                still uploading (callers then fall back to sending the link)
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(source)
+            if entry is not None and entry["expires_at"] > now:
+                if entry["expires_at"] - now < self.refresh_margin and source not in self._refreshing:
+                    # Still valid: keep serving it while a new upload runs
+                    self._refreshing.add(source)
+                    threading.Thread(target=self._refresh, args=(source,), daemon=True).start()
+                metrics.increment("media_cache", result="hit")
+                return entry["media_id"]
+            if self._failed_until.get(source, 0) > now:
+                metrics.increment("media_cache", result="backoff")
+                return None
+            done = self._uploading.get(source)
+            leader = done is None
+            if leader:
+                done = self._uploading[source] = threading.Event()
+        metrics.increment("media_cache", result="miss")
+
+        if leader:
+            if wait:
+                return self._upload_once(source, done)
+            threading.Thread(target=self._upload_once, args=(source, done), daemon=True).start()
+            return None
+        if not wait:
+            return None
+        # Another caller is uploading this asset; share its result
+        done.wait()
+        with self._lock:
+            entry = self._entries.get(source)
+        return entry["media_id"] if entry is not None else None
+
+    def wait_for(self, source, timeout):
+        """
+        Wait a bounded time for an upload in flight.
+
+        Returns:
+            str: The media id, or None if it is not uploaded within the timeout
+        """
+        with self._lock:
+            done = self._uploading.get(source)
+        if done is not None:
+            done.wait(timeout)
+        with self._lock:
+            entry = self._entries.get(source)
+        return entry["media_id"] if entry is not None and entry["expires_at"] > time.time() else None
+
+    def pending(self, source):
+        """
+        Returns:
+            bool: True while an upload of the asset is in flight
+        """
+        with self._lock:
+            return source in self._uploading
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                source: {"media_id": entry["media_id"], "expires_in": int(entry["expires_at"] - now)}
+                for source, entry in self._entries.items()
+            }
+
+
+def init_media_manager(app):
+    """Create the media manager uploading through the app's Graph API session."""
+    # Imported lazily: whatsapp_utils imports this module's users
+    from app.utils.whatsapp_utils import upload_media
+
+    def upload(source):
+        # Also called from background refresh threads
+        with app.app_context():
+            return upload_media(source)
+
+    manager = MediaManager(
+        upload,
+        cache_path=app.config["MEDIA_CACHE_PATH"],
+        ttl=app.config["MEDIA_ID_TTL"],
+        refresh_margin=app.config["MEDIA_REFRESH_MARGIN"],
+    )
+    app.extensions["media_manager"] = manager
+    return manager
@@ -1,19 +1,119 @@
-from openai import OpenAI
-import shelve
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import os
+import threading
 import time
 import logging
 
-load_dotenv()
+from app.services.answer_cache import AnswerCache, assistant_fingerprint
+from app.services.thread_store import ThreadStore, estimate_tokens
+from app.utils.profiling import timed
+
+# Read from the environment that load_configurations() filled from .env: this
+# module is imported on the first Assistant call, after create_app()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_ASSISTANT_ID = os.getenv("OPENAI_ASSISTANT_ID")
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Hard cap on how long a run is polled before it is cancelled
+OPENAI_RUN_TIMEOUT = float(os.getenv("OPENAI_RUN_TIMEOUT", "60"))
+# Answers to generic questions are reused for OPENAI_ANSWER_CACHE_TTL seconds (size 0 disables)
+OPENAI_ANSWER_CACHE_SIZE = int(os.getenv("OPENAI_ANSWER_CACHE_SIZE", "256"))
+OPENAI_ANSWER_CACHE_TTL = float(os.getenv("OPENAI_ANSWER_CACHE_TTL", "3600"))
+# Threads are rotated (replaced by a fresh thread seeded with a summary) past
+# these sizes or after this much inactivity, so run latency stays flat
+OPENAI_THREADS_DB = os.getenv("OPENAI_THREADS_DB", "threads_db")
+OPENAI_THREAD_MAX_MESSAGES = int(os.getenv("OPENAI_THREAD_MAX_MESSAGES", "40"))
+OPENAI_THREAD_MAX_TOKENS = int(os.getenv("OPENAI_THREAD_MAX_TOKENS", "8000"))
+OPENAI_THREAD_IDLE_TTL = float(os.getenv("OPENAI_THREAD_IDLE_TTL", str(7 * 24 * 3600)))
+# Recent messages carried over into the summary, and its maximum length
+OPENAI_SUMMARY_MESSAGES = int(os.getenv("OPENAI_SUMMARY_MESSAGES", "10"))
+OPENAI_SUMMARY_CHARS = int(os.getenv("OPENAI_SUMMARY_CHARS", "1500"))
+
+# The openai package takes most of a second to import, so the clients, the
+# thread store and the answer cache are created on first use (or by the
+# warm-up, see app/services/warmup.py), not when this module is imported
+_lazy = {}
+_lazy_lock = threading.Lock()
+# Appends cached exchanges to the user's thread in order, off the reply path
+_thread_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thread-append")
+
+
+def _get_or_create(name, factory):
+    try:
+        return _lazy[name]
+    except KeyError:
+        with _lazy_lock:
+            if name not in _lazy:
+                _lazy[name] = factory()
+            return _lazy[name]
+
+
+def get_client():
+    """
+    Returns:
+        OpenAI: The shared client, created on first use
+    """
+    def create():
+        from openai import OpenAI
+
+        return OpenAI(api_key=OPENAI_API_KEY)
+
+    return _get_or_create("client", create)
+
+
+def get_async_client():
+    """
+    Returns:
+        AsyncOpenAI: The shared client of the async serving mode, created on first use
+    """
+    def create():
+        from openai import AsyncOpenAI
+
+        return AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+    return _get_or_create("async_client", create)
+
+
+def get_thread_store():
+    """
+    Returns:
+        ThreadStore: The wa_id -> thread store, opened on first use
+    """
+    return _get_or_create("thread_store", lambda: ThreadStore(
+        OPENAI_THREADS_DB,
+        max_messages=OPENAI_THREAD_MAX_MESSAGES,
+        max_tokens=OPENAI_THREAD_MAX_TOKENS,
+        idle_ttl=OPENAI_THREAD_IDLE_TTL,
+    ))
+
+
+def get_answer_cache():
+    """
+    Returns:
+        AnswerCache: The answer cache, or None if OPENAI_ANSWER_CACHE_SIZE is 0
+    """
+    return _get_or_create("answer_cache", lambda: (
+        AnswerCache(OPENAI_ANSWER_CACHE_SIZE, OPENAI_ANSWER_CACHE_TTL) if OPENAI_ANSWER_CACHE_SIZE > 0 else None
+    ))
+
+
+_LAZY_ATTRIBUTES = {
+    "client": get_client,
+    "async_client": get_async_client,
+    "thread_store": get_thread_store,
+    "answer_cache": get_answer_cache,
+}
+
+
+def __getattr__(name):
+    # Keeps `openai_service.client` and friends working, created on first access
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def upload_file(path):
     # Upload a file with an "assistants" purpose
-    file = client.files.create(
+    file = get_client().files.create(
         file=open("../../data/airbnb-faq.pdf", "rb"), purpose="assistants"
     )
 
@@ -22,33 +122,97 @@ def create_assistant(file):
     """
     You currently cannot set the temperature for Assistant via the API.
     """
-    assistant = client.beta.assistants.create(
+    assistant = get_client().beta.assistants.create(
         name="WhatsApp AirBnb Assistant",
         instructions="You're a helpful WhatsApp assistant that can assist guests that are staying in our Paris AirBnb. Use your knowledge base to best respond to customer queries. If you don't know the answer, say simply that you cannot help with question and advice to contact the host directly. Be friendly and funny.",
         tools=[{"type": "retrieval"}],
         model="gpt-4-1106-preview",
         file_ids=[file.id],
     )
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        answer_cache.invalidate()
     return assistant
 
 
-# Use context manager to ensure the shelf file is closed properly
 def check_if_thread_exists(wa_id):
-    with shelve.open("threads_db") as threads_shelf:
-        return threads_shelf.get(wa_id, None)
+    record = get_thread_store().get(wa_id)
+    return record["thread_id"] if record else None
 
 
 def store_thread(wa_id, thread_id):
-    with shelve.open("threads_db", writeback=True) as threads_shelf:
-        threads_shelf[wa_id] = thread_id
+    get_thread_store().put(wa_id, thread_id)
+
+
+def summarize_thread(thread_id):
+    """
+    Compact summary of the end of a thread, used to seed its replacement.
+
+    Extractive (the last OPENAI_SUMMARY_MESSAGES messages, trimmed to
+    OPENAI_SUMMARY_CHARS) so rotating costs one list call, not an extra run.
+    """
+    messages = get_client().beta.threads.messages.list(
+        thread_id=thread_id, limit=OPENAI_SUMMARY_MESSAGES, order="desc"
+    )
+    budget = OPENAI_SUMMARY_CHARS
+    lines = []
+    for message in messages.data:
+        text = " ".join(
+            part.text.value for part in message.content if getattr(part, "type", "text") == "text"
+        ).strip()
+        if not text:
+            continue
+        speaker = "Guest" if message.role == "user" else "Assistant"
+        line = f"{speaker}: {text[:300]}"
+        if len(line) > budget:
+            break
+        lines.append(line)
+        budget -= len(line) + 1
+    return "\n".join(reversed(lines))
 
 
-def run_assistant(thread, name):
+def rotate_thread(wa_id, name, record, reason):
+    """
+    Replace a user's thread with a fresh one seeded with a summary of it.
+
+    Returns:
+        Thread: The thread to use from now on
+    """
+    old_thread_id = record["thread_id"]
+    logging.info(f"Rotating thread of {name} with wa_id {wa_id} ({reason}, {record['messages']} messages)")
+    try:
+        summary = summarize_thread(old_thread_id)
+    except Exception as e:
+        logging.warning(f"Failed to summarize thread {old_thread_id}: {e}")
+        summary = ""
+
+    seed = []
+    if summary:
+        seed.append({"role": "assistant", "content": f"Summary of our earlier conversation:\n{summary}"})
+    thread = get_client().beta.threads.create(messages=seed, metadata={"previous_thread_id": old_thread_id})
+    if not get_thread_store().replace(wa_id, old_thread_id, thread.id, tokens=estimate_tokens(summary)):
+        # A concurrent request rotated first: use its thread
+        logging.info(f"Thread of {wa_id} was already rotated")
+        return get_client().beta.threads.retrieve(check_if_thread_exists(wa_id))
+    return thread
+
+
+@timed("run_assistant")
+def run_assistant(thread, name, timeout=None):
+    """
+    Run the assistant on a thread and return its newest message.
+
+    Raises:
+        TimeoutError: If the run does not finish within `timeout` seconds
+            (default OPENAI_RUN_TIMEOUT); the run is cancelled
+        RuntimeError: If the run fails, expires or is cancelled
+    """
     # Retrieve the Assistant
-    assistant = client.beta.assistants.retrieve(OPENAI_ASSISTANT_ID)
+    assistant = get_client().beta.assistants.retrieve(OPENAI_ASSISTANT_ID)
+    check_assistant_changed(assistant)
 
     # Run the assistant
-    run = client.beta.threads.runs.create(
+    run = get_client().beta.threads.runs.create(
         thread_id=thread.id,
         assistant_id=assistant.id,
         # instructions=f"You are having a conversation with {name}",
@@ -56,42 +220,188 @@ def run_assistant(thread, name):
 
     # Wait for completion
     # https://platform.openai.com/docs/assistants/how-it-works/runs-and-run-steps#:~:text=under%20failed_at.-,Polling%20for%20updates,-In%20order%20to
+    deadline = time.monotonic() + (timeout or OPENAI_RUN_TIMEOUT)
     while run.status != "completed":
+        if run.status in ("failed", "cancelled", "expired", "incomplete"):
+            raise RuntimeError(f"Assistant run {run.id} ended with status {run.status}")
+        if time.monotonic() >= deadline:
+            try:
+                get_client().beta.threads.runs.cancel(thread_id=thread.id, run_id=run.id)
+            except Exception as e:
+                logging.warning(f"Failed to cancel run {run.id}: {e}")
+            raise TimeoutError(f"Assistant run {run.id} did not finish in time")
         # Be nice to the API
         time.sleep(0.5)
-        run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
+        run = get_client().beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
 
     # Retrieve the Messages
-    messages = client.beta.threads.messages.list(thread_id=thread.id)
+    messages = get_client().beta.threads.messages.list(thread_id=thread.id)
     new_message = messages.data[0].content[0].text.value
     logging.info(f"Generated message: {new_message}")
     return new_message
 
 
-def generate_response(message_body, wa_id, name):
-    # Check if there is already a thread_id for the wa_id
-    thread_id = check_if_thread_exists(wa_id)
+def check_assistant_changed(assistant=None):
+    """
+    Invalidate the answer cache if the Assistant's instructions, model or files changed.
+
+    Args:
+        assistant: The retrieved Assistant (fetched when omitted)
+    """
+    answer_cache = get_answer_cache()
+    if answer_cache is None:
+        return
+    if assistant is None:
+        assistant = get_client().beta.assistants.retrieve(OPENAI_ASSISTANT_ID)
+    if answer_cache.check_fingerprint(assistant_fingerprint(assistant)):
+        logging.info("Assistant configuration changed, answer cache cleared")
+
+
+def get_or_create_thread(wa_id, name):
+    # Check if there is already a thread for the wa_id
+    record = get_thread_store().get(wa_id)
 
     # If a thread doesn't exist, create one and store it
-    if thread_id is None:
+    if record is None:
         logging.info(f"Creating new thread for {name} with wa_id {wa_id}")
-        thread = client.beta.threads.create()
+        thread = get_client().beta.threads.create()
         store_thread(wa_id, thread.id)
-        thread_id = thread.id
+        return thread
+
+    # Start over with a summary once the thread is too long or stale
+    reason = get_thread_store().rotation_reason(record)
+    if reason is not None:
+        return rotate_thread(wa_id, name, record, reason)
 
     # Otherwise, retrieve the existing thread
-    else:
-        logging.info(f"Retrieving existing thread for {name} with wa_id {wa_id}")
-        thread = client.beta.threads.retrieve(thread_id)
+    logging.info(f"Retrieving existing thread for {name} with wa_id {wa_id}")
+    return get_client().beta.threads.retrieve(record["thread_id"])
+
+
+def append_cached_exchange(wa_id, name, message_body, answer):
+    """
+    Record a question answered from the cache in the user's thread, so later
+    Assistant runs see the whole conversation.
+    """
+    try:
+        thread = get_or_create_thread(wa_id, name)
+        get_client().beta.threads.messages.create(thread_id=thread.id, role="user", content=message_body)
+        get_client().beta.threads.messages.create(thread_id=thread.id, role="assistant", content=answer)
+        get_thread_store().record_exchange(wa_id, thread.id, message_body, answer)
+        # The hit skipped run_assistant, so look for Assistant changes here
+        check_assistant_changed()
+    except Exception as e:
+        logging.warning(f"Failed to append cached answer to thread of {wa_id}: {e}")
+
+
+@timed("assistant.generate_response")
+def generate_response(message_body, wa_id, name):
+    # Generic questions ("wifi password?") are answered from the cache
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        cached = answer_cache.get(message_body)
+        if cached is not None:
+            logging.info(f"Answered {wa_id} from the answer cache")
+            _thread_writer.submit(append_cached_exchange, wa_id, name, message_body, cached)
+            return cached
+
+    thread = get_or_create_thread(wa_id, name)
 
     # Add message to thread
-    message = client.beta.threads.messages.create(
-        thread_id=thread_id,
+    message = get_client().beta.threads.messages.create(
+        thread_id=thread.id,
         role="user",
         content=message_body,
     )
 
     # Run the assistant and get the new message
     new_message = run_assistant(thread, name)
+    get_thread_store().record_exchange(wa_id, thread.id, message_body, new_message)
+
+    # Answers addressing the guest by name are personal, never share them
+    if answer_cache is not None and not (name and name.lower() in new_message.lower()):
+        answer_cache.put(message_body, new_message)
+
+    return new_message
+
+
+# Async versions, used by the async serving mode (app/async_app.py)
+
+
+@timed("run_assistant")
+async def run_assistant_async(thread_id, name, timeout=None):
+    """
+    Event-loop version of run_assistant; polls with asyncio.sleep.
+
+    Raises:
+        TimeoutError: If the run does not finish within `timeout` seconds
+            (default OPENAI_RUN_TIMEOUT); the run is cancelled
+        RuntimeError: If the run fails, expires or is cancelled
+    """
+    assistant = await get_async_client().beta.assistants.retrieve(OPENAI_ASSISTANT_ID)
+    check_assistant_changed(assistant)
+
+    run = await get_async_client().beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant.id)
+
+    deadline = time.monotonic() + (timeout or OPENAI_RUN_TIMEOUT)
+    while run.status != "completed":
+        if run.status in ("failed", "cancelled", "expired", "incomplete"):
+            raise RuntimeError(f"Assistant run {run.id} ended with status {run.status}")
+        if time.monotonic() >= deadline:
+            try:
+                await get_async_client().beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id)
+            except Exception as e:
+                logging.warning(f"Failed to cancel run {run.id}: {e}")
+            raise TimeoutError(f"Assistant run {run.id} did not finish in time")
+        await asyncio.sleep(0.5)
+        run = await get_async_client().beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+
+    messages = await get_async_client().beta.threads.messages.list(thread_id=thread_id)
+    new_message = messages.data[0].content[0].text.value
+    logging.info(f"Generated message: {new_message}")
+    return new_message
+
+
+async def get_or_create_thread_id_async(wa_id, name):
+    """
+    Event-loop version of get_or_create_thread.
+
+    Returns:
+        str: Id of the thread to use (no retrieve call is needed for a known thread)
+    """
+    record = get_thread_store().get(wa_id)
+    if record is None:
+        logging.info(f"Creating new thread for {name} with wa_id {wa_id}")
+        thread = await get_async_client().beta.threads.create()
+        store_thread(wa_id, thread.id)
+        return thread.id
+
+    reason = get_thread_store().rotation_reason(record)
+    if reason is not None:
+        # Rare; the synchronous rotation runs on a worker thread
+        thread = await asyncio.to_thread(rotate_thread, wa_id, name, record, reason)
+        return thread.id
+    return record["thread_id"]
+
+
+@timed("assistant.generate_response")
+async def generate_response_async(message_body, wa_id, name):
+    """Event-loop version of generate_response, sharing its answer cache and thread store."""
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        cached = answer_cache.get(message_body)
+        if cached is not None:
+            logging.info(f"Answered {wa_id} from the answer cache")
+            _thread_writer.submit(append_cached_exchange, wa_id, name, message_body, cached)
+            return cached
+
+    thread_id = await get_or_create_thread_id_async(wa_id, name)
+    await get_async_client().beta.threads.messages.create(thread_id=thread_id, role="user", content=message_body)
+
+    new_message = await run_assistant_async(thread_id, name)
+    get_thread_store().record_exchange(wa_id, thread_id, message_body, new_message)
+
+    if answer_cache is not None and not (name and name.lower() in new_message.lower()):
+        answer_cache.put(message_body, new_message)
 
     return new_message
@@ -0,0 +1,396 @@
+"""
+Durable outbox for outbound WhatsApp messages.
+
+Replies are first written to a local SQLite database (WAL mode) and then
+delivered by a background sender, so a failed Graph API call or a restart
+no longer loses them. Writes from concurrent requests are grouped into one
+transaction, and with synchronous=NORMAL WAL only syncs at checkpoints, not
+once per message. The sender retries failures with exponential backoff and
+marks a row sent once the Graph API answers with a message id. Rows still
+pending after a crash are picked up again on startup.
+
+Messages to the same recipient are sent one after the other, in the order
+they were written; different recipients are sent in parallel. The sender
+keeps fetching due rows while other recipients' sends are in flight, so a
+slow recipient does not hold back the rest.
+"""
+import atexit
+import collections
+import logging
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.utils import metrics
+
+PENDING = 0
+SENT = 1
+FAILED = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recipient TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    message_id TEXT,
+    last_error TEXT,
+    sender TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt);
+CREATE INDEX IF NOT EXISTS outbox_recipient ON outbox (recipient, status);
+"""
+
+
+class PermanentSendError(Exception):
+    """Raised by the send function when retrying cannot help (e.g. invalid recipient)."""
+
+
+class _Pending:
+    __slots__ = ("recipient", "payload", "sender", "committed", "row_id")
+
+    def __init__(self, recipient, payload, sender=None):
+        self.recipient = recipient
+        self.payload = payload
+        self.sender = sender
+        self.committed = threading.Event()
+        self.row_id = None
+
+
+class Outbox:
+    """
+    SQLite-backed outbox with group commit and a retrying sender.
+
+    Args:
+        path (str): SQLite database file
+        send (callable): (payload) -> message id, or (payload, sender) for
+            messages enqueued with a sender; raises on failure,
+            PermanentSendError if the message must not be retried
+        batch_size (int): Rows written or sent per transaction
+        max_attempts (int): Attempts before a message is marked failed
+        base_backoff (float): Delay in seconds before the first retry, doubled on each attempt
+        max_backoff (float): Longest delay between attempts
+        workers (int): Recipients sent to in parallel
+        poll_interval (float): Seconds between checks for retries that became due
+        retention (float): Seconds sent rows are kept before being deleted
+    """
+
+    def __init__(self, path, send, batch_size=100, max_attempts=8, base_backoff=1.0, max_backoff=300.0,
+                 workers=8, poll_interval=0.5, retention=24 * 3600):
+        self.path = path
+        self.send = send
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.workers = workers
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")]
+        if "sender" not in columns:
+            # Outbox files written before multi-tenant sending
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN sender TEXT")
+        self._db_lock = threading.Lock()
+
+        self._queue = []
+        self._queue_condition = threading.Condition()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._last_prune = 0.0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="outbox-send")
+        # Recipients with a group of messages being sent; never fetched twice at once
+        self._in_flight = set()
+        self._flight_lock = threading.Lock()
+
+        recovered = self.stats()["pending"]
+        if recovered:
+            # Retry recovered messages right away instead of waiting out old backoffs
+            self._conn.execute("UPDATE outbox SET next_attempt = ? WHERE status = ?", (time.time(), PENDING))
+            logging.info(f"Recovered {recovered} pending outbound messages from {path}")
+            metrics.increment("outbox_recovered", recovered)
+
+        self._writer = threading.Thread(target=self._write_loop, name="outbox-writer", daemon=True)
+        self._sender = threading.Thread(target=self._send_loop, name="outbox-sender", daemon=True)
+        self._writer.start()
+        self._sender.start()
+
+    # Writing
+
+    def enqueue(self, recipient, payload, wait=True, timeout=5.0, sender=None):
+        """
+        Add a message to the outbox.
+
+        Args:
+            recipient (str): WhatsApp ID the message is for (orders sends per recipient)
+            payload (str): JSON body for the Graph API messages endpoint
+            wait (bool): Return only once the message is committed to disk
+            timeout (float): Longest wait for the commit
+            sender (str): Tenant phone number id the message is sent from
+                (None for the app's own number)
+
+        Returns:
+            int: The outbox row id (None if not committed yet; the message
+                stays queued and is still sent)
+
+        Raises:
+            RuntimeError: If the outbox is shut down or the message could not be written
+        """
+        item = _Pending(recipient, payload, sender)
+        with self._queue_condition:
+            if self._stopping:
+                raise RuntimeError("Outbox is shut down")
+            self._queue.append(item)
+            self._queue_condition.notify()
+        if wait and not item.committed.wait(timeout):
+            logging.warning(f"Outbox commit for {recipient} is taking longer than {timeout}s")
+        elif wait and item.row_id is None:
+            raise RuntimeError(f"Outbox could not write the message for {recipient}")
+        return item.row_id
+
+    def _write_loop(self):
+        while True:
+            with self._queue_condition:
+                while not self._queue and not self._stopping:
+                    self._queue_condition.wait()
+                if not self._queue and self._stopping:
+                    return
+                # Everything that arrived while the last commit ran goes into one transaction
+                batch = self._queue[: self.batch_size]
+                del self._queue[: self.batch_size]
+            try:
+                self._commit(batch)
+            except sqlite3.Error as e:
+                logging.error(f"Failed to write {len(batch)} messages to the outbox: {e}")
+                metrics.increment("outbox_write_errors", len(batch))
+            finally:
+                for item in batch:
+                    item.committed.set()
+            self._wake.set()
+
+    def _commit(self, batch):
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            try:
+                for item in batch:
+                    cursor = self._conn.execute(
+                        "INSERT INTO outbox (recipient, payload, sender, next_attempt, created, updated)"
+                        " VALUES (?, ?, ?, ?, ?, ?)",
+                        (item.recipient, item.payload, item.sender, now, now, now),
+                    )
+                    item.row_id = cursor.lastrowid
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        metrics.increment("outbox_commits")
+        metrics.increment("outbox_enqueued", len(batch))
+
+    # Sending
+
+    def _due(self, busy=()):
+        now = time.time()
+        # Recipients being sent to are left to their group in flight
+        skip = f" AND recipient NOT IN ({', '.join('?' * len(busy))})" if busy else ""
+        with self._db_lock:
+            # Skip recipients whose earlier message is still waiting for a retry
+            return self._conn.execute(
+                "SELECT id, recipient, payload, attempts, sender FROM outbox o"
+                " WHERE status = ? AND next_attempt <= ?" + skip + " AND NOT EXISTS ("
+                "   SELECT 1 FROM outbox p WHERE p.recipient = o.recipient AND p.status = ?"
+                "   AND p.id < o.id AND p.next_attempt > ?)"
+                " ORDER BY id LIMIT ?",
+                (PENDING, now, *busy, PENDING, now, self.batch_size),
+            ).fetchall()
+
+    def _send_loop(self):
+        while not self._stopping:
+            try:
+                with self._flight_lock:
+                    busy = list(self._in_flight)
+                free = self.workers - len(busy)
+                rows = self._due(busy) if free > 0 else []
+                if not rows:
+                    self._prune()
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+                    continue
+                by_recipient = collections.OrderedDict()
+                for row in rows:
+                    by_recipient.setdefault(row[1], []).append(row)
+                # Recipients beyond the free workers are fetched again once one finishes
+                for recipient, group in list(by_recipient.items())[:free]:
+                    with self._flight_lock:
+                        self._in_flight.add(recipient)
+                    future = self._pool.submit(self._send_group, group)
+                    future.add_done_callback(lambda f, recipient=recipient: self._finish(recipient, f))
+            except Exception as e:
+                logging.error(f"Outbox sender error: {e}")
+                time.sleep(self.poll_interval)
+
+    def _finish(self, recipient, future):
+        """Record a recipient's group and let the sender fetch its next messages."""
+        try:
+            self._record(future.result())
+        except Exception as e:
+            logging.error(f"Outbox sender error: {e}")
+        finally:
+            with self._flight_lock:
+                self._in_flight.discard(recipient)
+            self._wake.set()
+
+    def _send_group(self, rows):
+        """Send one recipient's messages in order, stopping at the first failure."""
+        results = []
+        for row_id, recipient, payload, attempts, sender in rows:
+            try:
+                message_id = self.send(payload) if sender is None else self.send(payload, sender)
+            except PermanentSendError as e:
+                results.append((row_id, FAILED, attempts + 1, None, str(e)))
+            except Exception as e:
+                status = FAILED if attempts + 1 >= self.max_attempts else PENDING
+                results.append((row_id, status, attempts + 1, None, str(e)))
+                # Later messages must not overtake this one
+                break
+            else:
+                if not message_id:
+                    # Without a message id there is no proof the Graph API took the message
+                    status = FAILED if attempts + 1 >= self.max_attempts else PENDING
+                    results.append((row_id, status, attempts + 1, None, "No message id in the response"))
+                    break
+                results.append((row_id, SENT, attempts + 1, message_id, None))
+        return results
+
+    def _record(self, results):
+        now = time.time()
+        updates = []
+        for row_id, status, attempts, message_id, error in results:
+            delay = 0.0
+            if status == PENDING:
+                delay = min(self.max_backoff, self.base_backoff * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+                metrics.increment("outbox_retries")
+                logging.warning(f"Outbound message {row_id} failed (attempt {attempts}), retrying in {delay:.1f}s: {error}")
+            elif status == FAILED:
+                metrics.increment("outbox_failed")
+                logging.error(f"Outbound message {row_id} failed permanently after {attempts} attempts: {error}")
+            else:
+                metrics.increment("outbox_sent")
+            updates.append((status, attempts, now + delay, now, message_id, error, row_id))
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt = ?, updated = ?,"
+                " message_id = ?, last_error = ? WHERE id = ?",
+                updates,
+            )
+            self._conn.execute("COMMIT")
+
+    def _prune(self):
+        now = time.time()
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        with self._db_lock:
+            self._conn.execute("DELETE FROM outbox WHERE status = ? AND updated < ?", (SENT, now - self.retention))
+
+    # Operations
+
+    def stats(self):
+        """
+        Returns:
+            dict: Number of pending, sent and failed rows
+        """
+        with self._db_lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        return {"pending": counts.get(PENDING, 0), "sent": counts.get(SENT, 0), "failed": counts.get(FAILED, 0)}
+
+    def get(self, row_id):
+        """
+        Returns:
+            dict: status, attempts and message_id of an outbox row, or None
+        """
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT status, attempts, message_id, last_error FROM outbox WHERE id = ?", (row_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"status": ("pending", "sent", "failed")[row[0]], "attempts": row[1], "message_id": row[2],
+                "last_error": row[3]}
+
+    def wait_idle(self, timeout=10.0):
+        """
+        Wait until nothing is queued or pending (retries included).
+
+        Returns:
+            bool: True if the outbox drained within the timeout
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._queue_condition:
+                queued = len(self._queue)
+            if not queued and not self.stats()["pending"]:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def close(self):
+        """Commit queued messages and stop the threads; pending rows are sent after restart."""
+        with self._queue_condition:
+            if self._stopping:
+                return
+            self._stopping = True
+            self._queue_condition.notify_all()
+        self._wake.set()
+        self._writer.join()
+        self._sender.join()
+        self._pool.shutdown(wait=True)
+        with self._db_lock:
+            self._conn.close()
+
+
+def init_outbox(app):
+    """Create the outbox when OUTBOX_PATH is configured."""
+    path = app.config.get("OUTBOX_PATH")
+    if not path:
+        return None
+
+    # Imported lazily: whatsapp_utils uses the outbox through app.extensions
+    import requests
+    from app.services.tenants import use_tenant
+    from app.utils.whatsapp_utils import post_message
+
+    def send(payload, sender=None):
+        with app.app_context():
+            if sender is not None:
+                use_tenant(sender)
+            try:
+                return post_message(payload)
+            except requests.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                # Rejected requests (bad recipient, invalid template) will not succeed on retry
+                if status is not None and 400 <= status < 500 and status not in (408, 429):
+                    raise PermanentSendError(f"{status}: {e.response.text}") from e
+                raise
+
+    outbox = Outbox(
+        path,
+        send,
+        max_attempts=app.config["OUTBOX_MAX_ATTEMPTS"],
+        base_backoff=app.config["OUTBOX_BASE_BACKOFF"],
+        workers=app.config["OUTBOX_WORKERS"],
+    )
+    app.extensions["outbox"] = outbox
+    atexit.register(outbox.close)
+    return outbox
@@ -0,0 +1,338 @@
+"""
+Scheduled messages: appointment reminders and follow-ups sent later.
+
+Jobs are rows of a local SQLite database (WAL mode), indexed by due time
+and by wa_id, so scheduling and cancelling cost O(log n) whatever the
+number of pending jobs, and jobs survive restarts. Only the jobs due
+within the next `horizon` seconds are also kept in an in-memory heap,
+which the release thread sleeps on; the heap is refilled from the due
+index as time advances, at most `batch_size` jobs at a time once it holds
+a batch, so a backlog of overdue jobs after a restart is paged in as it is
+released. Memory therefore follows the near-term load, not the millions of
+reminders booked weeks ahead.
+
+Due jobs are released in batches of up to `batch_size` into the outbound
+path (the durable outbox when there is one) and deleted once handed over.
+A crash between the two re-releases the batch on restart: delivery is at
+least once, like the outbox itself.
+"""
+import atexit
+import collections
+import heapq
+import logging
+import math
+import sqlite3
+import threading
+import time
+
+from app.utils import metrics
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scheduled (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    due REAL NOT NULL,
+    wa_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    sender TEXT,
+    kind TEXT
+);
+CREATE INDEX IF NOT EXISTS scheduled_due ON scheduled (due);
+CREATE INDEX IF NOT EXISTS scheduled_wa_id ON scheduled (wa_id, kind);
+"""
+
+Job = collections.namedtuple("Job", ["id", "due", "wa_id", "payload", "sender", "kind"])
+
+
+class Scheduler:
+    """
+    Persistent scheduler releasing due messages in batches.
+
+    Args:
+        path (str): SQLite database file
+        deliver (callable): (list of Job) -> None; hands due jobs to the
+            outbound path, raises if they could not be taken
+        batch_size (int): Jobs released per batch
+        horizon (float): Seconds ahead whose jobs are kept in memory
+        retry_delay (float): Seconds before a batch whose delivery raised is released again
+        start (bool): Start the release thread (tests call run_due() themselves)
+    """
+
+    def __init__(self, path, deliver, batch_size=500, horizon=300.0, retry_delay=5.0, start=True):
+        self.path = path
+        self.deliver = deliver
+        self.batch_size = batch_size
+        self.horizon = horizon
+        self.retry_delay = retry_delay
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Releases touch index pages all over the file; keep more of them cached (64MB)
+        self._conn.execute("PRAGMA cache_size=-65536")
+        self._conn.executescript(SCHEMA)
+
+        # Guards the connection, the heap and _loaded_until together, so a
+        # job is in the heap exactly when its due time is below _loaded_until
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._heap = []
+        self._loaded_until = float("-inf")
+        self._stopping = False
+
+        pending = self.stats()["pending"]
+        if pending:
+            logging.info(f"Loaded scheduler with {pending} pending jobs from {path}")
+
+        self._thread = None
+        if start:
+            self._thread = threading.Thread(target=self._release_loop, name="scheduler", daemon=True)
+            self._thread.start()
+
+    # Scheduling
+
+    def schedule(self, wa_id, payload, due, sender=None, kind=None):
+        """
+        Schedule a message.
+
+        Args:
+            wa_id (str): Recipient
+            payload (str): JSON body for the Graph API messages endpoint
+            due (float): Unix time to send it at
+            sender (str): Tenant phone number id to send it from (None for the app's own)
+            kind (str): Free label such as 'reminder', for cancelling by kind
+
+        Returns:
+            int: Job id
+        """
+        return self.schedule_many([(wa_id, payload, due, sender, kind)])[0]
+
+    def schedule_many(self, jobs):
+        """
+        Schedule many messages in one transaction.
+
+        Args:
+            jobs (iterable): (wa_id, payload, due, sender, kind) tuples
+
+        Returns:
+            list: Job ids, in order
+        """
+        ids = []
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for wa_id, payload, due, sender, kind in jobs:
+                    cursor = self._conn.execute(
+                        "INSERT INTO scheduled (due, wa_id, payload, sender, kind) VALUES (?, ?, ?, ?, ?)",
+                        (due, wa_id, payload, sender, kind),
+                    )
+                    ids.append(cursor.lastrowid)
+                    if due < self._loaded_until:
+                        heapq.heappush(self._heap, (due, cursor.lastrowid))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            # The release thread may be sleeping past the new earliest job
+            self._wake.notify()
+        metrics.increment("scheduler_scheduled", len(ids))
+        return ids
+
+    def cancel(self, job_id):
+        """
+        Returns:
+            bool: True if the job was pending
+        """
+        with self._lock:
+            cancelled = self._conn.execute("DELETE FROM scheduled WHERE id = ?", (job_id,)).rowcount
+        # A heap entry left behind is skipped on release: its row is gone
+        metrics.increment("scheduler_cancelled", cancelled)
+        return bool(cancelled)
+
+    def cancel_for(self, wa_id, kind=None):
+        """
+        Cancel a user's pending jobs, e.g. their reminders after they cancel the visit.
+
+        Args:
+            wa_id (str): Recipient
+            kind (str): Only cancel jobs with this label (default: all)
+
+        Returns:
+            int: Number of jobs cancelled
+        """
+        with self._lock:
+            if kind is None:
+                cursor = self._conn.execute("DELETE FROM scheduled WHERE wa_id = ?", (wa_id,))
+            else:
+                cursor = self._conn.execute("DELETE FROM scheduled WHERE wa_id = ? AND kind = ?", (wa_id, kind))
+        metrics.increment("scheduler_cancelled", cursor.rowcount)
+        return cursor.rowcount
+
+    def pending(self, wa_id):
+        """
+        Returns:
+            list: A user's pending jobs, earliest first
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, due, wa_id, payload, sender, kind FROM scheduled WHERE wa_id = ? ORDER BY due", (wa_id,)
+            ).fetchall()
+        return [Job(*row) for row in rows]
+
+    # Releasing
+
+    def _refill(self, now):
+        # Called with the lock held: load the jobs entering the horizon, a
+        # page at a time while the heap holds less than a batch
+        until = now + self.horizon
+        while self._loaded_until < until and len(self._heap) < self.batch_size:
+            rows = self._conn.execute(
+                "SELECT due, id FROM scheduled WHERE due >= ? AND due < ? ORDER BY due LIMIT ?",
+                (self._loaded_until, until, self.batch_size),
+            ).fetchall()
+            if len(rows) < self.batch_size:
+                loaded_until = until
+            elif rows[0][0] == rows[-1][0]:
+                # One due time fills the page: take all of its jobs so the boundary moves past it
+                loaded_until = math.nextafter(rows[0][0], math.inf)
+                rows = self._conn.execute("SELECT due, id FROM scheduled WHERE due = ?", (rows[0][0],)).fetchall()
+            else:
+                # Jobs sharing the last due time may not all be in the page; leave them for the next one
+                loaded_until = rows[-1][0]
+                rows = [row for row in rows if row[0] < loaded_until]
+            for row in rows:
+                heapq.heappush(self._heap, row)
+            self._loaded_until = loaded_until
+
+    def _take_due(self, now):
+        # Called with the lock held
+        while True:
+            if now + self.horizon / 2 >= self._loaded_until:
+                self._refill(now)
+            if not self._heap or self._heap[0][0] > now:
+                return []
+            ids = []
+            while self._heap and self._heap[0][0] <= now and len(ids) < self.batch_size:
+                ids.append(heapq.heappop(self._heap)[1])
+            placeholders = ",".join("?" * len(ids))
+            rows = self._conn.execute(
+                f"SELECT id, due, wa_id, payload, sender, kind FROM scheduled WHERE id IN ({placeholders})"
+                " ORDER BY due, id",
+                ids,
+            ).fetchall()
+            # Ids of cancelled jobs find no row; keep going if a whole batch was cancelled
+            if rows:
+                return [Job(*row) for row in rows]
+
+    def run_due(self, now=None):
+        """
+        Release every job due at `now`, batch by batch.
+
+        Returns:
+            int: Number of jobs delivered
+        """
+        now = time.time() if now is None else now
+        released = 0
+        while True:
+            with self._lock:
+                jobs = self._take_due(now)
+            if not jobs:
+                return released
+            try:
+                self.deliver(jobs)
+            except Exception as e:
+                logging.error(f"Failed to release {len(jobs)} scheduled messages, retrying: {e}")
+                metrics.increment("scheduler_release_errors", len(jobs))
+                with self._lock:
+                    for job in jobs:
+                        heapq.heappush(self._heap, (now + self.retry_delay, job.id))
+                return released
+            ids = [job.id for job in jobs]
+            with self._lock:
+                self._conn.execute(f"DELETE FROM scheduled WHERE id IN ({','.join('?' * len(ids))})", ids)
+            released += len(jobs)
+            metrics.increment("scheduler_released", len(jobs))
+
+    def _release_loop(self):
+        while True:
+            try:
+                self.run_due()
+            except Exception as e:
+                logging.error(f"Scheduler error: {e}")
+                time.sleep(self.retry_delay)
+            with self._lock:
+                if self._stopping:
+                    return
+                # Sleep until the next job, or the next refill of the heap. A
+                # heap holding a full page already has the earliest jobs.
+                wake_at = self._loaded_until - self.horizon / 2
+                if len(self._heap) >= self.batch_size:
+                    wake_at = self._heap[0][0]
+                elif self._heap:
+                    wake_at = min(wake_at, self._heap[0][0])
+                timeout = wake_at - time.time()
+                if timeout > 0:
+                    self._wake.wait(timeout)
+
+    # Operations
+
+    def stats(self):
+        """
+        Returns:
+            dict: Pending jobs, jobs held in memory and the next due time
+        """
+        with self._lock:
+            pending, next_due = self._conn.execute("SELECT COUNT(*), MIN(due) FROM scheduled").fetchone()
+            in_memory = len(self._heap)
+        return {"pending": pending, "in_memory": in_memory, "next_due": next_due}
+
+    def close(self):
+        """Stop the release thread; pending jobs stay in the database."""
+        with self._lock:
+            if self._stopping:
+                return
+            self._stopping = True
+            self._wake.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            self._conn.close()
+
+
+def init_scheduler(app):
+    """Create the scheduler when SCHEDULER_PATH is configured."""
+    path = app.config.get("SCHEDULER_PATH")
+    if not path:
+        return None
+
+    # Imported lazily: whatsapp_utils uses the scheduler through app.extensions
+    from flask import g
+    from app.services.tenants import use_tenant
+    from app.utils.whatsapp_utils import deliver_message
+
+    def deliver(jobs):
+        outbox = app.extensions.get("outbox")
+        if outbox is not None:
+            # One group commit for the whole batch: only the last enqueue waits.
+            # A slow commit (None) still writes the batch, so it counts as
+            # handed over; only the outbox's RuntimeError puts the jobs back.
+            for job in jobs[:-1]:
+                outbox.enqueue(job.wa_id, job.payload, wait=False, sender=job.sender)
+            last = jobs[-1]
+            outbox.enqueue(last.wa_id, last.payload, sender=last.sender)
+            return
+        with app.app_context():
+            for job in jobs:
+                g.tenant = None
+                if job.sender is not None:
+                    use_tenant(job.sender)
+                deliver_message(job.wa_id, job.payload)
+
+    scheduler = Scheduler(
+        path,
+        deliver,
+        batch_size=app.config["SCHEDULER_BATCH_SIZE"],
+        horizon=app.config["SCHEDULER_HORIZON"],
+    )
+    app.extensions["scheduler"] = scheduler
+    atexit.register(scheduler.close)
+    return scheduler
@@ -0,0 +1,245 @@
+"""
+Per-user conversation sessions for multi-step flows.
+
+A session remembers where a user is in a conversation (e.g. halfway
+through booking: service chosen, time not yet) and what they last asked
+about. Sessions are compact `__slots__` records in an LRU-ordered dict, so
+a lookup or update on the reply path is O(1).
+
+Idle sessions expire after `ttl` seconds. Expiry runs on a timing wheel:
+one bucket per `tick` seconds of expiry time, and each lookup first empties
+the buckets whose tick has passed, so expiring costs O(1) per session and
+no thread or scan is needed. Past `max_sessions`, the least recently used
+session is spilled to a shelf on disk (or dropped when there is none) and
+loaded back on the user's next message. Spilled sessions that went idle
+are discarded when read and when the store is opened or closed.
+"""
+import atexit
+import collections
+import logging
+import math
+import shelve
+import threading
+import time
+
+from app.utils import metrics
+
+
+class Session:
+    """
+    One user's conversation state.
+
+    Attributes:
+        key (str): wa_id (prefixed with the tenant's phone number id for tenants)
+        state (str): Step of the flow the user is in, or None
+        data (dict): Values collected by the flow so far, or None
+        last_topic (str): Message file of the user's last keyword match
+        turns (int): Messages received in this session
+        last_seen (float): Unix time of the last message
+    """
+
+    __slots__ = ("key", "state", "data", "last_topic", "turns", "last_seen", "slot")
+
+    def __init__(self, key, last_seen, state=None, data=None, last_topic=None, turns=0):
+        self.key = key
+        self.state = state
+        self.data = data
+        self.last_topic = last_topic
+        self.turns = turns
+        self.last_seen = last_seen
+        self.slot = None
+
+    def set(self, name, value):
+        if self.data is None:
+            self.data = {}
+        self.data[name] = value
+
+    def get(self, name, default=None):
+        return default if self.data is None else self.data.get(name, default)
+
+    def reset(self):
+        """End the current flow, keeping the last topic."""
+        self.state = None
+        self.data = None
+
+    def _dump(self):
+        return (self.state, self.data, self.last_topic, self.turns, self.last_seen)
+
+    def __repr__(self):
+        return f"<Session {self.key} state={self.state} turns={self.turns}>"
+
+
+class SessionStore:
+    """
+    Bounded in-memory session store with idle expiry and spill to disk.
+
+    Args:
+        max_sessions (int): Sessions kept in memory
+        ttl (float): Seconds of inactivity after which a session expires
+        spill_path (str): Shelf file for sessions evicted from memory (None drops them)
+        ticks (int): Buckets of the timing wheel over one TTL (expiry precision is ttl / ticks)
+    """
+
+    def __init__(self, max_sessions=10000, ttl=1800.0, spill_path=None, ticks=60):
+        if ttl <= 0:
+            raise ValueError(f"Session TTL must be positive (SESSION_TTL), got {ttl}")
+        if ticks < 1:
+            raise ValueError(f"The timing wheel needs at least one tick, got {ticks}")
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.spill_path = spill_path
+        self.tick = ttl / ticks
+        # One more bucket than a TTL spans, so a new expiry never lands in the bucket being emptied
+        self._wheel = [set() for _ in range(int(math.ceil(ttl / self.tick)) + 2)]
+        self._done_tick = None
+        self._sessions = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._spill = shelve.open(spill_path) if spill_path else None
+        self.expired = 0
+        self.evictions = 0
+        self._purge_spill(time.time())
+
+    def _tick_of(self, timestamp):
+        return int(timestamp // self.tick)
+
+    def _reschedule(self, session):
+        slot = self._tick_of(session.last_seen + self.ttl) % len(self._wheel)
+        if slot != session.slot:
+            if session.slot is not None:
+                self._wheel[session.slot].discard(session.key)
+            self._wheel[slot].add(session.key)
+            session.slot = slot
+
+    def _advance(self, now):
+        # Empty the buckets of every tick that ended before `now`
+        current = self._tick_of(now)
+        if self._done_tick is None:
+            self._done_tick = current - 1
+            return
+        first = max(self._done_tick + 1, current - len(self._wheel))
+        for tick in range(first, current):
+            bucket = self._wheel[tick % len(self._wheel)]
+            for key in list(bucket):
+                session = self._sessions.get(key)
+                if session is None:
+                    # Left behind by a session that was already removed
+                    bucket.discard(key)
+                    continue
+                if session.last_seen + self.ttl <= now:
+                    bucket.discard(key)
+                    del self._sessions[key]
+                    self.expired += 1
+        self._done_tick = max(self._done_tick, current - 1)
+
+    def get(self, key, now=None):
+        """
+        Return a user's session, creating it if needed, and mark it active.
+
+        Args:
+            key (str): wa_id (see session_key)
+            now (float): Current Unix time (default: time.time())
+
+        Returns:
+            Session: The session; its fields may be changed in place
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self._advance(now)
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._load_spilled(key, now) or Session(key, now)
+                metrics.increment("sessions_created" if session.turns == 0 else "sessions_restored")
+                self._sessions[key] = session
+            else:
+                self._sessions.move_to_end(key)
+            session.last_seen = now
+            session.turns += 1
+            self._reschedule(session)
+            if len(self._sessions) > self.max_sessions:
+                self._evict_oldest()
+        return session
+
+    def peek(self, key):
+        """
+        Returns:
+            Session: The session if it is in memory, without marking it active
+        """
+        with self._lock:
+            return self._sessions.get(key)
+
+    def end(self, key):
+        """Forget a user's session."""
+        with self._lock:
+            session = self._sessions.pop(key, None)
+            if session is not None and session.slot is not None:
+                self._wheel[session.slot].discard(key)
+            if self._spill is not None and key in self._spill:
+                del self._spill[key]
+
+    def _evict_oldest(self):
+        key, session = self._sessions.popitem(last=False)
+        self._wheel[session.slot].discard(key)
+        self.evictions += 1
+        if self._spill is not None:
+            self._spill[key] = session._dump()
+            metrics.increment("sessions_spilled")
+
+    def _load_spilled(self, key, now):
+        if self._spill is None or key not in self._spill:
+            return None
+        state, data, last_topic, turns, last_seen = self._spill.pop(key)
+        if last_seen + self.ttl <= now:
+            self.expired += 1
+            return None
+        return Session(key, last_seen, state, data, last_topic, turns)
+
+    def _purge_spill(self, now):
+        if self._spill is None:
+            return
+        expired = [key for key in self._spill if self._spill[key][4] + self.ttl <= now]
+        for key in expired:
+            del self._spill[key]
+        if expired:
+            logging.info(f"Discarded {len(expired)} idle sessions from {self.spill_path}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": len(self._sessions),
+                "spilled": len(self._spill) if self._spill is not None else 0,
+                "expired": self.expired,
+                "evictions": self.evictions,
+            }
+
+    def close(self):
+        """Write the sessions in memory to the shelf (if any) and close it."""
+        with self._lock:
+            if self._spill is None:
+                return
+            now = time.time()
+            for key, session in self._sessions.items():
+                if session.last_seen + self.ttl > now:
+                    self._spill[key] = session._dump()
+            self._sessions.clear()
+            for bucket in self._wheel:
+                bucket.clear()
+            self._purge_spill(now)
+            self._spill.close()
+            self._spill = None
+
+
+def session_key(wa_id, tenant=None):
+    """The store key of a user: tenants keep separate sessions for the same wa_id."""
+    return wa_id if tenant is None else f"{tenant.phone_number_id}:{wa_id}"
+
+
+def init_sessions(app):
+    """Create the session store (spilling to SESSION_SPILL_PATH when set)."""
+    store = SessionStore(
+        max_sessions=app.config["SESSION_MAX_ACTIVE"],
+        ttl=app.config["SESSION_TTL"],
+        spill_path=app.config.get("SESSION_SPILL_PATH") or None,
+    )
+    app.extensions["sessions"] = store
+    atexit.register(store.close)
+    return store
@@ -0,0 +1,412 @@
+"""
+Compact storage for delivery-status webhooks (sent, delivered, read, failed).
+
+Most webhook traffic is statuses: every message we send comes back as three
+more webhook calls. Instead of logging and discarding them, each status is
+appended to fixed-width `array` columns (8-byte message id hash, 8-byte
+recipient hash, 4-byte timestamp, 1-byte status code) and flushed to disk in
+columnar blocks once a batch fills up or `flush_interval` has passed. A
+bounded index of recent message ids answers most delivery-state queries from
+memory; older ids are found by scanning the on-disk id columns, without
+holding up the webhooks that add statuses meanwhile.
+
+The file is rotated into numbered segments once it grows past
+`segment_bytes` or was started more than `segment_age` seconds ago, and only
+the newest `keep_segments` rotated segments are kept. Each block carries a
+CRC of its columns: a block torn by a crash mid-write is skipped and reading
+resumes at the next block.
+
+Status webhooks are classified on the raw bytes and, in the shape Meta sends
+them, read with one regular expression instead of a JSON decode.
+"""
+import atexit
+import collections
+import glob
+import hashlib
+import itertools
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from array import array
+
+from app.utils.webhook_events import StatusEvent
+
+# Status name <-> 1-byte code. Higher codes win when statuses arrive out of order.
+STATUS_CODES = {"sent": 1, "delivered": 2, "read": 3, "failed": 4}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+# Block header: magic, record count, CRC32 of the columns
+BLOCK_HEADER = struct.Struct("<4sII")
+BLOCK_MAGIC = b"WST2"
+# Blocks written before the CRC was added: magic, record count
+LEGACY_HEADER = struct.Struct("<4sI")
+LEGACY_MAGIC = b"WST1"
+# Bytes per record: id hash, recipient hash, timestamp, status code
+RECORD_SIZE = 21
+
+# File rotation: past 64 MB or a day, keeping a week of rotated segments
+SEGMENT_BYTES = 64 * 1024 * 1024
+SEGMENT_AGE = 86400.0
+KEEP_SEGMENTS = 7
+
+_STATUSES_KEY = re.compile(rb'"statuses"\s*:')
+_MESSAGES_KEY = re.compile(rb'"messages"\s*:')
+_PHONE_NUMBER_ID = re.compile(rb'"phone_number_id"\s*:\s*"([^"\\]*)"')
+# The leading fields of a status object, in the order Meta sends them. The
+# pattern starts with a literal so the regex engine can skip ahead to it.
+_STATUS_OBJECT = re.compile(
+    rb'"id"\s*:\s*"([^"\\]+)"\s*,\s*"status"\s*:\s*"([a-z]+)"\s*,'
+    rb'\s*"timestamp"\s*:\s*"(\d+)"\s*,\s*"recipient_id"\s*:\s*"([^"\\]*)"'
+)
+
+DeliveryState = collections.namedtuple("DeliveryState", ["message_id", "status", "timestamp"])
+
+
+def _hash_id(value):
+    """64-bit hash of a message id or phone number."""
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def looks_like_status_payload(raw):
+    """
+    Cheap check on the raw body: does it carry statuses and no messages?
+
+    Args:
+        raw (bytes): The raw webhook body
+
+    Returns:
+        bool: True if the body can take the status fast path
+    """
+    # Match keys, not values: every body also carries "field": "messages"
+    return _STATUSES_KEY.search(raw) is not None and _MESSAGES_KEY.search(raw) is None
+
+
+def scan_status_payload(raw):
+    """
+    Read the statuses of a status-only body without decoding its JSON.
+
+    Only bodies in the shape Meta sends are read this way: every status
+    object starts with id, status, timestamp and recipient_id, no string is
+    escaped and the body is for one phone number id. For anything else the
+    caller falls back to parse_webhook.
+
+    Args:
+        raw (bytes): The raw webhook body, already classified by looks_like_status_payload
+
+    Returns:
+        list: StatusEvent instances, or None if the body has to be parsed
+    """
+    matches = _STATUS_OBJECT.findall(raw)
+    # Any other "status" (a key elsewhere, or a value) means another shape
+    if not matches or len(matches) != raw.count(b'"status"'):
+        return None
+    phone_number_ids = set(_PHONE_NUMBER_ID.findall(raw))
+    if len(phone_number_ids) > 1:
+        return None
+    try:
+        phone_number_id = phone_number_ids.pop().decode("utf-8") if phone_number_ids else None
+        return [
+            StatusEvent(
+                message_id.decode("utf-8"), recipient.decode("utf-8"), status.decode("ascii"),
+                int(timestamp), phone_number_id,
+            )
+            for message_id, status, timestamp, recipient in matches
+        ]
+    except UnicodeDecodeError:
+        return None
+
+
+class StatusStore:
+    """
+    Append-only status log with array-backed columns.
+
+    Args:
+        path (str): File the columnar blocks are appended to; rotated
+            segments are kept next to it as path.1, path.2, ...
+        flush_size (int): Buffered records that trigger a flush
+        flush_interval (float): Seconds after which a non-empty buffer is flushed
+        index_size (int): Recent message ids whose latest state is kept in memory
+        segment_bytes (int): Size past which the file is rotated
+        segment_age (float): Seconds since the file's first write after
+            which it is rotated
+        keep_segments (int): Rotated segments kept; older ones are deleted
+        start (bool): Start the thread flushing the buffer every flush_interval
+    """
+
+    def __init__(self, path, flush_size=512, flush_interval=5.0, index_size=100000,
+                 segment_bytes=SEGMENT_BYTES, segment_age=SEGMENT_AGE, keep_segments=KEEP_SEGMENTS, start=True):
+        self.path = path
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.index_size = index_size
+        self.segment_bytes = segment_bytes
+        self.segment_age = segment_age
+        self.keep_segments = keep_segments
+        self.recorded = 0
+        self.flushed = 0
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._reset_buffer()
+        # message hash -> (code, timestamp), most recently updated last
+        self._index = collections.OrderedDict()
+        # Wall-clock time of the current file's first write (of its last one
+        # before a restart: never earlier than the real start)
+        try:
+            self._segment_started = os.path.getmtime(path)
+        except OSError:
+            self._segment_started = None
+
+        self._stopping = threading.Event()
+        self._thread = None
+        if start:
+            self._thread = threading.Thread(target=self._flush_loop, name="status-store", daemon=True)
+            self._thread.start()
+
+    def _reset_buffer(self):
+        self._ids = array("Q")
+        self._recipients = array("Q")
+        self._timestamps = array("I")
+        self._codes = array("B")
+
+    def _update_index(self, key, code, timestamp):
+        current = self._index.get(key)
+        if current is None or code >= current[0]:
+            self._index[key] = (code, timestamp)
+        self._index.move_to_end(key)
+        if len(self._index) > self.index_size:
+            self._index.popitem(last=False)
+
+    def add(self, statuses):
+        """
+        Record status events.
+
+        Args:
+            statuses: Iterable of StatusEvent
+        """
+        with self._lock:
+            for status in statuses:
+                code = STATUS_CODES.get(status.status)
+                if code is None:
+                    continue
+                key = _hash_id(status.message_id)
+                self._ids.append(key)
+                self._recipients.append(_hash_id(status.recipient_id or ""))
+                self._timestamps.append(max(0, min(status.timestamp, 0xFFFFFFFF)))
+                self._codes.append(code)
+                self._update_index(key, code, status.timestamp)
+                self.recorded += 1
+
+            if len(self._ids) >= self.flush_size or (
+                self._ids and time.monotonic() - self._last_flush >= self.flush_interval
+            ):
+                self._flush_locked()
+
+    def flush(self):
+        """Write buffered records to disk as one block."""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_loop(self):
+        while not self._stopping.wait(self.flush_interval):
+            with self._lock:
+                if self._ids and time.monotonic() - self._last_flush >= self.flush_interval:
+                    self._flush_locked()
+
+    def close(self):
+        """Stop the flush thread and write what is buffered."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _flush_locked(self):
+        self._last_flush = time.monotonic()
+        count = len(self._ids)
+        if not count:
+            return
+        self._rotate_if_due()
+        columns = b"".join(
+            (self._ids.tobytes(), self._recipients.tobytes(), self._timestamps.tobytes(), self._codes.tobytes())
+        )
+        try:
+            with open(self.path, "ab") as f:
+                f.write(BLOCK_HEADER.pack(BLOCK_MAGIC, count, zlib.crc32(columns)) + columns)
+        except OSError as e:
+            # Keep the buffer; the next flush retries
+            logging.error(f"Failed to flush status store: {e}")
+            return
+        if self._segment_started is None:
+            self._segment_started = time.time()
+        self.flushed += count
+        self._reset_buffer()
+
+    def _rotate_if_due(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        too_old = self._segment_started is not None and time.time() - self._segment_started >= self.segment_age
+        if not size or (size < self.segment_bytes and not too_old):
+            return
+        try:
+            # path.1 is the newest rotated segment
+            for number in range(self.keep_segments, 0, -1):
+                older = f"{self.path}.{number}"
+                if not os.path.exists(older):
+                    continue
+                if number == self.keep_segments:
+                    os.remove(older)
+                else:
+                    os.replace(older, f"{self.path}.{number + 1}")
+            if self.keep_segments > 0:
+                os.replace(self.path, f"{self.path}.1")
+            else:
+                os.remove(self.path)
+        except OSError as e:
+            logging.error(f"Failed to rotate status store: {e}")
+            return
+        self._segment_started = None
+        logging.info(f"Rotated status store {self.path} at {size} bytes")
+
+    def segments(self):
+        """Paths of the rotated segments and the current file, oldest first."""
+        rotated = []
+        for path in glob.glob(glob.escape(self.path) + ".*"):
+            suffix = path[len(self.path) + 1:]
+            if suffix.isdigit():
+                rotated.append((int(suffix), path))
+        return [path for _, path in sorted(rotated, reverse=True)] + [self.path]
+
+    @staticmethod
+    def _map(path):
+        try:
+            with open(path, "rb") as f:
+                if not os.fstat(f.fileno()).st_size:
+                    return None
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+    def _iter_blocks(self, data, path):
+        """Yield (ids, timestamps, codes) arrays for each intact block of a mapped file."""
+        with data:
+            size = len(data)
+            position = 0
+            while position + LEGACY_HEADER.size <= size:
+                block = self._read_block(data, position, size)
+                if block is None:
+                    # Torn or corrupt block: resume at the next block header
+                    following = [found for found in (data.find(BLOCK_MAGIC, position + 1),
+                                                     data.find(LEGACY_MAGIC, position + 1)) if found >= 0]
+                    if not following:
+                        # Nothing after it: the final block, maybe still being written
+                        return
+                    logging.warning(f"Skipping a corrupt status store block in {path} at byte {position}")
+                    position = min(following)
+                    continue
+                position, ids, timestamps, codes = block
+                yield ids, timestamps, codes
+
+    @staticmethod
+    def _read_block(data, position, size):
+        magic = data[position:position + 4]
+        if magic == BLOCK_MAGIC and position + BLOCK_HEADER.size <= size:
+            _, count, crc = BLOCK_HEADER.unpack_from(data, position)
+            start = position + BLOCK_HEADER.size
+        elif magic == LEGACY_MAGIC:
+            _, count = LEGACY_HEADER.unpack_from(data, position)
+            start, crc = position + LEGACY_HEADER.size, None
+        else:
+            return None
+        end = start + count * RECORD_SIZE
+        if end > size or (crc is not None and zlib.crc32(data[start:end]) != crc):
+            return None
+        ids = array("Q", data[start:start + count * 8])
+        timestamps = array("I", data[start + count * 16:start + count * 20])
+        codes = array("B", data[start + count * 20:end])
+        return end, ids, timestamps, codes
+
+    def get_delivery_state(self, message_id):
+        """
+        Return the most advanced delivery state seen for an outbound message.
+
+        Args:
+            message_id (str): The wamid returned when the message was sent
+
+        Returns:
+            DeliveryState: (message_id, status, timestamp), or None if unknown
+        """
+        key = _hash_id(message_id)
+        with self._lock:
+            found = self._index.get(key)
+            if found is None:
+                # Records flushed after this copy are read from the file: seen twice, never missed
+                buffered = (array("Q", self._ids), array("I", self._timestamps), array("B", self._codes))
+        if found is None:
+            # Without the lock: add() is on the webhook path
+            found = self._scan(key, buffered)
+        if found is None:
+            return None
+        return DeliveryState(message_id, STATUS_NAMES[found[0]], found[1])
+
+    def _scan(self, key, buffered):
+        best = None
+        # Every segment is mapped before any is read, so a rotation meanwhile renames nothing under the scan
+        mapped = [(self._map(path), path) for path in self.segments()]
+        blocks = (self._iter_blocks(data, path) for data, path in mapped if data is not None)
+        for ids, timestamps, codes in itertools.chain(itertools.chain.from_iterable(blocks), [buffered]):
+            start = 0
+            while True:
+                try:
+                    i = ids.index(key, start)
+                except ValueError:
+                    break
+                if best is None or codes[i] >= best[0]:
+                    best = (codes[i], timestamps[i])
+                start = i + 1
+        return best
+
+    def stats(self):
+        with self._lock:
+            return {
+                "recorded": self.recorded,
+                "flushed": self.flushed,
+                "buffered": len(self._ids),
+                "indexed": len(self._index),
+                "segments": len(self.segments()),
+            }
+
+
+def init_status_store(app):
+    """Create the app's status store and flush it when the process exits."""
+    store = StatusStore(
+        app.config["STATUS_STORE_PATH"],
+        flush_size=app.config["STATUS_FLUSH_SIZE"],
+        flush_interval=app.config["STATUS_FLUSH_INTERVAL"],
+        segment_bytes=app.config.get("STATUS_SEGMENT_BYTES", SEGMENT_BYTES),
+        segment_age=app.config.get("STATUS_SEGMENT_AGE", SEGMENT_AGE),
+        keep_segments=app.config.get("STATUS_KEEP_SEGMENTS", KEEP_SEGMENTS),
+    )
+    app.extensions["status_store"] = store
+    atexit.register(store.close)
+    return store
+
+
+def get_delivery_state(message_id):
+    """
+    Query API: delivery state of an outbound message in the current app.
+
+    Args:
+        message_id (str): The wamid returned when the message was sent
+
+    Returns:
+        DeliveryState: (message_id, status, timestamp), or None if unknown
+    """
+    from flask import current_app
+
+    return current_app.extensions["status_store"].get_delivery_state(message_id)
@@ -0,0 +1,275 @@
+"""
+Multi-tenant routing: many business phone numbers served by one process.
+
+Each tenant is a directory named after its phone number id under TENANTS_DIR:
+
+    tenants/<phone_number_id>/tenant.json     credentials and settings
+    tenants/<phone_number_id>/messages/*.txt  messages it customizes (optional)
+    tenants/<phone_number_id>/keywords.json   its keyword table (optional)
+
+tenant.json holds "name", "access_token", "app_secret" (values starting with
+'$' are read from that environment variable), "send_rate" (messages per
+second), "welcome_template" and "welcome_header_image". Anything left out
+comes from the app's own configuration and messages.
+
+Webhooks are routed on `entry[].changes[].value.metadata.phone_number_id`.
+Tenants are loaded on their first webhook and kept in an LRU cache; inactive
+tenants are evicted once more than TENANT_CACHE_SIZE are loaded, and reloaded
+on their next webhook. Send-rate limiters are kept outside the cache, so an
+evicted and reloaded tenant does not start over with a full burst. Their greeted users are appended to
+`greeted_users.txt` in the tenant directory, so eviction and restarts forget
+nothing. Phone numbers without a directory are served with the app's own
+configuration, as before.
+"""
+import collections
+import json
+import logging
+import os
+import threading
+
+from flask import current_app, g
+
+from app.services.campaign import TokenBucket
+from app.utils import metrics
+from app.utils.message_handlers import (
+    DEFAULT_REPLY,
+    KEYWORD_TABLE,
+    MessageCatalog,
+    default_catalog,
+    load_keyword_table,
+)
+
+
+class GreetedUsers:
+    """
+    Set of greeted wa_ids backed by an append-only file.
+
+    Args:
+        path (str): File with one wa_id per line (None keeps it in memory)
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._users = set()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._users.update(line.strip() for line in f if line.strip())
+
+    def __contains__(self, wa_id):
+        return wa_id in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+    def add(self, wa_id):
+        with self._lock:
+            if wa_id in self._users:
+                return
+            self._users.add(wa_id)
+            if self.path:
+                try:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(f"{wa_id}\n")
+                except OSError as e:
+                    logging.error(f"Failed to record greeted user in {self.path}: {e}")
+
+
+class Tenant:
+    """One business phone number with its own credentials, messages and limits."""
+
+    __slots__ = (
+        "phone_number_id", "name", "directory", "access_token", "app_secret", "catalog", "keywords",
+        "default_reply", "greeted", "limiter", "welcome_template", "welcome_header_image", "media_manager",
+    )
+
+    def __init__(self, phone_number_id, directory, settings):
+        self.phone_number_id = phone_number_id
+        self.directory = directory
+        self.name = settings.get("name", phone_number_id)
+        self.access_token = _resolve(settings.get("access_token"))
+        self.app_secret = _resolve(settings.get("app_secret"))
+        self.welcome_template = settings.get("welcome_template")
+        self.welcome_header_image = settings.get("welcome_header_image")
+        self.catalog = MessageCatalog(os.path.join(directory, "messages"), fallback=default_catalog)
+        self.keywords, self.default_reply = _load_keywords(os.path.join(directory, "keywords.json"))
+        self.greeted = GreetedUsers(os.path.join(directory, "greeted_users.txt"))
+        send_rate = settings.get("send_rate")
+        self.limiter = TokenBucket(float(send_rate)) if send_rate else None
+        self.media_manager = None
+
+    def __repr__(self):
+        return f"<Tenant {self.phone_number_id} {self.name}>"
+
+
+def _load_keywords(path):
+    """
+    Read a tenant's keywords.json.
+
+    Returns:
+        tuple: (keyword table, default reply); the app's own when the file is
+            missing or malformed, so one bad file does not take the tenant down
+    """
+    if not os.path.exists(path):
+        return KEYWORD_TABLE, DEFAULT_REPLY
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            keywords = json.load(f)
+        if not isinstance(keywords, dict):
+            raise ValueError("expected a JSON object")
+        default_reply = keywords.get("default", DEFAULT_REPLY)
+        if not isinstance(default_reply, str):
+            raise ValueError("'default' must be a string")
+        # Filled with the matched reply on every message; bad braces must fail here
+        default_reply.format(message="")
+        return load_keyword_table(keywords.get("rules", ())), default_reply
+    except (OSError, ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+        logging.error(f"Ignoring malformed keywords file {path}, using the default keywords: {e}")
+        return KEYWORD_TABLE, DEFAULT_REPLY
+
+
+def _resolve(value):
+    # "$SALON_TOKEN" keeps secrets out of the tenant files
+    if isinstance(value, str) and value.startswith("$"):
+        return os.getenv(value[1:])
+    return value
+
+
+class TenantRegistry:
+    """
+    Lazily loaded, LRU-cached tenants.
+
+    Args:
+        directory (str): TENANTS_DIR, or None for a single-tenant app
+        max_active (int): Tenants kept loaded before the least recently used is evicted
+    """
+
+    def __init__(self, directory=None, max_active=64):
+        self.directory = directory
+        self.max_active = max_active
+        self._tenants = collections.OrderedDict()
+        # phone number id -> TokenBucket, kept across eviction
+        self._limiters = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, phone_number_id):
+        """
+        Returns:
+            Tenant: The tenant for a phone number id, or None if it has no
+                tenant directory (served with the app's configuration)
+        """
+        if not self.directory or not phone_number_id:
+            return None
+        with self._lock:
+            tenant = self._tenants.get(phone_number_id)
+            if tenant is not None:
+                self._tenants.move_to_end(phone_number_id)
+                return tenant
+
+        tenant = self._load(phone_number_id)
+        if tenant is None:
+            return None
+        with self._lock:
+            self._share_limiter(tenant)
+            # Another request may have loaded it meanwhile; keep the first one
+            tenant = self._tenants.setdefault(phone_number_id, tenant)
+            self._tenants.move_to_end(phone_number_id)
+            while len(self._tenants) > self.max_active:
+                evicted = self._tenants.popitem(last=False)[1]
+                self.evictions += 1
+                metrics.increment("tenant_evictions")
+                logging.info(f"Evicted inactive tenant {evicted.phone_number_id}")
+        return tenant
+
+    def _share_limiter(self, tenant):
+        """Give a (re)loaded tenant the limiter its earlier loads used, unless its rate changed."""
+        kept = self._limiters.get(tenant.phone_number_id)
+        if tenant.limiter is None:
+            self._limiters.pop(tenant.phone_number_id, None)
+        elif kept is not None and kept.rate == tenant.limiter.rate:
+            tenant.limiter = kept
+        else:
+            self._limiters[tenant.phone_number_id] = tenant.limiter
+
+    def _load(self, phone_number_id):
+        # Phone number ids are digits; anything else never names a directory
+        if not str(phone_number_id).isdigit():
+            return None
+        directory = os.path.join(self.directory, phone_number_id)
+        settings_path = os.path.join(directory, "tenant.json")
+        if not os.path.exists(settings_path):
+            return None
+        try:
+            with open(settings_path, "r", encoding="utf-8") as f:
+                tenant = Tenant(phone_number_id, directory, json.load(f))
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logging.error(f"Failed to load tenant {phone_number_id}: {e}")
+            return None
+        self.loads += 1
+        metrics.increment("tenant_loads")
+        logging.info(f"Loaded tenant {tenant.phone_number_id} ({tenant.name})")
+        return tenant
+
+    def stats(self):
+        with self._lock:
+            active = list(self._tenants)
+        return {"active": active, "loads": self.loads, "evictions": self.evictions}
+
+
+def get_media_manager(tenant):
+    """
+    The tenant's own media cache: media ids belong to the phone number that uploaded them.
+
+    Returns:
+        MediaManager: Created on first use, cached in the tenant directory
+    """
+    if tenant.media_manager is None:
+        # Imported lazily: whatsapp_utils uses this module
+        from app.services.media_manager import MediaManager
+        from app.utils.whatsapp_utils import upload_media
+
+        app = current_app._get_current_object()
+
+        def upload(source):
+            # Also called from background refresh threads
+            with app.app_context():
+                g.tenant = tenant
+                return upload_media(source)
+
+        tenant.media_manager = MediaManager(
+            upload,
+            cache_path=os.path.join(tenant.directory, "media_cache.json"),
+            ttl=app.config["MEDIA_ID_TTL"],
+            refresh_margin=app.config["MEDIA_REFRESH_MARGIN"],
+        )
+    return tenant.media_manager
+
+
+def current_tenant():
+    """
+    Returns:
+        Tenant: The tenant the current request or outbox send is for, or None
+    """
+    return g.get("tenant")
+
+
+def use_tenant(phone_number_id):
+    """
+    Route the rest of the current app context to a phone number's tenant.
+
+    Returns:
+        Tenant: The tenant, or None when the app's own configuration applies
+    """
+    registry = current_app.extensions.get("tenants")
+    tenant = registry.get(phone_number_id) if registry is not None else None
+    g.tenant = tenant
+    return tenant
+
+
+def init_tenants(app):
+    """Create the tenant registry (single-tenant when TENANTS_DIR is unset)."""
+    registry = TenantRegistry(app.config.get("TENANTS_DIR"), app.config["TENANT_CACHE_SIZE"])
+    app.extensions["tenants"] = registry
+    return registry
@@ -0,0 +1,177 @@
+"""
+Lifecycle of the OpenAI thread kept for each WhatsApp user.
+
+Every Assistant run re-reads the whole thread, so a guest who has been
+chatting for weeks makes every run slower and more expensive. Each wa_id maps
+to a record with its thread id, message count and an approximate token count.
+Once a thread grows past a size limit, or has been idle for too long, it is
+rotated: a fresh thread seeded with a short summary of the old one replaces
+it in the mapping.
+"""
+import logging
+import shelve
+import threading
+import time
+
+from app.utils.profiling import timed
+
+# One lock per shelf file: dbm files must not be written from two threads at once
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _lock_for(path):
+    with _locks_guard:
+        return _locks.setdefault(path, threading.RLock())
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token)."""
+    return len(text or "") // 4 + 1
+
+
+def new_record(thread_id, tokens=0, rotations=0):
+    now = time.time()
+    return {
+        "thread_id": thread_id,
+        "messages": 0,
+        "tokens": tokens,
+        "created": now,
+        "last_active": now,
+        "rotations": rotations,
+    }
+
+
+class ThreadStore:
+    """
+    Shelve-backed wa_id -> thread record mapping with a rotation policy.
+
+    Args:
+        path (str): Shelf file name
+        max_messages (int): Messages after which a thread is rotated (0 = no limit)
+        max_tokens (int): Approximate tokens after which a thread is rotated (0 = no limit)
+        idle_ttl (float): Seconds of inactivity after which a thread is rotated (0 = never)
+    """
+
+    def __init__(self, path="threads_db", max_messages=40, max_tokens=8000, idle_ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self.idle_ttl = idle_ttl
+        self._lock = _lock_for(path)
+
+    @timed("thread_store.get")
+    def get(self, wa_id):
+        """
+        Returns:
+            dict: The user's thread record, or None
+        """
+        with self._lock, shelve.open(self.path) as threads_shelf:
+            record = threads_shelf.get(wa_id, None)
+        if isinstance(record, str):
+            # Mapping written before records were tracked: sizes unknown
+            record = new_record(record)
+        return record
+
+    @timed("thread_store.put")
+    def put(self, wa_id, thread_id, tokens=0):
+        """Map a user to a new thread, keeping the rotation count."""
+        with self._lock, shelve.open(self.path, writeback=True) as threads_shelf:
+            previous = threads_shelf.get(wa_id)
+            rotations = previous.get("rotations", 0) if isinstance(previous, dict) else 0
+            threads_shelf[wa_id] = new_record(thread_id, tokens, rotations)
+
+    @timed("thread_store.replace")
+    def replace(self, wa_id, old_thread_id, new_thread_id, tokens=0):
+        """
+        Atomically swap the user's thread, unless another request already did.
+
+        Returns:
+            bool: True if the mapping now points at new_thread_id
+        """
+        with self._lock, shelve.open(self.path, writeback=True) as threads_shelf:
+            current = threads_shelf.get(wa_id)
+            current_id = current.get("thread_id") if isinstance(current, dict) else current
+            if current_id != old_thread_id:
+                return False
+            rotations = current.get("rotations", 0) + 1 if isinstance(current, dict) else 1
+            threads_shelf[wa_id] = new_record(new_thread_id, tokens, rotations)
+            return True
+
+    @timed("thread_store.record_exchange")
+    def record_exchange(self, wa_id, thread_id, *texts):
+        """
+        Count messages added to a thread.
+
+        Args:
+            wa_id (str): WhatsApp ID of the user
+            thread_id (str): Thread the messages were added to
+            *texts (str): The messages
+        """
+        with self._lock, shelve.open(self.path, writeback=True) as threads_shelf:
+            record = threads_shelf.get(wa_id)
+            if isinstance(record, str):
+                record = new_record(record)
+            if record is None or record["thread_id"] != thread_id:
+                # Rotated meanwhile: the counts belong to the old thread
+                return
+            record["messages"] += len(texts)
+            record["tokens"] += sum(estimate_tokens(t) for t in texts)
+            record["last_active"] = time.time()
+            threads_shelf[wa_id] = record
+
+    def rotation_reason(self, record, now=None):
+        """
+        Decide whether a thread should be replaced.
+
+        Returns:
+            str: 'messages', 'tokens' or 'idle', or None to keep the thread
+        """
+        now = now or time.time()
+        if self.max_messages and record["messages"] >= self.max_messages:
+            return "messages"
+        if self.max_tokens and record["tokens"] >= self.max_tokens:
+            return "tokens"
+        if self.idle_ttl and now - record["last_active"] >= self.idle_ttl:
+            return "idle"
+        return None
+
+    def stats(self, top=20):
+        """
+        Per-thread size statistics.
+
+        Args:
+            top (int): Number of largest threads listed individually
+
+        Returns:
+            dict: Totals, maxima and the largest threads by approximate tokens
+        """
+        try:
+            with self._lock, shelve.open(self.path, flag="r") as threads_shelf:
+                items = [(wa_id, threads_shelf[wa_id]) for wa_id in threads_shelf.keys()]
+        except Exception as e:
+            # No shelf yet (no thread created) or unreadable
+            logging.debug(f"No thread statistics available from {self.path}: {e}")
+            items = []
+
+        now = time.time()
+        threads = []
+        for wa_id, record in items:
+            if isinstance(record, str):
+                record = new_record(record)
+            threads.append({
+                "wa_id": wa_id,
+                "thread_id": record["thread_id"],
+                "messages": record["messages"],
+                "approx_tokens": record["tokens"],
+                "idle_seconds": int(now - record["last_active"]),
+                "rotations": record.get("rotations", 0),
+            })
+        threads.sort(key=lambda t: t["approx_tokens"], reverse=True)
+        return {
+            "threads": len(threads),
+            "max_messages": max((t["messages"] for t in threads), default=0),
+            "max_approx_tokens": max((t["approx_tokens"] for t in threads), default=0),
+            "total_rotations": sum(t["rotations"] for t in threads),
+            "largest": threads[:top],
+        }
@@ -0,0 +1,115 @@
+"""
+Warm-up of what the app otherwise creates on first use.
+
+The OpenAI client, the Graph API session, the message texts and the welcome
+header upload are all created lazily, so a cold start only pays for what the
+first webhook needs. With WARM_UP set to 'background' (the default) they are
+created on a thread right after startup, and pooled connections to the Graph
+API and OpenAI are opened; with 'blocking' `create_app()` returns once they
+are ready. The instance reports ready (GET /ready) when the warm-up is done.
+Every step is timed into the startup profile.
+"""
+import logging
+import threading
+import time
+
+from app.utils.message_handlers import load_catalog
+
+
+def _warm_up_openai():
+    from app.services import openai_service
+
+    openai_service.get_client()
+    openai_service.get_thread_store()
+    openai_service.get_answer_cache()
+
+
+def _fetch_assistant():
+    from app.services import openai_service
+
+    # Opens the connection the first run reuses, and checks the answer cache is current
+    assistant = openai_service.get_client().beta.assistants.retrieve(openai_service.OPENAI_ASSISTANT_ID)
+    openai_service.check_assistant_changed(assistant)
+
+
+def _open_graph_connection(url):
+    from app.utils.whatsapp_utils import get_graph_session
+
+    # Any answer leaves a keep-alive connection (TLS done) in the pool
+    get_graph_session().head(url, timeout=5)
+
+
+def warm_up(app):
+    """
+    Create the lazily initialized clients and caches now.
+
+    A failing step is logged and skipped; it is retried on first use.
+
+    Args:
+        app (Flask): The app to warm up
+
+    Returns:
+        dict: Seconds taken by each step
+    """
+    from app.utils.whatsapp_utils import get_graph_session, get_media_id
+
+    steps = [("message_catalog", load_catalog), ("graph_session", get_graph_session)]
+    graph_url = app.config.get("GRAPH_API_URL")
+    if graph_url:
+        steps.append(("graph_connection", lambda: _open_graph_connection(graph_url)))
+    if app.config.get("REPLY_ENGINE") == "openai":
+        steps.append(("openai_client", _warm_up_openai))
+        steps.append(("openai_assistant", _fetch_assistant))
+    header_image = app.config.get("WELCOME_HEADER_IMAGE")
+    if header_image and app.extensions.get("media_manager") is not None:
+        steps.append(("welcome_header", lambda: get_media_id(header_image)))
+
+    profile = app.extensions.get("startup_profile")
+    timings = {}
+    with app.app_context():
+        for name, step in steps:
+            start = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                logging.warning(f"Warm-up step {name} failed: {e}")
+            timings[name] = time.perf_counter() - start
+            if profile is not None:
+                profile.add(f"warm_up.{name}", timings[name])
+    logging.info(f"Warm-up done in {sum(timings.values()) * 1000:.1f} ms")
+    return timings
+
+
+def _mark_ready(app):
+    lifecycle = app.extensions.get("lifecycle")
+    if lifecycle is not None:
+        lifecycle.mark_ready()
+
+
+def _warm_up_then_ready(app):
+    try:
+        warm_up(app)
+    finally:
+        _mark_ready(app)
+
+
+def init_warm_up(app):
+    """
+    Run the warm-up as configured by WARM_UP ('off', 'background' or 'blocking'),
+    then report the instance ready.
+
+    Returns:
+        threading.Thread: The background warm-up thread, or None
+    """
+    mode = app.config.get("WARM_UP", "off")
+    if mode == "blocking":
+        warm_up(app)
+    elif mode == "background":
+        thread = threading.Thread(target=_warm_up_then_ready, args=(app,), name="warm-up", daemon=True)
+        thread.start()
+        app.extensions["warm_up_thread"] = thread
+        return thread
+    elif mode != "off":
+        logging.warning(f"Unknown WARM_UP mode {mode!r}, not warming up")
+    _mark_ready(app)
+    return None
@@ -0,0 +1,96 @@
+"""
+Webhook body ingestion: decode the raw request bytes once per request.
+
+The decoded JSON and the parsed WebhookBatch are cached on `flask.g`, so
+every step of handling a webhook shares one copy of the body instead of
+each calling `request.get_json()`. Status-only bodies, most of the traffic,
+are usually read straight from the raw bytes and never decoded.
+
+orjson is used when it is installed (pip install orjson); otherwise the
+standard library decoder is used. Both accept bytes directly.
+"""
+import json
+
+from flask import g, request
+
+from app.services.status_store import looks_like_status_payload, scan_status_payload
+from app.utils.webhook_events import parse_webhook
+
+try:
+    import orjson
+
+    def loads(data):
+        return orjson.loads(data)
+
+    JSON_DECODER = "orjson"
+except ImportError:
+
+    def loads(data):
+        try:
+            return json.loads(data)
+        except UnicodeDecodeError as e:
+            # Report bad encodings like orjson does, as a JSON decode error
+            raise json.JSONDecodeError(str(e), "", 0) from e
+
+    JSON_DECODER = "json"
+
+
+def get_raw_body():
+    """Return the request body as bytes (read once, cached by Werkzeug)."""
+    return request.get_data(cache=True)
+
+
+def get_webhook_body():
+    """
+    Return the decoded JSON body of the current request.
+
+    Raises:
+        json.JSONDecodeError: If the body is not valid JSON
+    """
+    if "webhook_body" not in g:
+        g.webhook_body = loads(get_raw_body())
+    return g.webhook_body
+
+
+def get_webhook_batch():
+    """
+    Return the parsed events of the current request's body.
+
+    Raises:
+        json.JSONDecodeError: If the body is not valid JSON
+    """
+    if "webhook_batch" not in g:
+        g.webhook_batch = parse_webhook(get_webhook_body())
+    return g.webhook_batch
+
+
+def get_status_events():
+    """
+    Return the statuses of a status-only body, or None for any other body.
+
+    Raises:
+        json.JSONDecodeError: If the body has to be decoded and is not valid JSON
+    """
+    if "status_events" not in g:
+        raw = get_raw_body()
+        statuses = None
+        if looks_like_status_payload(raw):
+            statuses = scan_status_payload(raw)
+            if statuses is None:
+                batch = get_webhook_batch()
+                statuses = batch.statuses if batch.is_status_only else None
+        g.status_events = statuses
+    return g.status_events
+
+
+def get_phone_number_id():
+    """
+    Return our business phone number id the current body is for, or None.
+
+    Raises:
+        json.JSONDecodeError: If the body has to be decoded and is not valid JSON
+    """
+    statuses = get_status_events()
+    if statuses:
+        return statuses[0].phone_number_id
+    return get_webhook_batch().phone_number_id
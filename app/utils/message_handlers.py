@@ -1,7 +1,12 @@
 """
 Message handlers for WhatsApp bot responses
 """
+import logging
 import os
+import re
+
+from app.utils import metrics
+from app.utils.profiling import timed
 
 # Track users who have already received the welcome message
 greeted_users = set()
@@ -10,6 +15,64 @@ greeted_users = set()
 MESSAGES_DIR = os.path.join(os.path.dirname(__file__), 'messages')
 
 
+class MessageCatalog:
+    """
+    Message texts of one directory, read from disk on first use and then
+    served from memory.
+
+    Args:
+        directory (str): Directory holding the .txt message files
+        fallback (MessageCatalog): Catalog used for files missing here
+            (tenants only override the messages they customize)
+    """
+
+    def __init__(self, directory, fallback=None):
+        self.directory = directory
+        self.fallback = fallback
+        self.messages = {}
+
+    def load(self, filename):
+        """
+        Load a message from a text file.
+
+        Args:
+            filename (str): Name of the message file (without path)
+
+        Returns:
+            str: The message content
+        """
+        message = self.messages.get(filename)
+        if message is not None:
+            return message
+        file_path = os.path.join(self.directory, filename)
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                message = f.read().strip()
+        except FileNotFoundError:
+            if self.fallback is not None:
+                return self.fallback.load(filename)
+            return f"Error: Message file '{filename}' not found."
+        self.messages[filename] = message
+        return message
+
+    def load_all(self):
+        """
+        Read every message file into memory (used by the warm-up).
+
+        Returns:
+            int: Number of messages loaded
+        """
+        if os.path.isdir(self.directory):
+            for filename in os.listdir(self.directory):
+                if filename.endswith('.txt'):
+                    self.load(filename)
+        return len(self.messages)
+
+
+# The bot's own messages (tenants fall back to these)
+default_catalog = MessageCatalog(MESSAGES_DIR)
+
+
 def load_message(filename):
     """
     Load a message from a text file.
@@ -20,12 +83,17 @@ def load_message(filename):
     Returns:
         str: The message content
     """
-    file_path = os.path.join(MESSAGES_DIR, filename)
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return f.read().strip()
-    except FileNotFoundError:
-        return f"Error: Message file '{filename}' not found."
+    return default_catalog.load(filename)
+
+
+def load_catalog():
+    """
+    Read every message file into memory (used by the warm-up).
+
+    Returns:
+        int: Number of messages loaded
+    """
+    return default_catalog.load_all()
 
 
 def get_welcome_message():
@@ -38,64 +106,191 @@ def get_welcome_message():
     return load_message('welcome.txt')
 
 
-def should_send_welcome(wa_id):
+def should_send_welcome(wa_id, greeted=None):
     """
     Check if a user should receive the welcome message.
 
     Args:
         wa_id (str): WhatsApp ID of the user
+        greeted: Set-like store of greeted users (default: greeted_users)
 
     Returns:
         bool: True if welcome message should be sent
     """
-    if wa_id not in greeted_users:
-        greeted_users.add(wa_id)
+    greeted = greeted_users if greeted is None else greeted
+    if wa_id not in greeted:
+        greeted.add(wa_id)
         return True
     return False
 
 
-def generate_response(response):
+# Keyword rules, checked in order: a rule matches if the message contains any
+# of its `any` keywords or all of its `all` keywords
+KEYWORD_TABLE = (
+    (("consulta capilar", "consulta", "relajacion", "relajación"), (), 'consulta_capilar.txt'),
+    (("wash and go", "lavado", "definicion de rizos", "definición de rizos"), (), 'lavado_rizos.txt'),
+    (("rizos elaborados", "elaborados", "flexis"), (), 'rizos_elaborados.txt'),
+    (("trenzas", "boxbraids", "box braids", "africanas"), (), 'trenzas_africanas.txt'),
+    (("crochet", "metodo crochet", "método crochet"), (), 'metodo_crochet.txt'),
+    (("prueba de color", "prueba color"), ("prueba", "color"), 'prueba_color.txt'),
+    (("color", "tinte"), (), 'color_hint.txt'),
+    (("costos",), (), 'costos.txt'),
+    (("horario",), (), 'horario.txt'),
+    (("servicios",), (), 'servicios.txt'),
+    (("ubicacion", "ubicación"), (), 'ubicacion.txt'),
+    (("reserva", "cita"), (), 'reserva.txt'),
+    (("hola",), (), 'hola.txt'),
+    (("gracias",), (), 'gracias.txt'),
+)
+
+# Services the booking flow can book, by the message file that describes them
+BOOKABLE_SERVICES = {
+    'consulta_capilar.txt': 'Consulta Capilar y Relajación',
+    'lavado_rizos.txt': 'Wash and Go / Definición de Rizos',
+    'rizos_elaborados.txt': 'Rizos Elaborados',
+    'trenzas_africanas.txt': 'Trenzas Africanas',
+    'metodo_crochet.txt': 'Método Crochet',
+    'prueba_color.txt': 'Prueba de Color',
+    'color_hint.txt': 'Tintes y Prueba de Color',
+}
+
+# Steps of the booking flow (Session.state)
+BOOKING_SERVICE = "booking:service"
+BOOKING_TIME = "booking:time"
+
+# Words that leave the booking flow at any step
+BOOKING_CANCEL_WORDS = ("cancelar", "salir")
+
+# A preferred time names a day, a date or a time of day
+BOOKING_TIME_PATTERN = re.compile(
+    r"\b(lunes|martes|mi[eé]rcoles|jueves|viernes|s[aá]bado|domingo|hoy|ma[nñ]ana|tarde|noche|mediod[ií]a"
+    r"|enero|febrero|marzo|abril|mayo|junio|julio|agosto|septiembre|octubre|noviembre|diciembre)\b"
+    r"|\b\d{1,2}\s*(:\d{2}|am\b|pm\b|a\.\s?m\.|p\.\s?m\.|h\b)"
+    r"|\ba las \d{1,2}\b"
+    r"|\b\d{1,2}/\d{1,2}\b"
+)
+
+# Reply when no keyword matches; {message} is the user's message
+DEFAULT_REPLY = "Recibí tu mensaje: '{message}'. ¿Puedes ser más específico? Escribe 'servicios' para ver lo que ofrecemos."
+
+
+def load_keyword_table(rules):
+    """
+    Build a keyword table from its JSON form.
+
+    Args:
+        rules (list): Dicts with 'message' and 'any' and/or 'all' keyword lists
+
+    Returns:
+        tuple: Rules in the format of KEYWORD_TABLE
+
+    Raises:
+        ValueError: If a rule is not an object with a message and lists of keywords
+    """
+    if not isinstance(rules, (list, tuple)):
+        raise ValueError("'rules' must be a list")
+    table = []
+    for rule in rules:
+        if not isinstance(rule, dict) or not isinstance(rule.get("message"), str):
+            raise ValueError(f"rule {rule!r} needs a 'message' file name")
+        keywords = []
+        for field in ("any", "all"):
+            words = rule.get(field, ())
+            if not isinstance(words, (list, tuple)) or not all(isinstance(k, str) for k in words):
+                raise ValueError(f"'{field}' of rule {rule['message']!r} must be a list of strings")
+            keywords.append(tuple(k.lower() for k in words))
+        table.append((keywords[0], keywords[1], rule["message"]))
+    return tuple(table)
+
+
+def match_keywords(message_lower, table=KEYWORD_TABLE):
+    """
+    Returns:
+        str: Message file of the first matching rule, or None
+    """
+    for any_of, all_of, filename in table:
+        if any(k in message_lower for k in any_of) or (all_of and all(k in message_lower for k in all_of)):
+            return filename
+    return None
+
+
+def continue_booking(session, filename, response, catalog):
+    """
+    Advance the booking flow: service, then preferred day and time.
+
+    "cancelar" or "salir" leaves the flow at any step, and an answer to the
+    time question that names no day or time is asked again.
+
+    Args:
+        session (Session): The user's session
+        filename (str): Message file matched by the keywords, or None
+        response (str): The incoming message
+        catalog (MessageCatalog): Where the replies are read
+
+    Returns:
+        str: The flow's reply, or None to answer with the keyword match
+    """
+    message_lower = response.lower().strip()
+    if session.state in (BOOKING_SERVICE, BOOKING_TIME) and any(
+        re.search(rf"\b{word}\b", message_lower) for word in BOOKING_CANCEL_WORDS
+    ):
+        session.reset()
+        metrics.increment("bookings_cancelled")
+        return catalog.load('reserva_cancelada.txt')
+
+    service = None
+    if filename == 'reserva.txt':
+        # "quiero una cita" right after asking about a service books that service
+        service = BOOKABLE_SERVICES.get(session.last_topic)
+        session.reset()
+        session.state = BOOKING_SERVICE
+    elif session.state == BOOKING_SERVICE and filename in BOOKABLE_SERVICES:
+        service = BOOKABLE_SERVICES[filename]
+    elif session.state == BOOKING_TIME and filename is None:
+        if not BOOKING_TIME_PATTERN.search(message_lower):
+            # Not a day or time: ask again instead of booking whatever was said
+            return catalog.load('reserva_horario_invalido.txt')
+        service = session.get('service')
+        session.reset()
+        logging.info(f"Booking requested by {session.key}: {service}, {response.strip()}")
+        metrics.increment("bookings_requested")
+        return catalog.load('reserva_confirmada.txt').format(service=service, time=response.strip())
+
+    if filename is not None:
+        session.last_topic = filename
+    if service is None:
+        return None
+    session.set('service', service)
+    session.state = BOOKING_TIME
+    return catalog.load('reserva_horario.txt').format(service=service)
+
+
+@timed("generate_response")
+def generate_response(response, catalog=None, table=KEYWORD_TABLE, default_reply=DEFAULT_REPLY, session=None):
     """
     Generate a response based on keywords in the incoming message.
 
     Args:
         response (str): The incoming message from the user
+        catalog (MessageCatalog): Where the replies are read (default: the bot's own messages)
+        table (tuple): Keyword rules, see KEYWORD_TABLE
+        default_reply (str): Reply when no keyword matches
+        session (Session): The user's conversation so far, for multi-step
+            flows (default: answer every message on its own)
 
     Returns:
         str: The appropriate response based on keywords
     """
     # Normalize the message to lowercase for comparison
     message_lower = response.lower().strip()
+    catalog = catalog or default_catalog
 
-    # Keyword-based responses using if/else
-    if "consulta capilar" in message_lower or "consulta" in message_lower or "relajacion" in message_lower or "relajación" in message_lower:
-        return load_message('consulta_capilar.txt')
-    elif "wash and go" in message_lower or "lavado" in message_lower or "definicion de rizos" in message_lower or "definición de rizos" in message_lower:
-        return load_message('lavado_rizos.txt')
-    elif "rizos elaborados" in message_lower or "elaborados" in message_lower or "flexis" in message_lower:
-        return load_message('rizos_elaborados.txt')
-    elif "trenzas" in message_lower or "boxbraids" in message_lower or "box braids" in message_lower or "africanas" in message_lower:
-        return load_message('trenzas_africanas.txt')
-    elif "crochet" in message_lower or "metodo crochet" in message_lower or "método crochet" in message_lower:
-        return load_message('metodo_crochet.txt')
-    elif "prueba de color" in message_lower or "prueba color" in message_lower or ("prueba" in message_lower and "color" in message_lower):
-        return load_message('prueba_color.txt')
-    elif "color" in message_lower or "tinte" in message_lower:
-        return load_message('color_hint.txt')
-    elif "costos" in message_lower:
-        return load_message('costos.txt')
-    elif "horario" in message_lower:
-        return load_message('horario.txt')
-    elif "servicios" in message_lower:
-        return load_message('servicios.txt')
-    elif "ubicacion" in message_lower or "ubicación" in message_lower:
-        return load_message('ubicacion.txt')
-    elif "reserva" in message_lower or "cita" in message_lower:
-        return load_message('reserva.txt')
-    elif "hola" in message_lower:
-        return load_message('hola.txt')
-    elif "gracias" in message_lower:
-        return load_message('gracias.txt')
-    else:
+    filename = match_keywords(message_lower, table)
+    if session is not None:
+        reply = continue_booking(session, filename, response, catalog)
+        if reply is not None:
+            return reply
+    if filename is None:
         # Default response if no keyword matches
-        return f"Recibí tu mensaje: '{response}'. ¿Puedes ser más específico? Escribe 'servicios' para ver lo que ofrecemos."
+        return default_reply.format(message=response)
+    return catalog.load(filename)
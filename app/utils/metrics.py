@@ -0,0 +1,75 @@
+"""
+In-process metrics: labelled counters and timing summaries.
+
+Kept deliberately small: a lock and two dicts. `snapshot()` is what the
+/metrics endpoint returns.
+"""
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+# key -> [count, total, max]
+_summaries = {}
+
+
+def _key(name, labels):
+    if not labels:
+        return name
+    rendered = ",".join(f"{k}={v}" for k, v in sorted(labels.items()))
+    return f"{name}{{{rendered}}}"
+
+
+def increment(name, value=1, **labels):
+    """
+    Add `value` to a counter.
+
+    Args:
+        name (str): Metric name, e.g. 'webhook_shed'
+        value (int): Amount to add
+        **labels: Label values, e.g. reason='queue_full'
+    """
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """
+    Record one observation (e.g. a duration in seconds) in a summary.
+    """
+    key = _key(name, labels)
+    with _lock:
+        summary = _summaries.get(key)
+        if summary is None:
+            _summaries[key] = [1, value, value]
+        else:
+            summary[0] += 1
+            summary[1] += value
+            if value > summary[2]:
+                summary[2] = value
+
+
+def get_counter(name, **labels):
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+
+def snapshot():
+    """
+    Returns:
+        dict: {'counters': {key: value}, 'summaries': {key: {count, sum, max}}}
+    """
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "summaries": {
+                key: {"count": count, "sum": total, "max": maximum}
+                for key, (count, total, maximum) in _summaries.items()
+            },
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _summaries.clear()
@@ -0,0 +1,291 @@
+"""
+Production profiling: named timing spans, an on-demand stack sampler and
+capture of slow requests.
+
+Spans time the hot-path calls (keyword and Assistant replies, Graph API
+sends, thread-store shelve calls). Functions are wrapped once with
+`@timed(name)`; while spans are disabled the wrapper costs one global check
+before calling through (see `python -m benchmarks.profiling`). Enabled
+spans are recorded as `span_seconds{span=...}` summaries on /metrics
+(PROFILE_SPANS) and in the capture of the request they ran in.
+
+`sample_stacks()` samples the Python stacks of every thread for a few
+seconds and returns them in the collapsed format of flame graph tools
+(`frame;frame;frame count`); nothing runs until it is called (admin
+endpoint POST /profile). With PROFILE_SLOW_REQUEST_MS set, each webhook
+request is captured by a RequestProfiler: its spans, and stacks of its
+thread sampled while it ran; requests slower than the threshold are kept
+for GET /profile/slow.
+"""
+import collections
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+
+from app.utils import metrics
+
+# Checked by every @timed call: False means spans cost nothing else
+_recording = False
+# Also record spans as span_seconds summaries on /metrics
+_to_metrics = False
+# The capture of the request the current thread or task is handling
+_capture = contextvars.ContextVar("profile_capture", default=None)
+
+# Only one on-demand sampling session runs at a time
+_sampling = threading.Lock()
+
+
+def enable_spans(to_metrics=False):
+    """
+    Start recording spans.
+
+    Args:
+        to_metrics (bool): Record every span in the span_seconds summaries,
+            not only in request captures
+    """
+    global _recording, _to_metrics
+    _to_metrics = to_metrics
+    _recording = True
+
+
+def disable_spans():
+    global _recording, _to_metrics
+    _recording = False
+    _to_metrics = False
+
+
+def _record(name, started, seconds):
+    if _to_metrics:
+        metrics.observe("span_seconds", seconds, span=name)
+    capture = _capture.get()
+    if capture is not None:
+        capture.spans.append((name, started - capture.started, seconds))
+
+
+@contextlib.contextmanager
+def span(name):
+    """Time the body of the `with` block as span `name`."""
+    if not _recording:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, started, time.perf_counter() - started)
+
+
+def timed(name):
+    """
+    Decorator timing each call of a function (or coroutine function) as span `name`.
+    """
+
+    def decorate(f):
+        if inspect.iscoroutinefunction(f):
+
+            @functools.wraps(f)
+            async def async_wrapper(*args, **kwargs):
+                if not _recording:
+                    return await f(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return await f(*args, **kwargs)
+                finally:
+                    _record(name, started, time.perf_counter() - started)
+
+            return async_wrapper
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not _recording:
+                return f(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                _record(name, started, time.perf_counter() - started)
+
+        return wrapper
+
+    return decorate
+
+
+# Stack sampling
+
+
+def collapse_stack(frame, root=None):
+    """
+    Returns:
+        str: The stack ending at `frame`, outermost call first, as
+            'file:function;file:function;...' (prefixed with `root` if given)
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}")
+        frame = frame.f_back
+    if root is not None:
+        names.append(root)
+    names.reverse()
+    return ";".join(names)
+
+
+def sample_stacks(seconds, interval=0.005):
+    """
+    Sample the stacks of every other thread for `seconds`.
+
+    Args:
+        seconds (float): Sampling duration
+        interval (float): Seconds between samples
+
+    Returns:
+        collections.Counter: Collapsed stack (rooted at the thread name) -> samples
+
+    Raises:
+        RuntimeError: If another sampling session is running
+    """
+    if not _sampling.acquire(blocking=False):
+        raise RuntimeError("A profile is already being taken")
+    try:
+        own = threading.get_ident()
+        stacks = collections.Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    stacks[collapse_stack(frame, names.get(ident, str(ident)))] += 1
+            time.sleep(interval)
+        metrics.increment("profiles_taken")
+        return stacks
+    finally:
+        _sampling.release()
+
+
+def format_collapsed(stacks):
+    """Render sampled stacks as collapsed-stack lines, most samples first."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+# Slow requests
+
+
+class _Capture:
+    __slots__ = ("started", "spans", "thread", "stacks")
+
+    def __init__(self, thread):
+        self.started = time.perf_counter()
+        self.spans = []
+        self.thread = thread
+        self.stacks = collections.Counter() if thread is not None else None
+
+
+class RequestProfiler:
+    """
+    Captures the spans (and sampled stacks) of each request and keeps the slow ones.
+
+    Args:
+        threshold (float): Seconds above which a request is kept
+        keep (int): Slow requests kept, newest last
+        interval (float): Seconds between stack samples of the threads handling requests
+    """
+
+    def __init__(self, threshold, keep=50, interval=0.01):
+        self.threshold = threshold
+        self.interval = interval
+        self.slow = collections.deque(maxlen=keep)
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread = threading.Thread(target=self._sample_loop, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def begin(self, sample=True):
+        """
+        Start capturing the current request.
+
+        Args:
+            sample (bool): Sample the current thread's stack while the request
+                runs (not for requests sharing an event loop thread)
+
+        Returns:
+            tuple: Token for end()
+        """
+        capture = _Capture(threading.get_ident() if sample else None)
+        if sample:
+            with self._lock:
+                self._watched[capture.thread] = capture
+                self._wake.notify()
+        return capture, _capture.set(capture)
+
+    def end(self, token, label):
+        """
+        Stop capturing; keep the request if it was slow.
+
+        Returns:
+            float: The request's duration in seconds
+        """
+        capture, reset = token
+        duration = time.perf_counter() - capture.started
+        _capture.reset(reset)
+        if capture.thread is not None:
+            with self._lock:
+                self._watched.pop(capture.thread, None)
+        if duration >= self.threshold:
+            metrics.increment("slow_requests")
+            logging.warning(f"Slow request {label}: {duration * 1000:.0f} ms")
+            self.slow.append({
+                "at": time.time(),
+                "label": label,
+                "duration_ms": round(duration * 1000, 2),
+                "spans": [
+                    {"name": name, "start_ms": round(start * 1000, 2), "ms": round(seconds * 1000, 2)}
+                    for name, start, seconds in capture.spans
+                ],
+                "stacks": format_collapsed(capture.stacks) if capture.stacks else "",
+            })
+        return duration
+
+    def _sample_loop(self):
+        while True:
+            # Under the lock: end() reads a capture's stacks once it is unwatched
+            with self._lock:
+                while not self._watched:
+                    self._wake.wait()
+                frames = sys._current_frames()
+                for ident, capture in self._watched.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        capture.stacks[collapse_stack(frame)] += 1
+                del frames
+            time.sleep(self.interval)
+
+    def recent(self):
+        """
+        Returns:
+            list: The slow requests kept, newest first
+        """
+        return list(reversed(self.slow))
+
+
+def init_profiler(app):
+    """
+    Enable spans (PROFILE_SPANS) and slow-request capture (PROFILE_SLOW_REQUEST_MS).
+    """
+    threshold_ms = app.config.get("PROFILE_SLOW_REQUEST_MS") or 0
+    if app.config.get("PROFILE_SPANS"):
+        enable_spans(to_metrics=True)
+    if threshold_ms <= 0:
+        return None
+    if not _recording:
+        enable_spans()
+    profiler = RequestProfiler(threshold_ms / 1000, keep=app.config["PROFILE_SLOW_REQUEST_KEEP"])
+    app.extensions["profiler"] = profiler
+    logging.info(f"Capturing requests slower than {threshold_ms} ms")
+    return profiler
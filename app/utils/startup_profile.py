@@ -0,0 +1,51 @@
+"""
+Startup profile: where the time of `create_app()` goes.
+
+Each phase (configuration, logging, every service, the warm-up) is timed and
+the breakdown is logged once the app is built. It is also kept in
+`app.extensions["startup_profile"]` and served by the admin endpoint
+/startup. For the import-time breakdown of a cold start, run
+`python -m benchmarks.startup`.
+"""
+import contextlib
+import threading
+import time
+
+
+class StartupProfile:
+    """Ordered phase timings, thread-safe (the warm-up may run in the background)."""
+
+    def __init__(self):
+        self.phases = []
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.phases.append((name, seconds))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the body of the `with` block as phase `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def as_dict(self):
+        """
+        Returns:
+            dict: total_ms and the phases in order, in milliseconds
+        """
+        with self._lock:
+            phases = list(self.phases)
+        return {
+            "total_ms": round(sum(seconds for name, seconds in phases if not name.startswith("warm_up.")) * 1000, 2),
+            "phases": [{"name": name, "ms": round(seconds * 1000, 2)} for name, seconds in phases],
+        }
+
+    def format(self):
+        profile = self.as_dict()
+        slowest = sorted(profile["phases"], key=lambda p: p["ms"], reverse=True)[:5]
+        breakdown = ", ".join(f"{p['name']} {p['ms']} ms" for p in slowest)
+        return f"App started in {profile['total_ms']} ms ({breakdown})"
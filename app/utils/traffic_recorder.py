@@ -0,0 +1,238 @@
+"""
+Webhook traffic recorder for performance regression testing.
+
+Writes each accepted webhook request (body, selected headers and arrival time)
+to gzip-compressed JSONL segments that are rotated by record count. Phone
+numbers, profile names and message ids are pseudonymized before anything
+touches disk.
+Records are handed to a background writer thread so recording never adds
+disk I/O to the webhook response.
+"""
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+# Headers worth keeping to reproduce the request shape. The signature is left
+# out: it no longer matches once the body is pseudonymized, replay re-signs.
+RECORDED_HEADERS = ("Content-Type", "User-Agent")
+
+# Keys holding phone numbers anywhere in a webhook body
+PHONE_KEYS = frozenset({"wa_id", "from", "recipient_id", "input", "to", "phone", "display_phone_number"})
+
+# Keys holding people's names (sender profiles and shared contact cards)
+NAME_KEYS = frozenset({"name", "formatted_name", "first_name", "last_name", "middle_name"})
+
+# Message ids (of messages, statuses and quoted messages) base64-encode the
+# customer's phone number. Other "id" values (media, button replies, the
+# business account) are kept: replay needs them.
+MESSAGE_ID_PREFIX = "wamid."
+
+
+class Pseudonymizer:
+    """
+    Replace phone numbers, names and message ids with stable pseudonyms.
+
+    The same input always maps to the same pseudonym for a given key, so a
+    recorded conversation keeps its shape (who talked to whom, how often).
+
+    Args:
+        key (bytes): Secret key for the keyed hash
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    def _digest(self, value):
+        return hmac.new(self.key, value.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def phone(self, value):
+        """Map a phone number to a fake one with the same number of digits."""
+        digits = str(int(self._digest(value)[:16], 16))
+        return ("9" + digits)[: max(len(value), 6)]
+
+    def name(self, value):
+        return f"Cliente {self._digest(value)[:6]}"
+
+    def message_id(self, value):
+        """Map a message id to a fake one; a status keeps the id of its message."""
+        length = min(max(len(value) - len(MESSAGE_ID_PREFIX), 16), 64)
+        return MESSAGE_ID_PREFIX + self._digest(value)[:length]
+
+    def scrub(self, node):
+        """
+        Recursively pseudonymize a parsed webhook body in place.
+
+        Args:
+            node: A dict/list from a parsed webhook body
+
+        Returns:
+            The same node, pseudonymized
+        """
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if isinstance(value, str):
+                    if key in PHONE_KEYS:
+                        node[key] = self.phone(value)
+                    elif key in NAME_KEYS:
+                        node[key] = self.name(value)
+                    elif key == "id" and value.startswith(MESSAGE_ID_PREFIX):
+                        node[key] = self.message_id(value)
+                else:
+                    self.scrub(value)
+        elif isinstance(node, list):
+            for item in node:
+                self.scrub(item)
+        return node
+
+
+class TrafficRecorder:
+    """
+    Record webhook requests to rotated, compressed JSONL segments.
+
+    Args:
+        directory (str): Where segments are written
+        pseudonym_key (bytes): Key for the pseudonymizer
+        segment_records (int): Records per segment before rotating
+        max_pending (int): Records buffered in memory before new ones are dropped
+    """
+
+    def __init__(self, directory, pseudonym_key, segment_records=10000, max_pending=10000):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.pseudonymizer = Pseudonymizer(pseudonym_key)
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._segment = None
+        self._segment_count = 0
+        self._sequence = 0
+        os.makedirs(directory, exist_ok=True)
+        self._writer = threading.Thread(target=self._run, name="traffic-recorder", daemon=True)
+        self._writer.start()
+
+    def record(self, body, headers, arrival_time=None):
+        """
+        Queue a request for recording. Never blocks the caller.
+
+        Args:
+            body (bytes): The raw request body
+            headers: The request headers (any mapping with .get)
+            arrival_time (float): Epoch seconds, defaults to now
+        """
+        entry = (
+            arrival_time or time.time(),
+            {name: headers.get(name) for name in RECORDED_HEADERS if headers.get(name)},
+            body,
+        )
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout=5.0):
+        """Wait until every queued record has been written."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if self._segment is not None:
+            self._segment.flush()
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._writer.join(timeout=5)
+
+    def _open_segment(self):
+        if self._segment is not None:
+            self._segment.close()
+        self._sequence += 1
+        name = f"webhooks-{time.strftime('%Y%m%dT%H%M%S')}-{self._sequence:04d}.jsonl.gz"
+        self._segment = gzip.open(os.path.join(self.directory, name), "at", encoding="utf-8")
+        self._segment_count = 0
+
+    def _encode(self, arrival_time, headers, body):
+        try:
+            parsed = json.loads(body)
+            body_text = json.dumps(self.pseudonymizer.scrub(parsed), separators=(",", ":"), ensure_ascii=False)
+        except ValueError:
+            # Not JSON, nothing we can safely scrub
+            body_text = None
+        return json.dumps({"t": arrival_time, "headers": headers, "body": body_text}, ensure_ascii=False)
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            try:
+                if entry is None:
+                    if self._segment is not None:
+                        self._segment.close()
+                        self._segment = None
+                    return
+                if self._segment is None or self._segment_count >= self.segment_records:
+                    self._open_segment()
+                self._segment.write(self._encode(*entry) + "\n")
+                self._segment_count += 1
+                if self._queue.empty():
+                    self._segment.flush()
+            except Exception as e:
+                logging.error(f"Failed to record webhook: {e}")
+            finally:
+                self._queue.task_done()
+
+
+def read_segments(paths):
+    """
+    Yield recorded entries from segment files or directories, in order.
+
+    A segment that was being written when the process died may end in a
+    truncated gzip block; everything before the truncation is still yielded.
+
+    Args:
+        paths (list): Segment files and/or directories containing segments
+
+    Yields:
+        dict: Entries with keys 't', 'headers' and 'body'
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name) for name in os.listdir(path) if name.endswith(".jsonl.gz")
+            )
+        else:
+            files.append(path)
+
+    for file_path in sorted(files):
+        with gzip.open(file_path, "rt", encoding="utf-8") as f:
+            try:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        entry = json.loads(line)
+                        if entry.get("body") is not None:
+                            yield entry
+            except (EOFError, ValueError) as e:
+                logging.warning(f"Segment {file_path} is truncated: {e}")
+
+
+def init_traffic_recorder(app):
+    """
+    Create the recorder when WEBHOOK_RECORD_DIR is configured.
+    """
+    directory = app.config.get("WEBHOOK_RECORD_DIR")
+    if not directory:
+        return None
+    secret = app.config.get("WEBHOOK_RECORD_KEY") or app.config.get("APP_SECRET") or ""
+    recorder = TrafficRecorder(
+        directory,
+        pseudonym_key=hashlib.sha256(b"pseudonym:" + secret.encode("utf-8")).digest(),
+        segment_records=app.config["WEBHOOK_RECORD_SEGMENT_RECORDS"],
+    )
+    app.extensions["traffic_recorder"] = recorder
+    logging.info(f"Recording webhook traffic to {directory}")
+    return recorder
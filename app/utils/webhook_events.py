@@ -0,0 +1,311 @@
+"""
+Parse-once model for WhatsApp webhook bodies.
+
+`parse_webhook` walks a webhook body a single time and turns it into compact
+event objects (text, media, interactive, contacts, status). Handlers work on
+these objects instead of indexing `body["entry"][0]["changes"][0]["value"]`
+over and over. Malformed parts of a body are skipped instead of raising.
+"""
+
+# Message types that carry a media object under the key of the same name
+MEDIA_TYPES = frozenset({"image", "audio", "video", "document", "sticker", "voice"})
+
+
+class MessageEvent:
+    """
+    Base class for inbound messages.
+
+    Attributes:
+        message_id (str): WhatsApp message id (wamid...)
+        wa_id (str): Sender's WhatsApp ID
+        name (str): Sender's profile name, if known
+        timestamp (int): Unix time the message was sent
+        type (str): WhatsApp message type ('text', 'image', ...)
+        phone_number_id (str): Our business phone number that received it
+    """
+
+    __slots__ = ("message_id", "wa_id", "name", "timestamp", "type", "phone_number_id")
+
+    def __init__(self, message_id, wa_id, name, timestamp, type, phone_number_id):
+        self.message_id = message_id
+        self.wa_id = wa_id
+        self.name = name
+        self.timestamp = timestamp
+        self.type = type
+        self.phone_number_id = phone_number_id
+
+    @property
+    def text(self):
+        """Text to answer with the keyword engine, or None if there is none."""
+        return None
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.message_id} from {self.wa_id}>"
+
+
+class TextEvent(MessageEvent):
+    __slots__ = ("body",)
+
+    def __init__(self, body, **common):
+        super().__init__(**common)
+        self.body = body
+
+    @property
+    def text(self):
+        return self.body
+
+
+class MediaEvent(MessageEvent):
+    """An image, audio, video, document, sticker or voice note."""
+
+    __slots__ = ("media_id", "mime_type", "sha256", "caption", "filename")
+
+    def __init__(self, media_id, mime_type=None, sha256=None, caption=None, filename=None, **common):
+        super().__init__(**common)
+        self.media_id = media_id
+        self.mime_type = mime_type
+        self.sha256 = sha256
+        self.caption = caption
+        self.filename = filename
+
+
+class InteractiveEvent(MessageEvent):
+    """A reply to a button or list message, or a template quick-reply button."""
+
+    __slots__ = ("reply_id", "title")
+
+    def __init__(self, reply_id, title, **common):
+        super().__init__(**common)
+        self.reply_id = reply_id
+        self.title = title
+
+    @property
+    def text(self):
+        return self.title
+
+
+class ContactEvent(MessageEvent):
+    """One or more contact cards shared by the user."""
+
+    __slots__ = ("contacts",)
+
+    def __init__(self, contacts, **common):
+        super().__init__(**common)
+        self.contacts = contacts
+
+
+class UnsupportedEvent(MessageEvent):
+    """Any other message type (location, reaction, unsupported, ...)."""
+
+    __slots__ = ()
+
+
+class StatusEvent:
+    """
+    A delivery status update for a message we sent.
+
+    Attributes:
+        message_id (str): Id of our outbound message
+        recipient_id (str): WhatsApp ID of the recipient
+        status (str): 'sent', 'delivered', 'read' or 'failed'
+        timestamp (int): Unix time of the status change
+        phone_number_id (str): Our business phone number that sent it
+    """
+
+    __slots__ = ("message_id", "recipient_id", "status", "timestamp", "phone_number_id")
+
+    def __init__(self, message_id, recipient_id, status, timestamp, phone_number_id):
+        self.message_id = message_id
+        self.recipient_id = recipient_id
+        self.status = status
+        self.timestamp = timestamp
+        self.phone_number_id = phone_number_id
+
+    def __repr__(self):
+        return f"<StatusEvent {self.message_id} {self.status}>"
+
+
+class WebhookBatch:
+    """
+    Every event found in one webhook body.
+
+    Attributes:
+        object (str): The webhook object type ('whatsapp_business_account')
+        messages (list): MessageEvent instances, in body order
+        statuses (list): StatusEvent instances, in body order
+        skipped (int): Number of malformed parts that were ignored
+    """
+
+    __slots__ = ("object", "messages", "statuses", "skipped")
+
+    def __init__(self, object=None):
+        self.object = object
+        self.messages = []
+        self.statuses = []
+        self.skipped = 0
+
+    @property
+    def is_status_only(self):
+        return bool(self.statuses) and not self.messages
+
+    @property
+    def phone_number_id(self):
+        """Our business phone number the body is for (of its first event), or None."""
+        for events in (self.messages, self.statuses):
+            if events:
+                return events[0].phone_number_id
+        return None
+
+
+def _timestamp(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        return 0
+
+
+def _string(value):
+    # Ids and titles are used as dict keys and sent back in replies
+    return value if isinstance(value, str) else None
+
+
+def _parse_message(message, names, phone_number_id):
+    wa_id = message.get("from")
+    message_type = _string(message.get("type"))
+    if not wa_id or not isinstance(wa_id, str):
+        return None
+
+    common = {
+        "message_id": _string(message.get("id")),
+        "wa_id": wa_id,
+        "name": names.get(wa_id),
+        "timestamp": _timestamp(message.get("timestamp")),
+        "type": message_type,
+        "phone_number_id": phone_number_id,
+    }
+
+    text = message.get("text")
+    if isinstance(text, dict) and isinstance(text.get("body"), str):
+        common["type"] = message_type or "text"
+        return TextEvent(text["body"], **common)
+
+    if message_type in MEDIA_TYPES:
+        media = message.get(message_type)
+        if isinstance(media, dict) and _string(media.get("id")):
+            return MediaEvent(
+                media["id"],
+                mime_type=_string(media.get("mime_type")),
+                sha256=_string(media.get("sha256")),
+                caption=_string(media.get("caption")),
+                filename=_string(media.get("filename")),
+                **common,
+            )
+        return None
+
+    if message_type == "interactive":
+        interactive = message.get("interactive")
+        if not isinstance(interactive, dict):
+            return None
+        reply = interactive.get("button_reply") or interactive.get("list_reply")
+        if isinstance(reply, dict):
+            return InteractiveEvent(_string(reply.get("id")), _string(reply.get("title")), **common)
+        return None
+
+    if message_type == "button":
+        button = message.get("button")
+        if isinstance(button, dict):
+            return InteractiveEvent(_string(button.get("payload")), _string(button.get("text")), **common)
+        return None
+
+    if message_type == "contacts":
+        contacts = message.get("contacts")
+        if isinstance(contacts, list):
+            return ContactEvent(contacts, **common)
+        return None
+
+    return UnsupportedEvent(**common)
+
+
+def _parse_status(status, phone_number_id):
+    message_id = _string(status.get("id"))
+    state = _string(status.get("status"))
+    if not message_id or not state:
+        return None
+    return StatusEvent(
+        message_id,
+        _string(status.get("recipient_id")),
+        state,
+        _timestamp(status.get("timestamp")),
+        phone_number_id,
+    )
+
+
+def _list(value):
+    return value if isinstance(value, list) else ()
+
+
+def parse_webhook(body):
+    """
+    Parse a webhook body into events in a single traversal.
+
+    Never raises on malformed input: anything that does not look like a
+    message or a status is counted in `skipped` and ignored.
+
+    Args:
+        body (dict): The decoded webhook JSON
+
+    Returns:
+        WebhookBatch: The parsed events
+    """
+    if not isinstance(body, dict):
+        batch = WebhookBatch()
+        batch.skipped = 1
+        return batch
+
+    batch = WebhookBatch(body.get("object"))
+    entries = body.get("entry")
+    if not isinstance(entries, list):
+        return batch
+
+    for entry in entries:
+        changes = entry.get("changes") if isinstance(entry, dict) else None
+        if not isinstance(changes, list):
+            batch.skipped += 1
+            continue
+        for change in changes:
+            value = change.get("value") if isinstance(change, dict) else None
+            if not isinstance(value, dict):
+                batch.skipped += 1
+                continue
+
+            metadata = value.get("metadata")
+            phone_number_id = _string(metadata.get("phone_number_id")) if isinstance(metadata, dict) else None
+
+            names = {}
+            for contact in _list(value.get("contacts")):
+                wa_id = contact.get("wa_id") if isinstance(contact, dict) else None
+                if isinstance(wa_id, str):
+                    profile = contact.get("profile")
+                    names[wa_id] = _string(profile.get("name")) if isinstance(profile, dict) else None
+
+            messages = value.get("messages")
+            if messages is not None and not isinstance(messages, list):
+                batch.skipped += 1
+            for message in _list(messages):
+                event = _parse_message(message, names, phone_number_id) if isinstance(message, dict) else None
+                if event is None:
+                    batch.skipped += 1
+                else:
+                    batch.messages.append(event)
+
+            statuses = value.get("statuses")
+            if statuses is not None and not isinstance(statuses, list):
+                batch.skipped += 1
+            for status in _list(statuses):
+                event = _parse_status(status, phone_number_id) if isinstance(status, dict) else None
+                if event is None:
+                    batch.skipped += 1
+                else:
+                    batch.statuses.append(event)
+
+    return batch
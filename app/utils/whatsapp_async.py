@@ -0,0 +1,243 @@
+"""
+Async versions of the Graph API calls and the reply flow, used by the async
+serving mode (app/async_app.py).
+
+The message bodies, welcome flow, media handling and keyword replies are
+the ones of whatsapp_utils; only the waiting is different. Graph API calls
+go through one aiohttp session per app, so a slow reply holds no thread.
+Callers run inside the Flask app context of the app that owns the session.
+"""
+import asyncio
+import logging
+
+import aiohttp
+from flask import current_app, g
+
+from app.services.tenants import current_tenant, use_tenant
+from app.utils import metrics
+from app.utils.profiling import timed
+from app.utils.message_handlers import should_send_welcome
+from app.utils.webhook_events import MediaEvent, WebhookBatch, parse_webhook
+from app.utils.whatsapp_utils import (
+    acknowledge_media,
+    flush_replies,
+    get_keyword_responder,
+    get_messages_request,
+    get_read_receipt_input,
+    get_sender,
+    get_session,
+    get_text_message_input,
+    get_welcome_messages,
+)
+
+
+def get_async_graph_session():
+    """
+    Returns:
+        aiohttp.ClientSession: The app's Graph API session (see async_app.graph_session_ctx)
+    """
+    return current_app.extensions["async_graph_session"]
+
+
+@timed("send_message")
+async def post_message_async(data):
+    """
+    Send a message through the Graph API.
+
+    Args:
+        data (str): JSON body for the messages endpoint
+
+    Returns:
+        str: Id of the sent message (None for read receipts)
+
+    Raises:
+        aiohttp.ClientError: If the request fails or is rejected
+        asyncio.TimeoutError: If the Graph API does not answer in 10 seconds
+    """
+    phone_number_id, access_token = get_sender()
+    tenant = current_tenant()
+    if tenant is not None and tenant.limiter is not None:
+        # The token bucket sleeps; keep it off the event loop
+        await asyncio.to_thread(tenant.limiter.acquire)
+    metrics.increment("tenant_sends", tenant=phone_number_id)
+
+    url, headers = get_messages_request(phone_number_id, access_token)
+
+    async with get_async_graph_session().post(
+        url, data=data, headers=headers, timeout=aiohttp.ClientTimeout(total=10)
+    ) as response:
+        body = await response.text()
+        logging.info(f"Status: {response.status}")
+        logging.info(f"Body: {body}")
+        if response.status >= 400:
+            logging.error(f"WhatsApp API Error Response: {body}")
+        response.raise_for_status()
+        messages = (await response.json(content_type=None)).get("messages") or [{}]
+    return messages[0].get("id")
+
+
+@timed("send_read_receipt")
+async def send_read_receipt_async(message_id):
+    """
+    Async send_read_receipt: no send-rate tokens, send metrics or send span.
+
+    Returns:
+        bool: True if the Graph API accepted it (failures are logged, never raised)
+    """
+    url, headers = get_messages_request(*get_sender())
+    try:
+        async with get_async_graph_session().post(
+            url, data=get_read_receipt_input(message_id), headers=headers, timeout=aiohttp.ClientTimeout(total=10)
+        ) as response:
+            response.raise_for_status()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logging.warning(f"Failed to send the read receipt for {message_id}: {e}")
+        metrics.increment("read_receipts", result="error")
+        return False
+    metrics.increment("read_receipts", result="ok")
+    return True
+
+
+async def send_message_async(data):
+    """
+    Async send_message: failures are logged, never raised.
+
+    Returns:
+        str: Id of the sent message, or None if sending failed
+    """
+    try:
+        return await post_message_async(data)
+    except asyncio.TimeoutError:
+        logging.error("Timeout occurred while sending message")
+    except aiohttp.ClientError as e:
+        logging.error(f"Request failed due to: {e}")
+    return None
+
+
+async def deliver_message_async(recipient, data):
+    """
+    Async deliver_message: through the durable outbox if there is one.
+
+    The outbox commit blocks briefly (group commit), so it runs on a worker
+    thread instead of the event loop.
+
+    Returns:
+        The outbox row id (None while its commit is pending or the text waits
+        in the coalescer), or the sent message id when sent directly
+    """
+    coalescer = current_app.extensions.get("send_coalescer")
+    if coalescer is not None:
+        # Merged texts are sent by the coalescer's own (synchronous) path
+        tenant = current_tenant()
+        sender = tenant.phone_number_id if tenant is not None else None
+        return await asyncio.to_thread(coalescer.submit, recipient, data, sender)
+    outbox = current_app.extensions.get("outbox")
+    if outbox is not None:
+        tenant = current_tenant()
+        sender = tenant.phone_number_id if tenant is not None else None
+        try:
+            # None when the commit is slow: the message is still queued and
+            # will be sent, so it must not also go out directly
+            return await asyncio.to_thread(outbox.enqueue, recipient, data, sender=sender)
+        except RuntimeError:
+            # Shut down by a drain (a late follow-up) or the write failed
+            logging.error(f"Outbox unavailable, sending to {recipient} directly")
+    return await send_message_async(data)
+
+
+def start_typing_indicator_async(message_id):
+    """
+    Async start_typing_indicator.
+
+    Returns:
+        asyncio.Task: Cancel it once the reply is ready, or None if disabled
+    """
+    if not current_app.config.get("TYPING_INDICATOR") or not message_id:
+        return None
+
+    app = current_app._get_current_object()
+    tenant = current_tenant()
+    delay = current_app.config["TYPING_INDICATOR_DELAY"]
+
+    async def send_indicator():
+        await asyncio.sleep(delay)
+        with app.app_context():
+            g.tenant = tenant
+            await send_read_receipt_async(message_id)
+
+    return asyncio.ensure_future(send_indicator())
+
+
+@timed("process_whatsapp_message")
+async def process_whatsapp_message_async(body):
+    """
+    Reply to every inbound message in a webhook body.
+
+    Args:
+        body: The decoded webhook JSON or an already parsed WebhookBatch
+    """
+    batch = body if isinstance(body, WebhookBatch) else parse_webhook(body)
+    for event in batch.messages:
+        await reply_to_message_async(event)
+    if current_app.extensions.get("send_coalescer") is not None:
+        await asyncio.to_thread(flush_replies, batch)
+
+
+async def reply_to_message_async(event):
+    """
+    Async reply_to_message: same welcome flow, media acknowledgement and reply.
+
+    Args:
+        event (MessageEvent): The inbound message
+    """
+    wa_id = event.wa_id
+    tenant = use_tenant(event.phone_number_id)
+    metrics.increment("tenant_messages", tenant=event.phone_number_id or "default")
+
+    indicator = start_typing_indicator_async(event.message_id)
+    try:
+        if should_send_welcome(wa_id, tenant.greeted if tenant is not None else None):
+            logging.info(f"Sending welcome messages to new user: {wa_id}")
+            # A local header file may wait briefly for its upload (the worker
+            # thread runs in a copy of this context: same app and tenant)
+            template_data, welcome_data = await asyncio.to_thread(get_welcome_messages, wa_id)
+            if template_data is not None:
+                await deliver_message_async(wa_id, template_data)
+            await deliver_message_async(wa_id, welcome_data)
+
+        message_body = event.text
+        if isinstance(event, MediaEvent) and event.media_id:
+            response = acknowledge_media(event)
+        elif message_body is None:
+            logging.info(f"Received a {event.type} message from {wa_id}, no text to answer")
+            return
+        else:
+            response = await generate_reply_async(message_body, wa_id, event.name)
+    finally:
+        if indicator is not None:
+            indicator.cancel()
+
+    await deliver_message_async(wa_id, get_text_message_input(wa_id, response))
+
+
+async def generate_reply_async(message_body, wa_id, name):
+    """
+    Async generate_reply: keyword engine, or the Assistant under its latency budget.
+    """
+    keyword_reply = get_keyword_responder(get_session(wa_id))
+    responder = current_app.extensions.get("llm_responder")
+    if responder is None:
+        return keyword_reply(message_body)
+
+    app = current_app._get_current_object()
+    tenant = current_tenant()
+
+    async def send_follow_up(text):
+        with app.app_context():
+            g.tenant = tenant
+            await deliver_message_async(wa_id, get_text_message_input(wa_id, text))
+
+    return await responder.respond_async(
+        message_body, wa_id, name, deliver_late=lambda text: asyncio.ensure_future(send_follow_up(text)),
+        fast_fn=keyword_reply,
+    )
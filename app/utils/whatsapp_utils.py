@@ -1,16 +1,24 @@
 import logging
-from flask import current_app, jsonify
+from flask import current_app, g, jsonify
 import json
+import mimetypes
+import os
 import requests
 import re
-import time
+import threading
 
 # from app.services.openai_service import generate_response
+from app.services.sessions import session_key
+from app.services.tenants import current_tenant, get_media_manager, use_tenant
+from app.utils import metrics
+from app.utils.profiling import timed
 from app.utils.message_handlers import (
+    default_catalog,
     generate_response,
     get_welcome_message,
     should_send_welcome,
 )
+from app.utils.webhook_events import MediaEvent, WebhookBatch, parse_webhook
 
 
 def log_http_response(response):
@@ -31,7 +39,8 @@ def get_text_message_input(recipient, text):
     )
 
 
-def get_template_message_input(recipient, template_name, language_code="es", header_image_url=None):
+def get_template_message_input(recipient, template_name, language_code="es", header_image_url=None,
+                               header_image_id=None):
     template_data = {
         "messaging_product": "whatsapp",
         "to": recipient,
@@ -42,17 +51,16 @@ def get_template_message_input(recipient, template_name, language_code="es", hea
         },
     }
 
-    # Add header component if image URL is provided
-    if header_image_url:
+    # Add header component if an uploaded media id or image URL is provided
+    if header_image_id or header_image_url:
+        image = {"id": header_image_id} if header_image_id else {"link": header_image_url}
         template_data["template"]["components"] = [
             {
                 "type": "header",
                 "parameters": [
                     {
                         "type": "image",
-                        "image": {
-                            "link": header_image_url
-                        }
+                        "image": image
                     }
                 ]
             }
@@ -61,19 +69,157 @@ def get_template_message_input(recipient, template_name, language_code="es", hea
     return json.dumps(template_data)
 
 
-def send_message(data):
+def get_media_message_input(recipient, media_type, media_id=None, link=None, caption=None, filename=None):
+    """
+    Build an image, document, audio or video message.
+
+    Args:
+        recipient (str): WhatsApp ID of the recipient
+        media_type (str): 'image', 'document', 'audio' or 'video'
+        media_id (str): Id of uploaded media (preferred)
+        link (str): Public URL, used when there is no media id
+        caption (str): Caption (not supported for audio)
+        filename (str): File name shown for documents
+    """
+    media = {"id": media_id} if media_id else {"link": link}
+    if caption and media_type != "audio":
+        media["caption"] = caption
+    if filename and media_type == "document":
+        media["filename"] = filename
+    return json.dumps(
+        {
+            "messaging_product": "whatsapp",
+            "recipient_type": "individual",
+            "to": recipient,
+            "type": media_type,
+            media_type: media,
+        }
+    )
+
+
+def get_read_receipt_input(message_id, typing_indicator=True):
+    data = {
+        "messaging_product": "whatsapp",
+        "status": "read",
+        "message_id": message_id,
+    }
+    if typing_indicator:
+        # Shown until the reply arrives or for at most 25 seconds
+        data["typing_indicator"] = {"type": "text"}
+    return json.dumps(data)
+
+
+def get_graph_session():
+    """
+    Pooled HTTP session for Graph API calls, shared by every request of the app.
+
+    Returns:
+        requests.Session: Session reusing keep-alive connections
+    """
+    session = current_app.extensions.get("graph_session")
+    if session is None:
+        pool_size = current_app.config.get("GRAPH_POOL_SIZE", 20)
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session = current_app.extensions.setdefault("graph_session", session)
+    return session
+
+
+def get_sender():
+    """
+    Business phone number messages are sent from: the current tenant's, or
+    the app's own when no tenant applies.
+
+    Returns:
+        tuple: (phone number id, access token)
+    """
+    tenant = current_tenant()
+    if tenant is not None:
+        return tenant.phone_number_id, tenant.access_token or current_app.config["ACCESS_TOKEN"]
+    return current_app.config["PHONE_NUMBER_ID"], current_app.config["ACCESS_TOKEN"]
+
+
+def get_messages_request(phone_number_id, access_token):
+    """
+    Returns:
+        tuple: (URL, headers) of the messages endpoint of a phone number
+    """
     headers = {
         "Content-type": "application/json",
-        "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
+        "Authorization": f"Bearer {access_token}",
     }
+    url = f"{current_app.config['GRAPH_API_URL']}/{current_app.config['VERSION']}/{phone_number_id}/messages"
+    return url, headers
+
+
+@timed("send_message")
+def post_to_graph(data):
+    phone_number_id, access_token = get_sender()
+    tenant = current_tenant()
+    if tenant is not None and tenant.limiter is not None:
+        # The tenant's send_rate
+        tenant.limiter.acquire()
+    metrics.increment("tenant_sends", tenant=phone_number_id)
+
+    url, headers = get_messages_request(phone_number_id, access_token)
+
+    response = get_graph_session().post(
+        url, data=data, headers=headers, timeout=10
+    )  # 10 seconds timeout as an example
+    response.raise_for_status()  # Raises an HTTPError if the HTTP request returned an unsuccessful status code
+    return response
+
 
-    url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{current_app.config['PHONE_NUMBER_ID']}/messages"
+def post_message(data):
+    """
+    Send a message through the Graph API.
+
+    Args:
+        data (str): JSON body for the messages endpoint
+
+    Returns:
+        str: Id of the sent message (None for read receipts)
+
+    Raises:
+        requests.RequestException: If the request fails or is rejected
+    """
+    response = post_to_graph(data)
+    log_http_response(response)
+    messages = response.json().get("messages") or [{}]
+    return messages[0].get("id")
+
+
+@timed("send_read_receipt")
+def send_read_receipt(message_id):
+    """
+    Mark an inbound message as read and show the typing indicator.
 
+    Read receipts are not messages: they do not take the tenant's send-rate
+    tokens and are not counted or timed as sends.
+
+    Args:
+        message_id (str): The inbound message id
+
+    Returns:
+        bool: True if the Graph API accepted it (failures are logged, never raised)
+    """
+    url, headers = get_messages_request(*get_sender())
+    try:
+        response = get_graph_session().post(url, data=get_read_receipt_input(message_id), headers=headers, timeout=10)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        logging.warning(f"Failed to send the read receipt for {message_id}: {e}")
+        metrics.increment("read_receipts", result="error")
+        return False
+    metrics.increment("read_receipts", result="ok")
+    return True
+
+
+def send_message(data):
     try:
-        response = requests.post(
-            url, data=data, headers=headers, timeout=10
-        )  # 10 seconds timeout as an example
-        response.raise_for_status()  # Raises an HTTPError if the HTTP request returned an unsuccessful status code
+        response = post_to_graph(data)
     except requests.Timeout:
         logging.error("Timeout occurred while sending message")
         return jsonify({"status": "error", "message": "Request timed out"}), 408
@@ -91,6 +237,112 @@ def send_message(data):
         return response
 
 
+def deliver_message(recipient, data):
+    """
+    Send a message through the durable outbox, or directly if there is none.
+
+    The outbox retries failed sends and survives restarts; messages to the
+    same recipient keep their order. With a send coalescer, text messages
+    are first held back to be merged with the next ones to the recipient.
+
+    Args:
+        recipient (str): WhatsApp ID of the recipient
+        data (str): JSON body for the messages endpoint
+
+    Returns:
+        The outbox row id, or send_message's result when sent directly
+        (None while the text waits in the coalescer or the outbox commit)
+    """
+    coalescer = current_app.extensions.get("send_coalescer")
+    if coalescer is not None:
+        tenant = current_tenant()
+        return coalescer.submit(recipient, data, sender=tenant.phone_number_id if tenant is not None else None)
+    return deliver_now(recipient, data)
+
+
+def deliver_now(recipient, data):
+    """deliver_message without the coalescer."""
+    outbox = current_app.extensions.get("outbox")
+    if outbox is not None:
+        tenant = current_tenant()
+        try:
+            # None when the commit is slow: the message is still queued and
+            # will be sent, so it must not also go out directly
+            return outbox.enqueue(recipient, data, sender=tenant.phone_number_id if tenant is not None else None)
+        except RuntimeError:
+            # Shut down by a drain (a late follow-up) or the write failed
+            logging.error(f"Outbox unavailable, sending to {recipient} directly")
+    return send_message(data)
+
+
+def upload_media(source):
+    """
+    Upload a file to the Cloud API media endpoint.
+
+    Args:
+        source (str): Public URL or local file path
+
+    Returns:
+        str: The media id
+
+    Raises:
+        requests.RequestException: If fetching or uploading fails
+    """
+    session = get_graph_session()
+    if source.startswith(("http://", "https://")):
+        response = session.get(source, timeout=30)
+        response.raise_for_status()
+        content = response.content
+        mime_type = response.headers.get("Content-Type", "").split(";")[0] or None
+        filename = os.path.basename(source.split("?", 1)[0]) or "media"
+    else:
+        with open(source, "rb") as f:
+            content = f.read()
+        mime_type = None
+        filename = os.path.basename(source)
+    mime_type = mime_type or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    phone_number_id, access_token = get_sender()
+    url = f"{current_app.config['GRAPH_API_URL']}/{current_app.config['VERSION']}/{phone_number_id}/media"
+    response = session.post(
+        url,
+        headers={"Authorization": f"Bearer {access_token}"},
+        data={"messaging_product": "whatsapp", "type": mime_type},
+        files={"file": (filename, content, mime_type)},
+        timeout=60,
+    )
+    response.raise_for_status()
+    return response.json()["id"]
+
+
+def get_media_manager_for_sender():
+    """
+    Returns:
+        MediaManager: The media cache of the current tenant or the app, or None
+    """
+    tenant = current_tenant()
+    if tenant is not None:
+        # Media ids belong to the phone number that uploaded them
+        return get_media_manager(tenant)
+    return current_app.extensions.get("media_manager")
+
+
+def get_media_id(source, wait=True):
+    """
+    Media id for an outbound asset, uploaded once and cached.
+
+    Args:
+        source (str): Public URL or local file path of the asset
+        wait (bool): Wait for the upload on a cache miss, otherwise start it in the background
+
+    Returns:
+        str: The media id, or None if there is no media manager, the upload
+            failed or (without wait) it is still running
+    """
+    manager = get_media_manager_for_sender()
+    return manager.get_media_id(source, wait=wait) if manager is not None else None
+
+
 def process_text_for_whatsapp(text):
     # Remove brackets
     pattern = r"\【.*?\】"
@@ -109,60 +361,242 @@ def process_text_for_whatsapp(text):
     return whatsapp_style_text
 
 
+def start_typing_indicator(message_id):
+    """
+    Send the read receipt and typing indicator for a message in the background.
+
+    The call is delayed by TYPING_INDICATOR_DELAY so replies that are ready
+    sooner can cancel it and never pay for the extra request.
+
+    Args:
+        message_id (str): The inbound message id
+
+    Returns:
+        threading.Timer: Cancel it once the reply is ready, or None if disabled
+    """
+    if not current_app.config.get("TYPING_INDICATOR") or not message_id:
+        return None
+
+    app = current_app._get_current_object()
+    tenant = current_tenant()
+
+    def send_indicator():
+        with app.app_context():
+            g.tenant = tenant
+            send_read_receipt(message_id)
+
+    timer = threading.Timer(current_app.config["TYPING_INDICATOR_DELAY"], send_indicator)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+@timed("process_whatsapp_message")
 def process_whatsapp_message(body):
-    wa_id = body["entry"][0]["changes"][0]["value"]["contacts"][0]["wa_id"]
-    name = body["entry"][0]["changes"][0]["value"]["contacts"][0]["profile"]["name"]
+    """
+    Reply to every inbound message in a webhook body.
+
+    Args:
+        body: The decoded webhook JSON or an already parsed WebhookBatch
+    """
+    batch = body if isinstance(body, WebhookBatch) else parse_webhook(body)
+    for event in batch.messages:
+        reply_to_message(event)
+    flush_replies(batch)
+
+
+def flush_replies(batch):
+    """Send the replies to a webhook's senders held back by the coalescer."""
+    coalescer = current_app.extensions.get("send_coalescer")
+    if coalescer is None:
+        return
+    for wa_id in dict.fromkeys(event.wa_id for event in batch.messages):
+        coalescer.flush(wa_id)
+
+
+def reply_to_message(event):
+    """
+    Send the welcome flow to new users and a keyword reply to the message.
+    Media is downloaded in the background and acknowledged.
+
+    Args:
+        event (MessageEvent): The inbound message
+    """
+    wa_id = event.wa_id
+    # Credentials, messages and greeted users of the number that was written to
+    tenant = use_tenant(event.phone_number_id)
+    metrics.increment("tenant_messages", tenant=event.phone_number_id or "default")
+
+    # Mark as read and show "typing..." unless the reply is ready right away
+    indicator = start_typing_indicator(event.message_id)
+    try:
+        # Check if this is a new user and send welcome messages
+        if should_send_welcome(wa_id, tenant.greeted if tenant is not None else None):
+            logging.info(f"Sending welcome messages to new user: {wa_id}")
+            template_data, welcome_data = get_welcome_messages(wa_id)
+
+            if template_data is not None:
+                # Send template message first with header image
+                template_response = deliver_message(wa_id, template_data)
+
+                # Log template response for debugging
+                if template_response is None:
+                    logging.info(f"Template message for {wa_id} queued, commit pending")
+                elif isinstance(template_response, tuple):
+                    logging.error(f"Template message failed: {template_response}")
+                elif isinstance(template_response, int):
+                    logging.info(f"Template message queued in the outbox as {template_response}")
+                else:
+                    logging.info(
+                        f"Template message response: {template_response.status_code} - {template_response.text}"
+                    )
+
+            # Then send text welcome message with menu; messages to one
+            # recipient keep their order, so no pause holds this thread
+            deliver_message(wa_id, welcome_data)
+
+        message_body = event.text
+        if isinstance(event, MediaEvent) and event.media_id:
+            response = acknowledge_media(event)
+        elif message_body is None:
+            # Contacts, locations, ... have nothing for the keyword engine
+            logging.info(f"Received a {event.type} message from {wa_id}, no text to answer")
+            return
+        else:
+            # Generate response to user's message
+            response = generate_reply(message_body, wa_id, event.name)
+    finally:
+        if indicator is not None:
+            indicator.cancel()
 
-    message = body["entry"][0]["changes"][0]["value"]["messages"][0]
-    message_body = message["text"]["body"]
+    data = get_text_message_input(wa_id, response)
+    deliver_message(wa_id, data)
+
+
+def get_welcome_messages(wa_id):
+    """
+    Build the welcome flow for a new user.
 
-    # Check if this is a new user and send welcome messages
-    if should_send_welcome(wa_id):
-        logging.info(f"Sending welcome messages to new user: {wa_id}")
+    The template's header image is uploaded once and referenced by id. The
+    reply does not wait for an upload of a public URL: until it is done (or
+    if it failed) the header uses the link. A local file has no link, so its
+    upload is waited for up to WELCOME_HEADER_WAIT seconds; if there is still
+    no media id the template is skipped, since the Graph API rejects it
+    without its header.
 
-        # Send template message first with header image
-        header_image_url = "https://www.rizosafrosymas.com/_next/image?url=%2Fram1.jpg&w=2048&q=75"
+    Args:
+        wa_id (str): WhatsApp ID of the user
+
+    Returns:
+        tuple: (template message body or None, welcome text message body)
+    """
+    tenant = current_tenant()
+    header_image = (tenant and tenant.welcome_header_image) or current_app.config["WELCOME_HEADER_IMAGE"]
+    header_image_url = header_image if header_image.startswith(("http://", "https://")) else None
+    header_image_id = get_media_id(header_image, wait=False) if header_image else None
+    # Without a link to fall back on, the header needs the media id
+    needs_id = bool(header_image) and header_image_url is None
+    manager = get_media_manager_for_sender()
+    if needs_id and header_image_id is None and manager is not None:
+        header_image_id = manager.wait_for(header_image, current_app.config.get("WELCOME_HEADER_WAIT", 5.0))
+
+    template_data = None
+    if needs_id and header_image_id is None:
+        logging.warning(f"No media id for the welcome header {header_image}, skipping the template for {wa_id}")
+        metrics.increment("welcome_template_skipped")
+    else:
         template_data = get_template_message_input(
             wa_id,
-            "mensaje_de_bienvenida",
-            header_image_url=header_image_url
+            (tenant and tenant.welcome_template) or "mensaje_de_bienvenida",
+            header_image_url=header_image_url,
+            header_image_id=header_image_id,
         )
-        template_response = send_message(template_data)
+    welcome_message = tenant.catalog.load("welcome.txt") if tenant is not None else get_welcome_message()
+    welcome_data = get_text_message_input(wa_id, welcome_message)
+    return template_data, welcome_data
 
-        # Log template response for debugging
-        if isinstance(template_response, tuple):
-            logging.error(f"Template message failed: {template_response}")
-        else:
-            logging.info(f"Template message response: {template_response.status_code} - {template_response.text}")
 
-        # Wait a bit to ensure template is delivered first
-        time.sleep(2)
+def acknowledge_media(event):
+    """
+    Queue an inbound photo, voice note or document for background download.
 
-        # Then send text welcome message with menu
-        welcome_message = get_welcome_message()
-        welcome_data = get_text_message_input(wa_id, welcome_message)
-        send_message(welcome_data)
+    Args:
+        event (MediaEvent): The inbound media message
 
-    # Generate response to user's message
-    response = generate_response(message_body)
+    Returns:
+        str: The acknowledgement to reply with
+    """
+    tenant = current_tenant()
+    downloader = current_app.extensions.get("media_downloader")
+    if downloader is not None:
+        downloader.submit(event.media_id, sha256=event.sha256, mime_type=event.mime_type,
+                          access_token=tenant.access_token if tenant is not None else None)
+    return (tenant.catalog if tenant is not None else default_catalog).load("media_recibido.txt")
 
-    # OpenAI Integration
-    # response = generate_response(message_body, wa_id, name)
-    # response = process_text_for_whatsapp(response)
 
-    data = get_text_message_input(wa_id, response)
-    send_message(data)
+def generate_reply(message_body, wa_id, name):
+    """
+    Reply with the keyword engine, or with the OpenAI Assistant when
+    REPLY_ENGINE is 'openai'. The Assistant runs under a latency budget: a
+    late answer falls back to the keyword reply and may follow up later.
+    """
+    keyword_reply = get_keyword_responder(get_session(wa_id))
+    responder = current_app.extensions.get("llm_responder")
+    if responder is None:
+        return keyword_reply(message_body)
+
+    app = current_app._get_current_object()
+    tenant = current_tenant()
+
+    def send_follow_up(text):
+        with app.app_context():
+            g.tenant = tenant
+            deliver_message(wa_id, get_text_message_input(wa_id, text))
+
+    return responder.respond(message_body, wa_id, name, deliver_late=send_follow_up, fast_fn=keyword_reply)
+
+
+def get_session(wa_id):
+    """
+    Returns:
+        Session: The user's conversation session (marked active), or None without a session store
+    """
+    store = current_app.extensions.get("sessions")
+    if store is None:
+        return None
+    return store.get(session_key(wa_id, current_tenant()))
+
+
+def get_keyword_responder(session=None):
+    """
+    Args:
+        session (Session): The user's session, for multi-step flows
+
+    Returns:
+        callable: (message_body) -> reply with the current tenant's keywords and messages
+    """
+    tenant = current_tenant()
+    if tenant is None:
+        if session is None:
+            return generate_response
+
+        def keyword_reply(message_body):
+            return generate_response(message_body, session=session)
+
+        return keyword_reply
+
+    def keyword_reply(message_body):
+        return generate_response(message_body, tenant.catalog, tenant.keywords, tenant.default_reply, session=session)
+
+    return keyword_reply
 
 
 def is_valid_whatsapp_message(body):
     """
     Check if the incoming webhook event has a valid WhatsApp message structure.
+
+    Args:
+        body: The decoded webhook JSON or an already parsed WebhookBatch
     """
-    return (
-        body.get("object")
-        and body.get("entry")
-        and body["entry"][0].get("changes")
-        and body["entry"][0]["changes"][0].get("value")
-        and body["entry"][0]["changes"][0]["value"].get("messages")
-        and body["entry"][0]["changes"][0]["value"]["messages"][0]
-    )
+    batch = body if isinstance(body, WebhookBatch) else parse_webhook(body)
+    return bool(batch.object and batch.messages)
@@ -1,10 +1,23 @@
 import logging
 import json
+import time
+from urllib.parse import urlsplit
 
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app
 
-from .decorators.security import signature_required
+from .decorators.admission import admission_controlled
+from .decorators.affinity import affinity_routed
+from .decorators.lifecycle import drain_aware
+from .decorators.profiling import profiled
+from .decorators.recording import traffic_recorded
+from .decorators.security import admin_required, signature_required
+from .services.thread_store import ThreadStore
+from .utils import metrics
+from .utils.profiling import format_collapsed, sample_stacks
+from .utils.ingestion import get_status_events, get_webhook_batch
 from .utils.whatsapp_utils import (
+    get_template_message_input,
+    get_text_message_input,
     process_whatsapp_message,
     is_valid_whatsapp_message,
 )
@@ -26,22 +39,22 @@ def handle_message():
     Returns:
         response: A tuple containing a JSON response and an HTTP status code.
     """
-    body = request.get_json()
-    # logging.info(f"request body: {body}")
-
-    # Check if it's a WhatsApp status update
-    if (
-        body.get("entry", [{}])[0]
-        .get("changes", [{}])[0]
-        .get("value", {})
-        .get("statuses")
-    ):
-        logging.info("Received a WhatsApp status update.")
-        return jsonify({"status": "ok"}), 200
-
     try:
-        if is_valid_whatsapp_message(body):
-            process_whatsapp_message(body)
+        # Check if it's a WhatsApp status update. Statuses are most of the
+        # traffic: read them from the raw bytes, store them in compact
+        # columns and acknowledge right away.
+        statuses = get_status_events()
+        if statuses is not None:
+            current_app.extensions["status_store"].add(statuses)
+            logging.debug("Recorded a WhatsApp status update.")
+            return jsonify({"status": "ok"}), 200
+
+        # Decoded once from the raw bytes and walked once; shared via flask.g
+        batch = get_webhook_batch()
+        # logging.info(f"request body: {get_webhook_body()}")
+
+        if is_valid_whatsapp_message(batch):
+            process_whatsapp_message(batch)
             return jsonify({"status": "ok"}), 200
         else:
             # if the request is not a WhatsApp API event, return an error
@@ -54,27 +67,74 @@ def handle_message():
         return jsonify({"status": "error", "message": "Invalid JSON provided"}), 400
 
 
-# Required webhook verifictaion for WhatsApp
-def verify():
-    # Parse params from the webhook verification request
-    mode = request.args.get("hub.mode")
-    token = request.args.get("hub.verify_token")
-    challenge = request.args.get("hub.challenge")
+def verify_subscription(mode, token, challenge, verify_token):
+    """
+    Check a webhook verification request (shared by the WSGI and async apps).
+
+    Args:
+        mode (str): The hub.mode parameter
+        token (str): The hub.verify_token parameter
+        challenge (str): The hub.challenge parameter
+        verify_token (str): The configured VERIFY_TOKEN
+
+    Returns:
+        tuple: (challenge string or error dict, HTTP status code)
+    """
     # Check if a token and mode were sent
     if mode and token:
         # Check the mode and token sent are correct
-        if mode == "subscribe" and token == current_app.config["VERIFY_TOKEN"]:
+        if mode == "subscribe" and token == verify_token:
             # Respond with 200 OK and challenge token from the request
             logging.info("WEBHOOK_VERIFIED")
             return challenge, 200
         else:
             # Responds with '403 Forbidden' if verify tokens do not match
             logging.info("VERIFICATION_FAILED")
-            return jsonify({"status": "error", "message": "Verification failed"}), 403
+            return {"status": "error", "message": "Verification failed"}, 403
     else:
         # Responds with '400 Bad Request' if verify tokens do not match
         logging.info("MISSING_PARAMETER")
-        return jsonify({"status": "error", "message": "Missing parameters"}), 400
+        return {"status": "error", "message": "Missing parameters"}, 400
+
+
+# Required webhook verifictaion for WhatsApp
+def verify():
+    # Parse params from the webhook verification request
+    result, status = verify_subscription(
+        request.args.get("hub.mode"),
+        request.args.get("hub.verify_token"),
+        request.args.get("hub.challenge"),
+        current_app.config["VERIFY_TOKEN"],
+    )
+    if isinstance(result, dict):
+        return jsonify(result), status
+    return result, status
+
+
+def readiness(lifecycle):
+    """
+    Readiness of an instance (shared by the WSGI and async apps).
+
+    Returns:
+        tuple: (state dict, 200 when ready to take traffic, else 503)
+    """
+    if lifecycle is None:
+        return {"state": "ready"}, 200
+    return lifecycle.stats(), 200 if lifecycle.ready else 503
+
+
+@webhook_blueprint.route("/health", methods=["GET"])
+def health_get():
+    # Liveness: the process answers, whatever its state
+    lifecycle = current_app.extensions.get("lifecycle")
+    return jsonify(lifecycle.stats() if lifecycle is not None else {"state": "ready"}), 200
+
+
+@webhook_blueprint.route("/ready", methods=["GET"])
+def ready_get():
+    # Readiness: 503 while warming up and once draining
+    result, status = readiness(current_app.extensions.get("lifecycle"))
+    return jsonify(result), status
 
 
 @webhook_blueprint.route("/webhook", methods=["GET"])
@@ -82,8 +142,166 @@ def webhook_get():
     return verify()
 
 @webhook_blueprint.route("/webhook", methods=["POST"])
+@drain_aware
+@profiled
 @signature_required
+@traffic_recorded
+@admission_controlled
+@affinity_routed
 def webhook_post():
     return handle_message()
 
 
+@webhook_blueprint.route("/metrics", methods=["GET"])
+@admin_required
+def metrics_get():
+    return jsonify(metrics.snapshot()), 200
+
+
+@webhook_blueprint.route("/profile", methods=["POST"])
+@admin_required
+def profile_post():
+    """
+    Sample the stacks of every thread for ?seconds= (default 10, at most 60),
+    every ?interval_ms= (default 5), and return them as collapsed stacks
+    (one 'frame;frame;frame count' line each), the input of flame graph tools.
+    """
+    try:
+        seconds = float(request.args.get("seconds", 10))
+        interval = float(request.args.get("interval_ms", 5)) / 1000
+    except ValueError:
+        seconds = interval = 0
+    if not 0 < seconds <= 60 or not 0 < interval <= 1:
+        return jsonify({"status": "error", "message": "seconds must be in (0, 60], interval_ms in (0, 1000]"}), 400
+    try:
+        stacks = sample_stacks(seconds, interval)
+    except RuntimeError as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+    return Response(format_collapsed(stacks), mimetype="text/plain")
+
+
+@webhook_blueprint.route("/profile/slow", methods=["GET"])
+@admin_required
+def profile_slow_get():
+    # Spans and sampled stacks of the slowest recent webhook requests, newest first
+    profiler = current_app.extensions.get("profiler")
+    if profiler is None:
+        return jsonify({"status": "error", "message": "Slow-request capture disabled (PROFILE_SLOW_REQUEST_MS)"}), 404
+    return jsonify(profiler.recent()), 200
+
+
+@webhook_blueprint.route("/threads", methods=["GET"])
+@admin_required
+def threads_get():
+    # Size of each user's Assistant thread, largest first
+    return jsonify(ThreadStore(current_app.config["OPENAI_THREADS_DB"]).stats()), 200
+
+
+@webhook_blueprint.route("/startup", methods=["GET"])
+@admin_required
+def startup_get():
+    # Where the time of create_app() went, warm-up included
+    return jsonify(current_app.extensions["startup_profile"].as_dict()), 200
+
+
+@webhook_blueprint.route("/tenants", methods=["GET"])
+@admin_required
+def tenants_get():
+    # Loaded tenants (most recently active last), loads and evictions
+    return jsonify(current_app.extensions["tenants"].stats()), 200
+
+
+@webhook_blueprint.route("/cluster", methods=["GET"])
+@admin_required
+def cluster_get():
+    # Ring members as this instance sees them (null when not clustered)
+    cluster = current_app.extensions.get("affinity")
+    return jsonify(cluster.stats() if cluster is not None else None), 200
+
+
+@webhook_blueprint.route("/cluster", methods=["PUT"])
+@admin_required
+def cluster_put():
+    # Replace the ring members, e.g. {"nodes": ["http://10.0.0.1:8000", ...]}
+    cluster = current_app.extensions.get("affinity")
+    if cluster is None:
+        return jsonify({"status": "error", "message": "Not clustered (CLUSTER_NODES)"}), 400
+    body = request.get_json(silent=True)
+    nodes = body.get("nodes") if isinstance(body, dict) else None
+    if not isinstance(nodes, list) or not nodes:
+        return jsonify({"status": "error", "message": "nodes must be a non-empty list of URLs"}), 400
+    invalid = [n for n in nodes if not is_node_url(n)]
+    if invalid:
+        return jsonify({"status": "error", "message": f"Not http(s) base URLs: {invalid}"}), 400
+    # Duplicates (also with a trailing slash) are one member
+    cluster.set_nodes(dict.fromkeys(n.rstrip("/") for n in nodes))
+    return jsonify(cluster.stats()), 200
+
+
+def is_node_url(node):
+    """Whether `node` is an http(s) base URL usable as a cluster member."""
+    if not isinstance(node, str):
+        return False
+    parsed = urlsplit(node)
+    return parsed.scheme in ("http", "https") and bool(parsed.netloc) and not (parsed.query or parsed.fragment)
+
+
+def get_scheduler():
+    scheduler = current_app.extensions.get("scheduler")
+    if scheduler is None:
+        return None, (jsonify({"status": "error", "message": "Scheduler disabled (SCHEDULER_PATH)"}), 404)
+    return scheduler, None
+
+
+@webhook_blueprint.route("/scheduled", methods=["POST"])
+@admin_required
+def scheduled_post():
+    """
+    Schedule a message, e.g. a reminder the day before a visit.
+
+    JSON body: "wa_id", "at" (unix time) or "delay" (seconds), "text" or
+    "template" (with optional "language"), and optionally "kind" (a label
+    to cancel by) and "phone_number_id" (the tenant to send from).
+    """
+    scheduler, error = get_scheduler()
+    if error:
+        return error
+    data = request.get_json(silent=True) or {}
+    wa_id = data.get("wa_id")
+    try:
+        due = float(data["at"]) if "at" in data else time.time() + float(data.get("delay", 0))
+    except (TypeError, ValueError):
+        due = None
+    if data.get("text"):
+        payload = get_text_message_input(wa_id, data["text"])
+    elif data.get("template"):
+        payload = get_template_message_input(wa_id, data["template"], data.get("language", "es"))
+    else:
+        payload = None
+    if not wa_id or due is None or payload is None:
+        return jsonify({"status": "error", "message": "wa_id, at or delay, and text or template are required"}), 400
+    job_id = scheduler.schedule(wa_id, payload, due, sender=data.get("phone_number_id"), kind=data.get("kind"))
+    return jsonify({"id": job_id, "due": due}), 201
+
+
+@webhook_blueprint.route("/scheduled", methods=["GET"])
+@admin_required
+def scheduled_get():
+    # A user's pending jobs with ?wa_id=, otherwise the totals
+    scheduler, error = get_scheduler()
+    if error:
+        return error
+    wa_id = request.args.get("wa_id")
+    if wa_id:
+        return jsonify([{"id": j.id, "due": j.due, "kind": j.kind} for j in scheduler.pending(wa_id)]), 200
+    return jsonify(scheduler.stats()), 200
+
+
+@webhook_blueprint.route("/scheduled/<wa_id>", methods=["DELETE"])
+@admin_required
+def scheduled_delete(wa_id):
+    # Cancel a user's jobs (only those labelled ?kind= if given)
+    scheduler, error = get_scheduler()
+    if error:
+        return error
+    return jsonify({"cancelled": scheduler.cancel_for(wa_id, request.args.get("kind"))}), 200
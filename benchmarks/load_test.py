@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+"""
+Load test for the webhook app.
+
+Starts local stub servers for the Graph API and the OpenAI Assistants API,
+serves `create_app()` on a local port and drives it with HMAC-signed webhook
+traffic at a fixed rate and concurrency. Reports throughput, latency
+percentiles and errors.
+
+Usage:
+    python -m benchmarks.load_test --rate 200 --concurrency 32 --duration 30
+    python -m benchmarks.load_test --rate 0 --requests 5000   # as fast as possible
+    python -m benchmarks.load_test --reply-engine keywords    # no Assistant runs
+"""
+import argparse
+import asyncio
+import collections
+import contextlib
+import json
+import logging
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.stub_servers import graph_api_stub, openai_stub
+from benchmarks.webhook_traffic import TrafficGenerator
+
+TEST_APP_SECRET = "load-test-secret"
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100.0 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+
+class LoadTestResult:
+    """Collects per-request latencies and outcomes (thread-safe)."""
+
+    def __init__(self):
+        self.latencies = []
+        self.status_codes = collections.Counter()
+        self.errors = collections.Counter()
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record(self, latency, status_code=None, error=None):
+        with self._lock:
+            self.latencies.append(latency)
+            if status_code is not None:
+                self.status_codes[status_code] += 1
+            if error is not None:
+                self.errors[error] += 1
+            elif status_code is not None and status_code >= 400:
+                self.errors[f"HTTP {status_code}"] += 1
+
+    def summary(self):
+        """
+        Returns:
+            dict: requests, duration, throughput, latency percentiles (ms) and errors
+        """
+        latencies = sorted(self.latencies)
+        duration = (self.finished or time.perf_counter()) - (self.started or 0)
+        total = len(latencies)
+        return {
+            "requests": total,
+            "duration_s": round(duration, 3),
+            "throughput_rps": round(total / duration, 1) if duration > 0 else 0.0,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+            "errors": sum(self.errors.values()),
+            "error_breakdown": dict(self.errors),
+            "status_codes": {str(k): v for k, v in sorted(self.status_codes.items())},
+        }
+
+
+def format_summary(summary, title="Load test results"):
+    lines = [
+        "=" * 70,
+        title,
+        "=" * 70,
+        f"Requests:    {summary['requests']} in {summary['duration_s']}s",
+        f"Throughput:  {summary['throughput_rps']} req/s",
+        f"Latency:     p50 {summary['p50_ms']} ms | p95 {summary['p95_ms']} ms | "
+        f"p99 {summary['p99_ms']} ms | max {summary['max_ms']} ms",
+        f"Errors:      {summary['errors']} {summary['error_breakdown'] or ''}",
+        f"Status:      {summary['status_codes']}",
+    ]
+    return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def serve_wsgi(app, port=0):
+    """Serve a WSGI app on a background thread and yield its base URL."""
+    from werkzeug.serving import make_server
+
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+
+
+@contextlib.contextmanager
+def serve_aiohttp(app, port=0):
+    """Serve an aiohttp app on an event loop in a background thread and yield its base URL."""
+    from aiohttp import web
+
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app, access_log=None)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    loop.run_until_complete(site.start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{runner.addresses[0][1]}"
+    finally:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result(timeout=30)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+_local = threading.local()
+
+
+def timed_post(url, body, headers, scheduled_at, result):
+    """POST one request on this thread's pooled session and record its latency."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+    try:
+        response = session.post(url, data=body, headers=headers, timeout=60)
+        result.record(time.perf_counter() - scheduled_at, status_code=response.status_code)
+    except requests.RequestException as e:
+        result.record(time.perf_counter() - scheduled_at, error=type(e).__name__)
+
+
+def drive(url, next_request, rate=100.0, concurrency=16, duration=10.0, total=None):
+    """
+    Send webhook requests to `url` and measure them.
+
+    With a positive `rate` the load is open-loop: request i is scheduled at
+    start + i / rate and its latency is measured from that scheduled time, so
+    queueing inside the client counts against the server (no coordinated
+    omission). With `rate` 0 each worker sends back-to-back.
+
+    Args:
+        url (str): Full webhook URL
+        next_request (callable): Returns (kind, body bytes, headers)
+        rate (float): Requests per second, 0 for as fast as possible
+        concurrency (int): Maximum requests in flight
+        duration (float): Seconds to run when `total` is not given
+        total (int): Number of requests to send
+
+    Returns:
+        LoadTestResult: The collected measurements
+    """
+    result = LoadTestResult()
+    lock = threading.Lock()
+
+    def send(scheduled_at):
+        with lock:
+            _, body, headers = next_request()
+        timed_post(url, body, headers, scheduled_at, result)
+
+    result.started = time.perf_counter()
+    deadline = result.started + duration
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        if rate and rate > 0:
+            sent = 0
+            while (total is None or sent < total) and (total is not None or time.perf_counter() < deadline):
+                scheduled_at = result.started + sent / rate
+                delay = scheduled_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(send, scheduled_at)
+                sent += 1
+        else:
+            counter = iter(range(total)) if total is not None else None
+
+            def worker():
+                while True:
+                    if counter is not None:
+                        with lock:
+                            if next(counter, None) is None:
+                                return
+                    elif time.perf_counter() >= deadline:
+                        return
+                    send(time.perf_counter())
+
+            for _ in range(concurrency):
+                pool.submit(worker)
+
+    result.finished = time.perf_counter()
+    return result
+
+
+def configure_environment(graph_url, openai_url, app_secret=TEST_APP_SECRET, reply_engine="keywords"):
+    """Point the app's configuration at the local stub servers."""
+    state_dir = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ.update(
+        {
+            "ACCESS_TOKEN": "load-test-token",
+            "APP_SECRET": app_secret,
+            "VERIFY_TOKEN": "load-test-verify",
+            "VERSION": "v18.0",
+            "PHONE_NUMBER_ID": "123456789",
+            "GRAPH_API_URL": graph_url,
+            "REPLY_ENGINE": reply_engine,
+            "OPENAI_API_KEY": "load-test-key",
+            "OPENAI_ASSISTANT_ID": "asst_stub",
+            "OPENAI_BASE_URL": f"{openai_url}/v1",
+            "STATUS_STORE_PATH": os.path.join(state_dir, "status_db.bin"),
+            "OPENAI_THREADS_DB": os.path.join(state_dir, "threads_db"),
+            "MEDIA_CACHE_PATH": os.path.join(state_dir, "media_cache.json"),
+            "MEDIA_DOWNLOAD_DIR": os.path.join(state_dir, "media"),
+            "OUTBOX_PATH": os.path.join(state_dir, "outbox.db"),
+            "SESSION_SPILL_PATH": os.path.join(state_dir, "sessions_db"),
+            "SCHEDULER_PATH": os.path.join(state_dir, "scheduled.db"),
+            "WELCOME_HEADER_IMAGE": f"{graph_url}/assets/welcome.jpg",
+        }
+    )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Load test the WhatsApp webhook app")
+    parser.add_argument("--rate", type=float, default=100.0, help="Requests per second (0 = as fast as possible)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Maximum requests in flight")
+    parser.add_argument("--duration", type=float, default=10.0, help="Test duration in seconds")
+    parser.add_argument("--requests", type=int, default=None, help="Send exactly this many requests instead")
+    parser.add_argument("--users", type=int, default=1000, help="Number of distinct senders")
+    parser.add_argument("--status-ratio", type=float, default=0.75, help="Fraction of status webhooks")
+    parser.add_argument("--graph-latency", type=float, default=0.05, help="Stub Graph API latency (s)")
+    parser.add_argument("--graph-error-rate", type=float, default=0.0, help="Stub Graph API error rate (0..1)")
+    parser.add_argument("--reply-engine", choices=["openai", "keywords"], default="openai")
+    parser.add_argument("--openai-latency", type=float, default=2.0, help="Stub Assistant run duration (s)")
+    parser.add_argument("--openai-error-rate", type=float, default=0.0, help="Stub Assistant run failure rate")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for the traffic mix")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    graph = graph_api_stub(latency=args.graph_latency, error_rate=args.graph_error_rate)
+    assistant = openai_stub(latency=args.openai_latency, error_rate=args.openai_error_rate)
+    with graph, assistant:
+        configure_environment(graph.url, assistant.url, reply_engine=args.reply_engine)
+
+        from app import create_app
+
+        app = create_app()
+        # Per-request INFO logging would dominate the measurement
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+        traffic = TrafficGenerator(TEST_APP_SECRET, users=args.users, status_ratio=args.status_ratio, seed=args.seed)
+        with serve_wsgi(app) as base_url:
+            result = drive(
+                f"{base_url}/webhook",
+                traffic.next_request,
+                rate=args.rate,
+                concurrency=args.concurrency,
+                duration=args.duration,
+                total=args.requests,
+            )
+        # Replies are sent from the outbox after the webhook returns; count them too
+        outbox = app.extensions.get("outbox")
+        if outbox is not None and not outbox.wait_idle(timeout=30):
+            logging.warning(f"Outbox not drained: {outbox.stats()}")
+
+    summary = result.summary()
+    summary["graph_api_calls"] = graph.request_count
+    summary["openai_calls"] = assistant.request_count
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(format_summary(summary))
+        print(f"Graph API calls: {graph.request_count} | OpenAI calls: {assistant.request_count}")
+        print("=" * 70)
+    return 0 if summary["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
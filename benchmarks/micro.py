@@ -0,0 +1,295 @@
+"""
+Microbenchmarks for the functions that run on every message.
+
+Each benchmark runs one function over a realistic input corpus (short
+Spanish chat messages, long LLM outputs, large webhook bodies) and reports
+the time per call in nanoseconds. `run_benchmarks.py` compares the results
+against the baselines stored in `benchmarks/baselines.json`.
+"""
+import json
+import time
+
+from benchmarks.webhook_traffic import SAMPLE_MESSAGES, sign_payload, status_body, text_message_body
+
+# name -> setup function returning (callable taking one input, corpus list),
+# optionally followed by a cleanup callable undoing the setup
+BENCHMARKS = {}
+
+# Below this many ns per call, timings are re-measured with more repetitions:
+# one disturbed repetition is a large fraction of a tiny timing
+TINY_NS = 1000
+TINY_REPEAT_FACTOR = 4
+
+
+def benchmark(name):
+    """Register a benchmark setup function under `name`."""
+
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+# --------------------------------------------------------------
+# Input corpora
+# --------------------------------------------------------------
+
+SHORT_MESSAGES = SAMPLE_MESSAGES + [
+    "Buenas tardes, ¿me pueden dar información sobre los servicios?",
+    "Cuánto cuesta una relajación?",
+    "quiero saber el horario del sábado",
+    "Hola buenas, tienen disponibilidad para wash and go?",
+    "ok",
+    "👍",
+    "Me gustaría agendar una cita para el viernes en la tarde",
+    "donde estan ubicados",
+    "muchas gracias por todo!!",
+    "asdfgh",
+]
+
+
+def long_llm_outputs(count=20, paragraphs=12):
+    """Assistant-style answers with markdown bold and retrieval citations."""
+    paragraph = (
+        "**Check-in** is from 15:00 and **check-out** is before 11:00. "
+        "The wifi network is *ParisFlat* and the password is on the fridge【4:0†source】. "
+        "Please remember to close the windows when you leave, and feel free to contact "
+        "the host if anything is missing from the apartment. "
+    )
+    return [
+        f"Respuesta {i}:\n" + "\n\n".join(paragraph for _ in range(paragraphs))
+        for i in range(count)
+    ]
+
+
+def batched_webhook_body(messages=50, statuses=50):
+    """One webhook body carrying many messages and statuses across entries."""
+    entries = []
+    for i in range(messages):
+        entries.extend(text_message_body(f"52155{i:08d}", SHORT_MESSAGES[i % len(SHORT_MESSAGES)])["entry"])
+    for i in range(statuses):
+        entries.extend(status_body(f"52155{i:08d}", "delivered")["entry"])
+    return {"object": "whatsapp_business_account", "entry": entries}
+
+
+def webhook_bodies():
+    """Single text messages, single statuses and a large batched body."""
+    bodies = [text_message_body(f"52155{i:08d}", m) for i, m in enumerate(SHORT_MESSAGES)]
+    bodies += [status_body(f"52155{i:08d}") for i in range(10)]
+    bodies.append(batched_webhook_body())
+    return bodies
+
+
+# --------------------------------------------------------------
+# Benchmarks
+# --------------------------------------------------------------
+
+
+@benchmark("message_handlers.generate_response")
+def _generate_response():
+    from app.utils.message_handlers import generate_response
+
+    return generate_response, SHORT_MESSAGES
+
+
+@benchmark("profiling.timed[disabled]")
+def _timed_disabled():
+    from app.utils.profiling import timed
+
+    # What every span costs in production, where spans are off by default
+    return timed("benchmark")(len), SHORT_MESSAGES
+
+
+@benchmark("message_handlers.load_message")
+def _load_message():
+    from app.utils.message_handlers import load_message
+
+    return load_message, ["welcome.txt", "servicios.txt", "costos.txt", "hola.txt", "missing.txt"]
+
+
+@benchmark("message_handlers.should_send_welcome")
+def _should_send_welcome():
+    from app.utils.message_handlers import should_send_welcome
+
+    # Its own set, so the app's greeted_users is left alone
+    greeted = set()
+
+    def call(wa_id):
+        return should_send_welcome(wa_id, greeted)
+
+    # Mostly returning users, some new ones
+    return call, [f"52155{i % 200:08d}" for i in range(1000)]
+
+
+@benchmark("whatsapp_utils.process_text_for_whatsapp")
+def _process_text_for_whatsapp():
+    from app.utils.whatsapp_utils import process_text_for_whatsapp
+
+    return process_text_for_whatsapp, long_llm_outputs() + SHORT_MESSAGES
+
+
+@benchmark("whatsapp_utils.get_text_message_input")
+def _get_text_message_input():
+    from app.utils.whatsapp_utils import get_text_message_input
+
+    def call(text):
+        return get_text_message_input("5215512345678", text)
+
+    return call, SHORT_MESSAGES + long_llm_outputs(count=5)
+
+
+@benchmark("whatsapp_utils.get_template_message_input")
+def _get_template_message_input():
+    from app.utils.whatsapp_utils import get_template_message_input
+
+    def call(image_url):
+        return get_template_message_input("5215512345678", "mensaje_de_bienvenida", header_image_url=image_url)
+
+    return call, [None, "https://example.com/header.jpg"]
+
+
+@benchmark("whatsapp_utils.is_valid_whatsapp_message")
+def _is_valid_whatsapp_message():
+    from app.utils.webhook_events import parse_webhook
+    from app.utils.whatsapp_utils import is_valid_whatsapp_message
+
+    # handle_message passes the already parsed batch; parsing is timed below
+    return is_valid_whatsapp_message, [parse_webhook(body) for body in webhook_bodies()]
+
+
+@benchmark("webhook_events.parse_webhook")
+def _parse_webhook():
+    from app.utils.webhook_events import parse_webhook
+
+    return parse_webhook, webhook_bodies()
+
+
+@benchmark("webhook_events.parse_webhook[batched]")
+def _parse_webhook_batched():
+    from app.utils.webhook_events import parse_webhook
+
+    # Large batched deliveries as Meta sends them during bursts
+    return parse_webhook, [batched_webhook_body(messages=250, statuses=250) for _ in range(2)]
+
+
+@benchmark("status_store.add")
+def _status_store_add():
+    import os
+    import tempfile
+
+    from app.services.status_store import StatusStore
+    from app.utils.webhook_events import parse_webhook
+
+    descriptor, path = tempfile.mkstemp(prefix="bench-status-")
+    os.close(descriptor)
+    store = StatusStore(path, flush_size=10 ** 9, index_size=1000, start=False)
+    batches = [parse_webhook(status_body(f"52155{i:08d}", "delivered")).statuses for i in range(100)]
+    return store.add, batches, lambda: os.remove(path)
+
+
+@benchmark("status_store.scan_status_payload")
+def _scan_status_payload():
+    from app.services.status_store import scan_status_payload
+
+    # The status fast path: single and batched status bodies, never decoded
+    bodies = [status_body(f"52155{i:08d}", "delivered") for i in range(10)]
+    bodies.append(batched_webhook_body(messages=0, statuses=50))
+    return scan_status_payload, [json.dumps(body).encode("utf-8") for body in bodies]
+
+
+@benchmark("security.validate_signature")
+def _validate_signature():
+    from flask import Flask
+
+    from app.decorators.security import validate_signature
+
+    app = Flask(__name__)
+    app.config["APP_SECRET"] = "benchmark-secret"
+    context = app.app_context()
+    context.push()
+
+    payloads = [json.dumps(body).encode("utf-8") for body in webhook_bodies()]
+    corpus = [(p, sign_payload(p, "benchmark-secret")[7:]) for p in payloads]
+
+    def call(item):
+        payload, signature = item
+        return validate_signature(payload, signature)
+
+    return call, corpus, context.pop
+
+
+# --------------------------------------------------------------
+# Measurement
+# --------------------------------------------------------------
+
+
+def _calibration_loop():
+    total = 0
+    for i in range(1000):
+        total += i * i % 7
+    return total
+
+
+def measure(func, corpus, repeat=5, min_time=0.1):
+    """
+    Time `func` over `corpus` and return the best time per call in ns.
+
+    Each repetition runs the whole corpus enough times to last at least
+    `min_time` seconds; the fastest repetition is reported since it is the
+    one least disturbed by the rest of the machine.
+    """
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            for item in corpus:
+                func(item)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2
+
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            for item in corpus:
+                func(item)
+        best = min(best, time.perf_counter() - start)
+    return best / (loops * len(corpus)) * 1e9
+
+
+def calibrate(repeat=15):
+    """Time a fixed pure-Python loop, used to normalize across machines."""
+    # The first timings after startup are noisy (cold caches, frequency scaling)
+    measure(lambda _: _calibration_loop(), [None], repeat=1)
+    return measure(lambda _: _calibration_loop(), [None], repeat=repeat)
+
+
+def run(names=None, repeat=5, min_time=0.1):
+    """
+    Run the selected benchmarks.
+
+    Returns:
+        dict: benchmark name -> ns per call
+    """
+    results = {}
+    for name in BENCHMARKS:
+        if names and not any(n in name for n in names):
+            continue
+        results[name] = run_one(name, repeat=repeat, min_time=min_time)
+    return results
+
+
+def run_one(name, repeat=5, min_time=0.1):
+    """Set up, time and clean up one benchmark; returns ns per call."""
+    func, corpus, *cleanup = BENCHMARKS[name]()
+    try:
+        ns = measure(func, corpus, repeat=repeat, min_time=min_time)
+        if ns < TINY_NS:
+            ns = min(ns, measure(func, corpus, repeat=repeat * TINY_REPEAT_FACTOR, min_time=min_time))
+        return ns
+    finally:
+        for undo in cleanup:
+            undo()
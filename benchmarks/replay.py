@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+Replay recorded webhook traffic against the app.
+
+Reads the segments written by the traffic recorder (WEBHOOK_RECORD_DIR),
+re-signs every body with a test APP_SECRET and sends the requests with their
+original inter-arrival times, scaled by --speed.
+
+Usage:
+    # Against a local app with stub Graph/OpenAI servers, at real speed
+    python -m benchmarks.replay recordings/
+
+    # Ten times faster than recorded
+    python -m benchmarks.replay recordings/ --speed 10
+
+    # As fast as possible against an already running instance
+    python -m benchmarks.replay recordings/ --speed max --url http://localhost:8000/webhook --app-secret test
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.utils.traffic_recorder import read_segments
+from benchmarks.load_test import (
+    TEST_APP_SECRET,
+    LoadTestResult,
+    configure_environment,
+    format_summary,
+    serve_wsgi,
+    timed_post,
+)
+from benchmarks.stub_servers import graph_api_stub, openai_stub
+from benchmarks.webhook_traffic import sign_payload
+
+
+def parse_speed(value):
+    """Accept '1', '2.5', '10x' or 'max' (0 means no pacing)."""
+    value = value.lower()
+    if value == "max":
+        return 0.0
+    speed = float(value[:-1] if value.endswith("x") else value)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive or 'max'")
+    return speed
+
+
+def prepare_requests(entries, app_secret, run_id=None):
+    """
+    Turn recorded entries into (offset seconds, body bytes, headers).
+
+    Args:
+        entries: Iterable of recorded entries
+        app_secret (str): Secret used to re-sign the bodies
+        run_id (str): When given, appended to inbound message ids so the app
+            does not treat a second replay of the same capture as duplicates
+
+    Yields:
+        tuple: (seconds since the first request, body, headers)
+    """
+    first = None
+    for entry in entries:
+        if first is None:
+            first = entry["t"]
+        body = entry["body"]
+        if run_id:
+            parsed = json.loads(body)
+            for e in parsed.get("entry", []):
+                for change in e.get("changes", []):
+                    for message in change.get("value", {}).get("messages", []):
+                        if "id" in message:
+                            message["id"] = f"{message['id']}.{run_id}"
+            body = json.dumps(parsed, separators=(",", ":"), ensure_ascii=False)
+        payload = body.encode("utf-8")
+        headers = dict(entry.get("headers") or {})
+        headers.setdefault("Content-Type", "application/json")
+        headers["X-Hub-Signature-256"] = sign_payload(payload, app_secret)
+        yield entry["t"] - first, payload, headers
+
+
+def replay(url, prepared, speed=1.0, concurrency=64):
+    """
+    Send prepared requests, keeping recorded timing scaled by `speed`.
+
+    Latency is measured from each request's scheduled send time, so a server
+    that falls behind the recorded burst shows up as growing latency.
+
+    Returns:
+        LoadTestResult: The collected measurements
+    """
+    result = LoadTestResult()
+    result.started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for offset, body, headers in prepared:
+            if speed:
+                scheduled_at = result.started + offset / speed
+                delay = scheduled_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                scheduled_at = time.perf_counter()
+            pool.submit(timed_post, url, body, headers, scheduled_at, result)
+    result.finished = time.perf_counter()
+    return result
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Replay recorded webhook traffic")
+    parser.add_argument("paths", nargs="+", help="Segment files or recording directories")
+    parser.add_argument("--speed", type=parse_speed, default=1.0, help="1, N (e.g. 10 or 10x) or 'max'")
+    parser.add_argument("--url", default=None, help="Webhook URL; defaults to a local app on stub servers")
+    parser.add_argument("--app-secret", default=TEST_APP_SECRET, help="APP_SECRET used to re-sign bodies")
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum requests in flight")
+    parser.add_argument("--limit", type=int, default=None, help="Replay only the first N requests")
+    parser.add_argument("--unique-ids", action="store_true", help="Make message ids unique per replay run")
+    parser.add_argument("--graph-latency", type=float, default=0.05, help="Stub Graph API latency (s)")
+    parser.add_argument("--openai-latency", type=float, default=2.0, help="Stub Assistant run duration (s)")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    run_id = f"r{int(time.time())}" if args.unique_ids else None
+    prepared = prepare_requests(read_segments(args.paths), args.app_secret, run_id)
+    if args.limit:
+        prepared = itertools.islice(prepared, args.limit)
+
+    with contextlib.ExitStack() as stack:
+        url = args.url
+        if url is None:
+            graph = stack.enter_context(graph_api_stub(latency=args.graph_latency))
+            assistant = stack.enter_context(openai_stub(latency=args.openai_latency))
+            configure_environment(graph.url, assistant.url, app_secret=args.app_secret)
+
+            from app import create_app
+
+            app = create_app()
+            logging.getLogger().setLevel(logging.WARNING)
+            logging.getLogger("werkzeug").setLevel(logging.WARNING)
+            url = f"{stack.enter_context(serve_wsgi(app))}/webhook"
+
+        result = replay(url, prepared, speed=args.speed, concurrency=args.concurrency)
+
+    summary = result.summary()
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(format_summary(summary, title=f"Replay results (speed: {args.speed or 'max'})"))
+    return 0 if summary["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""
+Scheduling overhead and memory per job of the scheduled-message engine.
+
+Fills a scheduler (app/services/scheduler.py) with jobs spread over the
+next `--days` days, then times bulk and single inserts, cancellation by
+wa_id, and the release of due jobs in batches. Memory is reported for the
+in-memory heap (jobs within the horizon, measured with tracemalloc) and for
+the database on disk.
+
+Usage:
+    python -m benchmarks.scheduler
+    python -m benchmarks.scheduler --jobs 2000000 --days 30 --json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from app.services.scheduler import Scheduler  # noqa: E402
+
+PAYLOAD = json.dumps(
+    {
+        "messaging_product": "whatsapp",
+        "to": "5215500000000",
+        "type": "template",
+        "template": {"name": "recordatorio_cita", "language": {"code": "es"}},
+    }
+)
+
+
+def _per_op_us(seconds, count):
+    return round(seconds / max(count, 1) * 1e6, 2)
+
+
+def run_benchmark(jobs=200_000, days=7.0, horizon=300.0, batch_size=500, singles=2_000, seed=1):
+    """
+    Returns:
+        dict: Timings (microseconds per job) and memory (bytes per job)
+    """
+    rng = random.Random(seed)
+    directory = tempfile.mkdtemp(prefix="scheduler-bench-")
+    released = []
+    scheduler = Scheduler(
+        os.path.join(directory, "scheduled.db"), lambda batch: released.append(len(batch)),
+        batch_size=batch_size, horizon=horizon, start=False,
+    )
+    try:
+        now = time.time()
+        span = days * 86400
+        wa_ids = [f"52155{i:08d}" for i in range(max(1, jobs // 3))]
+
+        started = time.perf_counter()
+        chunk = 10_000
+        for offset in range(0, jobs, chunk):
+            scheduler.schedule_many(
+                (rng.choice(wa_ids), PAYLOAD, now + rng.uniform(0, span), None, "reminder")
+                for _ in range(min(chunk, jobs - offset))
+            )
+        bulk = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(singles):
+            scheduler.schedule(rng.choice(wa_ids), PAYLOAD, now + rng.uniform(0, span), kind="follow_up")
+        single = time.perf_counter() - started
+
+        started = time.perf_counter()
+        cancelled = sum(scheduler.cancel_for(rng.choice(wa_ids), "follow_up") for _ in range(singles))
+        cancel = time.perf_counter() - started
+
+        # Load the horizon into the heap and measure what it holds
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        scheduler.run_due(now)
+        heap_bytes = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        in_memory = scheduler.stats()["in_memory"]
+
+        # Release a day's worth of jobs
+        due_jobs = scheduler.stats()["pending"]
+        started = time.perf_counter()
+        count = scheduler.run_due(now + 86400)
+        release = time.perf_counter() - started
+        pending = scheduler.stats()["pending"]
+
+        disk = sum(
+            os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+        )
+        return {
+            "jobs": jobs + singles,
+            "days": days,
+            "schedule_bulk_us": _per_op_us(bulk, jobs),
+            "schedule_single_us": _per_op_us(single, singles),
+            "cancel_by_wa_id_us": _per_op_us(cancel, singles),
+            "cancelled": cancelled,
+            "release_us": _per_op_us(release, count),
+            "released": count,
+            "batches": len(released),
+            "pending_after": pending,
+            "in_memory_jobs": in_memory,
+            "heap_bytes_per_job": round(heap_bytes / in_memory, 1) if in_memory else None,
+            "disk_bytes_per_job": round(disk / max(due_jobs, 1), 1),
+        }
+    finally:
+        scheduler.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def format_report(result):
+    lines = [
+        "=" * 60,
+        f"Scheduler: {result['jobs']} jobs over {result['days']} days",
+        "=" * 60,
+        f"  schedule (bulk)          {result['schedule_bulk_us']:>10} us/job",
+        f"  schedule (one by one)    {result['schedule_single_us']:>10} us/job",
+        f"  cancel by wa_id          {result['cancel_by_wa_id_us']:>10} us/call ({result['cancelled']} cancelled)",
+        f"  release                  {result['release_us']:>10} us/job "
+        f"({result['released']} in {result['batches']} batches)",
+        f"  heap                     {result['heap_bytes_per_job']} bytes/job "
+        f"({result['in_memory_jobs']} jobs in memory)",
+        f"  disk                     {result['disk_bytes_per_job']:>10} bytes/job",
+        "=" * 60,
+    ]
+    return "\n".join(lines)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the scheduled-message engine")
+    parser.add_argument("--jobs", type=int, default=200_000, help="Jobs scheduled in bulk")
+    parser.add_argument("--days", type=float, default=7.0, help="Days the due times are spread over")
+    parser.add_argument("--horizon", type=float, default=300.0, help="Seconds ahead kept in memory")
+    parser.add_argument("--batch-size", type=int, default=500, help="Jobs released per batch")
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    result = run_benchmark(args.jobs, args.days, args.horizon, args.batch_size)
+    print(json.dumps(result, indent=2) if args.json else format_report(result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Compare the WSGI app (run.py) with the async app (run_async.py).
+
+Both modes get the same signed message webhooks, with the same concurrency,
+against the same stub Graph API and stub Assistant. Replies are generated by
+the Assistant and sent inline (no outbox), so every request waits on the
+Graph API and on an Assistant run. That is the case where a thread per
+request is the limit.
+
+Usage:
+    python -m benchmarks.serving_modes --concurrency 64 --duration 20
+    python -m benchmarks.serving_modes --reply-engine keywords --graph-latency 0.2
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.load_test import (
+    TEST_APP_SECRET,
+    configure_environment,
+    drive,
+    format_summary,
+    serve_aiohttp,
+    serve_wsgi,
+)
+from benchmarks.stub_servers import graph_api_stub, openai_stub
+from benchmarks.webhook_traffic import TrafficGenerator
+
+MODES = ("wsgi", "async")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Compare the WSGI and async serving modes")
+    parser.add_argument("--modes", default=",".join(MODES), help="Comma-separated modes to run")
+    parser.add_argument("--rate", type=float, default=0.0, help="Requests per second (0 = as fast as possible)")
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum requests in flight")
+    parser.add_argument("--duration", type=float, default=15.0, help="Seconds per mode")
+    parser.add_argument("--requests", type=int, default=None, help="Send exactly this many requests per mode")
+    parser.add_argument("--users", type=int, default=1000, help="Number of distinct senders")
+    parser.add_argument("--status-ratio", type=float, default=0.0, help="Fraction of status webhooks")
+    parser.add_argument("--reply-engine", choices=["openai", "keywords"], default="openai")
+    parser.add_argument("--graph-latency", type=float, default=0.1, help="Stub Graph API latency (s)")
+    parser.add_argument("--openai-latency", type=float, default=1.0, help="Stub Assistant run duration (s)")
+    parser.add_argument("--welcome", action="store_true",
+                        help="Send the welcome flow (2s pause) to first-time senders")
+    parser.add_argument("--json", action="store_true", help="Print the summaries as JSON")
+    return parser
+
+
+def run_mode(mode, args, traffic):
+    from app import create_app
+    from app.utils.message_handlers import greeted_users
+
+    greeted_users.clear()
+    if not args.welcome:
+        greeted_users.update(traffic.users)
+
+    app = create_app()
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    if mode == "async":
+        from app.async_app import create_async_app
+
+        server = serve_aiohttp(create_async_app(app))
+    else:
+        server = serve_wsgi(app)
+    with server as base_url:
+        result = drive(
+            f"{base_url}/webhook",
+            traffic.next_request,
+            rate=args.rate,
+            concurrency=args.concurrency,
+            duration=args.duration,
+            total=args.requests,
+        )
+    responder = app.extensions.get("llm_responder")
+    if responder is not None:
+        responder.shutdown(wait=False)
+    return result.summary()
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+
+    graph = graph_api_stub(latency=args.graph_latency)
+    assistant = openai_stub(latency=args.openai_latency)
+    summaries = {}
+    with graph, assistant:
+        configure_environment(graph.url, assistant.url)
+        os.environ.update(
+            {
+                "REPLY_ENGINE": args.reply_engine,
+                # Every request waits on its own Graph API call and Assistant run
+                "OUTBOX_PATH": "",
+                "OPENAI_ANSWER_CACHE_SIZE": "0",
+                "TYPING_INDICATOR": "false",
+            }
+        )
+        for mode in modes:
+            traffic = TrafficGenerator(TEST_APP_SECRET, users=args.users, status_ratio=args.status_ratio, seed=1)
+            summaries[mode] = run_mode(mode, args, traffic)
+
+    if args.json:
+        print(json.dumps(summaries, indent=2))
+    else:
+        for mode, summary in summaries.items():
+            print(format_summary(summary, title=f"{mode} ({args.reply_engine}, concurrency {args.concurrency})"))
+        if len(summaries) == 2 and summaries["wsgi"]["throughput_rps"]:
+            speedup = summaries["async"]["throughput_rps"] / summaries["wsgi"]["throughput_rps"]
+            print("=" * 70)
+            print(f"async / wsgi throughput: {speedup:.2f}x")
+        print("=" * 70)
+    return 0 if all(s["errors"] == 0 for s in summaries.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
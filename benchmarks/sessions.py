@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+Memory per session and lookup latency of the conversation session store.
+
+Fills a session store (app/services/sessions.py) with `--sessions` users,
+each halfway through a booking, and reports the memory each one takes
+(measured with tracemalloc), the latency of a lookup that finds the session
+in memory, of one that creates it, and of one that loads it back from the
+spill shelf after it was evicted past the memory cap.
+
+Usage:
+    python -m benchmarks.sessions
+    python -m benchmarks.sessions --sessions 500000 --json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from app.services.sessions import SessionStore  # noqa: E402
+from app.utils.message_handlers import BOOKING_TIME  # noqa: E402
+
+
+def _per_op_us(seconds, count):
+    return round(seconds / max(count, 1) * 1e6, 2)
+
+
+def run_benchmark(sessions=100_000, lookups=200_000, spilled=2_000, seed=1):
+    """
+    Returns:
+        dict: Memory (bytes per active session) and timings (microseconds per lookup)
+    """
+    rng = random.Random(seed)
+    directory = tempfile.mkdtemp(prefix="sessions-bench-")
+    store = SessionStore(max_sessions=sessions, ttl=1800.0, spill_path=os.path.join(directory, "sessions_db"))
+    try:
+        keys = [f"52155{i:08d}" for i in range(sessions)]
+        now = time.time()
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        for key in keys:
+            session = store.get(key, now)
+            session.state = BOOKING_TIME
+            session.set("service", "Trenzas Africanas")
+            session.last_topic = "trenzas_africanas.txt"
+        create = time.perf_counter() - started
+        memory = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+
+        sample = [rng.choice(keys) for _ in range(lookups)]
+        started = time.perf_counter()
+        for key in sample:
+            store.get(key, now)
+        hit = time.perf_counter() - started
+
+        # New users past the cap push the least recently used out to the shelf
+        extra = [f"52166{i:08d}" for i in range(spilled)]
+        for key in extra:
+            store.get(key, now)
+        evicted = [key for key in keys if store.peek(key) is None][:spilled]
+        started = time.perf_counter()
+        for key in evicted:
+            store.get(key, now)
+        restore = time.perf_counter() - started
+
+        return {
+            "sessions": sessions,
+            "bytes_per_session": round(memory / sessions, 1),
+            "create_us": _per_op_us(create, sessions),
+            "get_hit_us": _per_op_us(hit, lookups),
+            "get_spilled_us": _per_op_us(restore, len(evicted)),
+            "restored": len(evicted),
+            "stats": store.stats(),
+        }
+    finally:
+        store.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def format_report(result):
+    lines = [
+        "=" * 60,
+        f"Sessions: {result['sessions']} active",
+        "=" * 60,
+        f"  memory                   {result['bytes_per_session']:>10} bytes/session",
+        f"  get (create)             {result['create_us']:>10} us",
+        f"  get (in memory)          {result['get_hit_us']:>10} us",
+        f"  get (spilled)            {result['get_spilled_us']:>10} us ({result['restored']} restored)",
+        "=" * 60,
+    ]
+    return "\n".join(lines)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the conversation session store")
+    parser.add_argument("--sessions", type=int, default=100_000, help="Active sessions (the memory cap)")
+    parser.add_argument("--lookups", type=int, default=200_000, help="Lookups of sessions in memory")
+    parser.add_argument("--spilled", type=int, default=2_000, help="Sessions evicted and restored")
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    result = run_benchmark(args.sessions, args.lookups, args.spilled)
+    print(json.dumps(result, indent=2) if args.json else format_report(result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
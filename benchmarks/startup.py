@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+Cold-start report for the webhook app.
+
+Runs `create_app()` in fresh interpreters with `python -X importtime` and
+prints the wall-clock time, the phases of `create_app()` (see
+app/utils/startup_profile.py) and the modules whose imports cost the most,
+both individually and grouped by top-level package.
+
+Usage:
+    python -m benchmarks.startup
+    python -m benchmarks.startup --reply-engine openai --warm-up blocking --top 25
+"""
+import argparse
+import collections
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from app import create_app
+app = create_app()
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "wall_ms": round(elapsed * 1000, 2),
+    "profile": app.extensions["startup_profile"].as_dict(),
+    "openai_imported": "openai" in sys.modules,
+}))
+"""
+
+
+def parse_importtime(stderr):
+    """
+    Parse `-X importtime` output.
+
+    Returns:
+        list: (module, self microseconds, cumulative microseconds) per imported module
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def measure_startup(env=None, runs=3):
+    """
+    Start the app `runs` times in fresh interpreters, each in an empty state directory.
+
+    Returns:
+        tuple: (fastest run's result dict, its import rows)
+    """
+    best = None
+    for _ in range(runs):
+        state_dir = tempfile.mkdtemp(prefix="startup-")
+        # Cold start as configured by `env`; the warm-up only runs when asked for
+        child_env = dict(os.environ, **{"WARM_UP": "off", **(env or {})})
+        child_env.update(
+            {
+                "PYTHONPATH": ROOT,
+                "STATUS_STORE_PATH": os.path.join(state_dir, "status_db.bin"),
+                "OPENAI_THREADS_DB": os.path.join(state_dir, "threads_db"),
+                "MEDIA_CACHE_PATH": os.path.join(state_dir, "media_cache.json"),
+                "MEDIA_DOWNLOAD_DIR": os.path.join(state_dir, "media"),
+                "OUTBOX_PATH": os.path.join(state_dir, "outbox.db"),
+                "SESSION_SPILL_PATH": os.path.join(state_dir, "sessions_db"),
+                "SCHEDULER_PATH": os.path.join(state_dir, "scheduled.db"),
+            }
+        )
+        try:
+            completed = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", CHILD],
+                cwd=state_dir, env=child_env, capture_output=True, text=True, check=True,
+            )
+        finally:
+            shutil.rmtree(state_dir, ignore_errors=True)
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        if best is None or result["wall_ms"] < best[0]["wall_ms"]:
+            best = (result, parse_importtime(completed.stderr))
+    return best
+
+
+def format_report(result, rows, top=15):
+    by_package = collections.Counter()
+    for name, self_us, _ in rows:
+        by_package[name.split(".")[0]] += self_us
+
+    lines = [
+        "=" * 70,
+        "Startup report",
+        "=" * 70,
+        f"Import + create_app(): {result['wall_ms']} ms (openai imported: {result['openai_imported']})",
+        "",
+        "create_app() phases:",
+    ]
+    lines += [f"  {p['name']:<32} {p['ms']:>9.2f} ms" for p in result["profile"]["phases"]]
+    lines += ["", "Imports by package (self time):"]
+    lines += [f"  {name:<32} {us / 1000:>9.2f} ms" for name, us in by_package.most_common(top)]
+    lines += ["", "Slowest imports (cumulative):"]
+    for name, _, cumulative_us in sorted(rows, key=lambda r: r[2], reverse=True)[:top]:
+        lines.append(f"  {name:<48} {cumulative_us / 1000:>9.2f} ms")
+    lines.append("=" * 70)
+    return "\n".join(lines)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Report where the app's cold start time goes")
+    parser.add_argument("--reply-engine", choices=["keywords", "openai"], default="keywords")
+    parser.add_argument("--warm-up", choices=["off", "background", "blocking"], default="off")
+    parser.add_argument("--runs", type=int, default=3, help="Cold starts measured (the fastest is reported)")
+    parser.add_argument("--top", type=int, default=15, help="Rows per import table")
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    env = {"REPLY_ENGINE": args.reply_engine, "WARM_UP": args.warm_up, "OPENAI_API_KEY": "startup-report"}
+    result, rows = measure_startup(env, runs=args.runs)
+    if args.json:
+        result["imports"] = [{"module": n, "self_us": s, "cumulative_us": c} for n, s, c in rows]
+        print(json.dumps(result, indent=2))
+    else:
+        print(format_report(result, rows, top=args.top))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
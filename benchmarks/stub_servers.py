@@ -0,0 +1,313 @@
+"""
+Local stand-in servers for the Graph API and the OpenAI Assistants API.
+
+Both servers run on a background thread, listen on 127.0.0.1 and can be
+configured with an artificial latency and an error rate so the app can be
+load tested without touching graph.facebook.com or api.openai.com.
+"""
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Base handler: JSON helpers, latency/error injection and quiet logging."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Keep the benchmark output readable
+        pass
+
+    @property
+    def stub(self):
+        return self.server.stub
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_bytes(self, data, content_type="application/octet-stream", status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def simulate(self):
+        """
+        Apply the configured latency and decide whether this call fails.
+
+        Returns:
+            bool: True if the request should be answered with an error
+        """
+        self.stub.record_request()
+        delay = self.stub.latency
+        if self.stub.jitter:
+            delay += random.uniform(-self.stub.jitter, self.stub.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        return random.random() < self.stub.error_rate
+
+
+# A tiny stand-in for the welcome template header image
+FAKE_IMAGE = b"\xff\xd8\xff\xe0" + b"stub-image" * 100 + b"\xff\xd9"
+
+
+class GraphAPIHandler(_StubHandler):
+    """
+    Mimics the WhatsApp Cloud API endpoints used by the app.
+
+    Besides sending messages it accepts media uploads, resolves media ids to
+    download URLs and serves the media content and a fake header image
+    under /assets/.
+    """
+
+    def do_GET(self):
+        if self.simulate():
+            self.send_json({"error": {"message": "Stub failure", "code": 131000}}, status=500)
+            return
+
+        parts = self.path.split("?", 1)[0].strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "assets":
+            self.send_bytes(FAKE_IMAGE, "image/jpeg")
+        elif len(parts) == 2 and parts[0] == "media-files" and parts[1] in self.stub.media:
+            content, mime_type = self.stub.media[parts[1]]
+            self.send_bytes(content, mime_type)
+        elif len(parts) == 2 and parts[1] in self.stub.media:
+            content, mime_type = self.stub.media[parts[1]]
+            self.send_json(
+                {
+                    "messaging_product": "whatsapp",
+                    "id": parts[1],
+                    "url": f"{self.stub.url}/media-files/{parts[1]}",
+                    "mime_type": mime_type,
+                    "sha256": hashlib.sha256(content).hexdigest(),
+                    "file_size": len(content),
+                }
+            )
+        else:
+            self.send_json({"error": {"message": f"Unknown path {self.path}"}}, status=404)
+
+    def do_POST(self):
+        body = self.read_body()
+        if self.simulate():
+            self.send_json(
+                {"error": {"message": "Stub failure", "type": "OAuthException", "code": 131000}},
+                status=500,
+            )
+            return
+
+        if self.path.endswith("/messages"):
+            try:
+                data = json.loads(body or b"{}")
+            except ValueError:
+                self.send_json({"error": {"message": "Invalid JSON"}}, status=400)
+                return
+            self.stub.record_payload(data)
+            if data.get("status") == "read":
+                self.send_json({"success": True})
+                return
+            self.send_json(
+                {
+                    "messaging_product": "whatsapp",
+                    "contacts": [{"input": data.get("to"), "wa_id": data.get("to")}],
+                    "messages": [{"id": f"wamid.stub{self.stub.next_id()}"}],
+                }
+            )
+        elif self.path.endswith("/media"):
+            # Multipart upload: the raw body is kept, it is never served back
+            self.send_json({"id": self.stub.add_media(body, "application/octet-stream")})
+        else:
+            self.send_json({"error": {"message": f"Unknown path {self.path}"}}, status=404)
+
+
+class OpenAIHandler(_StubHandler):
+    """
+    Mimics the subset of the OpenAI Assistants API used by openai_service.
+
+    Runs complete once `latency` seconds have passed since they were created,
+    so the app's polling loop sees a realistic run duration. The HTTP calls
+    themselves are answered immediately.
+    """
+
+    RUN_PATH = re.compile(r"^/v1/threads/([^/]+)/runs/([^/]+)(/cancel)?$")
+
+    def simulate(self):
+        self.stub.record_request()
+        return False
+
+    def _thread(self, thread_id):
+        return {"id": thread_id, "object": "thread", "created_at": int(time.time()), "metadata": {}}
+
+    def _message(self, thread_id, role, text):
+        return {
+            "id": f"msg_{self.stub.next_id()}",
+            "object": "thread.message",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "role": role,
+            "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+            "metadata": {},
+        }
+
+    def _run(self, thread_id, run_id):
+        created, failed = self.stub.runs.get(run_id, (time.time(), False))
+        if time.time() - created < self.stub.latency:
+            status = "in_progress"
+        else:
+            status = "failed" if failed else "completed"
+        return {
+            "id": run_id,
+            "object": "thread.run",
+            "created_at": int(created),
+            "thread_id": thread_id,
+            "assistant_id": "asst_stub",
+            "status": status,
+        }
+
+    def do_GET(self):
+        self.simulate()
+        path = self.path.split("?", 1)[0]
+        parts = path.strip("/").split("/")
+
+        if len(parts) == 3 and parts[1] == "assistants":
+            self.send_json(
+                {
+                    "id": parts[2],
+                    "object": "assistant",
+                    "created_at": 0,
+                    "name": "Stub Assistant",
+                    "model": "gpt-4-1106-preview",
+                    "instructions": "You are a stub.",
+                    "tools": [],
+                    "metadata": {},
+                }
+            )
+        elif len(parts) == 3 and parts[1] == "threads":
+            self.send_json(self._thread(parts[2]))
+        elif len(parts) == 4 and parts[3] == "messages":
+            reply = self._message(parts[2], "assistant", self.stub.reply_text)
+            self.send_json(
+                {"object": "list", "data": [reply], "first_id": reply["id"], "last_id": reply["id"], "has_more": False}
+            )
+        elif self.RUN_PATH.match(path):
+            thread_id, run_id, _ = self.RUN_PATH.match(path).groups()
+            self.send_json(self._run(thread_id, run_id))
+        else:
+            self.send_json({"error": {"message": f"Unknown path {self.path}"}}, status=404)
+
+    def do_POST(self):
+        body = self.read_body()
+        self.simulate()
+        path = self.path.split("?", 1)[0]
+        parts = path.strip("/").split("/")
+
+        if parts == ["v1", "threads"]:
+            self.send_json(self._thread(f"thread_{self.stub.next_id()}"))
+        elif len(parts) == 4 and parts[3] == "messages":
+            data = json.loads(body or b"{}")
+            self.send_json(self._message(parts[2], data.get("role", "user"), str(data.get("content", ""))))
+        elif len(parts) == 4 and parts[3] == "runs":
+            run_id = f"run_{self.stub.next_id()}"
+            self.stub.runs[run_id] = (time.time(), random.random() < self.stub.error_rate)
+            self.send_json(self._run(parts[2], run_id))
+        elif self.RUN_PATH.match(path):
+            thread_id, run_id, _ = self.RUN_PATH.match(path).groups()
+            self.stub.runs[run_id] = (0, True)
+            self.send_json(dict(self._run(thread_id, run_id), status="cancelled"))
+        else:
+            self.send_json({"error": {"message": f"Unknown path {self.path}"}}, status=404)
+
+
+class StubServer:
+    """
+    A threaded local HTTP server with configurable latency and error rate.
+
+    Args:
+        handler_class: The request handler implementing the fake API
+        latency (float): Seconds to wait before answering each request
+        jitter (float): Uniform random +/- jitter added to the latency
+        error_rate (float): Fraction of requests (0..1) answered with an error
+        port (int): Port to listen on, 0 picks a free one
+    """
+
+    def __init__(self, handler_class, latency=0.0, jitter=0.0, error_rate=0.0, port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.reply_text = "Respuesta de prueba del asistente."
+        self.runs = {}
+        # media id -> (content, mime type), uploaded or added by tests
+        self.media = {}
+        self.payloads = []
+        self.keep_payloads = False
+        self.request_count = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), handler_class)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_id(self):
+        return next(self._ids)
+
+    def add_media(self, content, mime_type):
+        """Store media content and return its id (simulates a customer's upload)."""
+        media_id = f"media{self.next_id()}"
+        with self._lock:
+            self.media[media_id] = (content, mime_type)
+        return media_id
+
+    def record_request(self):
+        with self._lock:
+            self.request_count += 1
+
+    def record_payload(self, payload):
+        if self.keep_payloads:
+            with self._lock:
+                self.payloads.append(payload)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def graph_api_stub(**kwargs):
+    """Create a stub for graph.facebook.com."""
+    return StubServer(GraphAPIHandler, **kwargs)
+
+
+def openai_stub(**kwargs):
+    """Create a stub for the OpenAI Assistants API (use `url + '/v1'` as base URL)."""
+    return StubServer(OpenAIHandler, **kwargs)
@@ -0,0 +1,131 @@
+"""
+Synthetic WhatsApp webhook traffic, signed the way Meta signs it.
+"""
+import hashlib
+import hmac
+import itertools
+import json
+import random
+import time
+
+# Short Spanish chat messages, the bulk of what customers send us
+SAMPLE_MESSAGES = [
+    "hola",
+    "Hola! quisiera información",
+    "cuales son los costos?",
+    "que servicios tienen",
+    "horario",
+    "quiero una cita para el sábado",
+    "me interesa la consulta capilar",
+    "cuanto cuesta el lavado de rizos?",
+    "hacen trenzas africanas?",
+    "ubicación por favor",
+    "tienen método crochet",
+    "gracias!!",
+    "quiero hacerme una prueba de color",
+    "reserva",
+]
+
+_message_ids = itertools.count(1)
+
+
+def sign_payload(payload, app_secret):
+    """
+    Compute the X-Hub-Signature-256 header value for a payload.
+
+    Args:
+        payload (bytes): The raw request body
+        app_secret (str): The app secret used by the webhook
+
+    Returns:
+        str: The header value, e.g. 'sha256=ab12...'
+    """
+    digest = hmac.new(
+        bytes(app_secret, "latin-1"), msg=payload, digestmod=hashlib.sha256
+    ).hexdigest()
+    return f"sha256={digest}"
+
+
+def _envelope(value, phone_number_id="123456789"):
+    value.setdefault("messaging_product", "whatsapp")
+    value.setdefault(
+        "metadata",
+        {"display_phone_number": "15550000000", "phone_number_id": phone_number_id},
+    )
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "0", "changes": [{"value": value, "field": "messages"}]}],
+    }
+
+
+def text_message_body(wa_id, text, name="Cliente", phone_number_id="123456789"):
+    """Build an inbound text message webhook body."""
+    return _envelope(
+        {
+            "contacts": [{"profile": {"name": name}, "wa_id": wa_id}],
+            "messages": [
+                {
+                    "from": wa_id,
+                    "id": f"wamid.in{next(_message_ids)}",
+                    "timestamp": str(int(time.time())),
+                    "text": {"body": text},
+                    "type": "text",
+                }
+            ],
+        },
+        phone_number_id,
+    )
+
+
+def status_body(wa_id, status="delivered", message_id=None, phone_number_id="123456789"):
+    """Build a delivery status webhook body (sent, delivered, read)."""
+    return _envelope(
+        {
+            "statuses": [
+                {
+                    "id": message_id or f"wamid.out{next(_message_ids)}",
+                    "status": status,
+                    "timestamp": str(int(time.time())),
+                    "recipient_id": wa_id,
+                }
+            ],
+        },
+        phone_number_id,
+    )
+
+
+class TrafficGenerator:
+    """
+    Produce signed webhook requests with a realistic mix of events.
+
+    Args:
+        app_secret (str): Secret used to sign the bodies
+        users (int): Size of the pool of sender wa_ids
+        status_ratio (float): Fraction of requests that are status updates
+        seed (int): Random seed for reproducible runs
+    """
+
+    def __init__(self, app_secret, users=1000, status_ratio=0.75, seed=None):
+        self.app_secret = app_secret
+        self.users = [f"5255{i:08d}" for i in range(users)]
+        self.status_ratio = status_ratio
+        self.random = random.Random(seed)
+
+    def next_request(self):
+        """
+        Returns:
+            tuple: (kind, body bytes, headers dict)
+        """
+        wa_id = self.random.choice(self.users)
+        if self.random.random() < self.status_ratio:
+            kind = "status"
+            body = status_body(wa_id, self.random.choice(["sent", "delivered", "read"]))
+        else:
+            kind = "message"
+            body = text_message_body(wa_id, self.random.choice(SAMPLE_MESSAGES))
+        payload = json.dumps(body).encode("utf-8")
+        headers = {
+            "Content-Type": "application/json",
+            "X-Hub-Signature-256": sign_payload(payload, self.app_secret),
+        }
+        return kind, payload, headers
@@ -1,10 +1,15 @@
 import logging
+import os
+import signal
 
 from app import create_app
+from app.services.lifecycle import install_signal_handlers
 
 
 app = create_app()
 
 if __name__ == "__main__":
     logging.info("Flask app started")
-    app.run(host="0.0.0.0", port=8000)
+    # SIGTERM drains the app, then stops the server as Ctrl+C would
+    install_signal_handlers(app, stop=lambda: os.kill(os.getpid(), signal.SIGINT))
+    app.run(host="0.0.0.0", port=int(os.getenv("PORT", "8000")))
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""
+Benchmark runner for WhatsApp Bot
+Times the hot per-message functions and fails on regressions
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+# Add current directory to path
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from benchmarks import micro
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "baselines.json")
+
+# Slowdowns smaller than this many ns per call are timer and scheduling noise,
+# whatever ratio they make on a benchmark of a few dozen ns
+NOISE_FLOOR_NS = 25.0
+
+
+def load_baselines(path):
+    """Load stored baselines, or an empty set if none exist yet"""
+    if not os.path.exists(path):
+        return {"calibration_ns": None, "benchmarks": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baselines(path, calibration, results, tolerance):
+    data = {
+        "calibration_ns": round(calibration, 1),
+        "tolerance": tolerance,
+        "benchmarks": {name: {"ns_per_call": round(ns, 1)} for name, ns in sorted(results.items())},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+
+
+def compare(results, baselines, calibration, tolerance, normalize=True, noise_floor=NOISE_FLOOR_NS):
+    """
+    Compare results against baselines.
+
+    Timings are scaled by the ratio of the stored and current calibration
+    loop so a faster or slower machine does not look like a regression. A
+    regression must also be slower than the baseline by more than
+    `noise_floor` ns per call.
+
+    Returns:
+        list: (name, current ns, baseline ns, ratio, regressed) tuples
+    """
+    scale = 1.0
+    if normalize and baselines.get("calibration_ns"):
+        scale = baselines["calibration_ns"] / calibration
+
+    rows = []
+    for name, ns in sorted(results.items()):
+        entry = baselines["benchmarks"].get(name)
+        if entry is None:
+            rows.append((name, ns, None, None, False))
+            continue
+        allowed = entry.get("tolerance", tolerance)
+        ratio = ns * scale / entry["ns_per_call"]
+        regressed = ratio > 1 + allowed and ns * scale - entry["ns_per_call"] > noise_floor
+        rows.append((name, ns, entry["ns_per_call"], ratio, regressed))
+    return rows
+
+
+def run_benchmarks(argv=None):
+    """Run the microbenchmarks and check them against the baselines"""
+    parser = argparse.ArgumentParser(description="Run WhatsApp Bot microbenchmarks")
+    parser.add_argument("names", nargs="*", help="Only run benchmarks whose name contains one of these")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=None,
+                        help="Allowed slowdown before failing, e.g. 0.25 = 25%% (default: from baseline file or 0.25)")
+    parser.add_argument("--update", action="store_true", help="Store the current timings as the new baseline")
+    parser.add_argument("--no-normalize", action="store_true", help="Do not scale by the calibration loop")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions per benchmark (best is kept)")
+    args = parser.parse_args(argv)
+
+    # Benchmarked functions log; keep the output readable
+    logging.disable(logging.CRITICAL)
+
+    baselines = load_baselines(args.baseline)
+    tolerance = args.tolerance if args.tolerance is not None else baselines.get("tolerance", 0.25)
+
+    calibration = micro.calibrate()
+    results = micro.run(args.names, repeat=args.repeat)
+
+    if args.update:
+        if args.names:
+            # Partial update keeps the other stored baselines
+            merged = {name: entry["ns_per_call"] for name, entry in baselines["benchmarks"].items()}
+            scale = calibration / baselines["calibration_ns"] if baselines.get("calibration_ns") else 1.0
+            merged = {name: ns * scale for name, ns in merged.items()}
+            merged.update(results)
+            results = merged
+        save_baselines(args.baseline, calibration, results, tolerance)
+        for name, ns in sorted(results.items()):
+            print(f"{name:<50} {ns:>12.1f} ns/call")
+        print(f"\nBaselines written to {args.baseline}")
+        return 0
+
+    rows = compare(results, baselines, calibration, tolerance, normalize=not args.no_normalize)
+    suspects = [row[0] for row in rows if row[4]]
+    if suspects:
+        # A busy machine slows a few benchmarks at random: fail only on a
+        # slowdown that shows again when measured a second time
+        calibration = micro.calibrate()
+        rechecked = {name: micro.run_one(name, repeat=args.repeat) for name in suspects}
+        rechecked = {row[0]: row for row in compare(rechecked, baselines, calibration, tolerance,
+                                                    normalize=not args.no_normalize)}
+        rows = [rechecked.get(row[0], row) for row in rows]
+
+    failed = False
+    print(f"{'benchmark':<50} {'ns/call':>12} {'baseline':>12} {'ratio':>8}")
+    print("-" * 86)
+    for name, ns, base, ratio, regressed in rows:
+        if base is None:
+            print(f"{name:<50} {ns:>12.1f} {'(none)':>12} {'':>8}")
+            continue
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{name:<50} {ns:>12.1f} {base:>12.1f} {ratio:>7.2f}x{flag}")
+        failed = failed or regressed
+
+    print()
+    print(f"Tolerance: {tolerance:.0%} | calibration: {calibration:.1f} ns")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    print("=" * 70)
+    print("Running WhatsApp Bot Benchmarks")
+    print("=" * 70)
+    print()
+
+    exit_code = run_benchmarks()
+
+    print()
+    print("=" * 70)
+    if exit_code == 0:
+        print("[PASS] No benchmark regressions!")
+    else:
+        print("[FAIL] Some benchmarks regressed. Please review the output above.")
+    print("=" * 70)
+
+    sys.exit(exit_code)
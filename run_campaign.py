@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Campaign sender for WhatsApp Bot
+Sends a template to every recipient of a CSV or JSONL file, rate limited,
+resumable after a crash, with per-recipient results
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+
+# Add current directory to path
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from flask import Flask
+
+from app.config import load_configurations
+from app.services.campaign import Campaign
+from app.services.media_manager import init_media_manager
+from app.utils.whatsapp_utils import get_template_message_input, post_message
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Send a WhatsApp template to a list of recipients")
+    parser.add_argument("recipients", help="CSV (with a wa_id or phone column) or JSONL file")
+    parser.add_argument("--template", default="mensaje_de_bienvenida", help="Approved template name")
+    parser.add_argument("--language", default="es", help="Template language code")
+    parser.add_argument("--header-image", default=None,
+                        help="Header image URL or file, uploaded once (default: none)")
+    parser.add_argument("--body-params", default="",
+                        help="Comma-separated recipient columns used as the template's body parameters")
+    parser.add_argument("--results", default=None,
+                        help="JSONL results file; reuse it to resume (default: <recipients>.results.jsonl)")
+    parser.add_argument("--rate", type=float, default=20.0, help="Messages per second (0 = unlimited)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Sends in flight")
+    parser.add_argument("--max-retries", type=int, default=3, help="Retries of throttled or failed sends")
+    parser.add_argument("--report-every", type=float, default=5.0, help="Seconds between progress lines")
+    parser.add_argument("--dry-run", action="store_true", help="Send to a local stub Graph API instead of Meta")
+    parser.add_argument("--stub-latency", type=float, default=0.05, help="Stub Graph API latency (s) for --dry-run")
+    parser.add_argument("--stub-error-rate", type=float, default=0.0, help="Stub Graph API error rate for --dry-run")
+    return parser
+
+
+def make_payload_builder(template, language, header_image_url=None, header_image_id=None, body_params=()):
+    def build_payload(record):
+        data = json.loads(get_template_message_input(
+            record["wa_id"],
+            template,
+            language_code=language,
+            header_image_url=header_image_url,
+            header_image_id=header_image_id,
+        ))
+        if body_params:
+            components = data["template"].setdefault("components", [])
+            components.append({
+                "type": "body",
+                "parameters": [{"type": "text", "text": str(record.get(column, ""))} for column in body_params],
+            })
+        return json.dumps(data)
+    return build_payload
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
+    results_path = args.results or f"{os.path.splitext(args.recipients)[0]}.results.jsonl"
+
+    app = Flask(__name__)
+    load_configurations(app)
+
+    with contextlib.ExitStack() as stack:
+        if args.dry_run:
+            from benchmarks.stub_servers import graph_api_stub
+
+            graph = stack.enter_context(graph_api_stub(latency=args.stub_latency, error_rate=args.stub_error_rate))
+            app.config.update(GRAPH_API_URL=graph.url, ACCESS_TOKEN="dry-run", VERSION="v18.0",
+                              PHONE_NUMBER_ID="dry-run")
+            print(f"Dry run against stub Graph API at {graph.url}")
+
+        header_image_url = header_image_id = None
+        if args.header_image:
+            if args.header_image.startswith(("http://", "https://")):
+                header_image_url = args.header_image
+            if not args.dry_run:
+                # Uploaded once instead of Meta fetching the link for every recipient
+                header_image_id = init_media_manager(app).get_media_id(args.header_image)
+
+        def send(payload):
+            with app.app_context():
+                return post_message(payload)
+
+        campaign = Campaign(
+            args.recipients,
+            results_path,
+            make_payload_builder(
+                args.template,
+                args.language,
+                header_image_url=header_image_url,
+                header_image_id=header_image_id,
+                body_params=[c.strip() for c in args.body_params.split(",") if c.strip()],
+            ),
+            send,
+            rate=args.rate,
+            concurrency=args.concurrency,
+            max_retries=args.max_retries,
+            dry_run=args.dry_run,
+        )
+        progress = campaign.run(report_every=args.report_every, report=print)
+
+    print(f"Results written to {results_path}")
+    return 0 if progress.failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Unit tests for webhook admission control and load shedding
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+
+from app.decorators.admission import CLAIMED, DUPLICATE, IN_FLIGHT, AdmissionController, init_admission_control
+from app.services.status_store import init_status_store
+from app.utils import metrics
+from app.views import webhook_blueprint
+from benchmarks.webhook_traffic import sign_payload, status_body, text_message_body
+
+
+def make_app(**overrides):
+    app = Flask(__name__)
+    app.config.update(
+        APP_SECRET="test-secret",
+        ADMIN_TOKEN="admin",
+        MAX_WEBHOOK_BODY_BYTES=1024 * 1024,
+        STATUS_STORE_PATH=os.path.join(tempfile.mkdtemp(), "statuses.bin"),
+        STATUS_FLUSH_SIZE=512,
+        STATUS_FLUSH_INTERVAL=5.0,
+        WEBHOOK_MAX_IN_FLIGHT=4,
+        WEBHOOK_MAX_QUEUE=4,
+        WEBHOOK_QUEUE_TIMEOUT=0.05,
+        WEBHOOK_STATUS_SHARE=0.5,
+        WEBHOOK_RETRY_AFTER=7,
+    )
+    app.config.update(overrides)
+    init_status_store(app)
+    init_admission_control(app)
+    app.register_blueprint(webhook_blueprint)
+    return app
+
+
+def post(app, body):
+    payload = json.dumps(body).encode("utf-8")
+    return app.test_client().post(
+        "/webhook",
+        data=payload,
+        headers={"Content-Type": "application/json", "X-Hub-Signature-256": sign_payload(payload, "test-secret")},
+    )
+
+
+class TestAdmissionController(unittest.TestCase):
+    """Test cases for AdmissionController"""
+
+    def test_messages_use_all_slots(self):
+        """Test that messages are admitted up to max_in_flight"""
+        controller = AdmissionController(max_in_flight=2, max_queue=0)
+        self.assertIsNone(controller.admit("message"))
+        self.assertIsNone(controller.admit("message"))
+        self.assertEqual(controller.admit("message"), "queue_full")
+
+    def test_statuses_shed_first(self):
+        """Test that statuses only get their share of the slots"""
+        controller = AdmissionController(max_in_flight=4, status_share=0.5)
+        self.assertIsNone(controller.admit("status"))
+        self.assertIsNone(controller.admit("status"))
+        self.assertEqual(controller.admit("status"), "status_overload")
+        self.assertIsNone(controller.admit("message"))
+
+    def test_queue_timeout(self):
+        """Test that a queued message is shed after the timeout"""
+        controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=0.05)
+        controller.admit("message")
+        self.assertEqual(controller.admit("message"), "queue_timeout")
+
+    def test_queued_message_gets_released_slot(self):
+        """Test that a waiting message is admitted when a slot frees up"""
+        controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=2)
+        controller.admit("message")
+        threading.Timer(0.05, controller.release).start()
+        self.assertIsNone(controller.admit("message"))
+
+    def test_duplicates(self):
+        """Test that already claimed message ids are reported as duplicates"""
+        controller = AdmissionController()
+        self.assertEqual(controller.claim_messages(["a"]), CLAIMED)
+        self.assertEqual(controller.claim_messages(["a"]), IN_FLIGHT)
+        controller.unclaim_messages(["a"])
+        self.assertEqual(controller.claim_messages(["a"]), CLAIMED)
+        controller.complete_messages(["a"])
+        self.assertEqual(controller.claim_messages(["a"]), DUPLICATE)
+
+
+class TestAdmissionEndpoint(unittest.TestCase):
+    """Test cases for the admission-controlled webhook"""
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_over_capacity_returns_503(self):
+        """Test fast 503 with Retry-After and a shed metric"""
+        app = make_app()
+        app.extensions["admission"].in_flight = 4
+        start = time.perf_counter()
+        response = post(app, text_message_body("5215500000001", "hola"))
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "7")
+        self.assertEqual(metrics.get_counter("webhook_shed", kind="message", reason="queue_timeout"), 1)
+
+    def test_status_shed_under_load(self):
+        """Test that statuses are shed while messages still have room"""
+        app = make_app()
+        app.extensions["admission"].in_flight = 2
+        response = post(app, status_body("5215500000001"))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(metrics.get_counter("webhook_shed", kind="status", reason="status_overload"), 1)
+
+    @mock.patch("app.views.process_whatsapp_message")
+    def test_duplicate_delivery_not_processed(self, process):
+        """Test that Meta retries of the same message are acknowledged once"""
+        app = make_app()
+        body = text_message_body("5215500000001", "hola")
+        self.assertEqual(post(app, body).status_code, 200)
+        self.assertEqual(post(app, body).status_code, 200)
+        self.assertEqual(process.call_count, 1)
+        self.assertEqual(metrics.get_counter("webhook_shed", kind="duplicate", reason="duplicate"), 1)
+        self.assertEqual(app.extensions["admission"].in_flight, 0)
+
+    @mock.patch("app.views.process_whatsapp_message")
+    def test_duplicate_while_in_flight(self, process):
+        """Test that a retry arriving while the first delivery runs gets 503, and is accepted if that one fails"""
+        app = make_app()
+        body = text_message_body("5215500000001", "hola")
+        started, release = threading.Event(), threading.Event()
+
+        def fail_slowly(batch):
+            started.set()
+            release.wait(5)
+            raise RuntimeError("Graph API down")
+
+        process.side_effect = fail_slowly
+        first = threading.Thread(target=post, args=(app, body))
+        first.start()
+        self.assertTrue(started.wait(5))
+        retry = post(app, body)
+        self.assertEqual(retry.status_code, 503)
+        self.assertEqual(retry.headers["Retry-After"], "7")
+        self.assertEqual(metrics.get_counter("webhook_shed", kind="duplicate", reason="in_flight"), 1)
+        release.set()
+        first.join()
+
+        process.side_effect = None
+        self.assertEqual(post(app, body).status_code, 200)
+        self.assertEqual(process.call_count, 2)
+
+    def test_metrics_endpoint_requires_token(self):
+        """Test that /metrics needs the admin token"""
+        client = make_app().test_client()
+        self.assertEqual(client.get("/metrics").status_code, 401)
+        response = client.get("/metrics", headers={"Authorization": "Bearer admin"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("counters", response.get_json())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,242 @@
+"""
+Unit tests for cross-node conversation affinity
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask, current_app
+
+from app.services.affinity import FORWARDED_HEADER, SECRET_HEADER, Cluster, HashRing, init_affinity
+from app.services.status_store import init_status_store
+from app.utils.webhook_events import parse_webhook
+from app.views import webhook_blueprint
+from benchmarks.load_test import serve_wsgi
+from benchmarks.webhook_traffic import sign_payload, text_message_body
+
+KEYS = [f"52155{i:08d}" for i in range(3000)]
+
+
+def make_app():
+    app = Flask(__name__)
+    app.config.update(
+        APP_SECRET="test-secret",
+        MAX_WEBHOOK_BODY_BYTES=1024 * 1024,
+        STATUS_STORE_PATH=os.path.join(tempfile.mkdtemp(), "statuses.bin"),
+        STATUS_FLUSH_SIZE=512,
+        STATUS_FLUSH_INTERVAL=5.0,
+    )
+    init_status_store(app)
+    app.register_blueprint(webhook_blueprint)
+    return app
+
+
+def batch_body(*wa_ids):
+    """One webhook body with a text message from each wa_id."""
+    body = text_message_body(wa_ids[0], "hola")
+    value = body["entry"][0]["changes"][0]["value"]
+    for wa_id in wa_ids[1:]:
+        other = text_message_body(wa_id, "hola")["entry"][0]["changes"][0]["value"]
+        value["contacts"] += other["contacts"]
+        value["messages"] += other["messages"]
+    return body
+
+
+class TestHashRing(unittest.TestCase):
+    """Test cases for HashRing"""
+
+    def test_spreads_keys(self):
+        """Test that every node owns a fair share of the keys"""
+        ring = HashRing(["a", "b", "c"])
+        counts = {}
+        for key in KEYS:
+            counts[ring.node_for(key)] = counts.get(ring.node_for(key), 0) + 1
+        self.assertEqual(set(counts), {"a", "b", "c"})
+        for count in counts.values():
+            self.assertGreater(count, len(KEYS) * 0.2)
+
+    def test_adding_a_node_moves_only_its_keys(self):
+        """Test that a new member only takes keys, about 1/N of them"""
+        ring = HashRing(["a", "b", "c"])
+        before = {key: ring.node_for(key) for key in KEYS}
+        ring.add("d")
+        moved = [key for key in KEYS if ring.node_for(key) != before[key]]
+        self.assertTrue(all(ring.node_for(key) == "d" for key in moved))
+        self.assertLess(len(moved), len(KEYS) * 0.4)
+
+        ring.remove("d")
+        self.assertEqual({key: ring.node_for(key) for key in KEYS}, before)
+
+    def test_empty_ring(self):
+        self.assertIsNone(HashRing().node_for("521"))
+
+
+class TestCluster(unittest.TestCase):
+    """Test cases for Cluster"""
+
+    def test_split(self):
+        """Test that messages are grouped by owner, and forwarded ones stay here"""
+        cluster = Cluster("a", ["a", "b"])
+        events = parse_webhook(batch_body(*KEYS[:20])).messages
+        local, remote = cluster.split(events)
+        self.assertTrue(local and remote)
+        self.assertTrue(all(cluster.owner(e.wa_id) == "a" for e in local))
+        self.assertEqual(set(remote), {"b"})
+
+        local, remote = cluster.split(events, forwarded=",".join(KEYS[:2]))
+        self.assertEqual([e.wa_id for e in local], KEYS[:2])
+        self.assertEqual(remote, {})
+
+    def test_set_nodes_keeps_self(self):
+        cluster = Cluster("a", ["a", "b"])
+        cluster.set_nodes(["b", "c"])
+        self.assertEqual(cluster.nodes, ["a", "b", "c"])
+
+    def test_self_must_be_a_member(self):
+        app = Flask(__name__)
+        app.config.update(CLUSTER_NODES="http://n1:8000,http://n2:8000", CLUSTER_SELF="http://n3:8000",
+                          CLUSTER_SECRET="s", CLUSTER_FORWARD_TIMEOUT=15.0)
+        with self.assertRaises(ValueError):
+            init_affinity(app)
+        app.config.update(CLUSTER_NODES=None)
+        self.assertIsNone(init_affinity(app))
+
+    def test_secret_required(self):
+        """Test that a cluster cannot start without the shared secret"""
+        app = Flask(__name__)
+        app.config.update(CLUSTER_NODES="http://n1:8000,http://n2:8000", CLUSTER_SELF="http://n1:8000",
+                          CLUSTER_FORWARD_TIMEOUT=15.0)
+        with self.assertRaises(ValueError):
+            init_affinity(app)
+        app.config.update(CLUSTER_SECRET="s")
+        self.assertTrue(init_affinity(app).is_peer("s"))
+
+    def test_is_peer(self):
+        cluster = Cluster("a", ["a", "b"], secret="s3cret")
+        self.assertTrue(cluster.is_peer("s3cret"))
+        self.assertFalse(cluster.is_peer("guess"))
+        self.assertFalse(cluster.is_peer(None))
+        self.assertFalse(Cluster("a", ["a", "b"]).is_peer(""))
+
+    def test_put_nodes_validated(self):
+        """Test that PUT /cluster only accepts a non-empty list of http(s) URLs"""
+        app = make_app()
+        app.config["ADMIN_TOKEN"] = "admin"
+        app.extensions["affinity"] = Cluster("http://a:8000", ["http://a:8000"], secret="s")
+        client = app.test_client()
+        headers = {"Authorization": "Bearer admin"}
+        for body in ({"nodes": []}, {"nodes": "http://b:8000"}, {"nodes": ["b:8000"]},
+                     {"nodes": [1]}, {"nodes": ["ftp://b"]}, ["http://b:8000"]):
+            self.assertEqual(client.put("/cluster", json=body, headers=headers).status_code, 400, body)
+        response = client.put("/cluster", json={"nodes": ["http://b:8000/", "http://b:8000", "https://c"]},
+                              headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["nodes"], ["http://a:8000", "http://b:8000", "https://c"])
+
+
+class TestMultiInstance(unittest.TestCase):
+    """Three instances on local ports behind a 'load balancer' that picks any of them"""
+
+    def setUp(self):
+        self.handled = []
+        self.lock = threading.Lock()
+
+        self.delays = {}
+
+        def record(batch):
+            time.sleep(self.delays.get(current_app.extensions["affinity"].self_node, 0))
+            with self.lock:
+                for event in batch.messages:
+                    self.handled.append((current_app.extensions["affinity"].self_node, event.wa_id))
+
+        patcher = mock.patch("app.views.process_whatsapp_message", side_effect=record)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.apps = [make_app() for _ in range(3)]
+        self.servers = [serve_wsgi(app) for app in self.apps]
+        self.urls = [server.__enter__() for server in self.servers]
+        for app, url in zip(self.apps, self.urls):
+            app.extensions["affinity"] = Cluster(url, self.urls, timeout=5, secret="cluster-secret")
+        self.ring = HashRing(self.urls)
+
+    def tearDown(self):
+        for server in self.servers:
+            server.__exit__(None, None, None)
+
+    def post(self, url, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        headers = {"Content-Type": "application/json", "X-Hub-Signature-256": sign_payload(payload, "test-secret"),
+                   **(headers or {})}
+        return requests.post(f"{url}/webhook", data=payload, headers=headers, timeout=10)
+
+    def test_messages_answered_by_their_owner(self):
+        """Test that each wa_id is answered once, always on the node owning it"""
+        wa_ids = KEYS[:12]
+        for i, wa_id in enumerate(wa_ids * 2):
+            response = self.post(self.urls[i % 3], text_message_body(wa_id, "hola"))
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.handled), len(wa_ids) * 2)
+        for node, wa_id in self.handled:
+            self.assertEqual(node, self.ring.node_for(wa_id))
+
+    def test_unverified_listing_is_routed(self):
+        """Test that a client's X-Affinity-Forwarded header does not keep a message off its owner"""
+        wa_id = next(k for k in KEYS if self.ring.node_for(k) == self.urls[1])
+        for secret in (None, "guess"):
+            headers = {FORWARDED_HEADER: wa_id}
+            if secret is not None:
+                headers[SECRET_HEADER] = secret
+            self.assertEqual(self.post(self.urls[0], text_message_body(wa_id, "hola"), headers).status_code, 200)
+        self.assertEqual(self.handled, [(self.urls[1], wa_id)] * 2)
+
+    def test_batch_split_across_nodes(self):
+        """Test that a body with several senders is answered piecewise by their owners"""
+        wa_ids = KEYS[:9]
+        self.assertEqual(self.post(self.urls[0], batch_body(*wa_ids)).status_code, 200)
+        self.assertEqual(sorted(w for _, w in self.handled), sorted(wa_ids))
+        for node, wa_id in self.handled:
+            self.assertEqual(node, self.ring.node_for(wa_id))
+
+    def test_unreachable_owner_answered_locally(self):
+        """Test that messages for a stopped node are answered where they arrive"""
+        self.servers[2].__exit__(None, None, None)
+        self.servers.pop()
+        wa_id = next(k for k in KEYS if self.ring.node_for(k) == self.urls[2])
+        self.assertEqual(self.post(self.urls[0], text_message_body(wa_id, "hola")).status_code, 200)
+        self.assertEqual(self.handled, [(self.urls[0], wa_id)])
+
+    def test_slow_owner_keeps_the_reply(self):
+        """Test that an owner still answering past the forward timeout is not doubled by a local reply"""
+        self.apps[0].extensions["affinity"].timeout = 0.1
+        self.delays[self.urls[1]] = 0.4
+        wa_id = next(k for k in KEYS if self.ring.node_for(k) == self.urls[1])
+        self.assertEqual(self.post(self.urls[0], text_message_body(wa_id, "hola")).status_code, 200)
+        deadline = time.monotonic() + 5
+        while not self.handled and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        self.assertEqual(self.handled, [(self.urls[1], wa_id)])
+
+    def test_forwards_run_concurrently(self):
+        """Test that a batch for two peers waits for the slower one, not for both in turn"""
+        self.delays[self.urls[1]] = self.delays[self.urls[2]] = 0.5
+        wa_ids = [next(k for k in KEYS if self.ring.node_for(k) == url) for url in self.urls[1:]]
+        started = time.monotonic()
+        self.assertEqual(self.post(self.urls[0], batch_body(*wa_ids)).status_code, 200)
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual(sorted(self.handled), sorted(zip(self.urls[1:], wa_ids)))
+
+
+if __name__ == '__main__':
+    unittest.main()
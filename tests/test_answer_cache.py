@@ -0,0 +1,99 @@
+"""
+Unit tests for the Assistant answer cache
+"""
+import os
+import sys
+import time
+import unittest
+from types import SimpleNamespace
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.answer_cache import (
+    AnswerCache,
+    assistant_fingerprint,
+    is_cacheable,
+    normalize_question,
+)
+
+
+class TestNormalization(unittest.TestCase):
+    """Test cases for question normalization"""
+
+    def test_phrasings_share_a_key(self):
+        """Test that case, accents, punctuation and stopwords are ignored"""
+        self.assertEqual(normalize_question("What is the WiFi password?"), "password wifi")
+        self.assertEqual(normalize_question("wifi password??"), "password wifi")
+        self.assertEqual(normalize_question("¿Contraseña del wifi?"), normalize_question("contrasena wifi"))
+
+    def test_word_order(self):
+        """Test that token-set hashing can be turned off"""
+        self.assertEqual(normalize_question("password wifi"), normalize_question("wifi password"))
+        self.assertNotEqual(
+            normalize_question("password wifi", token_set=False),
+            normalize_question("wifi password", token_set=False),
+        )
+
+    def test_personal_questions_not_cacheable(self):
+        """Test that booking-specific and numeric questions skip the cache"""
+        self.assertTrue(is_cacheable("What time is check-out?"))
+        self.assertFalse(is_cacheable("Can I change my booking?"))
+        self.assertFalse(is_cacheable("Is apartment 12 free on the 3rd?"))
+        self.assertFalse(is_cacheable("¿Dónde está mi reserva?"))
+        self.assertFalse(is_cacheable(" ".join(["word"] * 20)))
+
+
+class TestAnswerCache(unittest.TestCase):
+    """Test cases for AnswerCache"""
+
+    def test_hit_and_counters(self):
+        """Test that rephrased questions hit and hits are counted per entry"""
+        cache = AnswerCache()
+        self.assertIsNone(cache.get("wifi password?"))
+        cache.put("What is the wifi password?", "It is 'paris2024'")
+        self.assertEqual(cache.get("WIFI password"), "It is 'paris2024'")
+        cache.get("password of the wifi")
+        self.assertEqual(cache.stats(), {"entries": 1, "hits": {"password wifi": 2}})
+
+    def test_uncacheable_not_stored(self):
+        """Test that personal questions are never stored"""
+        cache = AnswerCache()
+        cache.put("When is my booking?", "Tomorrow")
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_ttl(self):
+        """Test that expired entries are not served"""
+        cache = AnswerCache(ttl=0.01)
+        cache.put("wifi password", "secret")
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("wifi password"))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted"""
+        cache = AnswerCache(max_entries=2)
+        cache.put("wifi password", "a")
+        cache.put("check out time", "b")
+        cache.get("wifi password")
+        cache.put("parking", "c")
+        self.assertEqual(cache.get("wifi password"), "a")
+        self.assertIsNone(cache.get("check out time"))
+
+    def test_fingerprint_invalidation(self):
+        """Test that a changed Assistant configuration clears the cache"""
+        assistant = SimpleNamespace(id="asst_1", model="gpt-4", instructions="Be helpful", tools=[], file_ids=["f1"])
+        cache = AnswerCache()
+        self.assertFalse(cache.check_fingerprint(assistant_fingerprint(assistant)))
+        cache.put("wifi password", "secret")
+
+        self.assertFalse(cache.check_fingerprint(assistant_fingerprint(assistant)))
+        self.assertEqual(cache.get("wifi password"), "secret")
+
+        assistant.file_ids = ["f1", "f2"]
+        self.assertTrue(cache.check_fingerprint(assistant_fingerprint(assistant)))
+        self.assertIsNone(cache.get("wifi password"))
+
+
+if __name__ == '__main__':
+    unittest.main()
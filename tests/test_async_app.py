@@ -0,0 +1,209 @@
+"""
+Unit tests for the async serving mode
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from aiohttp.test_utils import AioHTTPTestCase
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+
+from app.async_app import create_async_app
+from app.decorators.admission import init_admission_control
+from app.services.llm_fallback import DeadlineResponder
+from app.services.status_store import init_status_store
+from app.utils.message_handlers import greeted_users
+from app.utils.whatsapp_async import deliver_message_async
+from benchmarks.webhook_traffic import sign_payload, status_body, text_message_body
+
+
+def make_flask_app():
+    app = Flask(__name__)
+    app.config.update(
+        APP_SECRET="test-secret",
+        VERIFY_TOKEN="verify-me",
+        MAX_WEBHOOK_BODY_BYTES=1024 * 1024,
+        STATUS_STORE_PATH=os.path.join(tempfile.mkdtemp(), "statuses.bin"),
+        STATUS_FLUSH_SIZE=512,
+        STATUS_FLUSH_INTERVAL=5.0,
+        TYPING_INDICATOR=False,
+        WEBHOOK_MAX_IN_FLIGHT=4,
+        WEBHOOK_MAX_QUEUE=4,
+        WEBHOOK_QUEUE_TIMEOUT=1.0,
+        WEBHOOK_STATUS_SHARE=0.5,
+        WEBHOOK_RETRY_AFTER=3,
+    )
+    init_status_store(app)
+    init_admission_control(app)
+    return app
+
+
+def signed(body, secret="test-secret"):
+    payload = json.dumps(body).encode("utf-8")
+    return payload, {"Content-Type": "application/json", "X-Hub-Signature-256": sign_payload(payload, secret)}
+
+
+class TestAsyncWebhook(AioHTTPTestCase):
+    """Test cases for the aiohttp webhook app"""
+
+    async def get_application(self):
+        self.flask_app = make_flask_app()
+        return create_async_app(self.flask_app)
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.sent = []
+
+        async def fake_post(data):
+            self.sent.append(json.loads(data))
+            return f"wamid.{len(self.sent)}"
+
+        patcher = mock.patch("app.utils.whatsapp_async.post_message_async", side_effect=fake_post)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_verification(self):
+        """Test the subscription handshake"""
+        params = {"hub.mode": "subscribe", "hub.verify_token": "verify-me", "hub.challenge": "42"}
+        response = await self.client.get("/webhook", params=params)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(await response.text(), "42")
+
+        params["hub.verify_token"] = "wrong"
+        response = await self.client.get("/webhook", params=params)
+        self.assertEqual(response.status, 403)
+
+        response = await self.client.get("/webhook")
+        self.assertEqual(response.status, 400)
+
+    async def test_invalid_signature(self):
+        """Test that unsigned bodies are rejected"""
+        payload, headers = signed(status_body("5215500000001"), secret="other-secret")
+        response = await self.client.post("/webhook", data=payload, headers=headers)
+        self.assertEqual(response.status, 403)
+
+    async def test_invalid_json(self):
+        """Test that a signed body that is not JSON gets a 400"""
+        headers = {"X-Hub-Signature-256": sign_payload(b"{not json", "test-secret")}
+        response = await self.client.post("/webhook", data=b"{not json", headers=headers)
+        self.assertEqual(response.status, 400)
+
+    async def test_status_is_stored(self):
+        """Test the status fast path"""
+        payload, headers = signed(status_body("5215500000001", "read"))
+        response = await self.client.post("/webhook", data=payload, headers=headers)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(self.sent, [])
+        self.assertEqual(self.flask_app.extensions["status_store"].stats()["recorded"], 1)
+
+    async def test_message_is_answered(self):
+        """Test that a text message gets the keyword reply, once per message id"""
+        greeted_users.add("5215500000002")
+        payload, headers = signed(text_message_body("5215500000002", "hola"))
+        response = await self.client.post("/webhook", data=payload, headers=headers)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(self.sent[0]["to"], "5215500000002")
+
+        # Meta re-delivering the same message is acknowledged, not answered again
+        response = await self.client.post("/webhook", data=payload, headers=headers)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(len(self.sent), 1)
+
+    async def test_retry_while_in_flight(self):
+        """Test that a retry of a message still being answered gets 503 instead of an ack"""
+        body = text_message_body("5215500000003", "hola")
+        message_id = body["entry"][0]["changes"][0]["value"]["messages"][0]["id"]
+        self.flask_app.extensions["admission"].claim_messages([message_id])
+        payload, headers = signed(body)
+        response = await self.client.post("/webhook", data=payload, headers=headers)
+        self.assertEqual(response.status, 503)
+        self.assertEqual(response.headers["Retry-After"], "3")
+        self.assertEqual(self.sent, [])
+
+    async def test_concurrent_requests_share_the_loop(self):
+        """Test that slow Graph API calls overlap instead of queueing"""
+        async def slow_post(data):
+            await asyncio.sleep(0.2)
+            return "wamid.slow"
+
+        for i in range(10):
+            greeted_users.add(f"52155000001{i:02d}")
+        requests = [signed(text_message_body(f"52155000001{i:02d}", "hola")) for i in range(10)]
+        with mock.patch("app.utils.whatsapp_async.post_message_async", side_effect=slow_post):
+            start = asyncio.get_running_loop().time()
+            responses = await asyncio.gather(
+                *(self.client.post("/webhook", data=p, headers=h) for p, h in requests)
+            )
+            elapsed = asyncio.get_running_loop().time() - start
+        self.assertEqual([r.status for r in responses], [200] * 10)
+        self.assertLess(elapsed, 1.0)
+
+
+class TestRespondAsync(unittest.IsolatedAsyncioTestCase):
+    """Test cases for DeadlineResponder.respond_async"""
+
+    async def test_slow_answer_in_time(self):
+        """Test that an answer within the deadline is used"""
+        async def slow(message_body, wa_id, name):
+            await asyncio.sleep(0.01)
+            return "slow"
+
+        responder = DeadlineResponder(None, lambda body: "fast", deadline=1.0, async_slow_fn=slow)
+        self.assertEqual(await responder.respond_async("hola", "521", "Ana"), "slow")
+
+    async def test_deadline_miss_follows_up(self):
+        """Test that a late answer is delivered after the fast reply"""
+        async def slow(message_body, wa_id, name):
+            await asyncio.sleep(0.2)
+            return "slow"
+
+        late = asyncio.get_running_loop().create_future()
+        responder = DeadlineResponder(None, lambda body: "fast", deadline=0.05, async_slow_fn=slow)
+        reply = await responder.respond_async("hola", "521", "Ana", deliver_late=late.set_result)
+        self.assertEqual(reply, "fast")
+        self.assertEqual(await asyncio.wait_for(late, 1.0), "slow")
+
+    async def test_sync_slow_path_runs_on_the_pool(self):
+        """Test that responders without an async slow path still work"""
+        responder = DeadlineResponder(lambda body, wa_id, name: "slow", lambda body: "fast", deadline=1.0)
+        self.assertEqual(await responder.respond_async("hola", "521", "Ana"), "slow")
+        responder.shutdown()
+
+
+class TestDeliverMessageAsync(unittest.IsolatedAsyncioTestCase):
+    """Test cases for deliver_message_async with an outbox"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.outbox = mock.Mock()
+        self.app.extensions["outbox"] = self.outbox
+        self.context = self.app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+
+    @mock.patch("app.utils.whatsapp_async.send_message_async")
+    async def test_slow_commit_is_not_sent_twice(self, send_message_async):
+        """Test that a message still queued for the outbox does not also go out directly"""
+        self.outbox.enqueue.return_value = None
+        self.assertIsNone(await deliver_message_async("521", "{}"))
+        send_message_async.assert_not_called()
+
+    @mock.patch("app.utils.whatsapp_async.send_message_async")
+    async def test_unavailable_outbox_sends_directly(self, send_message_async):
+        """Test that a message the outbox refused is sent directly"""
+        self.outbox.enqueue.side_effect = RuntimeError("Outbox is shut down")
+        await deliver_message_async("521", "{}")
+        send_message_async.assert_called_once_with("{}")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+Unit tests for the microbenchmark runner
+"""
+import unittest
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks import micro
+from run_benchmarks import compare
+
+
+class TestBenchmarkRunner(unittest.TestCase):
+    """Test cases for baseline comparison"""
+
+    def setUp(self):
+        self.baselines = {
+            "calibration_ns": 1000.0,
+            "benchmarks": {
+                "fast": {"ns_per_call": 100.0},
+                "strict": {"ns_per_call": 100.0, "tolerance": 0.05},
+            },
+        }
+
+    def test_within_tolerance(self):
+        """Test that small slowdowns pass"""
+        rows = compare({"fast": 120.0}, self.baselines, calibration=1000.0, tolerance=0.25)
+        self.assertFalse(rows[0][4])
+
+    def test_regression_detected(self):
+        """Test that slowdowns beyond the tolerance fail"""
+        rows = compare({"fast": 130.0}, self.baselines, calibration=1000.0, tolerance=0.25)
+        self.assertTrue(rows[0][4])
+
+    def test_per_benchmark_tolerance(self):
+        """Test that a benchmark's own tolerance overrides the global one"""
+        rows = compare({"strict": 110.0}, self.baselines, calibration=1000.0, tolerance=0.25, noise_floor=0)
+        self.assertTrue(rows[0][4])
+
+    def test_calibration_normalizes(self):
+        """Test that a slower machine is not reported as a regression"""
+        rows = compare({"fast": 200.0}, self.baselines, calibration=2000.0, tolerance=0.25)
+        self.assertFalse(rows[0][4])
+
+    def test_noise_floor(self):
+        """Test that a few ns on a tiny benchmark are not a regression"""
+        baselines = {"calibration_ns": 1000.0, "benchmarks": {"tiny": {"ns_per_call": 60.0}}}
+        rows = compare({"tiny": 82.0}, baselines, calibration=1000.0, tolerance=0.25)
+        self.assertFalse(rows[0][4])
+        rows = compare({"tiny": 120.0}, baselines, calibration=1000.0, tolerance=0.25)
+        self.assertTrue(rows[0][4])
+
+    def test_new_benchmark_has_no_baseline(self):
+        """Test that benchmarks without a baseline never fail"""
+        rows = compare({"new": 1e9}, self.baselines, calibration=1000.0, tolerance=0.25)
+        self.assertIsNone(rows[0][2])
+        self.assertFalse(rows[0][4])
+
+    def test_all_benchmarks_run(self):
+        """Test that every registered benchmark can be set up and called"""
+        for name, setup in micro.BENCHMARKS.items():
+            func, corpus, *cleanup = setup()
+            try:
+                self.assertTrue(corpus, name)
+                func(corpus[0])
+            finally:
+                for undo in cleanup:
+                    undo()
+
+    def test_setup_leaves_no_state(self):
+        """Test that running the benchmarks leaves no app context or greeted users behind"""
+        from flask import has_app_context
+
+        from app.utils.message_handlers import greeted_users
+
+        greeted_users.add("5215500000999")
+        self.addCleanup(greeted_users.discard, "5215500000999")
+        micro.run(["should_send_welcome", "validate_signature", "status_store"], repeat=1, min_time=0.001)
+        self.assertFalse(has_app_context())
+        self.assertIn("5215500000999", greeted_users)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+"""
+Unit tests for the campaign sender
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.campaign import Campaign, TokenBucket, iter_recipients
+from run_campaign import main as run_campaign_main
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} error", response=response)
+
+
+class FakeGraph:
+    def __init__(self, errors=None):
+        self.sent = []
+        self.errors = errors or {}
+        self.lock = threading.Lock()
+
+    def __call__(self, payload):
+        with self.lock:
+            if self.errors.get(payload):
+                raise self.errors[payload].pop(0)
+            self.sent.append(payload)
+            return f"wamid.{len(self.sent)}"
+
+
+class TestCampaign(unittest.TestCase):
+    """Test cases for Campaign"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.recipients = os.path.join(self.directory, "recipients.csv")
+        self.results = os.path.join(self.directory, "results.jsonl")
+        with open(self.recipients, "w", encoding="utf-8") as f:
+            f.write("phone,name\n")
+            for i in range(20):
+                f.write(f"+52155{i:08d},N{i}\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def read_results(self):
+        with open(self.results, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def make_campaign(self, send, **kwargs):
+        kwargs.setdefault("rate", 0)
+        return Campaign(self.recipients, self.results, lambda record: record["wa_id"], send, **kwargs)
+
+    def test_iter_recipients(self):
+        """Test CSV and JSONL streaming and recipient normalization"""
+        self.assertEqual(next(iter_recipients(self.recipients))[1]["wa_id"], "5215500000000")
+        jsonl = os.path.join(self.directory, "r.jsonl")
+        with open(jsonl, "w", encoding="utf-8") as f:
+            f.write('{"wa_id": "1"}\n{"name": "no phone"}\n')
+        self.assertEqual([r and r["wa_id"] for _, r in iter_recipients(jsonl)], ["1", None])
+
+    def test_malformed_jsonl_rows_are_skipped(self):
+        """Test that bad JSON and non-object lines are recorded as skipped"""
+        jsonl = os.path.join(self.directory, "r.jsonl")
+        with open(jsonl, "w", encoding="utf-8") as f:
+            f.write('{"wa_id": "1"}\n{"wa_id": \n["2"]\n"3"\n{"wa_id": "4"}\n')
+        self.assertEqual([r and r["wa_id"] for _, r in iter_recipients(jsonl)], ["1", None, None, None, "4"])
+
+        self.recipients = jsonl
+        graph = FakeGraph()
+        progress = self.make_campaign(graph).run(report=lambda line: None)
+        self.assertEqual((progress.sent, progress.skipped), (2, 3))
+        self.assertEqual(graph.sent, ["1", "4"])
+
+    def test_sends_everyone_once(self):
+        """Test that every recipient gets one result line"""
+        graph = FakeGraph()
+        progress = self.make_campaign(graph, concurrency=4).run(report=lambda line: None)
+        self.assertEqual(progress.sent, 20)
+        self.assertEqual(len(set(graph.sent)), 20)
+        self.assertEqual(sorted(r["index"] for r in self.read_results()), list(range(20)))
+
+    def test_retries_and_failures(self):
+        """Test that throttling is retried and rejections are recorded"""
+        graph = FakeGraph(errors={"5215500000001": [http_error(429)], "5215500000002": [http_error(400)]})
+        campaign = self.make_campaign(graph)
+        with mock.patch("app.services.campaign.time.sleep"):
+            progress = campaign.run(report=lambda line: None)
+        results = {r["wa_id"]: r for r in self.read_results()}
+        self.assertEqual(results["5215500000001"]["status"], "sent")
+        self.assertEqual(results["5215500000002"]["status"], "failed")
+        self.assertEqual(progress.failed, 1)
+
+    def test_resume_skips_finished_recipients(self):
+        """Test that a restarted campaign only sends what was not finished"""
+        with open(self.results, "w", encoding="utf-8") as f:
+            for index in (0, 1, 2, 3, 7):
+                f.write(json.dumps({"index": index, "status": "sent"}) + "\n")
+            f.write('{"index": 8, "sta')  # Torn write from the crash
+        with open(f"{self.results}.checkpoint", "w", encoding="utf-8") as f:
+            json.dump({"next_index": 4}, f)
+
+        graph = FakeGraph()
+        self.make_campaign(graph).run(report=lambda line: None)
+        self.assertEqual(len(graph.sent), 15)
+        self.assertNotIn("5215500000007", graph.sent)
+        self.assertIn("5215500000008", graph.sent)
+        with open(self.results, "r", encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), 21)
+
+    def test_token_bucket(self):
+        """Test that the rate limit is applied after the burst"""
+        bucket = TokenBucket(rate=100, burst=1)
+        start = time.monotonic()
+        for _ in range(6):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.045)
+
+    def test_dry_run_cli(self):
+        """Test the command line against the stub Graph API"""
+        code = run_campaign_main([self.recipients, "--dry-run", "--stub-latency", "0", "--rate", "0",
+                                  "--results", self.results, "--report-every", "60"])
+        self.assertEqual(code, 0)
+        self.assertEqual({r["status"] for r in self.read_results()}, {"dry_run"})
+
+
+if __name__ == '__main__':
+    unittest.main()
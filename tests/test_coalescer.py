@@ -0,0 +1,152 @@
+"""
+Unit tests for outbound send coalescing
+"""
+import json
+import os
+import sys
+import threading
+import unittest
+from unittest import mock
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+
+from app.services.coalescer import SendCoalescer, init_send_coalescer
+from app.utils import metrics
+from app.utils.message_handlers import get_welcome_message, greeted_users, load_message
+from app.utils.whatsapp_utils import (
+    get_template_message_input,
+    get_text_message_input,
+    process_whatsapp_message,
+)
+from benchmarks.webhook_traffic import text_message_body
+
+
+class Recorder:
+    """deliver() stand-in recording each send."""
+
+    def __init__(self):
+        self.sent = []
+        self.delivered = threading.Event()
+
+    def __call__(self, recipient, data, sender):
+        message = json.loads(data)
+        self.sent.append((recipient, sender, message.get("type"), (message.get("text") or {}).get("body")))
+        self.delivered.set()
+        return len(self.sent)
+
+
+class TestSendCoalescer(unittest.TestCase):
+    """Test cases for SendCoalescer"""
+
+    def setUp(self):
+        metrics.reset()
+        self.recorder = Recorder()
+
+    def make_coalescer(self, **kwargs):
+        kwargs.setdefault("start", False)
+        coalescer = SendCoalescer(self.recorder, **kwargs)
+        self.addCleanup(coalescer.close)
+        return coalescer
+
+    def test_merges_consecutive_texts(self):
+        """Test that texts to one recipient go out as one message, in order"""
+        coalescer = self.make_coalescer()
+        self.assertIsNone(coalescer.submit("521", get_text_message_input("521", "uno")))
+        coalescer.submit("521", get_text_message_input("521", "dos"))
+        coalescer.submit("522", get_text_message_input("522", "otro"))
+        coalescer.submit("521", get_text_message_input("521", "tres"))
+        self.assertEqual(self.recorder.sent, [])
+        self.assertEqual(coalescer.flush("521"), 1)
+        self.assertEqual(self.recorder.sent, [("521", None, "text", "uno\n\ndos\n\ntres")])
+        self.assertEqual(coalescer.stats(), {"buffered": 1, "saved": 2})
+        self.assertEqual(metrics.get_counter("coalesced_sends_saved"), 2)
+
+    def test_template_is_never_merged(self):
+        """Test that a template flushes the buffered texts and follows them"""
+        coalescer = self.make_coalescer()
+        coalescer.submit("521", get_text_message_input("521", "uno"))
+        result = coalescer.submit("521", get_template_message_input("521", "recordatorio"))
+        self.assertEqual(result, 2)
+        coalescer.submit("521", get_text_message_input("521", "dos"))
+        coalescer.flush()
+        self.assertEqual([sent[2] for sent in self.recorder.sent], ["text", "template", "text"])
+        self.assertEqual(coalescer.stats()["saved"], 0)
+
+    def test_replies_quoting_a_message_are_not_merged(self):
+        coalescer = self.make_coalescer()
+        quoted = json.loads(get_text_message_input("521", "uno"))
+        quoted["context"] = {"message_id": "wamid.1"}
+        coalescer.submit("521", json.dumps(quoted))
+        coalescer.submit("521", get_text_message_input("521", "dos"))
+        coalescer.flush()
+        self.assertEqual([sent[3] for sent in self.recorder.sent], ["uno", "dos"])
+
+    def test_character_limit(self):
+        """Test that a merged body never exceeds max_chars"""
+        coalescer = self.make_coalescer(max_chars=10)
+        for text in ("abcd", "efgh", "ijkl", "mnopqrstuvwxyz"):
+            coalescer.submit("521", get_text_message_input("521", text))
+        coalescer.flush()
+        self.assertEqual([sent[3] for sent in self.recorder.sent], ["abcd\n\nefgh", "ijkl", "mnopqrstuvwxyz"])
+
+    def test_senders_are_not_merged(self):
+        coalescer = self.make_coalescer()
+        coalescer.submit("521", get_text_message_input("521", "uno"), sender="111")
+        coalescer.submit("521", get_text_message_input("521", "dos"), sender="222")
+        coalescer.flush()
+        self.assertEqual([sent[1] for sent in self.recorder.sent], ["111", "222"])
+
+    def test_window(self):
+        """Test that buffered texts are sent once their window ends"""
+        coalescer = self.make_coalescer(window=0.05, start=True)
+        coalescer.submit("521", get_text_message_input("521", "uno"))
+        coalescer.submit("521", get_text_message_input("521", "dos"))
+        self.assertTrue(self.recorder.delivered.wait(5))
+        self.assertEqual(self.recorder.sent, [("521", None, "text", "uno\n\ndos")])
+
+    def test_close_flushes(self):
+        coalescer = self.make_coalescer(window=60, start=True)
+        coalescer.submit("521", get_text_message_input("521", "uno"))
+        coalescer.close()
+        self.assertEqual(len(self.recorder.sent), 1)
+
+
+class TestCoalescedReplies(unittest.TestCase):
+    """Test cases for the coalescer on the reply path"""
+
+    def setUp(self):
+        self.wa_id = "5215500000777"
+        greeted_users.discard(self.wa_id)
+        self.addCleanup(greeted_users.discard, self.wa_id)
+        self.app = Flask(__name__)
+        self.app.config.update(
+            TYPING_INDICATOR=False,
+            WELCOME_HEADER_IMAGE="https://example.com/welcome.jpg",
+            SEND_COALESCE_WINDOW=60.0,
+            SEND_COALESCE_MAX_CHARS=4096,
+        )
+        coalescer = init_send_coalescer(self.app)
+        self.addCleanup(coalescer.close)
+        context = self.app.app_context()
+        context.push()
+        self.addCleanup(context.pop)
+
+    @mock.patch("app.utils.whatsapp_utils.send_message")
+    def test_welcome_flow_takes_two_calls(self, send_message):
+        """Test that a first contact sends the template, then menu and reply as one text"""
+        process_whatsapp_message(text_message_body(self.wa_id, "costos"))
+        payloads = [json.loads(call[0][0]) for call in send_message.call_args_list]
+        self.assertEqual([payload["type"] for payload in payloads], ["template", "text"])
+        self.assertEqual(payloads[1]["text"]["body"], get_welcome_message() + "\n\n" + load_message("costos.txt"))
+
+    def test_disabled(self):
+        app = Flask(__name__)
+        app.config["SEND_COALESCE_WINDOW"] = 0.0
+        self.assertIsNone(init_send_coalescer(app))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,186 @@
+"""
+Unit tests for readiness, warm-up and the graceful drain
+"""
+import json
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+
+from app.services.coalescer import init_send_coalescer
+from app.services.lifecycle import DRAINING, STOPPED, drain, init_lifecycle, install_signal_handlers
+from app.services.llm_fallback import DeadlineResponder
+from app.services.outbox import Outbox
+from app.services.sessions import SessionStore
+from app.services.warmup import init_warm_up
+from app.utils.message_handlers import greeted_users
+from app.utils.startup_profile import StartupProfile
+from app.views import webhook_blueprint
+from benchmarks.webhook_traffic import sign_payload, text_message_body
+
+WA_ID = "5215500000888"
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not met in time")
+        time.sleep(0.005)
+
+
+class TestDrain(unittest.TestCase):
+    """Test cases for drain() on an app with an outbox and a send coalescer"""
+
+    def setUp(self):
+        greeted_users.add(WA_ID)
+        self.addCleanup(greeted_users.discard, WA_ID)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+        self.app = Flask(__name__)
+        self.app.config.update(
+            APP_SECRET="test-secret",
+            TYPING_INDICATOR=False,
+            WEBHOOK_RETRY_AFTER=5,
+            SEND_COALESCE_WINDOW=60.0,
+            SEND_COALESCE_MAX_CHARS=4096,
+            SHUTDOWN_DRAIN_TIMEOUT=5.0,
+        )
+        self.app.register_blueprint(webhook_blueprint)
+        self.lifecycle = init_lifecycle(self.app)
+        self.lifecycle.mark_ready()
+
+        self.sent = []
+        self.outbox = Outbox(
+            os.path.join(self.directory, "outbox.db"),
+            lambda payload, sender=None: self.sent.append(json.loads(payload)["text"]["body"]) or "wamid.1",
+            poll_interval=0.01,
+        )
+        self.addCleanup(self.outbox.close)
+        self.app.extensions["outbox"] = self.outbox
+        self.addCleanup(init_send_coalescer(self.app).close)
+        self.sessions = SessionStore(spill_path=os.path.join(self.directory, "sessions_db"))
+        self.addCleanup(self.sessions.close)
+        self.app.extensions["sessions"] = self.sessions
+        self.client = self.app.test_client()
+
+    def post_message(self, text):
+        payload = json.dumps(text_message_body(WA_ID, text)).encode("utf-8")
+        return self.client.post(
+            "/webhook", data=payload,
+            headers={"Content-Type": "application/json", "X-Hub-Signature-256": sign_payload(payload, "test-secret")},
+        )
+
+    @mock.patch("app.utils.whatsapp_utils.generate_reply")
+    def test_in_flight_reply_is_not_lost(self, generate_reply):
+        """Test that a drain waits for the request in flight, refuses new ones and sends the reply"""
+        generate_reply.side_effect = lambda *args: time.sleep(0.3) or "respuesta lenta"
+        responses = []
+        request = threading.Thread(target=lambda: responses.append(self.post_message("hola")))
+        request.start()
+        wait_for(lambda: self.lifecycle.in_flight == 1)
+
+        reports = []
+        drainer = threading.Thread(target=lambda: reports.append(drain(self.app, 5.0)))
+        drainer.start()
+        wait_for(lambda: self.lifecycle.state == DRAINING)
+
+        refused = self.post_message("otra")
+        self.assertEqual(refused.status_code, 503)
+        self.assertEqual(refused.headers["Retry-After"], "5")
+        self.assertEqual(self.client.get("/ready").status_code, 503)
+        self.assertEqual(self.client.get("/health").status_code, 200)
+
+        request.join()
+        drainer.join()
+        self.assertEqual(responses[0].status_code, 200)
+        self.assertEqual(self.sent, ["respuesta lenta"])
+        report = reports[0]
+        self.assertTrue(report["requests_finished"])
+        self.assertEqual(report["outbox_pending"], 0)
+        self.assertEqual(self.lifecycle.state, STOPPED)
+
+    def test_deadline(self):
+        """Test that a stuck request does not hold the drain past its deadline"""
+        self.lifecycle.enter()
+        started = time.monotonic()
+        report = drain(self.app, 0.2)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertFalse(report["requests_finished"])
+        self.assertEqual(report["requests_left"], 1)
+
+    def test_sessions_are_persisted(self):
+        self.sessions.get(WA_ID).state = "booking:time"
+        drain(self.app, 1.0)
+        reopened = SessionStore(spill_path=os.path.join(self.directory, "sessions_db"))
+        self.addCleanup(reopened.close)
+        self.assertEqual(reopened.get(WA_ID).state, "booking:time")
+
+    def test_sigterm(self):
+        """Test that SIGTERM drains the app, then stops the server"""
+        stopped = threading.Event()
+        previous = signal.getsignal(signal.SIGTERM)
+        self.addCleanup(signal.signal, signal.SIGTERM, previous)
+        install_signal_handlers(self.app, stop=stopped.set)
+        os.kill(os.getpid(), signal.SIGTERM)
+        self.assertTrue(stopped.wait(5))
+        self.assertEqual(self.lifecycle.state, STOPPED)
+
+
+class TestReadiness(unittest.TestCase):
+    """Test cases for the warm-up and /ready"""
+
+    def make_app(self, mode):
+        app = Flask(__name__)
+        app.config.update(WARM_UP=mode, REPLY_ENGINE="keywords", WELCOME_HEADER_IMAGE="")
+        app.extensions["startup_profile"] = StartupProfile()
+        app.register_blueprint(webhook_blueprint)
+        init_lifecycle(app)
+        return app
+
+    def test_ready_after_background_warm_up(self):
+        app = self.make_app("background")
+        client = app.test_client()
+        thread = init_warm_up(app)
+        thread.join(5)
+        response = client.get("/ready")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["state"], "ready")
+        self.assertIn("graph_session", app.extensions)
+
+    def test_not_ready_while_starting(self):
+        app = self.make_app("off")
+        self.assertEqual(app.test_client().get("/ready").status_code, 503)
+        init_warm_up(app)
+        self.assertEqual(app.test_client().get("/ready").status_code, 200)
+
+
+class TestLateReplies(unittest.TestCase):
+    """Test cases for DeadlineResponder.wait_late"""
+
+    def test_wait_late(self):
+        """Test that a drain can wait for Assistant answers that missed their deadline"""
+        delivered = []
+        responder = DeadlineResponder(
+            lambda *args: time.sleep(0.2) or "tarde", lambda body: "rápido", deadline=0.01,
+        )
+        self.addCleanup(responder.shutdown)
+        self.assertEqual(responder.respond("hola", "521", "Ana", deliver_late=delivered.append), "rápido")
+        self.assertEqual(responder.late_pending, 1)
+        self.assertTrue(responder.wait_late(5))
+        self.assertEqual(delivered, ["tarde"])
+
+
+if __name__ == '__main__':
+    unittest.main()
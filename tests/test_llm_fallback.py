@@ -0,0 +1,145 @@
+"""
+Unit tests for the Assistant latency budget and circuit breaker
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.llm_fallback import CircuitBreaker, DeadlineResponder
+
+
+def fast(message_body):
+    return f"fast:{message_body}"
+
+
+def slow_after(seconds, answer="slow"):
+    def slow(message_body, wa_id, name):
+        time.sleep(seconds)
+        return answer
+    return slow
+
+
+def failing(message_body, wa_id, name):
+    raise RuntimeError("upstream error")
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """Test cases for CircuitBreaker"""
+
+    def test_opens_on_failures(self):
+        """Test that the breaker opens once the failure ratio is reached"""
+        breaker = CircuitBreaker(window=4, failure_ratio=0.5, min_calls=4, cooldown=60)
+        for success in (True, True, False, False):
+            breaker.record(breaker.allow(), success)
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+    def test_needs_minimum_calls(self):
+        """Test that a single failure does not open the breaker"""
+        breaker = CircuitBreaker(min_calls=5)
+        breaker.record(breaker.allow(), False)
+        self.assertEqual(breaker.state, "closed")
+
+    def test_half_open_trial(self):
+        """Test that one trial call is let through after the cooldown"""
+        breaker = CircuitBreaker(window=2, min_calls=2, cooldown=0.01)
+        breaker.record(breaker.allow(), False)
+        breaker.record(breaker.allow(), False)
+        time.sleep(0.02)
+        trial = breaker.allow()
+        self.assertTrue(trial)
+        self.assertFalse(breaker.allow())
+        breaker.record(trial, True)
+        self.assertEqual(breaker.state, "closed")
+
+    def test_late_results_are_ignored_while_open(self):
+        """Test that calls admitted before the breaker opened neither close it nor restart the cooldown"""
+        breaker = CircuitBreaker(window=2, min_calls=2, cooldown=0.05)
+        late_success, late_failure = breaker.allow(), breaker.allow()
+        breaker.record(breaker.allow(), False)
+        breaker.record(breaker.allow(), False)
+        self.assertEqual(breaker.state, "open")
+
+        breaker.record(late_success, True)
+        self.assertEqual(breaker.state, "open")
+        time.sleep(0.06)
+        breaker.record(late_failure, False)
+        self.assertEqual(breaker.state, "half-open")
+
+        trial = breaker.allow()
+        breaker.record(late_success, True)
+        self.assertEqual(breaker.state, "half-open")
+        self.assertIsNone(breaker.allow())
+        breaker.record(trial, True)
+        self.assertEqual(breaker.state, "closed")
+
+        # A stale failure from before the trial does not count towards reopening
+        breaker.record(late_failure, False)
+        breaker.record(late_failure, False)
+        self.assertEqual(breaker.state, "closed")
+
+
+class TestDeadlineResponder(unittest.TestCase):
+    """Test cases for DeadlineResponder"""
+
+    def test_fast_enough_slow_path(self):
+        """Test that an answer within the deadline is used"""
+        responder = DeadlineResponder(slow_after(0), fast, deadline=1)
+        self.assertEqual(responder.respond("hola", "1", "Ana"), "slow")
+
+    def test_deadline_falls_back(self):
+        """Test that a late Assistant gets the keyword reply within the budget"""
+        responder = DeadlineResponder(slow_after(0.3), fast, deadline=0.05, late_reply="drop")
+        start = time.perf_counter()
+        self.assertEqual(responder.respond("hola", "1", "Ana"), "fast:hola")
+        self.assertLess(time.perf_counter() - start, 0.25)
+
+    def test_holding_message(self):
+        """Test that a configured holding message replaces the fast reply"""
+        responder = DeadlineResponder(slow_after(0.3), fast, deadline=0.05, holding_message="Un momento...")
+        self.assertEqual(responder.respond("hola", "1", "Ana"), "Un momento...")
+
+    def test_late_answer_follow_up(self):
+        """Test that late answers are delivered when configured"""
+        delivered = threading.Event()
+        answers = []
+
+        def deliver(text):
+            answers.append(text)
+            delivered.set()
+
+        responder = DeadlineResponder(slow_after(0.1, "tarde"), fast, deadline=0.01, late_reply="followup")
+        responder.respond("hola", "1", "Ana", deliver_late=deliver)
+        self.assertTrue(delivered.wait(2))
+        self.assertEqual(answers, ["tarde"])
+
+    def test_late_answer_dropped(self):
+        """Test that late answers are discarded when configured"""
+        answers = []
+        responder = DeadlineResponder(slow_after(0.05), fast, deadline=0.01, late_reply="drop")
+        responder.respond("hola", "1", "Ana", deliver_late=answers.append)
+        responder.shutdown()
+        self.assertEqual(answers, [])
+
+    def test_errors_fall_back_and_open_breaker(self):
+        """Test that errors use the fast path and eventually skip the Assistant"""
+        calls = []
+
+        def counting_failure(*args):
+            calls.append(args)
+            return failing(*args)
+
+        breaker = CircuitBreaker(window=3, min_calls=3, cooldown=60)
+        responder = DeadlineResponder(counting_failure, fast, deadline=1, breaker=breaker)
+        for _ in range(5):
+            self.assertEqual(responder.respond("hola", "1", "Ana"), "fast:hola")
+        self.assertEqual(len(calls), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
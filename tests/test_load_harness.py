@@ -0,0 +1,90 @@
+"""
+Unit tests for the load-test harness (stub servers and signed traffic)
+"""
+import json
+import logging
+import os
+import sys
+import unittest
+
+import requests
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.load_test import configure_environment, drive, percentile, serve_wsgi
+from benchmarks.stub_servers import graph_api_stub
+from benchmarks.webhook_traffic import TrafficGenerator, sign_payload, status_body
+
+
+class TestLoadHarness(unittest.TestCase):
+    """Test cases for the load-test harness"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.graph = graph_api_stub().start()
+        configure_environment(cls.graph.url, cls.graph.url, app_secret="test-secret")
+
+        from app import create_app
+
+        cls.app = create_app()
+        logging.getLogger().setLevel(logging.WARNING)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.graph.stop()
+
+    def test_percentile(self):
+        """Test nearest-rank percentiles"""
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_signed_traffic_accepted(self):
+        """Test that generated signatures pass signature_required"""
+        payload = json.dumps(status_body("5255000001")).encode("utf-8")
+        response = self.app.test_client().post(
+            "/webhook",
+            data=payload,
+            headers={
+                "Content-Type": "application/json",
+                "X-Hub-Signature-256": sign_payload(payload, "test-secret"),
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_bad_signature_rejected(self):
+        """Test that a wrong secret is rejected"""
+        payload = json.dumps(status_body("5255000001")).encode("utf-8")
+        response = self.app.test_client().post(
+            "/webhook",
+            data=payload,
+            headers={
+                "Content-Type": "application/json",
+                "X-Hub-Signature-256": sign_payload(payload, "wrong-secret"),
+            },
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_graph_stub_returns_message_id(self):
+        """Test that the Graph API stub answers like the Cloud API"""
+        response = requests.post(
+            f"{self.graph.url}/v18.0/123/messages", json={"to": "5255000001", "type": "text"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["messages"][0]["id"].startswith("wamid."))
+
+    def test_drive_reports_results(self):
+        """Test a short closed-loop run against the served app"""
+        traffic = TrafficGenerator("test-secret", users=5, status_ratio=1.0, seed=1)
+        with serve_wsgi(self.app) as base_url:
+            result = drive(f"{base_url}/webhook", traffic.next_request, rate=0, concurrency=4, total=20)
+        summary = result.summary()
+        self.assertEqual(summary["requests"], 20)
+        self.assertEqual(summary["errors"], 0)
+        self.assertGreater(summary["throughput_rps"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""
+Unit tests for the inbound media download pipeline
+"""
+import base64
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.media_downloader import MediaDownloader, MediaTooLarge, normalize_sha256
+from benchmarks.stub_servers import graph_api_stub
+
+
+class TestMediaDownloader(unittest.TestCase):
+    """Test cases for MediaDownloader against the Graph API stub"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.graph = graph_api_stub().start()
+        self.content = os.urandom(200 * 1024)
+        self.sha256 = hashlib.sha256(self.content).hexdigest()
+        self.media_id = self.graph.add_media(self.content, "image/jpeg")
+
+    def tearDown(self):
+        self.graph.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def make_downloader(self, **kwargs):
+        return MediaDownloader(self.directory, self.graph.url, "v18.0", "token", chunk_size=8192, **kwargs)
+
+    def test_streams_to_disk(self):
+        """Test that media is resolved, streamed and named by its hash"""
+        path = self.make_downloader().download(self.media_id)
+        self.assertEqual(os.path.basename(path), f"{self.sha256}.jpg")
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual([p for p in os.listdir(self.directory) if p.endswith(".part")], [])
+
+    def test_duplicate_not_fetched_again(self):
+        """Test that media already stored is skipped by its sha256"""
+        downloader = self.make_downloader()
+        self.assertIsNotNone(downloader.submit(self.media_id, sha256=self.sha256, mime_type="image/jpeg").result(5))
+        requests_before = self.graph.request_count
+        self.assertIsNone(downloader.submit("media-again", sha256=self.sha256, mime_type="image/jpeg"))
+        self.assertEqual(self.graph.request_count, requests_before)
+        downloader.shutdown()
+
+    def test_base64_sha256(self):
+        """Test that the webhook's base64 hash finds the stored file and is checked against the content"""
+        downloader = self.make_downloader()
+        announced = base64.b64encode(bytes.fromhex(self.sha256)).decode("ascii")
+        path = downloader.submit(self.media_id, sha256=announced, mime_type="image/jpeg").result(5)
+        self.assertEqual(os.path.basename(path), f"{self.sha256}.jpg")
+        self.assertEqual(downloader.find(announced, "image/jpeg"), path)
+        self.assertIsNone(downloader.submit("media-again", sha256=announced, mime_type="image/jpeg"))
+        downloader.shutdown()
+
+    def test_malformed_sha256_is_ignored(self):
+        """Test that a hash that is neither hex nor base64 never becomes part of a path"""
+        downloader = self.make_downloader()
+        self.assertIsNone(downloader.find("../../etc/passwd"))
+        path = downloader.submit(self.media_id, sha256="../x/", mime_type="image/jpeg").result(5)
+        self.assertEqual(os.path.basename(path), f"{self.sha256}.jpg")
+        downloader.shutdown()
+
+    def test_normalize_sha256(self):
+        digest = bytes.fromhex(self.sha256)
+        self.assertEqual(normalize_sha256(self.sha256.upper()), self.sha256)
+        self.assertEqual(normalize_sha256(base64.urlsafe_b64encode(digest).decode().rstrip("=")), self.sha256)
+        self.assertIsNone(normalize_sha256(base64.b64encode(digest[:16]).decode()))
+        self.assertIsNone(normalize_sha256(None))
+
+    def test_size_limit(self):
+        """Test that oversized media is refused and leaves no partial file"""
+        downloader = self.make_downloader(max_bytes=1024)
+        with self.assertRaises(MediaTooLarge):
+            downloader.download(self.media_id)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_hash_mismatch(self):
+        """Test that corrupted downloads are discarded"""
+        with self.assertRaises(ValueError):
+            self.make_downloader().download(self.media_id, sha256="0" * 64)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_bounded_queue(self):
+        """Test that downloads are skipped when the queue is full"""
+        self.graph.latency = 0.2
+        downloader = self.make_downloader(max_workers=1, max_pending=1)
+        first = downloader.submit(self.media_id)
+        self.assertIsNone(downloader.submit(self.media_id))
+        self.assertIsNotNone(first.result(5))
+        downloader.shutdown()
+
+    def test_failed_download_resolves_to_none(self):
+        """Test that errors are logged, not raised, on the pool"""
+        downloader = self.make_downloader()
+        self.assertIsNone(downloader.submit("unknown-media").result(5))
+        downloader.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+"""
+Unit tests for the upload-once media cache
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from flask import Flask
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.media_manager import MediaManager
+from app.utils.whatsapp_utils import (
+    get_media_message_input,
+    get_template_message_input,
+    get_welcome_messages,
+    upload_media,
+)
+from benchmarks.stub_servers import graph_api_stub
+
+
+class FakeUploader:
+    def __init__(self, fail=False, delay=0):
+        self.calls = []
+        self.fail = fail
+        self.delay = delay
+
+    def __call__(self, source):
+        self.calls.append(source)
+        time.sleep(self.delay)
+        if self.fail:
+            raise IOError("upload failed")
+        return f"media_{len(self.calls)}"
+
+
+class TestMediaManager(unittest.TestCase):
+    """Test cases for MediaManager"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.directory, "media_cache.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_uploads_once(self):
+        """Test that repeated sends reuse the media id"""
+        upload = FakeUploader()
+        manager = MediaManager(upload, self.cache_path)
+        self.assertEqual(manager.get_media_id("https://example.com/a.jpg"), "media_1")
+        self.assertEqual(manager.get_media_id("https://example.com/a.jpg"), "media_1")
+        self.assertEqual(len(upload.calls), 1)
+
+    def test_survives_restart(self):
+        """Test that ids are persisted to disk"""
+        MediaManager(FakeUploader(), self.cache_path).get_media_id("welcome.jpg")
+        upload = FakeUploader()
+        self.assertEqual(MediaManager(upload, self.cache_path).get_media_id("welcome.jpg"), "media_1")
+        self.assertEqual(upload.calls, [])
+
+    def test_expired_id_uploaded_again(self):
+        """Test that expired ids are never served"""
+        upload = FakeUploader()
+        manager = MediaManager(upload, self.cache_path, ttl=0.01, refresh_margin=0)
+        manager.get_media_id("welcome.jpg")
+        time.sleep(0.02)
+        self.assertEqual(manager.get_media_id("welcome.jpg"), "media_2")
+
+    def test_refresh_before_expiry(self):
+        """Test that ids close to expiry are still served while re-uploading"""
+        upload = FakeUploader()
+        manager = MediaManager(upload, self.cache_path, ttl=60, refresh_margin=120)
+        manager.get_media_id("welcome.jpg")
+        self.assertEqual(manager.get_media_id("welcome.jpg"), "media_1")
+        deadline = time.time() + 2
+        while len(upload.calls) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        self.assertEqual(manager.stats()["welcome.jpg"]["media_id"], "media_2")
+
+    def test_failed_upload(self):
+        """Test that a failed upload returns None so the link is used"""
+        manager = MediaManager(FakeUploader(fail=True), self.cache_path)
+        self.assertIsNone(manager.get_media_id("welcome.jpg"))
+        self.assertFalse(os.path.exists(self.cache_path))
+
+    def test_concurrent_misses_share_one_upload(self):
+        """Test that callers missing the cache together wait for a single upload"""
+        upload = FakeUploader(delay=0.1)
+        manager = MediaManager(upload, self.cache_path)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(manager.get_media_id("welcome.jpg")))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ["media_1"] * 5)
+        self.assertEqual(len(upload.calls), 1)
+
+    def test_failed_upload_backs_off(self):
+        """Test that a failed asset is not uploaded again for every message"""
+        upload = FakeUploader(fail=True)
+        manager = MediaManager(upload, self.cache_path, failure_backoff=0.05)
+        self.assertIsNone(manager.get_media_id("welcome.jpg"))
+        self.assertIsNone(manager.get_media_id("welcome.jpg"))
+        self.assertEqual(len(upload.calls), 1)
+        time.sleep(0.06)
+        upload.fail = False
+        self.assertEqual(manager.get_media_id("welcome.jpg"), "media_2")
+
+    def test_upload_without_waiting(self):
+        """Test that wait=False starts the upload and returns at once"""
+        upload = FakeUploader(delay=0.1)
+        manager = MediaManager(upload, self.cache_path)
+        self.assertIsNone(manager.get_media_id("welcome.jpg", wait=False))
+        self.assertTrue(manager.pending("welcome.jpg"))
+        self.assertIsNone(manager.get_media_id("welcome.jpg", wait=False))
+        self.assertEqual(manager.get_media_id("welcome.jpg"), "media_1")
+        self.assertFalse(manager.pending("welcome.jpg"))
+        self.assertEqual(len(upload.calls), 1)
+
+    def test_welcome_uses_link_while_uploading(self):
+        """Test that the welcome template keeps its header link while the upload runs"""
+        app = Flask(__name__)
+        app.config.update(WELCOME_HEADER_IMAGE="https://example.com/a.jpg")
+        manager = MediaManager(FakeUploader(delay=0.2), self.cache_path)
+        app.extensions["media_manager"] = manager
+        with app.app_context():
+            started = time.monotonic()
+            template, _ = get_welcome_messages("1")
+            self.assertLess(time.monotonic() - started, 0.1)
+            image = json.loads(template)["template"]["components"][0]["parameters"][0]["image"]
+            self.assertEqual(image, {"link": "https://example.com/a.jpg"})
+            manager.get_media_id("https://example.com/a.jpg")
+            template, _ = get_welcome_messages("1")
+        image = json.loads(template)["template"]["components"][0]["parameters"][0]["image"]
+        self.assertEqual(image, {"id": "media_1"})
+
+    def test_welcome_waits_for_local_header(self):
+        """Test that a local header file is waited for, and the template skipped without it"""
+        app = Flask(__name__)
+        app.config.update(WELCOME_HEADER_IMAGE="welcome.jpg", WELCOME_HEADER_WAIT=1.0)
+        app.extensions["media_manager"] = MediaManager(FakeUploader(delay=0.1), self.cache_path)
+        with app.app_context():
+            template, _ = get_welcome_messages("1")
+        image = json.loads(template)["template"]["components"][0]["parameters"][0]["image"]
+        self.assertEqual(image, {"id": "media_1"})
+
+        app.extensions["media_manager"] = MediaManager(
+            FakeUploader(fail=True), os.path.join(self.directory, "failed.json")
+        )
+        with app.app_context():
+            template, welcome = get_welcome_messages("1")
+        self.assertIsNone(template)
+        self.assertEqual(json.loads(welcome)["type"], "text")
+
+    def test_upload_through_graph_api(self):
+        """Test the multipart upload against the Graph API stub"""
+        with graph_api_stub() as graph:
+            app = Flask(__name__)
+            app.config.update(GRAPH_API_URL=graph.url, VERSION="v18.0", PHONE_NUMBER_ID="1", ACCESS_TOKEN="t")
+            with app.app_context():
+                media_id = upload_media(f"{graph.url}/assets/welcome.jpg")
+            self.assertIn(media_id, graph.media)
+
+
+class TestMediaPayloads(unittest.TestCase):
+    """Test cases for media payload builders"""
+
+    def test_template_header_by_id(self):
+        """Test that an uploaded media id takes precedence over the link"""
+        data = json.loads(get_template_message_input(
+            "1", "welcome", header_image_url="https://example.com/a.jpg", header_image_id="media_1"
+        ))
+        image = data["template"]["components"][0]["parameters"][0]["image"]
+        self.assertEqual(image, {"id": "media_1"})
+
+    def test_media_message(self):
+        """Test image, document and audio messages"""
+        image = json.loads(get_media_message_input("1", "image", media_id="m", caption="Hola"))
+        self.assertEqual(image["image"], {"id": "m", "caption": "Hola"})
+        document = json.loads(get_media_message_input("1", "document", link="https://x/y.pdf", filename="y.pdf"))
+        self.assertEqual(document["document"], {"link": "https://x/y.pdf", "filename": "y.pdf"})
+        audio = json.loads(get_media_message_input("1", "audio", media_id="a", caption="ignored"))
+        self.assertEqual(audio["audio"], {"id": "a"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+"""
+Unit tests for the durable outbox
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.outbox import Outbox, PermanentSendError
+from app.utils import metrics
+
+
+class FakeSender:
+    """Records payloads; fails the first `failures` attempts of payloads listed in `failing`."""
+
+    def __init__(self, failing=(), failures=1, permanent=False):
+        self.sent = []
+        self.failing = set(failing)
+        self.failures = failures
+        self.permanent = permanent
+        self.attempts = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, payload):
+        with self.lock:
+            self.attempts[payload] = self.attempts.get(payload, 0) + 1
+            if payload in self.failing and self.attempts[payload] <= self.failures:
+                if self.permanent:
+                    raise PermanentSendError("invalid recipient")
+                raise IOError("Graph API unavailable")
+            self.sent.append(payload)
+            return f"wamid.{len(self.sent)}"
+
+
+class TestOutbox(unittest.TestCase):
+    """Test cases for Outbox"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "outbox.db")
+        self.outboxes = []
+
+    def tearDown(self):
+        for outbox in self.outboxes:
+            outbox.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def make_outbox(self, send, **kwargs):
+        kwargs.setdefault("base_backoff", 0.01)
+        kwargs.setdefault("poll_interval", 0.01)
+        outbox = Outbox(self.path, send, **kwargs)
+        self.outboxes.append(outbox)
+        return outbox
+
+    def test_sends_and_records_message_id(self):
+        """Test that a committed message is sent and marked done"""
+        sender = FakeSender()
+        outbox = self.make_outbox(sender)
+        row_id = outbox.enqueue("521", "hola")
+        self.assertIsNotNone(row_id)
+        self.assertTrue(outbox.wait_idle(5))
+        self.assertEqual(outbox.get(row_id)["status"], "sent")
+        self.assertEqual(outbox.get(row_id)["message_id"], "wamid.1")
+
+    def test_retries_with_backoff(self):
+        """Test that failed sends are retried until they succeed"""
+        sender = FakeSender(failing={"hola"}, failures=2)
+        outbox = self.make_outbox(sender)
+        row_id = outbox.enqueue("521", "hola")
+        self.assertTrue(outbox.wait_idle(5))
+        self.assertEqual(outbox.get(row_id)["attempts"], 3)
+        self.assertEqual(sender.sent, ["hola"])
+
+    def test_order_kept_per_recipient(self):
+        """Test that a failing message is not overtaken by later ones"""
+        sender = FakeSender(failing={"first"}, failures=2)
+        outbox = self.make_outbox(sender)
+        for payload in ("first", "second", "third"):
+            outbox.enqueue("521", payload, wait=False)
+        outbox.enqueue("522", "other")
+        self.assertTrue(outbox.wait_idle(5))
+        self.assertEqual([p for p in sender.sent if p != "other"], ["first", "second", "third"])
+
+    def test_permanent_failure(self):
+        """Test that rejected messages are not retried"""
+        sender = FakeSender(failing={"bad"}, failures=10, permanent=True)
+        outbox = self.make_outbox(sender)
+        row_id = outbox.enqueue("521", "bad")
+        self.assertTrue(outbox.wait_idle(5))
+        self.assertEqual(outbox.get(row_id)["status"], "failed")
+        self.assertEqual(sender.attempts["bad"], 1)
+
+    def test_gives_up_after_max_attempts(self):
+        """Test that messages are marked failed after max_attempts"""
+        sender = FakeSender(failing={"hola"}, failures=10)
+        outbox = self.make_outbox(sender, max_attempts=3)
+        row_id = outbox.enqueue("521", "hola")
+        self.assertTrue(outbox.wait_idle(5))
+        self.assertEqual(outbox.get(row_id), {"status": "failed", "attempts": 3, "message_id": None,
+                                              "last_error": "Graph API unavailable"})
+
+    def test_recovers_pending_after_restart(self):
+        """Test that messages not yet sent survive a restart"""
+        down = FakeSender(failing={"hola"}, failures=100)
+        outbox = self.make_outbox(down, base_backoff=60)
+        outbox.enqueue("521", "hola")
+        time.sleep(0.1)
+        outbox.close()
+        self.outboxes.remove(outbox)
+
+        sender = FakeSender()
+        # The 60s backoff of the failed attempt is not waited out after a restart
+        restarted = self.make_outbox(sender)
+        self.assertTrue(restarted.wait_idle(5))
+        self.assertEqual(sender.sent, ["hola"])
+
+    def test_group_commit(self):
+        """Test that concurrent writers share transactions"""
+        outbox = self.make_outbox(FakeSender())
+        commits_before = metrics.get_counter("outbox_commits")
+        threads = [threading.Thread(target=outbox.enqueue, args=(str(i), f"m{i}")) for i in range(200)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(outbox.wait_idle(5))
+        self.assertEqual(outbox.stats()["sent"], 200)
+        self.assertLess(metrics.get_counter("outbox_commits") - commits_before, 200)
+
+    def test_slow_recipient_does_not_hold_back_others(self):
+        """Test that rows written while one recipient's send hangs are still sent"""
+        release = threading.Event()
+        sent = []
+
+        def send(payload):
+            if payload == "slow":
+                release.wait(5)
+            sent.append(payload)
+            return f"wamid.{payload}"
+
+        outbox = self.make_outbox(send)
+        self.addCleanup(release.set)
+        outbox.enqueue("521", "slow")
+        time.sleep(0.05)
+        outbox.enqueue("522", "fast")
+        deadline = time.monotonic() + 5
+        while "fast" not in sent and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(sent, ["fast"])
+        release.set()
+        self.assertTrue(outbox.wait_idle(5))
+        self.assertEqual(sent, ["fast", "slow"])
+
+    def test_sent_only_with_message_id(self):
+        """Test that an answer without a message id is retried, not marked sent"""
+        answers = [None, "wamid.2"]
+        outbox = self.make_outbox(lambda payload: answers.pop(0))
+        row_id = outbox.enqueue("521", "hola")
+        self.assertTrue(outbox.wait_idle(5))
+        self.assertEqual(outbox.get(row_id), {"status": "sent", "attempts": 2, "message_id": "wamid.2",
+                                              "last_error": None})
+
+    def test_failed_write_raises(self):
+        """Test that a waiting writer learns its message was not stored"""
+        outbox = self.make_outbox(FakeSender())
+        with mock.patch.object(outbox, "_commit", side_effect=sqlite3.OperationalError("disk I/O error")):
+            with self.assertRaises(RuntimeError):
+                outbox.enqueue("521", "hola")
+
+
+if __name__ == '__main__':
+    unittest.main()
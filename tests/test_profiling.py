@@ -0,0 +1,163 @@
+"""
+Unit tests for the profiling hooks
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+
+from app.decorators.profiling import profiled
+from app.utils import metrics, profiling
+from app.utils.profiling import RequestProfiler, format_collapsed, init_profiler, sample_stacks, span, timed
+from app.views import webhook_blueprint
+from benchmarks.profiling import format_report, run_benchmark
+
+
+def busy_wait(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+@timed("test.work")
+def work(value):
+    return value * 2
+
+
+class TestSpans(unittest.TestCase):
+    """Test cases for timed() and span()"""
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(profiling.disable_spans)
+
+    def test_disabled_records_nothing(self):
+        self.assertEqual(work(2), 4)
+        self.assertEqual(metrics.snapshot()["summaries"], {})
+
+    def test_spans_on_metrics(self):
+        """Test that enabled spans are summarised per name"""
+        profiling.enable_spans(to_metrics=True)
+        work(1)
+        work(2)
+        with span("test.block"):
+            pass
+        summaries = metrics.snapshot()["summaries"]
+        self.assertEqual(summaries["span_seconds{span=test.work}"]["count"], 2)
+        self.assertEqual(summaries["span_seconds{span=test.block}"]["count"], 1)
+
+    def test_coroutines(self):
+        @timed("test.async")
+        async def answer():
+            await asyncio.sleep(0)
+            return 42
+
+        profiling.enable_spans(to_metrics=True)
+        self.assertEqual(asyncio.run(answer()), 42)
+        self.assertIn("span_seconds{span=test.async}", metrics.snapshot()["summaries"])
+
+
+class TestSampling(unittest.TestCase):
+    """Test cases for the stack sampler and slow-request capture"""
+
+    def setUp(self):
+        self.addCleanup(profiling.disable_spans)
+
+    def test_sample_stacks(self):
+        """Test that a busy thread shows up in the collapsed stacks"""
+        worker = threading.Thread(target=busy_wait, args=(0.3,), name="busy")
+        worker.start()
+        stacks = sample_stacks(0.1, interval=0.005)
+        worker.join()
+        busy = [stack for stack in stacks if stack.startswith("busy;")]
+        self.assertTrue(busy)
+        self.assertTrue(any(stack.endswith("test_profiling.py:busy_wait") for stack in busy))
+        line = format_collapsed(stacks).splitlines()[0]
+        self.assertTrue(line.rsplit(" ", 1)[1].isdigit())
+
+    def test_one_session_at_a_time(self):
+        thread = threading.Thread(target=sample_stacks, args=(0.2,))
+        thread.start()
+        time.sleep(0.05)
+        with self.assertRaises(RuntimeError):
+            sample_stacks(0.01)
+        thread.join()
+
+    def test_slow_request_capture(self):
+        """Test that slow requests keep their spans and stacks, fast ones are dropped"""
+        profiling.enable_spans()
+        profiler = RequestProfiler(threshold=0.05, interval=0.005)
+        token = profiler.begin()
+        work(1)
+        busy_wait(0.1)
+        profiler.end(token, "slow")
+        token = profiler.begin()
+        work(1)
+        profiler.end(token, "fast")
+
+        [captured] = profiler.recent()
+        self.assertEqual(captured["label"], "slow")
+        self.assertGreaterEqual(captured["duration_ms"], 100)
+        self.assertEqual([s["name"] for s in captured["spans"]], ["test.work"])
+        self.assertIn("busy_wait", captured["stacks"])
+
+
+class TestProfileEndpoints(unittest.TestCase):
+    """Test cases for /profile and /profile/slow"""
+
+    def setUp(self):
+        self.addCleanup(profiling.disable_spans)
+        self.app = Flask(__name__)
+        self.app.config.update(
+            ADMIN_TOKEN="admin", PROFILE_SPANS=False, PROFILE_SLOW_REQUEST_MS=0, PROFILE_SLOW_REQUEST_KEEP=10,
+        )
+        self.app.register_blueprint(webhook_blueprint)
+
+        @self.app.route("/slow")
+        @profiled
+        def slow():
+            work(1)
+            time.sleep(0.06)
+            return "ok"
+
+        self.client = self.app.test_client()
+        self.headers = {"Authorization": "Bearer admin"}
+
+    def test_profile(self):
+        response = self.client.post("/profile?seconds=0.05&interval_ms=5", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "text/plain")
+        self.assertTrue(response.get_data(as_text=True))
+        self.assertEqual(self.client.post("/profile?seconds=600", headers=self.headers).status_code, 400)
+        self.assertEqual(self.client.post("/profile?seconds=1").status_code, 401)
+
+    def test_slow_requests(self):
+        """Test that slow requests are listed once capture is configured"""
+        self.assertEqual(self.client.get("/profile/slow", headers=self.headers).status_code, 404)
+        self.app.config["PROFILE_SLOW_REQUEST_MS"] = 50
+        init_profiler(self.app)
+        self.client.get("/slow")
+        [captured] = self.client.get("/profile/slow", headers=self.headers).get_json()
+        self.assertEqual(captured["label"], "GET /slow")
+        self.assertEqual(captured["spans"][0]["name"], "test.work")
+
+
+class TestProfilingBenchmark(unittest.TestCase):
+    """Test cases for benchmarks/profiling.py"""
+
+    def test_small_run(self):
+        result = run_benchmark(calls=2000)
+        self.assertGreater(result["generate_response"]["bare"], 0)
+        self.assertIn("spans disabled", format_report(result))
+        self.assertFalse(profiling._recording)
+
+
+if __name__ == '__main__':
+    unittest.main()
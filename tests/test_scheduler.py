@@ -0,0 +1,259 @@
+"""
+Unit tests for the scheduled-message engine
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+
+from app.services.outbox import Outbox
+from app.services.scheduler import Scheduler, init_scheduler
+from app.views import webhook_blueprint
+from benchmarks.scheduler import format_report, run_benchmark
+
+NOW = 1_700_000_000.0
+
+
+class Recorder:
+    """deliver() stand-in recording each released batch; fails while `failing` is set."""
+
+    def __init__(self):
+        self.batches = []
+        self.failing = False
+        self.released = threading.Event()
+
+    def __call__(self, jobs):
+        if self.failing:
+            raise IOError("outbox unavailable")
+        self.batches.append([job.payload for job in jobs])
+        self.released.set()
+
+    @property
+    def payloads(self):
+        return [payload for batch in self.batches for payload in batch]
+
+
+class TestScheduler(unittest.TestCase):
+    """Test cases for Scheduler"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.path = os.path.join(self.directory, "scheduled.db")
+        self.recorder = Recorder()
+
+    def make_scheduler(self, **kwargs):
+        kwargs.setdefault("start", False)
+        scheduler = Scheduler(self.path, self.recorder, **kwargs)
+        self.addCleanup(scheduler.close)
+        return scheduler
+
+    def test_releases_due_jobs_in_order(self):
+        """Test that only due jobs are released, earliest first"""
+        scheduler = self.make_scheduler()
+        scheduler.schedule("521", "second", NOW + 20)
+        scheduler.schedule("522", "first", NOW + 10)
+        scheduler.schedule("523", "later", NOW + 3600)
+        self.assertEqual(scheduler.run_due(NOW), 0)
+        self.assertEqual(scheduler.run_due(NOW + 30), 2)
+        self.assertEqual(self.recorder.payloads, ["first", "second"])
+        self.assertEqual(scheduler.stats()["pending"], 1)
+        self.assertEqual(scheduler.run_due(NOW + 3600), 1)
+
+    def test_batches(self):
+        """Test that due jobs are released in batches of batch_size"""
+        scheduler = self.make_scheduler(batch_size=4)
+        scheduler.schedule_many([(f"52{i}", f"m{i}", NOW + i, None, None) for i in range(10)])
+        self.assertEqual(scheduler.run_due(NOW + 10), 10)
+        self.assertEqual([len(b) for b in self.recorder.batches], [4, 4, 2])
+
+    def test_cancel(self):
+        """Test cancelling by job id, by wa_id and by kind"""
+        scheduler = self.make_scheduler()
+        job_id = scheduler.schedule("521", "a", NOW + 1)
+        scheduler.schedule("522", "reminder", NOW + 1, kind="reminder")
+        scheduler.schedule("522", "follow-up", NOW + 2, kind="follow_up")
+        scheduler.schedule("523", "kept", NOW + 3)
+        # Load the jobs into memory first: cancelled heap entries must be skipped
+        scheduler.run_due(NOW)
+        self.assertTrue(scheduler.cancel(job_id))
+        self.assertFalse(scheduler.cancel(job_id))
+        self.assertEqual(scheduler.cancel_for("522", kind="reminder"), 1)
+        self.assertEqual([j.kind for j in scheduler.pending("522")], ["follow_up"])
+        self.assertEqual(scheduler.cancel_for("522"), 1)
+        scheduler.run_due(NOW + 10)
+        self.assertEqual(self.recorder.payloads, ["kept"])
+
+    def test_whole_batch_cancelled(self):
+        """Test that a cancelled batch does not hide the due jobs after it"""
+        scheduler = self.make_scheduler(batch_size=2)
+        scheduler.schedule_many([("521", f"x{i}", NOW + i, None, None) for i in range(2)])
+        scheduler.schedule("522", "kept", NOW + 5)
+        scheduler.run_due(NOW - 1)
+        scheduler.cancel_for("521")
+        self.assertEqual(scheduler.run_due(NOW + 10), 1)
+
+    def test_jobs_survive_restart(self):
+        """Test that pending jobs are kept across a restart and overdue ones sent"""
+        scheduler = self.make_scheduler()
+        scheduler.schedule("521", "overdue", NOW - 60)
+        scheduler.schedule("522", "future", time.time() + 3600)
+        scheduler.close()
+
+        reopened = self.make_scheduler()
+        self.assertEqual(reopened.stats()["pending"], 2)
+        reopened.run_due()
+        self.assertEqual(self.recorder.payloads, ["overdue"])
+
+    def test_failed_release_is_retried(self):
+        """Test that a batch the outbound path refused stays pending"""
+        scheduler = self.make_scheduler(retry_delay=5)
+        scheduler.schedule("521", "hola", NOW)
+        self.recorder.failing = True
+        self.assertEqual(scheduler.run_due(NOW), 0)
+        self.assertEqual(scheduler.stats()["pending"], 1)
+        self.recorder.failing = False
+        self.assertEqual(scheduler.run_due(NOW + 1), 0)
+        self.assertEqual(scheduler.run_due(NOW + 5), 1)
+
+    def test_only_the_horizon_is_in_memory(self):
+        """Test that far-future jobs stay on disk until they come near"""
+        scheduler = self.make_scheduler(horizon=60)
+        scheduler.schedule_many([("521", f"m{i}", NOW + i * 3600, None, None) for i in range(100)])
+        scheduler.run_due(NOW)
+        self.assertEqual(scheduler.stats()["in_memory"], 0)
+        scheduler.run_due(NOW + 3600)
+        self.assertEqual(self.recorder.payloads, ["m0", "m1"])
+
+    def test_overdue_backlog_is_paged(self):
+        """Test that jobs overdue after a restart are loaded a batch at a time, in order"""
+        scheduler = self.make_scheduler(batch_size=50)
+        scheduler.schedule_many([("521", f"m{i:04d}", NOW - 3600 + i, None, None) for i in range(1000)])
+        scheduler.close()
+
+        in_memory = []
+        reopened = Scheduler(self.path, lambda jobs: in_memory.append(reopened.stats()["in_memory"])
+                             or self.recorder(jobs), batch_size=50, start=False)
+        self.addCleanup(reopened.close)
+        self.assertEqual(reopened.run_due(NOW), 1000)
+        self.assertLessEqual(max(in_memory), 50)
+        self.assertEqual(self.recorder.payloads, [f"m{i:04d}" for i in range(1000)])
+
+    def test_page_of_one_due_time(self):
+        """Test that more jobs than a page sharing one due time are all released"""
+        scheduler = self.make_scheduler(batch_size=10)
+        scheduler.schedule_many([(f"52{i}", f"m{i}", NOW, None, None) for i in range(25)])
+        scheduler.schedule("530", "after", NOW + 1)
+        self.assertEqual(scheduler.run_due(NOW + 1), 26)
+        self.assertEqual(self.recorder.payloads[-1], "after")
+
+    def test_release_thread(self):
+        """Test that the background thread wakes for a job scheduled while it sleeps"""
+        scheduler = self.make_scheduler(start=True)
+        time.sleep(0.05)
+        scheduler.schedule("521", "hola", time.time() + 0.1)
+        self.assertTrue(self.recorder.released.wait(5))
+        self.assertEqual(self.recorder.payloads, ["hola"])
+
+
+class TestScheduledDelivery(unittest.TestCase):
+    """Test cases for init_scheduler and the admin endpoints"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.app = Flask(__name__)
+        self.app.config.update(
+            ADMIN_TOKEN="admin",
+            SCHEDULER_PATH=os.path.join(self.directory, "scheduled.db"),
+            SCHEDULER_BATCH_SIZE=100,
+            SCHEDULER_HORIZON=60.0,
+        )
+        self.app.register_blueprint(webhook_blueprint)
+        self.sent = []
+        outbox = Outbox(
+            os.path.join(self.directory, "outbox.db"),
+            lambda payload, sender=None: self.sent.append((json.loads(payload)["to"], sender)) or "wamid.1",
+            poll_interval=0.01,
+        )
+        self.addCleanup(outbox.close)
+        self.app.extensions["outbox"] = outbox
+        self.scheduler = init_scheduler(self.app)
+        self.addCleanup(self.scheduler.close)
+        self.client = self.app.test_client()
+        self.headers = {"Authorization": "Bearer admin"}
+
+    def test_released_into_outbox(self):
+        """Test that due jobs go out through the outbox, from their tenant"""
+        response = self.client.post(
+            "/scheduled", json={"wa_id": "521", "delay": 0, "text": "Te esperamos mañana", "phone_number_id": "111"},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 201)
+        deadline = time.monotonic() + 5
+        while not self.sent and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.sent, [("521", "111")])
+
+    def test_slow_commit_is_handed_over(self):
+        """Test that a batch whose commit outlasts the wait is not released again"""
+        class SlowOutbox:
+            def __init__(self):
+                self.queued = []
+
+            def enqueue(self, wa_id, payload, wait=True, sender=None):
+                self.queued.append(wa_id)
+                return None
+
+        outbox = SlowOutbox()
+        self.app.extensions["outbox"] = outbox
+        self.scheduler.schedule("521", "{}", due=time.time() - 1)
+        self.scheduler.schedule("522", "{}", due=time.time() - 1)
+        deadline = time.monotonic() + 5
+        while self.scheduler.stats()["pending"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+        self.assertEqual(sorted(outbox.queued), ["521", "522"])
+        self.assertEqual(self.scheduler.stats()["pending"], 0)
+
+    def test_admin_endpoints(self):
+        """Test scheduling, listing and cancelling a user's reminders"""
+        for kind in ("reminder", "follow_up"):
+            response = self.client.post(
+                "/scheduled", json={"wa_id": "521", "delay": 3600, "template": "recordatorio", "kind": kind},
+                headers=self.headers,
+            )
+            self.assertEqual(response.status_code, 201)
+        listed = self.client.get("/scheduled?wa_id=521", headers=self.headers).get_json()
+        self.assertEqual([job["kind"] for job in listed], ["reminder", "follow_up"])
+        response = self.client.delete("/scheduled/521?kind=reminder", headers=self.headers)
+        self.assertEqual(response.get_json(), {"cancelled": 1})
+        self.assertEqual(self.client.get("/scheduled", headers=self.headers).get_json()["pending"], 1)
+
+        response = self.client.post("/scheduled", json={"wa_id": "521", "delay": 10}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+
+
+class TestSchedulerBenchmark(unittest.TestCase):
+    """Test cases for benchmarks/scheduler.py"""
+
+    def test_small_run(self):
+        """Test that a small benchmark run reports every figure"""
+        result = run_benchmark(jobs=3000, days=1.0, horizon=3600, singles=50)
+        self.assertEqual(result["jobs"], 3050)
+        self.assertGreater(result["released"], 0)
+        self.assertEqual(result["pending_after"], 3050 - result["cancelled"] - result["released"])
+        self.assertIn("bytes/job", format_report(result))
+
+
+if __name__ == '__main__':
+    unittest.main()
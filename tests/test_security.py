@@ -0,0 +1,104 @@
+"""
+Unit tests for webhook signature verification and body ingestion
+"""
+import json
+import unittest
+import sys
+import os
+import tempfile
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+
+from app.decorators.security import validate_signature
+from app.services.status_store import init_status_store
+from app.views import webhook_blueprint
+from benchmarks.webhook_traffic import sign_payload, status_body
+
+
+def make_app(secret="test-secret", max_bytes=1024 * 1024):
+    app = Flask(__name__)
+    app.config["APP_SECRET"] = secret
+    app.config["MAX_WEBHOOK_BODY_BYTES"] = max_bytes
+    app.config["STATUS_STORE_PATH"] = os.path.join(tempfile.mkdtemp(), "statuses.bin")
+    app.config["STATUS_FLUSH_SIZE"] = 512
+    app.config["STATUS_FLUSH_INTERVAL"] = 5.0
+    init_status_store(app)
+    app.register_blueprint(webhook_blueprint)
+    return app
+
+
+class TestValidateSignature(unittest.TestCase):
+    """Test cases for validate_signature"""
+
+    def setUp(self):
+        self.app = make_app()
+        self.payload = json.dumps(status_body("5215500000001")).encode("utf-8")
+        self.signature = sign_payload(self.payload, "test-secret")[7:]
+
+    def test_bytes_payload(self):
+        """Test that raw bytes are verified without decoding"""
+        with self.app.app_context():
+            self.assertTrue(validate_signature(self.payload, self.signature))
+
+    def test_str_payload(self):
+        """Test that str payloads are still accepted"""
+        with self.app.app_context():
+            self.assertTrue(validate_signature(self.payload.decode("utf-8"), self.signature))
+
+    def test_tampered_payload(self):
+        """Test that a modified body is rejected"""
+        with self.app.app_context():
+            self.assertFalse(validate_signature(self.payload + b" ", self.signature))
+
+    def test_non_ascii_signature(self):
+        """Test that garbage in the header is rejected instead of raising"""
+        with self.app.app_context():
+            self.assertFalse(validate_signature(self.payload, "ñ" * 64))
+
+    def test_secret_change_rebuilds_key(self):
+        """Test that the cached key follows APP_SECRET"""
+        with self.app.app_context():
+            self.assertTrue(validate_signature(self.payload, self.signature))
+            self.app.config["APP_SECRET"] = "rotated-secret"
+            self.assertFalse(validate_signature(self.payload, self.signature))
+            self.assertTrue(validate_signature(self.payload, sign_payload(self.payload, "rotated-secret")[7:]))
+
+
+class TestWebhookIngestion(unittest.TestCase):
+    """Test cases for the raw-bytes webhook path"""
+
+    def post(self, app, payload, secret="test-secret"):
+        return app.test_client().post(
+            "/webhook",
+            data=payload,
+            headers={"Content-Type": "application/json", "X-Hub-Signature-256": sign_payload(payload, secret)},
+        )
+
+    def test_oversized_body_rejected(self):
+        """Test that bodies over the limit get 413 before hashing"""
+        app = make_app(max_bytes=100)
+        response = self.post(app, b"{" + b" " * 200 + b"}")
+        self.assertEqual(response.status_code, 413)
+
+    def test_invalid_json(self):
+        """Test that a signed but invalid body gets 400"""
+        response = self.post(make_app(), b"{not json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_utf8(self):
+        """Test that a signed body with a bad encoding gets 400"""
+        response = self.post(make_app(), b'{"object": "\xff"}')
+        self.assertEqual(response.status_code, 400)
+
+    def test_status_update(self):
+        """Test that a signed status webhook is acknowledged"""
+        payload = json.dumps(status_body("5215500000001")).encode("utf-8")
+        response = self.post(make_app(), payload)
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
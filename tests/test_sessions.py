@@ -0,0 +1,204 @@
+"""
+Unit tests for conversation sessions and the booking flow
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+
+from app.services.sessions import Session, SessionStore, init_sessions
+from app.utils.message_handlers import BOOKING_SERVICE, BOOKING_TIME, generate_response, load_message
+from app.utils.whatsapp_utils import generate_reply
+from benchmarks.sessions import format_report, run_benchmark
+
+NOW = 1_700_000_000.0
+
+
+class TestSessionStore(unittest.TestCase):
+    """Test cases for SessionStore"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.spill_path = os.path.join(self.directory, "sessions_db")
+
+    def make_store(self, **kwargs):
+        kwargs.setdefault("ttl", 60.0)
+        store = SessionStore(**kwargs)
+        self.addCleanup(store.close)
+        return store
+
+    def test_invalid_ttl(self):
+        """Test that a zero TTL or tick count is a configuration error"""
+        with self.assertRaises(ValueError):
+            SessionStore(ttl=0)
+        with self.assertRaises(ValueError):
+            SessionStore(ttl=60.0, ticks=0)
+
+    def test_get_returns_the_same_session(self):
+        store = self.make_store()
+        session = store.get("521", NOW)
+        session.state = "x"
+        self.assertIs(store.get("521", NOW + 1), session)
+        self.assertEqual(session.turns, 2)
+
+    def test_idle_sessions_expire(self):
+        """Test that the timing wheel drops sessions idle for longer than the TTL"""
+        store = self.make_store()
+        store.get("idle", NOW)
+        store.get("active", NOW)
+        store.get("active", NOW + 50)
+        store.get("other", NOW + 59)
+        self.assertIsNotNone(store.peek("idle"))
+        store.get("other", NOW + 62)
+        self.assertIsNone(store.peek("idle"))
+        self.assertIsNotNone(store.peek("active"))
+        self.assertEqual(store.stats()["expired"], 1)
+        store.get("other", NOW + 200)
+        self.assertIsNone(store.peek("active"))
+
+    def test_memory_cap_spills_least_recently_used(self):
+        """Test that evicted sessions are spilled to disk and come back intact"""
+        store = self.make_store(max_sessions=2, spill_path=self.spill_path)
+        first = store.get("521", NOW)
+        first.state = BOOKING_TIME
+        first.set("service", "Trenzas Africanas")
+        store.get("522", NOW + 1)
+        store.get("523", NOW + 2)
+        self.assertIsNone(store.peek("521"))
+        self.assertEqual(store.stats()["spilled"], 1)
+
+        restored = store.get("521", NOW + 3)
+        self.assertEqual(restored.state, BOOKING_TIME)
+        self.assertEqual(restored.get("service"), "Trenzas Africanas")
+        self.assertEqual(restored.turns, 2)
+        self.assertIsNone(store.peek("522"))
+
+    def test_memory_cap_without_spill(self):
+        store = self.make_store(max_sessions=1)
+        store.get("521", NOW).state = "x"
+        store.get("522", NOW)
+        self.assertIsNone(store.get("521", NOW).state)
+        self.assertEqual(store.stats()["evictions"], 2)
+
+    def test_spilled_sessions_expire(self):
+        store = self.make_store(max_sessions=1, spill_path=self.spill_path)
+        store.get("521", NOW).state = "x"
+        store.get("522", NOW)
+        self.assertIsNone(store.get("521", NOW + 120).state)
+
+    def test_sessions_survive_restart(self):
+        """Test that close() keeps active sessions on the shelf"""
+        store = self.make_store(ttl=3600.0, spill_path=self.spill_path)
+        store.get("521").state = BOOKING_SERVICE
+        store.close()
+        reopened = self.make_store(ttl=3600.0, spill_path=self.spill_path)
+        self.assertEqual(reopened.get("521").state, BOOKING_SERVICE)
+
+    def test_get_after_close(self):
+        """Test that expiry after close() does not trip over sessions it wrote out"""
+        store = self.make_store(spill_path=self.spill_path)
+        store.get("521", NOW)
+        store.close()
+        self.assertEqual(store.get("522", NOW + 120).turns, 1)
+
+    def test_end(self):
+        store = self.make_store()
+        store.get("521", NOW).state = "x"
+        store.end("521")
+        self.assertIsNone(store.get("521", NOW).state)
+
+
+class TestBookingFlow(unittest.TestCase):
+    """Test cases for the booking flow in generate_response"""
+
+    def test_service_then_time(self):
+        """Test that booking asks for the service, then the time, then confirms"""
+        session = Session("521", NOW)
+        self.assertEqual(generate_response("quiero una cita", session=session), load_message("reserva.txt"))
+        self.assertEqual(session.state, BOOKING_SERVICE)
+
+        reply = generate_response("trenzas", session=session)
+        self.assertIn("Trenzas Africanas", reply)
+        self.assertEqual(session.state, BOOKING_TIME)
+
+        reply = generate_response("el viernes a las 3pm en Gurabo", session=session)
+        self.assertIn("el viernes a las 3pm en Gurabo", reply)
+        self.assertIn("Trenzas Africanas", reply)
+        self.assertIsNone(session.state)
+
+    def test_booking_after_asking_about_a_service(self):
+        """Test that the service the user just asked about is booked directly"""
+        session = Session("521", NOW)
+        self.assertEqual(generate_response("lavado", session=session), load_message("lavado_rizos.txt"))
+        reply = generate_response("me gustaría reservar", session=session)
+        self.assertIn("Wash and Go", reply)
+        self.assertEqual(session.state, BOOKING_TIME)
+
+    def test_questions_during_the_flow(self):
+        """Test that keyword questions are answered without leaving the flow"""
+        session = Session("521", NOW)
+        generate_response("cita", session=session)
+        generate_response("crochet", session=session)
+        self.assertEqual(generate_response("costos?", session=session), load_message("costos.txt"))
+        self.assertEqual(session.state, BOOKING_TIME)
+
+    def test_time_must_name_a_day_or_hour(self):
+        """Test that an answer without a day or time is asked again instead of booked"""
+        session = Session("521", NOW)
+        generate_response("cita", session=session)
+        generate_response("trenzas", session=session)
+        self.assertEqual(generate_response("ok", session=session), load_message("reserva_horario_invalido.txt"))
+        self.assertEqual(session.state, BOOKING_TIME)
+        self.assertIn("mañana a las 10am", generate_response("mañana a las 10am", session=session))
+        self.assertIsNone(session.state)
+
+    def test_cancel(self):
+        """Test that 'cancelar' leaves the flow at any step"""
+        session = Session("521", NOW)
+        generate_response("cita", session=session)
+        self.assertEqual(generate_response("cancelar", session=session), load_message("reserva_cancelada.txt"))
+        self.assertIsNone(session.state)
+
+        generate_response("cita", session=session)
+        generate_response("crochet", session=session)
+        self.assertEqual(generate_response("mejor salir", session=session), load_message("reserva_cancelada.txt"))
+        self.assertIsNone(session.state)
+        self.assertIsNone(session.get("service"))
+
+    def test_without_session(self):
+        """Test that every message is answered on its own without a session"""
+        generate_response("cita")
+        self.assertEqual(generate_response("trenzas"), load_message("trenzas_africanas.txt"))
+
+    def test_reply_path_uses_the_store(self):
+        """Test that generate_reply carries a user's flow between messages"""
+        app = Flask(__name__)
+        app.config.update(SESSION_MAX_ACTIVE=100, SESSION_TTL=60.0, SESSION_SPILL_PATH=None)
+        init_sessions(app)
+        with app.app_context():
+            generate_reply("reserva", "521", "Ana")
+            self.assertIn("Método Crochet", generate_reply("crochet", "521", "Ana"))
+            self.assertEqual(generate_reply("crochet", "522", "Luz"), load_message("metodo_crochet.txt"))
+
+
+class TestSessionsBenchmark(unittest.TestCase):
+    """Test cases for benchmarks/sessions.py"""
+
+    def test_small_run(self):
+        """Test that a small benchmark run reports every figure"""
+        result = run_benchmark(sessions=500, lookups=1000, spilled=20)
+        self.assertEqual(result["restored"], 20)
+        self.assertEqual(result["stats"]["active"], 500)
+        self.assertGreater(result["bytes_per_session"], 0)
+        self.assertIn("bytes/session", format_report(result))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+Unit tests for lazy initialization, the warm-up and the startup profile
+"""
+import os
+import subprocess
+import sys
+import unittest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+
+from app.services.warmup import init_warm_up, warm_up
+from app.utils import message_handlers
+from app.utils.startup_profile import StartupProfile
+from benchmarks.startup import ROOT, measure_startup
+
+# Generous for slow CI machines; a cold start takes about 0.2s here
+MAX_STARTUP_MS = 2000
+
+
+class TestColdStart(unittest.TestCase):
+    """Test cases for the cold start of create_app()"""
+
+    def test_create_app_time_is_bounded(self):
+        """Test that importing the app and calling create_app() stays fast"""
+        result, rows = measure_startup({"REPLY_ENGINE": "openai", "OPENAI_API_KEY": "test"}, runs=1)
+        self.assertLess(result["wall_ms"], MAX_STARTUP_MS)
+        self.assertTrue(rows)
+        self.assertIn("init_outbox", [p["name"] for p in result["profile"]["phases"]])
+
+    def test_openai_is_imported_on_first_use(self):
+        """Test that neither create_app() nor importing openai_service loads the openai package"""
+        result, _ = measure_startup({"REPLY_ENGINE": "openai", "OPENAI_API_KEY": "test"}, runs=1)
+        self.assertFalse(result["openai_imported"])
+
+        code = "import sys; import app.services.openai_service; print('openai' in sys.modules)"
+        completed = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+        self.assertEqual(completed.stdout.strip(), "False")
+
+    def test_openai_service_leaves_dotenv_to_the_config(self):
+        """Test that importing openai_service does not read .env again"""
+        code = ("import dotenv; dotenv.load_dotenv = lambda *args, **kwargs: print('load_dotenv'); "
+                "import app.services.openai_service")
+        completed = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+        self.assertEqual(completed.stdout.strip(), "")
+
+
+class TestWarmUp(unittest.TestCase):
+    """Test cases for the warm-up hook"""
+
+    def make_app(self, mode):
+        app = Flask(__name__)
+        app.config.update(WARM_UP=mode, REPLY_ENGINE="keywords", WELCOME_HEADER_IMAGE="")
+        app.extensions["startup_profile"] = StartupProfile()
+        return app
+
+    def test_warm_up_fills_the_catalog(self):
+        """Test that the message texts are loaded and every step is profiled"""
+        message_handlers.default_catalog.messages.clear()
+        timings = warm_up(self.make_app("blocking"))
+        self.assertEqual(set(timings), {"message_catalog", "graph_session"})
+        self.assertIn("servicios.txt", message_handlers.default_catalog.messages)
+
+    def test_background_mode(self):
+        """Test that the background warm-up runs on a thread and is recorded"""
+        app = self.make_app("background")
+        thread = init_warm_up(app)
+        thread.join(5)
+        names = [p["name"] for p in app.extensions["startup_profile"].as_dict()["phases"]]
+        self.assertIn("warm_up.graph_session", names)
+        self.assertIn("graph_session", app.extensions)
+
+    def test_off_by_default(self):
+        """Test that nothing is created when WARM_UP is off"""
+        app = self.make_app("off")
+        self.assertIsNone(init_warm_up(app))
+        self.assertNotIn("graph_session", app.extensions)
+
+
+class TestStartupProfile(unittest.TestCase):
+    """Test cases for StartupProfile"""
+
+    def test_phases_and_total(self):
+        """Test that warm-up steps are listed but not counted in the total"""
+        profile = StartupProfile()
+        profile.add("import app", 0.1)
+        with profile.phase("init_outbox"):
+            pass
+        profile.add("warm_up.openai_client", 0.5)
+        result = profile.as_dict()
+        self.assertEqual([p["name"] for p in result["phases"]], ["import app", "init_outbox", "warm_up.openai_client"])
+        self.assertLess(result["total_ms"], 200)
+        self.assertIn("import app", profile.format())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+"""
+Unit tests for the delivery-status store
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+
+from app.services.status_store import StatusStore, looks_like_status_payload, scan_status_payload
+from app.utils.webhook_events import StatusEvent, parse_webhook
+from app.views import webhook_blueprint
+from benchmarks.webhook_traffic import sign_payload, status_body
+
+
+def status(message_id, name, timestamp=1700000000, recipient="5215500000001"):
+    return StatusEvent(message_id, recipient, name, timestamp, "111")
+
+
+class TestStatusStore(unittest.TestCase):
+    """Test cases for StatusStore"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "statuses.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def make_store(self, *args, **kwargs):
+        store = StatusStore(*args, **kwargs)
+        self.addCleanup(store.close)
+        return store
+
+    def test_latest_state(self):
+        """Test that the most advanced status wins"""
+        store = self.make_store(self.path)
+        store.add([status("wamid.1", "sent", 1), status("wamid.1", "read", 3), status("wamid.1", "delivered", 2)])
+        state = store.get_delivery_state("wamid.1")
+        self.assertEqual(state.status, "read")
+        self.assertEqual(state.timestamp, 3)
+
+    def test_unknown_message(self):
+        """Test that unknown ids return None"""
+        store = self.make_store(self.path)
+        self.assertIsNone(store.get_delivery_state("wamid.unknown"))
+
+    def test_batched_flush(self):
+        """Test that records are written in batches, not one by one"""
+        store = self.make_store(self.path, flush_size=3, flush_interval=3600)
+        store.add([status("wamid.1", "sent"), status("wamid.2", "sent")])
+        self.assertFalse(os.path.exists(self.path))
+        store.add([status("wamid.3", "sent")])
+        self.assertEqual(store.stats()["flushed"], 3)
+        self.assertEqual(store.stats()["buffered"], 0)
+
+    def test_query_from_disk(self):
+        """Test that states survive a restart and are found by scanning"""
+        store = self.make_store(self.path, flush_size=2)
+        store.add([status("wamid.1", "sent"), status("wamid.1", "delivered"),
+                   status("wamid.2", "failed")])
+        store.flush()
+
+        reopened = self.make_store(self.path)
+        self.assertEqual(reopened.get_delivery_state("wamid.1").status, "delivered")
+        self.assertEqual(reopened.get_delivery_state("wamid.2").status, "failed")
+
+    def test_index_is_bounded(self):
+        """Test that evicted ids are still answered from disk"""
+        store = self.make_store(self.path, flush_size=1, index_size=2)
+        store.add([status(f"wamid.{i}", "sent") for i in range(5)])
+        self.assertEqual(store.stats()["indexed"], 2)
+        self.assertEqual(store.get_delivery_state("wamid.0").status, "sent")
+
+    def test_unknown_status_ignored(self):
+        """Test that unknown status names are skipped"""
+        store = self.make_store(self.path)
+        store.add([status("wamid.1", "warning")])
+        self.assertEqual(store.stats()["recorded"], 0)
+
+    def test_scan_does_not_block_add(self):
+        """Test that statuses are added while a query scans the file"""
+        store = self.make_store(self.path, start=False)
+        scanning, release = threading.Event(), threading.Event()
+        scan = store._scan
+
+        def slow_scan(key, buffered):
+            scanning.set()
+            release.wait(5)
+            return scan(key, buffered)
+
+        store._scan = slow_scan
+        query = threading.Thread(target=store.get_delivery_state, args=("wamid.unknown",))
+        query.start()
+        self.assertTrue(scanning.wait(5))
+        adder = threading.Thread(target=store.add, args=([status("wamid.1", "sent")],))
+        adder.start()
+        adder.join(1)
+        self.assertFalse(adder.is_alive())
+        release.set()
+        query.join()
+
+    def test_flush_timer(self):
+        """Test that a buffer is flushed after flush_interval without further statuses"""
+        store = self.make_store(self.path, flush_interval=0.05)
+        store.add([status("wamid.1", "sent")])
+        deadline = time.monotonic() + 5
+        while store.stats()["buffered"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(store.stats()["flushed"], 1)
+
+    def test_torn_block_is_skipped(self):
+        """Test that blocks after a block torn by a crash are still read"""
+        store = self.make_store(self.path, flush_size=1, start=False)
+        store.add([status("wamid.1", "sent")])
+        with open(self.path, "ab") as f:
+            f.write(b"WST2\x05\x00\x00\x00garbage")
+        store.add([status("wamid.2", "read")])
+        store.add([status("wamid.3", "delivered")])
+
+        reopened = self.make_store(self.path, start=False)
+        for message_id, name in (("wamid.1", "sent"), ("wamid.2", "read"), ("wamid.3", "delivered")):
+            self.assertEqual(reopened.get_delivery_state(message_id).status, name)
+
+    def test_rotation(self):
+        """Test that the file is rotated by size, old segments are deleted and the rest is queried"""
+        store = self.make_store(self.path, flush_size=10, segment_bytes=200, keep_segments=2, start=False)
+        for i in range(40):
+            store.add([status(f"wamid.{i}", "sent")])
+        store.flush()
+        self.assertEqual(store.segments(), [self.path + ".2", self.path + ".1", self.path])
+        self.assertLessEqual(os.path.getsize(self.path), 200 + 10 * 21 + 12)
+
+        reopened = self.make_store(self.path, start=False)
+        self.assertEqual(reopened.get_delivery_state("wamid.39").status, "sent")
+        self.assertEqual(reopened.get_delivery_state("wamid.15").status, "sent")
+        self.assertIsNone(reopened.get_delivery_state("wamid.0"))
+
+    def test_rotation_by_age(self):
+        store = self.make_store(self.path, flush_size=1, segment_age=3600, start=False)
+        store.add([status("wamid.1", "sent")])
+        store._segment_started -= 7200
+        store.add([status("wamid.2", "sent")])
+        self.assertEqual(len(store.segments()), 2)
+
+    def test_looks_like_status_payload(self):
+        """Test the raw-bytes classification"""
+        self.assertTrue(looks_like_status_payload(b'{"entry":[{"changes":[{"value":{"statuses":[]}}]}]}'))
+        self.assertTrue(looks_like_status_payload(b'{"changes":[{"value":{"statuses": []},"field":"messages"}]}'))
+        self.assertFalse(looks_like_status_payload(b'{"entry":[{"changes":[{"value":{"messages":[]}}]}]}'))
+
+
+class TestScanStatusPayload(unittest.TestCase):
+    """Test cases for reading statuses from the raw body"""
+
+    def assert_same_as_parsed(self, body):
+        raw = json.dumps(body, separators=(",", ":")).encode("utf-8")
+        scanned = scan_status_payload(raw)
+        self.assertIsNotNone(scanned)
+        parsed = parse_webhook(body).statuses
+        self.assertEqual(
+            [(s.message_id, s.recipient_id, s.status, s.timestamp, s.phone_number_id) for s in scanned],
+            [(s.message_id, s.recipient_id, s.status, s.timestamp, s.phone_number_id) for s in parsed],
+        )
+
+    def test_meta_shape(self):
+        """Test a status with conversation and pricing, as Meta sends it"""
+        body = status_body("5215512345678", "delivered")
+        body["entry"][0]["changes"][0]["value"]["statuses"][0].update(
+            conversation={"id": "c0ffee", "origin": {"type": "service"}},
+            pricing={"billable": True, "pricing_model": "CBP", "category": "service"},
+        )
+        self.assert_same_as_parsed(body)
+
+    def test_batched(self):
+        body = status_body("5215512345678", "sent")
+        body["entry"] += status_body("5215587654321", "read")["entry"]
+        self.assert_same_as_parsed(body)
+
+    def test_webhook_is_not_decoded(self):
+        """Test that a status webhook is stored without decoding its JSON"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        app = Flask(__name__)
+        app.config["APP_SECRET"] = "test-secret"
+        app.register_blueprint(webhook_blueprint)
+        store = StatusStore(os.path.join(directory, "statuses.bin"), start=False)
+        app.extensions["status_store"] = store
+        payload = json.dumps(status_body("5215512345678", "read", message_id="wamid.x")).encode("utf-8")
+
+        with mock.patch("app.utils.ingestion.loads") as loads:
+            response = app.test_client().post(
+                "/webhook", data=payload,
+                headers={"Content-Type": "application/json", "X-Hub-Signature-256": sign_payload(payload, "test-secret")},
+            )
+        self.assertEqual(response.status_code, 200)
+        loads.assert_not_called()
+        self.assertEqual(store.get_delivery_state("wamid.x").status, "read")
+
+    def test_falls_back(self):
+        """Test that bodies in another shape are left to parse_webhook"""
+        reordered = b'{"statuses":[{"status":"read","id":"wamid.1","timestamp":"1","recipient_id":"5"}]}'
+        escaped = b'{"statuses":[{"id":"wamid.a\\/b","status":"read","timestamp":"1","recipient_id":"5"}]}'
+        two_numbers = json.dumps(
+            {"entry": status_body("1", "read")["entry"] + status_body("2", "read", phone_number_id="999")["entry"]}
+        ).encode("utf-8")
+        for raw in (reordered, escaped, two_numbers):
+            self.assertIsNone(scan_status_payload(raw), raw)
+
+
+if __name__ == '__main__':
+    unittest.main()
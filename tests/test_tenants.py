@@ -0,0 +1,283 @@
+"""
+Unit tests for multi-tenant routing
+"""
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+
+from app.services.outbox import Outbox
+from app.services.status_store import init_status_store
+from app.services.tenants import GreetedUsers, TenantRegistry, current_tenant, init_tenants, use_tenant
+from app.utils import metrics
+from app.utils.message_handlers import DEFAULT_REPLY, KEYWORD_TABLE, generate_response, load_keyword_table, match_keywords
+from app.utils.whatsapp_utils import get_keyword_responder, get_sender, post_to_graph
+from app.views import webhook_blueprint
+from benchmarks.webhook_traffic import sign_payload, status_body
+
+TENANT = "1110001"
+OTHER = "2220002"
+
+
+def write_tenant(directory, phone_number_id, settings, messages=None, keywords=None):
+    path = os.path.join(directory, phone_number_id)
+    os.makedirs(os.path.join(path, "messages"))
+    with open(os.path.join(path, "tenant.json"), "w", encoding="utf-8") as f:
+        json.dump(settings, f)
+    for filename, text in (messages or {}).items():
+        with open(os.path.join(path, "messages", filename), "w", encoding="utf-8") as f:
+            f.write(text)
+    if keywords is not None:
+        with open(os.path.join(path, "keywords.json"), "w", encoding="utf-8") as f:
+            json.dump(keywords, f)
+    return path
+
+
+class TenantTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        write_tenant(
+            self.directory,
+            TENANT,
+            {"name": "Salon Norte", "access_token": "$TENANT_TEST_TOKEN", "app_secret": "tenant-secret"},
+            messages={"horario.txt": "Abrimos de 9 a 5"},
+            keywords={"rules": [{"any": ["horas", "horario"], "message": "horario.txt"}], "default": "Hola de Norte"},
+        )
+        write_tenant(self.directory, OTHER, {"name": "Salon Sur", "access_token": "sur-token"})
+        os.environ["TENANT_TEST_TOKEN"] = "norte-token"
+        self.addCleanup(os.environ.pop, "TENANT_TEST_TOKEN", None)
+
+    def make_app(self):
+        app = Flask(__name__)
+        app.config.update(
+            APP_SECRET="test-secret",
+            ACCESS_TOKEN="app-token",
+            PHONE_NUMBER_ID="999",
+            GRAPH_API_URL="https://graph.example",
+            VERSION="v18.0",
+            MAX_WEBHOOK_BODY_BYTES=1024 * 1024,
+            STATUS_STORE_PATH=os.path.join(tempfile.mkdtemp(), "statuses.bin"),
+            STATUS_FLUSH_SIZE=512,
+            STATUS_FLUSH_INTERVAL=5.0,
+            TENANTS_DIR=self.directory,
+            TENANT_CACHE_SIZE=64,
+        )
+        init_status_store(app)
+        init_tenants(app)
+        app.register_blueprint(webhook_blueprint)
+        return app
+
+
+class TestTenantRegistry(TenantTestCase):
+    """Test cases for TenantRegistry"""
+
+    def test_loaded_on_first_use(self):
+        """Test that tenants are read from their directory once and cached"""
+        registry = TenantRegistry(self.directory)
+        self.assertEqual(registry.stats()["active"], [])
+        tenant = registry.get(TENANT)
+        self.assertEqual(tenant.name, "Salon Norte")
+        self.assertEqual(tenant.access_token, "norte-token")
+        self.assertIs(registry.get(TENANT), tenant)
+        self.assertEqual(registry.stats()["loads"], 1)
+
+    def test_unknown_numbers_use_app_configuration(self):
+        """Test that numbers without a directory, or with a bad id, have no tenant"""
+        registry = TenantRegistry(self.directory)
+        self.assertIsNone(registry.get("3330003"))
+        self.assertIsNone(registry.get("../" + TENANT))
+        self.assertIsNone(registry.get(None))
+        self.assertIsNone(TenantRegistry(None).get(TENANT))
+
+    def test_lru_eviction(self):
+        """Test that the least recently used tenant is evicted and reloaded later"""
+        registry = TenantRegistry(self.directory, max_active=1)
+        before = metrics.get_counter("tenant_evictions")
+        registry.get(TENANT)
+        registry.get(OTHER)
+        self.assertEqual(registry.stats()["active"], [OTHER])
+        self.assertEqual(metrics.get_counter("tenant_evictions"), before + 1)
+        registry.get(TENANT)
+        self.assertEqual(registry.stats()["loads"], 3)
+
+    def test_limiter_survives_eviction(self):
+        """Test that a reloaded tenant keeps its send-rate limiter instead of a fresh burst"""
+        write_tenant(self.directory, "3330003", {"name": "Salon Este", "send_rate": 5})
+        registry = TenantRegistry(self.directory, max_active=1)
+        limiter = registry.get("3330003").limiter
+        registry.get(TENANT)
+        self.assertIs(registry.get("3330003").limiter, limiter)
+
+    def test_malformed_keywords_fall_back_to_defaults(self):
+        """Test that a bad keywords.json keeps the tenant with the default keyword table"""
+        for number, keywords in (("4440001", ["not", "an", "object"]), ("4440002", {"rules": [{"any": [1]}]}),
+                                 ("4440003", {"rules": "horario.txt"}), ("4440004", {"rules": [], "default": 3}),
+                                 ("4440006", {"rules": [], "default": "Hola {nombre}"}),
+                                 ("4440007", {"rules": [], "default": "{message} {0}"}),
+                                 ("4440008", {"rules": [], "default": "{message"})):
+            write_tenant(self.directory, number, {"name": number}, keywords=keywords)
+            tenant = TenantRegistry(self.directory).get(number)
+            self.assertEqual(tenant.keywords, KEYWORD_TABLE)
+            self.assertEqual(tenant.default_reply, DEFAULT_REPLY)
+
+    def test_malformed_settings_skip_the_tenant(self):
+        write_tenant(self.directory, "4440005", ["not", "an", "object"])
+        self.assertIsNone(TenantRegistry(self.directory).get("4440005"))
+
+    def test_concurrent_first_use_keeps_one_tenant(self):
+        """Test that racing requests end up with the same tenant object"""
+        registry = TenantRegistry(self.directory)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(registry.get(TENANT))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(tenant) for tenant in results}), 1)
+
+
+class TestGreetedUsers(unittest.TestCase):
+    """Test cases for GreetedUsers"""
+
+    def test_persisted_across_instances(self):
+        """Test that greeted users survive an eviction or restart"""
+        path = os.path.join(tempfile.mkdtemp(), "greeted_users.txt")
+        greeted = GreetedUsers(path)
+        greeted.add("521")
+        greeted.add("521")
+        self.assertIn("521", GreetedUsers(path))
+        with open(path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), "521\n")
+
+
+class TestTenantReplies(TenantTestCase):
+    """Test cases for per-tenant keywords, messages and credentials"""
+
+    def test_keyword_table_and_catalog(self):
+        """Test that a tenant's keywords and messages apply, with the bot's messages as fallback"""
+        app = self.make_app()
+        with app.app_context():
+            use_tenant(TENANT)
+            reply = get_keyword_responder()
+            self.assertEqual(reply("a que horas abren?"), "Abrimos de 9 a 5")
+            self.assertEqual(reply("servicios"), "Hola de Norte")
+
+            use_tenant(OTHER)
+            self.assertEqual(get_keyword_responder()("servicios"), generate_response("servicios"))
+
+    def test_default_table_matches_previous_rules(self):
+        """Test the combined prueba + color rule of the default table"""
+        self.assertEqual(match_keywords("quiero una prueba de color", KEYWORD_TABLE), "prueba_color.txt")
+        self.assertEqual(match_keywords("color de prueba", KEYWORD_TABLE), "prueba_color.txt")
+        self.assertEqual(match_keywords("un tinte", KEYWORD_TABLE), "color_hint.txt")
+        table = load_keyword_table([{"all": ["Corte", "Pelo"], "message": "corte.txt"}])
+        self.assertEqual(match_keywords("pelo y corte", table), "corte.txt")
+        self.assertIsNone(match_keywords("corte", table))
+
+    def test_sends_with_tenant_credentials(self):
+        """Test that messages go out from the tenant's number with its token"""
+        app = self.make_app()
+        session = mock.Mock()
+        with app.app_context(), mock.patch("app.utils.whatsapp_utils.get_graph_session", return_value=session):
+            self.assertEqual(get_sender(), ("999", "app-token"))
+            use_tenant(TENANT)
+            post_to_graph("{}")
+            url = session.post.call_args.args[0]
+            headers = session.post.call_args.kwargs["headers"]
+            self.assertEqual(url, f"https://graph.example/v18.0/{TENANT}/messages")
+            self.assertEqual(headers["Authorization"], "Bearer norte-token")
+        self.assertGreaterEqual(metrics.get_counter("tenant_sends", tenant=TENANT), 1)
+
+
+class TestTenantSignatures(TenantTestCase):
+    """Test cases for per-tenant App Secrets"""
+
+    def post(self, app, phone_number_id, secret):
+        payload = json.dumps(status_body("521", phone_number_id=phone_number_id)).encode("utf-8")
+        return app.test_client().post(
+            "/webhook",
+            data=payload,
+            headers={"Content-Type": "application/json", "X-Hub-Signature-256": sign_payload(payload, secret)},
+        )
+
+    def test_tenant_secret(self):
+        """Test that a tenant's webhooks are verified with its own App Secret"""
+        app = self.make_app()
+        self.assertEqual(self.post(app, TENANT, "tenant-secret").status_code, 200)
+        self.assertEqual(self.post(app, TENANT, "test-secret").status_code, 403)
+
+    def test_app_secret_without_tenant_secret(self):
+        """Test that tenants without a secret, and unknown numbers, use APP_SECRET"""
+        app = self.make_app()
+        self.assertEqual(self.post(app, OTHER, "test-secret").status_code, 200)
+        self.assertEqual(self.post(app, "3330003", "test-secret").status_code, 200)
+        self.assertEqual(self.post(app, "3330003", "tenant-secret").status_code, 403)
+
+
+class TestOutboxSender(unittest.TestCase):
+    """Test cases for tenant-aware outbox sends"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.path = os.path.join(self.directory, "outbox.db")
+
+    def test_sender_passed_to_send(self):
+        """Test that messages enqueued for a tenant are sent from it"""
+        sent = []
+        outbox = Outbox(self.path, lambda payload, sender=None: sent.append((payload, sender)) or "wamid.1",
+                        poll_interval=0.01)
+        self.addCleanup(outbox.close)
+        outbox.enqueue("521", "hola", sender=TENANT)
+        outbox.enqueue("522", "adios")
+        self.assertTrue(outbox.wait_idle(5))
+        self.assertEqual(sorted(sent, key=lambda s: s[0]), [("adios", None), ("hola", TENANT)])
+
+    def test_migrates_old_outbox_files(self):
+        """Test that an outbox written before tenants gets the sender column"""
+        conn = sqlite3.connect(self.path)
+        conn.execute(
+            "CREATE TABLE outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, recipient TEXT NOT NULL,"
+            " payload TEXT NOT NULL, status INTEGER NOT NULL DEFAULT 0, attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt REAL NOT NULL, created REAL NOT NULL, updated REAL NOT NULL,"
+            " message_id TEXT, last_error TEXT)"
+        )
+        conn.execute(
+            "INSERT INTO outbox (recipient, payload, next_attempt, created, updated) VALUES ('521', 'pendiente', 0, 0, 0)"
+        )
+        conn.commit()
+        conn.close()
+
+        sent = []
+        outbox = Outbox(self.path, lambda payload: sent.append(payload) or "wamid.1", poll_interval=0.01)
+        self.addCleanup(outbox.close)
+        self.assertTrue(outbox.wait_idle(5))
+        self.assertEqual(sent, ["pendiente"])
+
+
+class TestSingleTenant(unittest.TestCase):
+    """Test cases for apps without TENANTS_DIR"""
+
+    def test_no_tenant(self):
+        app = Flask(__name__)
+        app.config.update(TENANT_CACHE_SIZE=64)
+        init_tenants(app)
+        with app.app_context():
+            self.assertIsNone(use_tenant(TENANT))
+            self.assertIsNone(current_tenant())
+            self.assertIs(get_keyword_responder(), generate_response)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+Unit tests for the Assistant thread lifecycle
+"""
+import os
+import shelve
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.thread_store import ThreadStore
+
+
+class TestThreadStore(unittest.TestCase):
+    """Test cases for ThreadStore"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "threads_db")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_counts_exchanges(self):
+        """Test that messages and approximate tokens are tracked"""
+        store = ThreadStore(self.path)
+        store.put("521", "thread_1")
+        store.record_exchange("521", "thread_1", "wifi?", "x" * 400)
+        record = store.get("521")
+        self.assertEqual(record["messages"], 2)
+        self.assertGreaterEqual(record["tokens"], 100)
+
+    def test_legacy_mapping(self):
+        """Test that plain thread ids stored by older versions still work"""
+        with shelve.open(self.path) as threads_shelf:
+            threads_shelf["521"] = "thread_old"
+        store = ThreadStore(self.path)
+        self.assertEqual(store.get("521")["thread_id"], "thread_old")
+        store.record_exchange("521", "thread_old", "hola")
+        self.assertEqual(store.get("521")["messages"], 1)
+
+    def test_rotation_reasons(self):
+        """Test the size and inactivity limits"""
+        store = ThreadStore(self.path, max_messages=4, max_tokens=50, idle_ttl=60)
+        store.put("521", "thread_1")
+        self.assertIsNone(store.rotation_reason(store.get("521")))
+
+        store.record_exchange("521", "thread_1", "a", "b", "c", "d")
+        self.assertEqual(store.rotation_reason(store.get("521")), "messages")
+
+        store.put("522", "thread_2")
+        store.record_exchange("522", "thread_2", "x" * 400)
+        self.assertEqual(store.rotation_reason(store.get("522")), "tokens")
+
+        store.put("523", "thread_3")
+        self.assertEqual(store.rotation_reason(store.get("523"), now=time.time() + 61), "idle")
+
+    def test_replace_is_compare_and_swap(self):
+        """Test that only the first of two concurrent rotations wins"""
+        store = ThreadStore(self.path)
+        store.put("521", "thread_1")
+        self.assertTrue(store.replace("521", "thread_1", "thread_2", tokens=30))
+        self.assertFalse(store.replace("521", "thread_1", "thread_3"))
+        record = store.get("521")
+        self.assertEqual(record["thread_id"], "thread_2")
+        self.assertEqual(record["tokens"], 30)
+        self.assertEqual(record["rotations"], 1)
+
+    def test_stale_exchange_ignored(self):
+        """Test that counts for a rotated-away thread are not applied"""
+        store = ThreadStore(self.path)
+        store.put("521", "thread_2")
+        store.record_exchange("521", "thread_1", "late answer")
+        self.assertEqual(store.get("521")["messages"], 0)
+
+    def test_stats(self):
+        """Test that per-thread sizes are reported, largest first"""
+        store = ThreadStore(self.path)
+        self.assertEqual(store.stats()["threads"], 0)
+        store.put("521", "thread_1")
+        store.put("522", "thread_2")
+        store.record_exchange("522", "thread_2", "x" * 100)
+        stats = store.stats()
+        self.assertEqual(stats["threads"], 2)
+        self.assertEqual(stats["largest"][0]["wa_id"], "522")
+        self.assertEqual(stats["max_messages"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
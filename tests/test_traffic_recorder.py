@@ -0,0 +1,125 @@
+"""
+Unit tests for the webhook traffic recorder and replay tool
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.utils.traffic_recorder import Pseudonymizer, TrafficRecorder, read_segments
+from benchmarks.replay import parse_speed, prepare_requests
+from benchmarks.webhook_traffic import sign_payload, text_message_body
+
+
+class TestPseudonymizer(unittest.TestCase):
+    """Test cases for phone number and name pseudonymization"""
+
+    def setUp(self):
+        self.pseudonymizer = Pseudonymizer(b"test-key")
+
+    def test_phone_is_stable(self):
+        """Test that the same number always maps to the same pseudonym"""
+        self.assertEqual(self.pseudonymizer.phone("5215512345678"), self.pseudonymizer.phone("5215512345678"))
+        self.assertNotEqual(self.pseudonymizer.phone("5215512345678"), "5215512345678")
+
+    def test_phone_keeps_length(self):
+        """Test that pseudonyms keep the number of digits"""
+        pseudonym = self.pseudonymizer.phone("5215512345678")
+        self.assertEqual(len(pseudonym), 13)
+        self.assertTrue(pseudonym.isdigit())
+
+    def test_scrub_webhook_body(self):
+        """Test that wa_id, from and profile name are replaced"""
+        body = text_message_body("5215512345678", "hola", name="Maria Lopez")
+        scrubbed = json.dumps(self.pseudonymizer.scrub(body))
+        self.assertNotIn("5215512345678", scrubbed)
+        self.assertNotIn("Maria Lopez", scrubbed)
+        self.assertIn("hola", scrubbed)
+
+    def test_scrub_message_ids(self):
+        """Test that message ids are replaced and still match their statuses"""
+        wamid = "wamid.HBgNNTIxNTUxMjM0NTY3OBUCABIYFjNFQjA="
+        message = self.pseudonymizer.scrub({"id": wamid, "interactive": {"button_reply": {"id": "servicios"}}})
+        status = self.pseudonymizer.scrub({"id": wamid, "status": "read"})
+        self.assertNotEqual(message["id"], wamid)
+        self.assertTrue(message["id"].startswith("wamid."))
+        self.assertEqual(message["id"], status["id"])
+        self.assertEqual(message["interactive"]["button_reply"]["id"], "servicios")
+
+
+class TestTrafficRecorder(unittest.TestCase):
+    """Test cases for recording and reading segments"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _record(self, count, segment_records=1000):
+        recorder = TrafficRecorder(self.directory, b"key", segment_records=segment_records)
+        for i in range(count):
+            body = json.dumps(text_message_body("5215500000000", f"mensaje {i}")).encode("utf-8")
+            recorder.record(body, {"Content-Type": "application/json"}, arrival_time=1000.0 + i)
+        recorder.close()
+
+    def test_roundtrip(self):
+        """Test that recorded entries are read back in order"""
+        self._record(5)
+        entries = list(read_segments([self.directory]))
+        self.assertEqual(len(entries), 5)
+        self.assertEqual([e["t"] for e in entries], [1000.0 + i for i in range(5)])
+        self.assertNotIn("5215500000000", entries[0]["body"])
+
+    def test_rotation(self):
+        """Test that segments rotate after the configured record count"""
+        self._record(5, segment_records=2)
+        segments = [n for n in os.listdir(self.directory) if n.endswith(".jsonl.gz")]
+        self.assertEqual(len(segments), 3)
+        self.assertEqual(len(list(read_segments([self.directory]))), 5)
+
+    def test_truncated_segment(self):
+        """Test that a partially written segment is still readable"""
+        self._record(3)
+        path = os.path.join(self.directory, os.listdir(self.directory)[0])
+        with open(path, "rb") as f:
+            data = f.read()
+        with open(path, "wb") as f:
+            f.write(data[:-10])
+        entries = list(read_segments([path]))
+        self.assertLessEqual(len(entries), 3)
+
+
+class TestReplay(unittest.TestCase):
+    """Test cases for preparing recorded traffic for replay"""
+
+    def test_parse_speed(self):
+        """Test speed parsing"""
+        self.assertEqual(parse_speed("1"), 1.0)
+        self.assertEqual(parse_speed("10x"), 10.0)
+        self.assertEqual(parse_speed("max"), 0.0)
+
+    def test_prepare_requests_resigns(self):
+        """Test that bodies are re-signed and offsets are relative"""
+        body = json.dumps(text_message_body("1", "hola"))
+        entries = [{"t": 50.0, "headers": {}, "body": body}, {"t": 52.5, "headers": {}, "body": body}]
+        prepared = list(prepare_requests(entries, "secret"))
+        self.assertEqual([p[0] for p in prepared], [0.0, 2.5])
+        offset, payload, headers = prepared[0]
+        self.assertEqual(headers["X-Hub-Signature-256"], sign_payload(payload, "secret"))
+
+    def test_prepare_requests_unique_ids(self):
+        """Test that message ids can be made unique per run"""
+        body = json.dumps(text_message_body("1", "hola"))
+        _, payload, _ = next(prepare_requests([{"t": 0, "headers": {}, "body": body}], "s", run_id="r1"))
+        message = json.loads(payload)["entry"][0]["changes"][0]["value"]["messages"][0]
+        self.assertTrue(message["id"].endswith(".r1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
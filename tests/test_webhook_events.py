@@ -0,0 +1,178 @@
+"""
+Unit tests for the parse-once webhook model
+"""
+import unittest
+from unittest import mock
+import sys
+import os
+
+from flask import Flask
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.utils.webhook_events import (
+    ContactEvent,
+    InteractiveEvent,
+    MediaEvent,
+    StatusEvent,
+    TextEvent,
+    UnsupportedEvent,
+    parse_webhook,
+)
+from app.utils.whatsapp_utils import process_whatsapp_message
+from app.utils.message_handlers import greeted_users
+
+
+def make_body(messages=None, statuses=None, contacts=None):
+    value = {"metadata": {"phone_number_id": "111"}}
+    if messages is not None:
+        value["messages"] = messages
+        value["contacts"] = contacts or [{"wa_id": "5215500000001", "profile": {"name": "Ana"}}]
+    if statuses is not None:
+        value["statuses"] = statuses
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "0", "changes": [{"value": value, "field": "messages"}]}],
+    }
+
+
+class TestParseWebhook(unittest.TestCase):
+    """Test cases for parse_webhook"""
+
+    def test_text_message(self):
+        """Test that a text message becomes a TextEvent with sender details"""
+        batch = parse_webhook(make_body([
+            {"from": "5215500000001", "id": "wamid.1", "timestamp": "1700000000",
+             "type": "text", "text": {"body": "hola"}}
+        ]))
+        event = batch.messages[0]
+        self.assertIsInstance(event, TextEvent)
+        self.assertEqual(event.text, "hola")
+        self.assertEqual(event.wa_id, "5215500000001")
+        self.assertEqual(event.name, "Ana")
+        self.assertEqual(event.timestamp, 1700000000)
+        self.assertEqual(event.phone_number_id, "111")
+
+    def test_media_message(self):
+        """Test that images and voice notes become MediaEvents without text"""
+        batch = parse_webhook(make_body([
+            {"from": "5215500000001", "id": "wamid.2", "type": "image",
+             "image": {"id": "media-1", "mime_type": "image/jpeg", "sha256": "abc", "caption": "mi cabello"}},
+            {"from": "5215500000001", "id": "wamid.3", "type": "audio",
+             "audio": {"id": "media-2", "mime_type": "audio/ogg"}},
+        ]))
+        image, audio = batch.messages
+        self.assertIsInstance(image, MediaEvent)
+        self.assertEqual(image.media_id, "media-1")
+        self.assertEqual(image.caption, "mi cabello")
+        self.assertIsNone(image.text)
+        self.assertEqual(audio.type, "audio")
+
+    def test_interactive_and_button_replies(self):
+        """Test that button and list replies expose their title as text"""
+        batch = parse_webhook(make_body([
+            {"from": "5215500000001", "id": "wamid.4", "type": "interactive",
+             "interactive": {"type": "button_reply", "button_reply": {"id": "b1", "title": "Servicios"}}},
+            {"from": "5215500000001", "id": "wamid.5", "type": "button",
+             "button": {"payload": "p1", "text": "Horario"}},
+        ]))
+        self.assertIsInstance(batch.messages[0], InteractiveEvent)
+        self.assertEqual(batch.messages[0].text, "Servicios")
+        self.assertEqual(batch.messages[1].text, "Horario")
+
+    def test_contacts_and_unsupported(self):
+        """Test shared contacts and unknown message types"""
+        batch = parse_webhook(make_body([
+            {"from": "5215500000001", "id": "wamid.6", "type": "contacts",
+             "contacts": [{"name": {"formatted_name": "Luis"}}]},
+            {"from": "5215500000001", "id": "wamid.7", "type": "location",
+             "location": {"latitude": 1, "longitude": 2}},
+        ]))
+        self.assertIsInstance(batch.messages[0], ContactEvent)
+        self.assertIsInstance(batch.messages[1], UnsupportedEvent)
+
+    def test_status_update(self):
+        """Test that statuses are parsed and flagged as status-only"""
+        batch = parse_webhook(make_body(statuses=[
+            {"id": "wamid.out", "status": "delivered", "timestamp": "1700000001", "recipient_id": "52155"}
+        ]))
+        self.assertTrue(batch.is_status_only)
+        self.assertIsInstance(batch.statuses[0], StatusEvent)
+        self.assertEqual(batch.statuses[0].status, "delivered")
+
+    def test_batched_entries(self):
+        """Test that every entry and change is parsed, not just the first"""
+        body = make_body([{"from": "1", "id": "a", "type": "text", "text": {"body": "uno"}}])
+        body["entry"].append(make_body([{"from": "2", "id": "b", "type": "text", "text": {"body": "dos"}}])["entry"][0])
+        batch = parse_webhook(body)
+        self.assertEqual([e.text for e in batch.messages], ["uno", "dos"])
+
+    def test_malformed_bodies(self):
+        """Test that malformed input never raises"""
+        for body in [None, [], {}, {"entry": "x"}, {"entry": [None]}, {"entry": [{"changes": [{"value": None}]}]},
+                     make_body(["not a dict", {"id": "no-sender"}]), make_body(statuses=[{"status": "read"}])]:
+            batch = parse_webhook(body)
+            self.assertEqual(batch.messages, [])
+            self.assertEqual(batch.statuses, [])
+
+    def test_wrong_types_are_skipped(self):
+        """Test that containers and values of the wrong type never raise"""
+        interactive = make_body([{"from": "5215500000001", "id": "wamid.8", "type": "interactive", "interactive": [1]}])
+        titled = make_body([{"from": "5215500000001", "id": "wamid.9", "type": "interactive",
+                             "interactive": {"button_reply": {"id": ["b"], "title": {"x": 1}}}}])
+        contacts = make_body([{"from": "5215500000001", "id": "wamid.10", "type": "text", "text": {"body": "hola"}}],
+                             contacts=[{"wa_id": ["5215500000001"], "profile": {"name": "Ana"}}, 5])
+        statuses = make_body(statuses=[{"id": ["wamid.out"], "status": "read"}, {"id": "wamid.out", "status": 3}])
+        messages = make_body()
+        messages["entry"][0]["changes"][0]["value"]["messages"] = 5
+        self.assertEqual(parse_webhook(interactive).skipped, 1)
+        self.assertIsNone(parse_webhook(titled).messages[0].text)
+        self.assertIsNone(parse_webhook(contacts).messages[0].name)
+        self.assertEqual(parse_webhook(statuses).skipped, 2)
+        self.assertEqual(parse_webhook(messages).skipped, 1)
+
+
+class TestProcessParsedMessages(unittest.TestCase):
+    """Test cases for processing parsed events"""
+
+    def setUp(self):
+        greeted_users.clear()
+        greeted_users.add("5215500000001")
+        self.app = Flask(__name__)
+        self.app.config["TYPING_INDICATOR"] = False
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+
+    @mock.patch("app.utils.whatsapp_utils.send_message")
+    def test_non_text_message_does_not_raise(self, send_message):
+        """Test that an image from a known user is handled cleanly and acknowledged"""
+        process_whatsapp_message(make_body([
+            {"from": "5215500000001", "id": "wamid.8", "type": "image", "image": {"id": "m"}}
+        ]))
+        send_message.assert_called_once()
+        self.assertIn("Recibimos tu archivo", send_message.call_args[0][0])
+
+    @mock.patch("app.utils.whatsapp_utils.send_message")
+    def test_location_message_not_answered(self, send_message):
+        """Test that messages with nothing to answer are skipped"""
+        process_whatsapp_message(make_body([
+            {"from": "5215500000001", "id": "wamid.9", "type": "location", "location": {"latitude": 1}}
+        ]))
+        send_message.assert_not_called()
+
+    @mock.patch("app.utils.whatsapp_utils.send_message")
+    def test_every_message_in_batch_is_answered(self, send_message):
+        """Test that each text message in a batched body gets a reply"""
+        process_whatsapp_message(make_body([
+            {"from": "5215500000001", "id": "a", "type": "text", "text": {"body": "hola"}},
+            {"from": "5215500000001", "id": "b", "type": "text", "text": {"body": "costos"}},
+        ]))
+        self.assertEqual(send_message.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,19 +2,30 @@
 Unit tests for WhatsApp utility functions
 """
 import unittest
+from unittest import mock
 import json
 import sys
 import os
+import time
+
+from flask import Flask, g
 
 # Add parent directory to path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from app.utils.whatsapp_utils import (
+    deliver_now,
+    get_read_receipt_input,
     get_text_message_input,
     get_template_message_input,
     process_text_for_whatsapp,
-    is_valid_whatsapp_message
+    is_valid_whatsapp_message,
+    reply_to_message,
+    send_read_receipt,
 )
+from app.utils import metrics
+from app.utils.message_handlers import greeted_users
+from app.utils.webhook_events import TextEvent
 
 
 class TestWhatsAppUtils(unittest.TestCase):
@@ -165,5 +176,116 @@ class TestMessageFormatting(unittest.TestCase):
         self.assertTrue(valid_json)
 
 
+class TestTypingIndicator(unittest.TestCase):
+    """Test cases for the read receipt and typing indicator"""
+
+    def setUp(self):
+        greeted_users.add("1234567890")
+        self.app = Flask(__name__)
+        self.app.config["TYPING_INDICATOR"] = True
+        self.app.config["TYPING_INDICATOR_DELAY"] = 0.05
+        self.context = self.app.app_context()
+        self.context.push()
+        self.event = TextEvent(
+            "hola", message_id="wamid.1", wa_id="1234567890", name="Ana",
+            timestamp=0, type="text", phone_number_id="111",
+        )
+
+    def tearDown(self):
+        self.context.pop()
+
+    def test_read_receipt_input(self):
+        """Test the mark-as-read payload with and without typing indicator"""
+        data = json.loads(get_read_receipt_input("wamid.1"))
+        self.assertEqual(data["status"], "read")
+        self.assertEqual(data["message_id"], "wamid.1")
+        self.assertEqual(data["typing_indicator"], {"type": "text"})
+        self.assertNotIn("typing_indicator", json.loads(get_read_receipt_input("wamid.1", typing_indicator=False)))
+
+    @mock.patch("app.utils.whatsapp_utils.send_message")
+    def test_instant_reply_skips_indicator(self, send_message):
+        """Test that instant replies never send the indicator"""
+        reply_to_message(self.event)
+        time.sleep(0.1)
+        self.assertEqual(send_message.call_count, 1)
+        self.assertEqual(json.loads(send_message.call_args[0][0])["type"], "text")
+
+    @mock.patch("app.utils.whatsapp_utils.generate_reply")
+    @mock.patch("app.utils.whatsapp_utils.send_read_receipt")
+    @mock.patch("app.utils.whatsapp_utils.send_message")
+    def test_slow_reply_sends_indicator_first(self, send_message, send_read_receipt, generate_reply):
+        """Test that slow replies show the indicator while they are generated"""
+        generate_reply.side_effect = lambda *args: time.sleep(0.2) or "respuesta"
+        reply_to_message(self.event)
+        send_read_receipt.assert_called_once_with("wamid.1")
+        self.assertEqual(send_message.call_count, 1)
+        self.assertEqual(json.loads(send_message.call_args[0][0])["text"]["body"], "respuesta")
+
+    @mock.patch("app.utils.whatsapp_utils.generate_reply")
+    @mock.patch("app.utils.whatsapp_utils.send_read_receipt")
+    @mock.patch("app.utils.whatsapp_utils.send_message")
+    def test_switch_disables_indicator(self, send_message, send_read_receipt, generate_reply):
+        """Test that TYPING_INDICATOR=false turns the call off"""
+        self.app.config["TYPING_INDICATOR"] = False
+        generate_reply.side_effect = lambda *args: time.sleep(0.1) or "respuesta"
+        reply_to_message(self.event)
+        self.assertEqual(send_message.call_count, 1)
+        send_read_receipt.assert_not_called()
+
+    @mock.patch("app.utils.whatsapp_utils.get_graph_session")
+    def test_read_receipt_is_not_a_send(self, get_graph_session):
+        """Test that read receipts skip the tenant's limiter and the send metrics"""
+        self.app.config.update(GRAPH_API_URL="https://graph.example", VERSION="v18.0")
+        tenant = mock.Mock(phone_number_id="111", access_token="t")
+        g.tenant = tenant
+        sends_before = metrics.get_counter("tenant_sends", tenant="111")
+        self.assertTrue(send_read_receipt("wamid.1"))
+        tenant.limiter.acquire.assert_not_called()
+        self.assertEqual(metrics.get_counter("tenant_sends", tenant="111"), sends_before)
+        url = get_graph_session.return_value.post.call_args[0][0]
+        self.assertEqual(url, "https://graph.example/v18.0/111/messages")
+        self.assertEqual(json.loads(get_graph_session.return_value.post.call_args[1]["data"])["status"], "read")
+
+
+class TestDeliverNow(unittest.TestCase):
+    """Test cases for deliver_now with an outbox"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.outbox = mock.Mock()
+        self.app.extensions["outbox"] = self.outbox
+        self.context = self.app.app_context()
+        self.context.push()
+        self.addCleanup(self.context.pop)
+
+    @mock.patch("app.utils.whatsapp_utils.send_message")
+    def test_slow_commit_is_not_sent_twice(self, send_message):
+        """Test that a message still queued for the outbox does not also go out directly"""
+        self.outbox.enqueue.return_value = None
+        self.assertIsNone(deliver_now("521", "{}"))
+        send_message.assert_not_called()
+
+    @mock.patch("app.utils.whatsapp_utils.send_message")
+    def test_unavailable_outbox_sends_directly(self, send_message):
+        """Test that a message the outbox refused is sent directly"""
+        self.outbox.enqueue.side_effect = RuntimeError("Outbox is shut down")
+        deliver_now("521", "{}")
+        send_message.assert_called_once_with("{}")
+
+    @mock.patch("app.utils.whatsapp_utils.generate_reply", return_value="respuesta")
+    @mock.patch("app.utils.whatsapp_utils.send_message")
+    def test_welcome_with_pending_commit(self, send_message, generate_reply):
+        """Test that the welcome flow goes on when the template's outbox commit is still pending"""
+        self.app.config.update(TYPING_INDICATOR=False, WELCOME_HEADER_IMAGE="")
+        self.outbox.enqueue.return_value = None
+        greeted_users.discard("5215500000777")
+        self.addCleanup(greeted_users.discard, "5215500000777")
+        event = TextEvent("hola", message_id="wamid.9", wa_id="5215500000777", name="Ana",
+                          timestamp=0, type="text", phone_number_id=None)
+        reply_to_message(event)
+        self.assertEqual(self.outbox.enqueue.call_count, 3)
+        send_message.assert_not_called()
+
+
 if __name__ == '__main__':
     unittest.main()